@@ -2,9 +2,19 @@
 Common helpers for analysis
 """
 
+import os
 import time
+import typing
 import psycopg2.extensions
 
+# where export_parquet.py writes its snapshot
+PARQUET_DIR = os.getenv('ANALYSIS_PARQUET_DIR', '/mnt/goldphish/parquet')
+
+# tables keyed by block are partitioned into directories of this many blocks, named
+# PARTITION_COLUMN=<first block>; about four months of blocks each
+PARTITION_BLOCKS = 1_000_000
+PARTITION_COLUMN = 'block_bucket'
+
 
 def label_zerox_exchanges(curr: psycopg2.extensions.cursor):
     """
@@ -491,3 +501,62 @@ def setup_only_uniswap_tables(curr: psycopg2.extensions.cursor):
     n_only_uniswap = curr.rowcount
     print(f'[*] found {n_only_uniswap:,} single-cycle arbitrages that only use uniswap (took {elapsed:.2f} seconds)')
 
+
+def connect_parquet(parquet_dir: str = PARQUET_DIR):
+    """
+    Open an in-memory DuckDB with a view over each table in the Parquet snapshot
+    (see export_parquet.py), named as in postgres, so most queries run unchanged.
+
+    Tables partitioned by block also have a block_bucket column; filter on it, as
+    block_range_filter() does, so that only the partitions needed are read.
+
+    Note that parameters are written `?` rather than `%s`, and `%` need not be doubled.
+    """
+    import duckdb
+
+    conn = duckdb.connect()
+    for table in sorted(os.listdir(parquet_dir)):
+        table_dir = os.path.join(parquet_dir, table)
+        if table.startswith('.') or not os.path.isdir(table_dir):
+            continue
+        hive_types = ''
+        if any(x.startswith(f'{PARTITION_COLUMN}=') for x in os.listdir(table_dir)):
+            # otherwise inferred, as VARCHAR when the only partition is block_bucket=null
+            hive_types = f", hive_types = {{'{PARTITION_COLUMN}': BIGINT}}"
+        conn.execute(
+            f'''
+            CREATE VIEW {table} AS
+            SELECT * FROM read_parquet('{table_dir}/**/*.parquet', hive_partitioning = true{hive_types})
+            '''
+        )
+    return conn
+
+
+def block_bucket(block_number: int) -> int:
+    """
+    The partition holding the block
+    """
+    return block_number - block_number % PARTITION_BLOCKS
+
+
+def block_range_filter(start_block: int, end_block: int, column: str = 'block_number') -> str:
+    """
+    SQL condition for rows with `column` (the table's partition column) from start_block
+    to end_block inclusive, which DuckDB can answer from only those partitions
+    """
+    return (
+        f'({column} BETWEEN {int(start_block)} AND {int(end_block)} AND '
+        f'{PARTITION_COLUMN} BETWEEN {block_bucket(int(start_block))} AND {block_bucket(int(end_block))})'
+    )
+
+
+_parquet_conn = None
+
+def query_parquet(sql: str, params: typing.Optional[typing.Sequence] = None):
+    """
+    Run a query against the Parquet snapshot, returning a pandas DataFrame
+    """
+    global _parquet_conn
+    if _parquet_conn is None:
+        _parquet_conn = connect_parquet()
+    return _parquet_conn.execute(sql, params or []).df()
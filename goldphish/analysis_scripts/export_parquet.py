@@ -0,0 +1,265 @@
+"""
+Snapshot the tables the analysis scripts read into Parquet, for local analysis with DuckDB
+(see common.connect_parquet).
+
+Every table is read in one REPEATABLE READ transaction, so the snapshot is consistent, and
+streamed through a server-side cursor, so memory use does not grow with the table. Tables
+keyed by block are partitioned Hive-style by block range (eg block_bucket=14000000/), with
+rows whose block is NULL in block_bucket=null/; a query that also filters on block_bucket
+(see common.block_range_filter) only opens the files for its blocks.
+
+NUMERIC columns (wei and token amounts, up to 78 digits) are exported as DOUBLE, which is
+plenty for aggregates and plots but not exact; BYTEA stays binary.
+
+Usage: python3 export_parquet.py --out /mnt/goldphish/parquet [--tables t1,t2]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import time
+import typing
+
+import psycopg2
+import psycopg2.extensions
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common import PARQUET_DIR, PARTITION_COLUMN, block_bucket
+
+BATCH_ROWS = 100_000
+
+# table -> column to partition by, if any
+TABLES: typing.Dict[str, typing.Optional[str]] = {
+    'tokens':                                      None,
+    'block_samples':                               None,
+    'block_timestamps':                            'block_number',
+    'eth_price_blocks':                            'block_number',
+    'naive_gas_price_estimate':                    'block_number',
+    'flashbots_transactions':                      'block_number',
+    'sample_arbitrages':                           'block_number',
+    'sample_arbitrage_exchanges':                  None,
+    'sample_arbitrage_cycles':                     None,
+    'sample_arbitrage_cycle_exchanges':            None,
+    'sample_arbitrage_cycle_exchange_items':       None,
+    'sample_arbitrages_no_fp':                     'block_number',
+    'sample_arbitrage_exchanges_no_fp':            None,
+    'sample_arbitrage_cycles_no_fp':               None,
+    'sample_arbitrage_cycle_exchanges_no_fp':      None,
+    'sample_arbitrage_cycle_exchange_items_no_fp': None,
+    'sample_arbitrage_backrun_detections':         None,
+    'arb_sandwich_detections':                     'block_number',
+    'candidate_arbitrages':                        'block_number',
+    'candidate_arbitrage_campaigns':               'block_number_start',
+    'candidate_arbitrage_campaign_member':         None,
+    'top_candidate_arbitrage_campaigns':           'start_block',
+}
+
+# postgres type oid -> (arrow type, conversion from what psycopg2 returns)
+_BYTEA = (pa.binary(), bytes)
+_NUMERIC = (pa.float64(), float)
+_TYPES = {
+    16:   (pa.bool_(), None),
+    17:   _BYTEA,
+    20:   (pa.int64(), None),
+    21:   (pa.int16(), None),
+    23:   (pa.int32(), None),
+    25:   (pa.string(), None),
+    700:  (pa.float32(), None),
+    701:  (pa.float64(), None),
+    1043: (pa.string(), None),
+    1114: (pa.timestamp('us'), None),
+    1700: _NUMERIC,
+    # arrays
+    1000: (pa.list_(pa.bool_()), None),
+    1001: (pa.list_(_BYTEA[0]), lambda x: [bytes(y) for y in x]),
+    1005: (pa.list_(pa.int16()), None),
+    1007: (pa.list_(pa.int32()), None),
+    1016: (pa.list_(pa.int64()), None),
+    1231: (pa.list_(_NUMERIC[0]), lambda x: [float(y) for y in x]),
+}
+# anything else goes out as its text form
+_FALLBACK = (pa.string(), str)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', type=str, default=PARQUET_DIR, help='directory to write the snapshot into')
+    parser.add_argument('--tables', type=str, default=None, help='comma-separated tables to export (default: all)')
+    args = parser.parse_args()
+
+    if args.tables is not None:
+        tables = args.tables.split(',')
+        unknown = set(tables).difference(TABLES.keys())
+        if len(unknown) > 0:
+            parser.error(f'unknown tables: {", ".join(sorted(unknown))}')
+    else:
+        tables = list(TABLES.keys())
+
+    db = psycopg2.connect(
+        host = os.getenv('PSQL_HOST', 'ethereum-measurement-pg'),
+        port = int(os.getenv('PSQL_PORT', '5432')),
+        user = os.getenv('PSQL_USER', 'measure'),
+        password = os.getenv('PSQL_PASSWORD', 'password'),
+        database = os.getenv('PSQL_DATABASE', 'eth_measure_db'),
+    )
+    print('connected to postgresql')
+    db.autocommit = False
+    db.cursor().execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, '_export.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as fin:
+            manifest = json.load(fin)
+    else:
+        manifest = {}
+
+    for table in tables:
+        t_start = time.time()
+        n_rows = export_table(db, table, TABLES[table], args.out)
+        if n_rows is None:
+            print(f'{table}: does not exist, skipped')
+            continue
+        print(f'{table}: {n_rows:,} rows in {time.time() - t_start:.1f} seconds')
+        manifest[table] = {
+            'rows': n_rows,
+            'exported_on': datetime.datetime.utcnow().isoformat(),
+        }
+
+    db.rollback()
+
+    with open(manifest_path, mode='w') as fout:
+        json.dump(manifest, fout, indent=2, sort_keys=True)
+
+
+def export_table(
+        db: psycopg2.extensions.connection,
+        table: str,
+        partition_column: typing.Optional[str],
+        out_dir: str,
+    ) -> typing.Optional[int]:
+    """
+    Write the table to out_dir/table/, replacing any earlier export once done.
+
+    Returns the number of rows written, or None if the table does not exist.
+    """
+    curr = db.cursor()
+    curr.execute('SELECT to_regclass(%s)', (table,))
+    (exists,) = curr.fetchone()
+    if exists is None:
+        return None
+
+    # named, so the rows are streamed rather than fetched all at once
+    stream = db.cursor(name=f'export_{table}')
+    stream.itersize = BATCH_ROWS
+    stream.execute(f'SELECT * FROM {table}')
+    try:
+        # the description is only known after the first fetch
+        first = stream.fetchmany(BATCH_ROWS)
+
+        def batches():
+            rows = first
+            while len(rows) > 0:
+                yield rows
+                rows = stream.fetchmany(BATCH_ROWS)
+
+        return write_table(out_dir, table, stream.description, batches(), partition_column)
+    finally:
+        stream.close()
+
+
+def write_table(
+        out_dir: str,
+        table: str,
+        description,
+        batches: typing.Iterable[typing.List[tuple]],
+        partition_column: typing.Optional[str],
+    ) -> int:
+    """
+    Write batches of rows, as psycopg2 returns them (with the cursor's description), to
+    out_dir/table/, replacing any earlier export once done.
+
+    Returns the number of rows written.
+    """
+    final_dir = os.path.join(out_dir, table)
+    tmp_dir = os.path.join(out_dir, f'.{table}.partial')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    schema, converters = _schema(description)
+    if partition_column is not None:
+        partition_idx = schema.get_field_index(partition_column)
+        assert partition_idx >= 0, f'{table} has no column {partition_column}'
+
+    # keyed by the directory under tmp_dir, '' when unpartitioned
+    writers: typing.Dict[str, pq.ParquetWriter] = {}
+    n_rows = 0
+    try:
+        for rows in batches:
+            if partition_column is None:
+                by_dir = {'': rows}
+            else:
+                by_dir = {}
+                for row in rows:
+                    by_dir.setdefault(_bucket_dir(row[partition_idx]), []).append(row)
+
+            for subdir, dir_rows in by_dir.items():
+                if subdir not in writers:
+                    os.makedirs(os.path.join(tmp_dir, subdir), exist_ok=True)
+                    fname = os.path.join(tmp_dir, subdir, 'part-0.parquet')
+                    writers[subdir] = pq.ParquetWriter(fname, schema, compression='zstd')
+                writers[subdir].write_table(_to_arrow(dir_rows, schema, converters))
+
+            n_rows += len(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    if len(writers) == 0:
+        # still write the (empty) table so that the view has columns, and, when
+        # partitioned, the partition column
+        subdir = '' if partition_column is None else _bucket_dir(None)
+        os.makedirs(os.path.join(tmp_dir, subdir), exist_ok=True)
+        pq.write_table(schema.empty_table(), os.path.join(tmp_dir, subdir, 'part-0.parquet'))
+
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.rename(tmp_dir, final_dir)
+    return n_rows
+
+
+def _bucket_dir(block_number: typing.Optional[int]) -> str:
+    """
+    The partition directory for a row; rows without a block go in block_bucket=null,
+    which DuckDB reads as a NULL block_bucket
+    """
+    if block_number is None:
+        return f'{PARTITION_COLUMN}=null'
+    return f'{PARTITION_COLUMN}={block_bucket(block_number)}'
+
+
+def _schema(description) -> typing.Tuple[pa.Schema, typing.List[typing.Optional[typing.Callable]]]:
+    fields = []
+    converters = []
+    for column in description:
+        type_, converter = _TYPES.get(column.type_code, _FALLBACK)
+        fields.append(pa.field(column.name, type_))
+        converters.append(converter)
+    return pa.schema(fields), converters
+
+
+def _to_arrow(rows: typing.List[tuple], schema: pa.Schema, converters: typing.List[typing.Optional[typing.Callable]]) -> pa.Table:
+    columns = []
+    for i, (field, converter) in enumerate(zip(schema, converters)):
+        if converter is None:
+            values = [row[i] for row in rows]
+        else:
+            values = [None if row[i] is None else converter(row[i]) for row in rows]
+        columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,10 @@ import itertools
 import logging
 import argparse
 import os
+import queue
 import socket
+import threading
+import time
 import networkx as nx
 import typing
 import web3
@@ -13,6 +16,9 @@ import web3._utils.filters
 import psycopg2.extensions
 from backtest.gather_samples.analyses import get_arbitrage_if_exists
 from backtest.gather_samples.database import insert_arbs, setup_db
+from backtest.gather_samples.models import Arbitrage
+from backtest.gather_samples import pipeline
+from backtest.progress import WorkerTelemetry
 
 from backtest.utils import ERC20_TRANSFER_TOPIC_HEX, ERC20_TRANSFER_TOPIC, CancellationToken, connect_db
 from utils import setup_logging, erc20
@@ -51,15 +57,7 @@ def main():
             l.info('Setup db')
             return
 
-        web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
-
-        w3 = web3.Web3(web3.WebsocketProvider(
-            web3_host,
-            websocket_timeout=60 * 5,
-            websocket_kwargs={
-                'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-            },
-        ))
+        w3 = connect_web3()
 
         if not w3.isConnected():
             l.error(f'Could not connect to web3')
@@ -88,23 +86,65 @@ def main():
         l.debug(f'Connected to web3, chainId={w3.eth.chain_id}')
 
         cancellation_token = CancellationToken(job_name, args.worker_name, connect_db())
+        telemetry = WorkerTelemetry(job_name, args.worker_name)
+        telemetry.instrument(w3)
+
+        # made once and reused by every reservation's pipeline
+        connections = StageConnections(
+            detect_w3 = telemetry.instrument(connect_web3()),
+            insert_w3 = telemetry.instrument(connect_web3()),
+            insert_db = connect_db(),
+        )
 
-        while not cancellation_token.cancel_requested():
-            maybe_rez = get_reservation(curr, start_block, end_block)
-            if maybe_rez is None:
-                # we're at the end
-                break
+        try:
+            while not cancellation_token.cancel_requested():
+                maybe_rez = get_reservation(curr, start_block, end_block)
+                if maybe_rez is None:
+                    # we're at the end
+                    break
 
-            try:
-                with maybe_rez as (reservation_start, reservation_end):
-                    process_reservation(w3, curr, reservation_start, reservation_end, cancellation_token)
-            except ReservationCancelRequestedException:
-                pass
+                try:
+                    with maybe_rez as (reservation_start, reservation_end):
+                        process_reservation(w3, curr, reservation_start, reservation_end, cancellation_token, telemetry, connections)
+                except ReservationCancelRequestedException:
+                    pass
+        finally:
+            telemetry.flush()
     except Exception:
         l.exception('exiting from root-level exception')
         exit(1)
 
 
+def connect_web3() -> web3.Web3:
+    """
+    Open a new websocket connection to the node.
+
+    Each pipeline stage gets its own connection (see StageConnections), websocket providers cannot
+    be shared across threads.
+    """
+    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
+
+    return web3.Web3(web3.WebsocketProvider(
+        web3_host,
+        websocket_timeout=60 * 5,
+        websocket_kwargs={
+            'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
+        },
+    ))
+
+
+class StageConnections(typing.NamedTuple):
+    """
+    The connections used by the pipeline stages of process_reservation(), one set per worker.
+
+    A stage is the only user of its connections while it runs, and the stages of one
+    reservation are joined before the next reservation's start.
+    """
+    detect_w3: web3.Web3
+    insert_w3: web3.Web3
+    insert_db: psycopg2.extensions.connection
+
+
 class ReservationContextManager:
 
     def __init__(self, id_: int, curr: psycopg2.extensions.cursor, start_block: int, end_block_exclusive: int) -> None:
@@ -306,44 +346,121 @@ def process_reservation(
         curr: psycopg2.extensions.cursor,
         reservation_start: int,
         reservation_end_exclusive: int,
-        cancellation_token: CancellationToken
+        cancellation_token: CancellationToken,
+        telemetry: WorkerTelemetry,
+        connections: StageConnections,
     ):
+    """
+    Scrape the reservation for arbitrages.
+
+    Runs as a three-stage pipeline so the node, the CPU, and postgres are busy at the same time:
+    this thread fetches transfer logs, a detector thread decodes them and looks for arbitrages,
+    and a writer thread inserts and commits each batch (in block order) on its own connection.
+    """
     l.info(f'processing blocks {reservation_start:,} to {reservation_end_exclusive:,} ({reservation_end_exclusive-reservation_start:,} blocks)')
 
     throttler = BlockThrottle(
         setpoint = 5_000, # log events per round-trip query
         additive_increase = 2,
         initial = 10, # starting guess
+        max_val = 10_000,
     )
 
+    # first block not yet committed by the writer
+    committed_until = reservation_start
+
+    def detect(w3_detect: web3.Web3, item):
+        batch_start, batch_end_inclusive, logs = item
+        arbs = detect_arbitrages(w3_detect, logs)
+        return (batch_start, batch_end_inclusive, arbs), len(logs)
+
+    def insert(ctx, item):
+        nonlocal committed_until
+        w3_insert, db = ctx
+        batch_start, batch_end_inclusive, arbs = item
+        assert batch_start == committed_until, 'batches must be committed in order'
+
+        with telemetry.db_write():
+            insert_arbs(w3_insert, db.cursor(), arbs)
+            db.commit()
+        committed_until = batch_end_inclusive + 1
+        telemetry.observe_blocks(batch_end_inclusive - batch_start + 1)
+        return None, len(arbs)
+
+    abort = threading.Event()
+    logs_queue = queue.Queue(maxsize=pipeline.DEFAULT_QUEUE_SIZE)
+    arbs_queue = queue.Queue(maxsize=pipeline.DEFAULT_QUEUE_SIZE)
+
+    fetch_stats = pipeline.StageStats('fetch')
+    detector = pipeline.Stage('detect', detect, logs_queue, arbs_queue, abort, setup=lambda: connections.detect_w3)
+    writer = pipeline.Stage('insert', insert, arbs_queue, None, abort, setup=lambda: (connections.insert_w3, connections.insert_db))
+    detector.start()
+    writer.start()
+
+    cancelled = False
     this_block_start = reservation_start
-    while this_block_start < reservation_end_exclusive:
-        if cancellation_token.cancel_requested():
-            raise ReservationCancelRequestedException(this_block_start)
-
-        n_blocks = throttler.val_int_clamp(1, 10_000)
-        this_end_block_inclusive = min(reservation_end_exclusive - 1, this_block_start + n_blocks - 1)
-        assert this_block_start <= this_end_block_inclusive
-
-        f: web3._utils.filters.Filter = w3.eth.filter({
-            'fromBlock': this_block_start,
-            'toBlock': this_end_block_inclusive,
-            'topics': [ERC20_TRANSFER_TOPIC_HEX],
-        })
-        logs = f.get_all_entries()
-        throttler.observe(len(logs))
-
-        process_batch(w3, curr, logs)
-        curr.connection.commit()
+    try:
+        while this_block_start < reservation_end_exclusive:
+            if cancellation_token.cancel_requested():
+                cancelled = True
+                break
+            telemetry.maybe_flush()
+
+            n_blocks = throttler.val_int_clamp(1, 10_000)
+            this_end_block_inclusive = min(reservation_end_exclusive - 1, this_block_start + n_blocks - 1)
+            assert this_block_start <= this_end_block_inclusive
+
+            t_start = time.time()
+            f: web3._utils.filters.Filter = w3.eth.filter({
+                'fromBlock': this_block_start,
+                'toBlock': this_end_block_inclusive,
+                'topics': [ERC20_TRANSFER_TOPIC_HEX],
+            })
+            logs = f.get_all_entries()
+            t_fetched = time.time()
+
+            pipeline.put_unless_aborted(logs_queue, (this_block_start, this_end_block_inclusive, logs), abort)
+            t_queued = time.time()
+
+            fetch_seconds = t_fetched - t_start
+            wait_seconds = t_queued - t_fetched
+            fetch_stats.record(fetch_seconds, wait_seconds, len(logs))
 
-        this_block_start = this_end_block_inclusive + 1
+            # Always back off when a query returns too many logs. Only grow the range while fetching
+            # is the bottleneck; when we mostly wait on the detector, larger ranges just sit in the queue.
+            if len(logs) > throttler.setpoint or wait_seconds <= fetch_seconds:
+                throttler.observe(len(logs))
 
+            this_block_start = this_end_block_inclusive + 1
 
-def process_batch(
+        pipeline.put_unless_aborted(logs_queue, None, abort)
+    except pipeline.PipelineAborted:
+        pass
+    except:
+        abort.set()
+        raise
+    finally:
+        # drains all batches already fetched (unless aborted)
+        detector.join()
+        writer.join()
+
+    for stage in [detector, writer]:
+        if stage.exception is not None:
+            raise Exception(f'pipeline stage {stage.name} failed') from stage.exception
+
+    for stats in [fetch_stats, detector.stats, writer.stats]:
+        l.info(str(stats))
+
+    if cancelled:
+        raise ReservationCancelRequestedException(committed_until)
+
+    assert committed_until == reservation_end_exclusive
+
+
+def detect_arbitrages(
         w3: web3.Web3,
-        curr: psycopg2.extensions.cursor,
         logs: typing.List[web3.types.LogReceipt]
-    ):
+    ) -> typing.List[Arbitrage]:
     # gather logs into per-transaction
     tx_to_logs = collections.defaultdict(lambda: [])
     for log in logs:
@@ -387,10 +504,8 @@ def process_batch(
             )
             if arb is not None:
                 arbs.append(arb)
-    
-    insert_arbs(w3, curr, arbs)
 
-    curr.connection.commit()
+    return arbs
 
 
 if __name__ == '__main__':
@@ -1,7 +1,7 @@
 import argparse
+import bisect
 import collections
 import logging
-import os
 import socket
 import time
 import web3
@@ -12,10 +12,12 @@ import typing
 import psycopg2
 import psycopg2.extensions
 from backtest.gather_samples.analyses import get_addr_to_movements, get_arbitrage_from_receipt_if_exists, get_potential_exchanges
-from backtest.utils import ERC20_TRANSFER_TOPIC, connect_db
+from backtest.gather_samples.receipts import BlockReceiptCache
+from backtest.progress import WorkerTelemetry
+from backtest.utils import connect_db
 from backtest.gather_samples.models import *
 
-from utils import setup_logging, erc20
+from utils import connect_web3, setup_logging
 
 l = logging.getLogger(__name__)
 
@@ -51,15 +53,8 @@ def main():
         reset_db(curr)
         return
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
-
-    w3 = web3.Web3(web3.WebsocketProvider(
-        web3_host,
-        websocket_timeout=60 * 5,
-        websocket_kwargs={
-            'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-        },
-    ))
+    # RetryingProvider supports batched requests, used for fetching receipts
+    w3 = connect_web3()
 
     if not w3.isConnected():
         l.error(f'Could not connect to web3')
@@ -67,47 +62,53 @@ def main():
 
     l.debug(f'Connected to web3, chainId={w3.eth.chain_id}')
 
+    telemetry = WorkerTelemetry(job_name, args.worker_name)
+    telemetry.instrument(w3)
+
     if DEBUG and DEBUG_TXN:
         curr.execute('SELECT block_number FROM sample_arbitrages WHERE txn_hash = %s', (DEBUG_TXN,))
         (debug_block,) = curr.fetchone()
-        process_reservation(w3, curr, debug_block, debug_block, -1)
+        process_reservation(w3, curr, debug_block, debug_block, -1, telemetry)
     elif DEBUG and DEBUG_SAMPLE:
         curr.execute('SELECT block_number FROM sample_arbitrages WHERE id = %s', (DEBUG_SAMPLE,))
         (debug_block,) = curr.fetchone()
-        process_reservation(w3, curr, debug_block, debug_block, -1)
+        process_reservation(w3, curr, debug_block, debug_block, -1, telemetry)
     else:
-        while True:
-            if not DEBUG:
-                curr.connection.commit()
-            curr.execute(
-                '''
-                SELECT id, start_block, end_block
-                FROM arb_sandwich_reservations
-                WHERE claimed_on IS NULL
-                FOR UPDATE SKIP LOCKED
-                '''
-            )
-            if curr.rowcount < 1:
-                l.info('Done')
-                break
+        try:
+            while True:
+                if not DEBUG:
+                    curr.connection.commit()
+                curr.execute(
+                    '''
+                    SELECT id, start_block, end_block
+                    FROM arb_sandwich_reservations
+                    WHERE claimed_on IS NULL
+                    FOR UPDATE SKIP LOCKED
+                    '''
+                )
+                if curr.rowcount < 1:
+                    l.info('Done')
+                    break
 
-            id_, start_block, end_block = curr.fetchone()
-            curr.execute('UPDATE arb_sandwich_reservations SET claimed_on = now()::timestamp WHERE id = %s', (id_,))
-            assert curr.rowcount == 1
-            if not DEBUG:
-                curr.connection.commit()
+                id_, start_block, end_block = curr.fetchone()
+                curr.execute('UPDATE arb_sandwich_reservations SET claimed_on = now()::timestamp WHERE id = %s', (id_,))
+                assert curr.rowcount == 1
+                if not DEBUG:
+                    curr.connection.commit()
 
-            l.info(f'Processing reservation {id_} from {start_block:,} to {end_block:,}')
+                l.info(f'Processing reservation {id_} from {start_block:,} to {end_block:,}')
 
-            try:
-                process_reservation(w3, curr, start_block, end_block, id_)
-            except:
-                l.exception(f'Reservation id={id_} failed')
-                curr.connection.rollback()
-                raise
+                try:
+                    process_reservation(w3, curr, start_block, end_block, id_, telemetry)
+                except:
+                    l.exception(f'Reservation id={id_} failed')
+                    curr.connection.rollback()
+                    raise
 
-            curr.execute('UPDATE arb_sandwich_reservations SET completed_on = now()::timestamp, progress = end_block WHERE id = %s', (id_,))
-            assert curr.rowcount == 1
+                curr.execute('UPDATE arb_sandwich_reservations SET completed_on = now()::timestamp, progress = end_block WHERE id = %s', (id_,))
+                assert curr.rowcount == 1
+        finally:
+            telemetry.flush()
 
 
 def setup_db(curr: psycopg2.extensions.cursor):
@@ -213,7 +214,84 @@ def reset_db(curr: psycopg2.extensions.cursor):
     raise NotImplementedError('didnt get around to this')
 
 
-def process_reservation(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: int, end_block: int, reservation_id: int):
+class BlockIndex:
+    """
+    Index of a full block: transaction hash -> position, and relayer (`to` address) -> sorted positions.
+    """
+
+    def __init__(self, block: web3.types.BlockData) -> None:
+        self.transactions = block['transactions']
+        self.txn_to_index: typing.Dict[bytes, int] = {}
+        self.relayer_to_idxs: typing.Dict[str, typing.List[int]] = collections.defaultdict(list)
+        for txn in self.transactions:
+            self.txn_to_index[bytes(txn['hash'])] = txn['transactionIndex']
+            self.relayer_to_idxs[txn['to']].append(txn['transactionIndex'])
+
+    def same_relayer_before(self, relayer: str, idx: int) -> typing.List[web3.types.TxData]:
+        """
+        Transactions to `relayer` at least two positions before `idx`.
+        """
+        idxs = self.relayer_to_idxs.get(relayer, [])
+        end = bisect.bisect_left(idxs, idx - 1)
+        return [self.transactions[i] for i in idxs[:end]]
+
+
+class SampleInfo(typing.NamedTuple):
+    profit_token: str
+    profit_amount: int
+    coinbase_xfer: typing.Optional[int]
+    exchanges: typing.Set[str]
+
+
+def load_sample_info(w3: web3.Web3, curr: psycopg2.extensions.cursor, sample_ids: typing.List[int]) -> typing.Dict[int, SampleInfo]:
+    """
+    Load profit token, profit and the exchanges used for all (single-cycle) samples in one go.
+    """
+    curr.execute(
+        '''
+        SELECT sa.id, t.address, sac.profit_amount, sa.coinbase_xfer
+        FROM (SELECT * FROM sample_arbitrages WHERE id = ANY(%s)) sa
+        JOIN sample_arbitrage_cycles sac ON sa.id = sac.sample_arbitrage_id
+        JOIN tokens t ON t.id = sac.profit_token
+        ''',
+        (sample_ids,)
+    )
+    assert curr.rowcount == len(sample_ids)
+    rows = curr.fetchall()
+
+    curr.execute(
+        '''
+        SELECT DISTINCT sac.sample_arbitrage_id, sae.address
+        FROM (SELECT * FROM sample_arbitrage_cycles WHERE sample_arbitrage_id = ANY(%s)) sac
+        JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
+        JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
+        JOIN sample_arbitrage_exchanges sae ON sae.id = sacei.exchange_id
+        ''',
+        (sample_ids,)
+    )
+    sample_to_exchanges = collections.defaultdict(set)
+    for id_, baddr in curr:
+        sample_to_exchanges[id_].add(w3.toChecksumAddress(baddr.tobytes()))
+
+    ret = {}
+    for id_, profit_token, profit_amount, coinbase_xfer in rows:
+        ret[id_] = SampleInfo(
+            profit_token = w3.toChecksumAddress(profit_token.tobytes()),
+            profit_amount = profit_amount,
+            coinbase_xfer = coinbase_xfer,
+            exchanges = sample_to_exchanges[id_],
+        )
+    return ret
+
+
+def process_reservation(
+        w3: web3.Web3,
+        curr: psycopg2.extensions.cursor,
+        start_block: int,
+        end_block: int,
+        reservation_id: int,
+        telemetry: WorkerTelemetry,
+    ):
     if DEBUG and DEBUG_TXN:
         curr.execute('SELECT id, txn_hash, block_number FROM sample_arbitrages_no_fp WHERE txn_hash = %s', (DEBUG_TXN,))
     elif DEBUG and DEBUG_SAMPLE:
@@ -233,66 +311,50 @@ def process_reservation(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_b
 
     l.info(f'Have {len(block_to_samples):,} blocks to examine from {start_block:,} to {end_block:,}')
 
+    all_sample_ids = [id_ for samples in block_to_samples.values() for id_, _ in samples]
+    sample_infos = load_sample_info(w3, curr, all_sample_ids) if len(all_sample_ids) > 0 else {}
+
+    # last block reported to telemetry as done
+    reported_until = start_block - 1
+
     for block_number in sorted(block_to_samples.keys()):
         l.debug(f'Processing block {block_number:,}')
         # if block_number < 12802592:
         #     continue
 
         block = w3.eth.get_block(block_number, full_transactions=True)
-        txn_to_index = {bytes(txn['hash']): txn['transactionIndex'] for txn in block['transactions']}
+        block_index = BlockIndex(block)
+        receipts = BlockReceiptCache(w3)
 
         for id_, txn_hash in block_to_samples[block_number]:
             l.debug(f'Detecting arb sandwiches provision for sample id={id_}')
-            idx = txn_to_index[txn_hash]
+            idx = block_index.txn_to_index[txn_hash]
             if idx < 2:
                 l.debug(f'Sample {id_} too high in block')
                 continue
             
             relayer = block['transactions'][idx]['to']
             # gather all transactions at least two prior to our index that also go to this relayer
-            same_relayer_txns = [x for x in block['transactions'][:idx - 1] if x['to'] == relayer]
+            same_relayer_txns = block_index.same_relayer_before(relayer, idx)
             if len(same_relayer_txns) == 0:
                 l.debug(f'Sample {id_} has no other txns before it to the same relayer')
                 continue
 
             # get receipts for all prior transactions
-            same_relayer_txns_receipts: typing.List[web3.types.TxReceipt] = []
-            for t in same_relayer_txns:
-                same_relayer_txns_receipts.append(
-                    w3.eth.get_transaction_receipt(t['hash'])
-                )
+            same_relayer_txns_receipts: typing.List[web3.types.TxReceipt] = receipts.get_many([bytes(t['hash']) for t in same_relayer_txns])
 
             # remove all that don't have enough ERC-20 movement (and parse the erc-20 txns, too)
             same_relayer_txns_receipts_with_erc20: typing.List[typing.Tuple[web3.types.TxReceipt, typing.List]] = []
             for txn in same_relayer_txns_receipts:
-                erc20s = []
-                for log in txn['logs']:
-                    if len(log['topics']) > 0 and log['topics'][0] == ERC20_TRANSFER_TOPIC:
-                        try:
-                            erc20s.append(
-                                erc20.events.Transfer().processLog(log)
-                            )
-                        except web3.exceptions.LogTopicError:
-                            l.warning(f'Could not parse erc20 log from {log["address"]}')
-                            pass
+                erc20s = receipts.get_transfers(bytes(txn['transactionHash']))
                 if len(erc20s) >= 3:
                     same_relayer_txns_receipts_with_erc20.append((txn, erc20s))
             
             if len(same_relayer_txns_receipts_with_erc20) == 0:
                 l.debug(f'Sample {id_} has no other txns before it with enough erc20 transfers to be an arbitrage')
 
-            # get original profit token
-            curr.execute(
-                '''
-                SELECT t.address
-                FROM sample_arbitrage_cycles sac
-                JOIN tokens t ON t.id = sac.profit_token 
-                WHERE sac.sample_arbitrage_id = %s
-                ''',
-                (id_,)
-            )
-            (original_profit_token,) = curr.fetchone()
-            original_profit_token = w3.toChecksumAddress(original_profit_token.tobytes())
+            sample_info = sample_infos[id_]
+            original_profit_token = sample_info.profit_token
 
             same_relayer_txns_with_arb_analysis: typing.List[typing.Tuple[web3.types.TxReceipt, Arbitrage]] = []
             for txn, erc20s in same_relayer_txns_receipts_with_erc20:
@@ -309,17 +371,7 @@ def process_reservation(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_b
                 continue
 
             # get original exchanges used
-            curr.execute(
-                '''
-                SELECT DISTINCT sae.address
-                FROM (SELECT * FROM sample_arbitrage_cycles WHERE sample_arbitrage_id = %s) sac
-                JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
-                JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
-                JOIN sample_arbitrage_exchanges sae ON sae.id = sacei.exchange_id
-                ''',
-                (id_,)
-            )
-            original_exchanges = set(w3.toChecksumAddress(x.tobytes()) for (x,) in curr)
+            original_exchanges = sample_info.exchanges
             assert len(original_exchanges) >= 2
 
             same_relayer_txns_same_exchanges: typing.List[typing.Tuple[web3.types.TxReceipt, Arbitrage]] = []
@@ -359,9 +411,9 @@ def process_reservation(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_b
                 for txn, arb in same_relayer_txns_same_exchanges:
                     prior_idx = txn['transactionIndex']
                     had_shared_exchange_txn = False
-                    for middle_txn in block['transactions'][prior_idx + 1 : idx]:
-                        middle_txn_receipt = w3.eth.get_transaction_receipt(middle_txn['hash'])
-                        erc20s = erc20.events.Transfer().processReceipt(middle_txn_receipt, errors=web3.logs.DISCARD)
+                    middle_txn_hashes = [bytes(t['hash']) for t in block['transactions'][prior_idx + 1 : idx]]
+                    for middle_txn_receipt in receipts.get_many(middle_txn_hashes):
+                        erc20s = receipts.get_transfers(bytes(middle_txn_receipt['transactionHash']))
                         potential_exchanges = get_potential_exchanges(middle_txn_receipt, get_addr_to_movements(erc20s))
                         isxn = original_exchanges.intersection(potential_exchanges)
                         if len(isxn) > 0:
@@ -370,7 +422,7 @@ def process_reservation(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_b
                     if had_shared_exchange_txn:
                         with_shared_exchanges.append((txn, isxn, arb))
 
-                original_reciept = w3.eth.get_transaction_receipt(txn_hash)
+                original_reciept = receipts.get(txn_hash)
 
                 ((front_txn, front_arb),) = same_relayer_txns_same_exchanges
                 l.debug(f'Sample {id_} was sandwiching, front transaction: {front_txn["transactionHash"].hex()}')
@@ -378,16 +430,8 @@ def process_reservation(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_b
 
                 # assert front_txn['transactionIndex'] + 2 == original_reciept['transactionIndex']
 
-                curr.execute(
-                    '''
-                    SELECT coinbase_xfer, profit_amount 
-                    FROM (select * from sample_arbitrages where id = %s) sa
-                    JOIN sample_arbitrage_cycles sac ON sa.id = sac.sample_arbitrage_id
-                    ''',
-                    (id_,)
-                )
-                assert curr.rowcount == 1
-                (coinbase_xfer, profit_amount) = curr.fetchone()
+                coinbase_xfer = sample_info.coinbase_xfer
+                profit_amount = sample_info.profit_amount
 
                 curr.execute(
                     '''
@@ -434,9 +478,14 @@ def process_reservation(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_b
             # import pdb; pdb.set_trace()
         if not DEBUG:
             curr.execute('UPDATE arb_sandwich_reservations SET progress = %s WHERE id = %s', (block_number, reservation_id))
-            curr.connection.commit()
+            with telemetry.db_write():
+                curr.connection.commit()
+            telemetry.observe_blocks(block_number - reported_until)
+            reported_until = block_number
+            telemetry.maybe_flush()
     if not DEBUG:
         curr.connection.commit()
+        telemetry.observe_blocks(end_block - reported_until)
 
 if __name__ == '__main__':
     main()
@@ -7,8 +7,8 @@ and checking against our model for the same or different profit before fees.
 
 import argparse
 import datetime
-import itertools
 import os
+import socket
 import subprocess
 import sys
 import time
@@ -20,9 +20,10 @@ import web3.contract
 import web3.types
 import web3._utils.filters
 import logging
-import numpy as np
 
 import backtest.gather_samples.analyses
+from backtest import work_queue
+from backtest.progress import WorkerTelemetry
 from backtest.utils import ERC20_TRANSFER_TOPIC, connect_db
 from utils import get_abi, setup_logging
 from utils import erc20
@@ -34,6 +35,11 @@ uv3_factory: web3.contract.Contract = web3.Web3().eth.contract(address=b'\x00'*2
 
 DEBUG = False
 
+JOB_NAME = 'fill_backrunners'
+
+# blocks per queued range; each range is processed in chunks of work_queue.DEFAULT_CHUNK_BLOCKS
+RESERVATION_BLOCKS = 1_000
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--setup-db', action='store_true', dest='setup_db')
@@ -41,7 +47,10 @@ def main():
     parser.add_argument('--worker-name', type=str, default=None, help='worker name for log, must be POSIX path-safe')
     args = parser.parse_args()
 
-    setup_logging('fill_backrunners', worker_name=args.worker_name, stdout_level=logging.DEBUG if args.verbose else logging.INFO)
+    if args.worker_name is None:
+        args.worker_name = socket.gethostname()
+
+    setup_logging(JOB_NAME, worker_name=args.worker_name, stdout_level=logging.DEBUG if args.verbose else logging.INFO)
 
     db = connect_db()
     curr = db.cursor()
@@ -139,8 +148,14 @@ def main():
             fill_queue(curr)
         else:
             ganache_proc, ganache_w3 = open_ganache()
-            for res in get_reservations(curr):
-                do_reorder(w3, ganache_w3, curr, res)
+            telemetry = WorkerTelemetry(JOB_NAME, args.worker_name)
+            telemetry.instrument(w3)
+            queue = work_queue.WorkQueue(connect_db(), JOB_NAME, args.worker_name)
+            work_queue.run_worker(
+                queue,
+                lambda start_block, end_block_exclusive: do_reorder(w3, ganache_w3, curr, start_block, end_block_exclusive),
+                telemetry = telemetry,
+            )
     except:
         l.exception('top-level exception')
         raise
@@ -164,28 +179,15 @@ def setup_db(curr: psycopg2.extensions.cursor):
         '''
     )
     
-    # create queue
-    curr.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS backrun_detection_reservations (
-            id SERIAL PRIMARY KEY NOT NULL,
-            start_block         INTEGER NOT NULL,
-            end_block_exclusive  INTEGER NOT NULL,
-            started_on          TIMESTAMP WITHOUT TIME ZONE,
-            finished_on         TIMESTAMP WITHOUT TIME ZONE
-        );
-        '''
-    )
+    work_queue.setup_db(curr)
     curr.connection.commit()
 
 
 def fill_queue(curr: psycopg2.extensions.cursor):
-    # see if we need to fill queue    
-    curr.execute('SELECT count(*) FROM backrun_detection_reservations')
-
-    (n_rows,) = curr.fetchone()
-
-    # find lowest / highest blocks where we have sample arbitrage transactions
+    """
+    Queue every block where we have sample arbitrages; on later runs, extends the queue
+    back or forward in history as the samples grow.
+    """
     curr.execute(
         '''
         SELECT min(block_number), max(block_number)
@@ -194,115 +196,10 @@ def fill_queue(curr: psycopg2.extensions.cursor):
     )
     min_block, max_block = curr.fetchone()
     assert min_block < max_block
-    assert (max_block - min_block) > 1000
-
-    if n_rows > 0:
-        l.error('Queue already created.')
-
-        # check for expanding back and forward
-        curr.execute('SELECT MIN(start_block), MAX(end_block_exclusive) FROM backrun_detection_reservations')
-        reservations_start_at, reservations_end_at_exclusive = curr.fetchone()
-
-        batch_size = 1000
-
-        n_inserted = 0
-        if reservations_start_at > min_block:
-            l.info('expanding back in history')
-            # fill from start to end
-            for i in itertools.count():
-                this_start_block = i * batch_size + min_block
-                this_end_block = min(reservations_start_at, (i + 1) * batch_size + min_block)
-                if this_start_block > reservations_start_at:
-                    break
-                curr.execute(
-                    '''
-                    INSERT INTO backrun_detection_reservations (start_block, end_block_exclusive)
-                    VALUES (%s, %s)
-                    ''',
-                    (this_start_block, this_end_block)
-                )
-                assert curr.rowcount == 1
-                n_inserted += 1
-
-        if reservations_end_at_exclusive < max_block:
-            l.info('expanding forward in history')
-            # fill from start to end
-            for i in itertools.count():
-                this_start_block = i * batch_size + reservations_end_at_exclusive
-                this_end_block = min(max_block + 1, (i + 1) * batch_size + reservations_end_at_exclusive)
-                if this_start_block > max_block + 1:
-                    break
-                curr.execute(
-                    '''
-                    INSERT INTO backrun_detection_reservations (start_block, end_block_exclusive)
-                    VALUES (%s, %s)
-                    ''',
-                    (this_start_block, this_end_block)
-                )
-                assert curr.rowcount == 1
-                n_inserted += 1
-
-        l.info(f'Inserted {n_inserted} reservations')
-        if n_inserted > 0:
-            input('ENTER to commit')
-            curr.connection.commit()
-            input('ENTER to continue')
-            raise Exception('stop')
-
-        exit(1)
-
-
-    l.debug(f'filling queue...')
-
-    # break into 10,000 reservations
-    lower_bounds, step = np.linspace(min_block, max_block, 10_000, dtype=int, retstep=True)
-    l.debug(f'reservation step size = {int(step):,} blocks')
-
-    for res_lower, res_upper_excl in zip(lower_bounds, list(lower_bounds[1:]) + [max_block + 1]):
-        assert res_lower < res_upper_excl
-
-        curr.execute(
-            '''
-            INSERT INTO backrun_detection_reservations (start_block, end_block_exclusive)
-            VALUES (%s, %s)
-            ''',
-            (int(res_lower), int(res_upper_excl))
-        )
 
+    n_inserted = work_queue.fill(curr, JOB_NAME, min_block, max_block + 1, RESERVATION_BLOCKS)
     curr.connection.commit()
-    l.debug(f'Inserted {len(lower_bounds)} reservations')
-
-
-def get_reservations(curr: psycopg2.extensions.cursor) -> typing.Iterator[typing.Tuple[int, int, int]]:
-    """
-    Gets reorder reservations
-    Returns (reservation_id, start, end_exclusive)
-    """
-    while True:
-        if not DEBUG:
-            curr.connection.commit()
-        curr.execute(
-            '''
-            SELECT id, start_block, end_block_exclusive
-            FROM backrun_detection_reservations
-            WHERE started_on is null
-            LIMIT 1
-            FOR UPDATE SKIP LOCKED
-            '''
-        )
-
-        if curr.rowcount != 1:
-            assert curr.rowcount <= 0
-            l.info('Out of work')
-            return
-
-        (reservation_id, start_block, end_block_exclusive) = curr.fetchone()
-
-        curr.execute('UPDATE backrun_detection_reservations SET started_on = now()::timestamp WHERE id = %s', (reservation_id,))
-        assert curr.rowcount == 1
-        if not DEBUG:
-            curr.connection.commit()
-        yield (reservation_id, start_block, end_block_exclusive)
+    l.info(f'Inserted {n_inserted:,} reservations')
 
 
 def open_ganache() -> typing.Tuple[subprocess.Popen, web3.Web3]:
@@ -343,9 +240,7 @@ def open_ganache() -> typing.Tuple[subprocess.Popen, web3.Web3]:
     return p, w3
 
 
-def do_reorder(w3_mainnet: web3.Web3, w3_ganache: web3.Web3, curr: psycopg2.extensions.cursor, reservation):
-    reservation_id, reservation_start, reservation_end_exclusive = reservation
-
+def do_reorder(w3_mainnet: web3.Web3, w3_ganache: web3.Web3, curr: psycopg2.extensions.cursor, reservation_start: int, reservation_end_exclusive: int):
     curr.execute(
         '''
         SELECT id, txn_hash
@@ -354,7 +249,7 @@ def do_reorder(w3_mainnet: web3.Web3, w3_ganache: web3.Web3, curr: psycopg2.exte
         ''',
         (reservation_start, reservation_end_exclusive),
     )
-    l.debug(f'have {curr.rowcount:,} items to process in this reservation (id={reservation_id:,})')
+    l.debug(f'have {curr.rowcount:,} items to process in blocks {reservation_start:,} to {reservation_end_exclusive:,}')
     queue: typing.List[typing.Tuple[int, bytes]] = [(i, txn.tobytes()) for i, txn in curr]
 
     for id_, txn_hash in queue:
@@ -364,11 +259,6 @@ def do_reorder(w3_mainnet: web3.Web3, w3_ganache: web3.Web3, curr: psycopg2.exte
             if not DEBUG:
                 curr.connection.commit()
 
-    l.info(f'finished with reservation id={reservation_id:,}')
-    curr.execute(
-        'UPDATE backrun_detection_reservations SET finished_on = now()::timestamp WHERE id = %s',
-        (reservation_id,)
-    )
     if not DEBUG:
         curr.connection.commit()
 
@@ -514,6 +404,7 @@ def insert_reorder_result(curr: psycopg2.extensions.cursor, id_: int, txn_hash:
             INSERT INTO sample_arbitrage_backrun_detections
             (sample_arbitrage_id, rerun_exactly)
             VALUES (%s, true)
+            ON CONFLICT (sample_arbitrage_id) DO NOTHING
             ''',
             (id_,)
         )
@@ -523,6 +414,7 @@ def insert_reorder_result(curr: psycopg2.extensions.cursor, id_: int, txn_hash:
             INSERT INTO sample_arbitrage_backrun_detections
             (sample_arbitrage_id, rerun_reverted)
             VALUES (%s, true)
+            ON CONFLICT (sample_arbitrage_id) DO NOTHING
             ''',
             (id_,)
         )
@@ -532,6 +424,7 @@ def insert_reorder_result(curr: psycopg2.extensions.cursor, id_: int, txn_hash:
             INSERT INTO sample_arbitrage_backrun_detections
             (sample_arbitrage_id, rerun_no_arbitrage)
             VALUES (%s, true)
+            ON CONFLICT (sample_arbitrage_id) DO NOTHING
             ''',
             (id_,)
         )
@@ -541,6 +434,7 @@ def insert_reorder_result(curr: psycopg2.extensions.cursor, id_: int, txn_hash:
             INSERT INTO sample_arbitrage_backrun_detections
             (sample_arbitrage_id, rerun_not_comparable)
             VALUES (%s, true)
+            ON CONFLICT (sample_arbitrage_id) DO NOTHING
             ''',
             (id_,)
         )
@@ -550,6 +444,7 @@ def insert_reorder_result(curr: psycopg2.extensions.cursor, id_: int, txn_hash:
             INSERT INTO sample_arbitrage_backrun_detections
             (sample_arbitrage_id, rerun_profit_token_changed)
             VALUES (%s, true)
+            ON CONFLICT (sample_arbitrage_id) DO NOTHING
             ''',
             (id_,)
         )
@@ -560,6 +455,7 @@ def insert_reorder_result(curr: psycopg2.extensions.cursor, id_: int, txn_hash:
             INSERT INTO sample_arbitrage_backrun_detections
             (sample_arbitrage_id, rerun_profit)
             VALUES (%s, %s)
+            ON CONFLICT (sample_arbitrage_id) DO NOTHING
             ''',
             (id_, result.new_profit)
         )
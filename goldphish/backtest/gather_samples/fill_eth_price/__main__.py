@@ -1,33 +1,48 @@
 """
 fill ethereum price over time
+
+Records every change in the USD price of ETH over the sampled blocks (see
+get_price_changes), then finalize() fills in the price at every block.
 """
 
 import argparse
-import collections
+import bisect
 import datetime
 import decimal
-import itertools
 import logging
-import os
-import socket
 import time
 import typing
-from eth_utils import event_abi_to_log_topic
 import psycopg2
 import psycopg2.extensions
 import psycopg2.extras
-import numpy as np
 
 
 import web3
-import web3.contract
-import web3.exceptions
-import web3._utils.filters
 from backtest.utils import connect_db
 
-from utils import BALANCER_VAULT_ADDRESS, connect_web3, get_abi, setup_logging
+from utils import connect_web3, setup_logging
+from utils.batch_call import batch_eth_call
+from utils.log_fetcher import LogFetcher
+
+CHAINLINK_ETH_USD_PROXY = '0x5f4eC3Df9cbd43714FE2740f5E3616155c5b8419'
+CHAINLINK_DECIMALS = 8
+AGGREGATOR_SELECTOR = bytes(web3.Web3.keccak(text='aggregator()')[:4])
+LATEST_ROUND_DATA_SELECTOR = bytes(web3.Web3.keccak(text='latestRoundData()')[:4])
+ANSWER_UPDATED_TOPIC = web3.Web3.keccak(text='AnswerUpdated(int256,uint256,uint256)')
+
+# eth/usd updates a few dozen times a day, so log requests can cover many blocks
+CHAINLINK_LOG_INITIAL_RANGE = 10_000
+CHAINLINK_LOG_MAX_RANGE = 200_000
+
+# probes per round-trip when searching for the block where the proxy changed aggregator
+AGGREGATOR_SEARCH_FANOUT = 32
+
+# used before chainlink was deployed; read every this many blocks
+MAKER_MEDIANIZER = '0x729D19f657BD0614b4985Cf1D82531c67569197B'
+MAKER_SAMPLE_BLOCKS = 50
+READ_SELECTOR = bytes(web3.Web3.keccak(text='read()')[:4])
 
-ROLLING_WINDOW_SIZE_BLOCKS = 60 * 60 // 13 # about 1 hour
+FINALIZE_CHUNK_BLOCKS = 100_000
 
 l = logging.getLogger(__name__)
 
@@ -69,101 +84,146 @@ def main():
     )
     assignments = curr.fetchall()
 
-    simple_abi = [{
-        "inputs": [],
-        "name": "latestRoundData",
-        "outputs": [
-            {
-                "internalType": "uint80",
-                "name": "roundId",
-                "type": "uint80"
-            },
-            {
-                "internalType": "int256",
-                "name": "answer",
-                "type": "int256"
-            },
-            {
-                "internalType": "uint256",
-                "name": "startedAt",
-                "type": "uint256"
-            },
-            {
-                "internalType": "uint256",
-                "name": "updatedAt",
-                "type": "uint256"
-            },
-            {
-                "internalType": "uint80",
-                "name": "answeredInRound",
-                "type": "uint80"
-            }
-        ],
-        "stateMutability": "view",
-        "type": "function"
-    }]
-    chainlink_contract = w3.eth.contract(address='0x5f4eC3Df9cbd43714FE2740f5E3616155c5b8419', abi=simple_abi)
-
-    simple_abi = [{
-        "constant": True,
-        "inputs": [],
-        "name": "read",
-        "outputs": [
-            {
-                "name": "",
-                "type": "bytes32"
-            }
-        ],
-        "payable": False,
-        "type": "function"
-    }]
-    maker_contract = w3.eth.contract(address='0x729D19f657BD0614b4985Cf1D82531c67569197B', abi=simple_abi)
-
-
-    curr2 = db.cursor()
     last_update = time.time()
     t_start = last_update
-    last_complete_reservation = None
     for i_res, (start_block, end_block) in enumerate(assignments):
+        if last_update + 30 < time.time():
+            last_update = time.time()
+            elapsed = time.time() - t_start
+            nps = i_res / elapsed
+            remain = len(assignments) - i_res
+            eta_s = remain / nps
+            eta = datetime.timedelta(seconds=eta_s)
+            l.info(F'Finished {i_res / len(assignments) * 100:.2f}% ETA {eta}')
+
+        # the price for a block is the one in effect after the block before it, see finalize()
+        changes = get_price_changes(w3, start_block - 1, end_block)
+        l.debug(f'{len(changes):,} price changes in {start_block:,} to {end_block:,}')
 
-        to_insert = []
-        for block_number in range(start_block, end_block + 1):
-
-            if last_update + 30 < time.time():
-                last_update = time.time()
-                elapsed = time.time() - t_start
-                nps = i_res / elapsed
-                remain = len(assignments) - i_res
-                eta_s = remain / nps
-                eta = datetime.timedelta(seconds=eta_s)
-                pct_done_assignment = (block_number - start_block) / (end_block - start_block + 1)
-                pct_done = (i_res + pct_done_assignment) / len(assignments)
-                l.info(F'Finished {pct_done * 100:.2f}% ETA {eta}')
-
-            if block_number % 50 != 0:
-                continue
-            try:
-                (_, answer, _, _, _) = chainlink_contract.functions.latestRoundData().call(block_identifier=block_number)
-                price_usd = decimal.Decimal(answer) / (10 ** 8)
-            except (web3.exceptions.BadFunctionCallOutput, web3.exceptions.ContractLogicError):
-                l.debug(f'Failed at block {block_number:,}, using backup method...')
-                try:
-                    answer = maker_contract.functions.read().call(block_identifier=block_number)
-                    answer = int.from_bytes(answer, byteorder='big', signed=False)
-                    price_usd = decimal.Decimal(answer) / (10 ** 18)
-                except web3.exceptions.BadFunctionCallOutput:
-                    l.critical(f'Failed at block {block_number:,}')
-                    raise
-
-            to_insert.append((block_number, price_usd))
-        
         psycopg2.extras.execute_values(
             curr,
             'INSERT INTO eth_prices (block_number, eth_price_usd) VALUES %s',
-            to_insert
+            changes
         )
-    
-    db.commit()
+        db.commit()
+
+
+# the price in effect after each listed block, in block order
+PriceChanges = typing.List[typing.Tuple[int, decimal.Decimal]]
+
+
+def get_price_changes(w3: web3.Web3, start_block: int, end_block: int) -> PriceChanges:
+    """
+    Every change in the price of ETH from start_block to end_block (inclusive), with
+    the price in effect after start_block first.
+
+    Chainlink prices are exact: the proxy's aggregator is found with a batched search,
+    and each aggregator's AnswerUpdated logs give every change it made. Before Chainlink,
+    the Maker medianizer is read (in batches) every MAKER_SAMPLE_BLOCKS blocks.
+    """
+    ret: PriceChanges = []
+    for segment_start, segment_end, aggregator in find_aggregators(w3, start_block, end_block):
+        segment = None
+        if aggregator is not None:
+            segment = _chainlink_price_changes(w3, aggregator, segment_start, segment_end)
+        if segment is None:
+            segment = _maker_price_changes(w3, segment_start, segment_end)
+
+        for block_number, price in segment:
+            if len(ret) == 0 or ret[-1][1] != price:
+                ret.append((block_number, price))
+    return ret
+
+
+def find_aggregators(w3: web3.Web3, start_block: int, end_block: int) -> typing.List[typing.Tuple[int, int, typing.Optional[str]]]:
+    """
+    Split start_block to end_block (inclusive) into (first block, last block, aggregator)
+    by the aggregator the Chainlink proxy uses, or None where there was no proxy yet.
+
+    Relies on the proxy never returning to an earlier aggregator, which holds because
+    phases only advance.
+    """
+    first, last = _aggregators_at(w3, [start_block, end_block])
+    ret = []
+    segment_start, aggregator = start_block, first
+    while aggregator != last:
+        # the first block with another aggregator is in (lo, hi]
+        lo, hi, hi_aggregator = segment_start, end_block, last
+        while hi - lo > 1:
+            probes = sorted(set(lo + (hi - lo) * i // (AGGREGATOR_SEARCH_FANOUT + 1) for i in range(1, AGGREGATOR_SEARCH_FANOUT + 1)).difference([lo, hi]))
+            for probe, probe_aggregator in zip(probes, _aggregators_at(w3, probes)):
+                if probe_aggregator != aggregator:
+                    hi, hi_aggregator = probe, probe_aggregator
+                    break
+                lo = probe
+        ret.append((segment_start, lo, aggregator))
+        segment_start, aggregator = hi, hi_aggregator
+    ret.append((segment_start, end_block, aggregator))
+    return ret
+
+
+def _aggregators_at(w3: web3.Web3, block_numbers: typing.List[int]) -> typing.List[typing.Optional[str]]:
+    ret = []
+    for result in batch_eth_call(w3, [(CHAINLINK_ETH_USD_PROXY, AGGREGATOR_SELECTOR, b) for b in block_numbers]):
+        if result is None or len(result) != 32:
+            ret.append(None)
+        else:
+            ret.append(web3.Web3.toChecksumAddress(result[12:]))
+    return ret
+
+
+def _chainlink_price_changes(w3: web3.Web3, aggregator: str, start_block: int, end_block: int) -> typing.Optional[PriceChanges]:
+    """
+    Returns None if the proxy had no answer yet at start_block
+    """
+    (result,) = batch_eth_call(w3, [(CHAINLINK_ETH_USD_PROXY, LATEST_ROUND_DATA_SELECTOR, start_block)])
+    if result is None:
+        l.debug(f'No chainlink answer at block {start_block:,}, using backup method...')
+        return None
+    answer = int.from_bytes(result[32:64], byteorder='big', signed=True)
+    ret = [(start_block, decimal.Decimal(answer) / (10 ** CHAINLINK_DECIMALS))]
+
+    if start_block < end_block:
+        fetcher = LogFetcher(
+            w3,
+            [ANSWER_UPDATED_TOPIC],
+            initial_range = CHAINLINK_LOG_INITIAL_RANGE,
+            max_range = CHAINLINK_LOG_MAX_RANGE,
+            node_addresses = [aggregator],
+        )
+        buckets = fetcher.fetch(start_block + 1, end_block, addresses = {aggregator})
+        for block_number in sorted(buckets.keys()):
+            by_txn = buckets[block_number]
+            # only the last update in the block is ever seen
+            log = by_txn[max(by_txn.keys())][-1]
+            answer = int.from_bytes(log['topics'][1], byteorder='big', signed=True)
+            ret.append((block_number, decimal.Decimal(answer) / (10 ** CHAINLINK_DECIMALS)))
+    return ret
+
+
+def _maker_price_changes(w3: web3.Web3, start_block: int, end_block: int) -> PriceChanges:
+    block_numbers = [start_block] + list(range(start_block - start_block % MAKER_SAMPLE_BLOCKS + MAKER_SAMPLE_BLOCKS, end_block + 1, MAKER_SAMPLE_BLOCKS))
+    ret = []
+    for block_number, result in zip(block_numbers, batch_eth_call(w3, [(MAKER_MEDIANIZER, READ_SELECTOR, b) for b in block_numbers])):
+        if result is None:
+            l.critical(f'Failed at block {block_number:,}')
+            raise Exception(f'no price from maker at block {block_number:,}')
+        answer = int.from_bytes(result, byteorder='big', signed=False)
+        ret.append((block_number, decimal.Decimal(answer) / (10 ** 18)))
+    return ret
+
+
+def prices_after(changes: PriceChanges, block_numbers: typing.Iterable[int]) -> typing.List[typing.Optional[decimal.Decimal]]:
+    """
+    Interpolate onto the given blocks: the price in effect after each block, or None
+    for those before the first change.
+    """
+    change_blocks = [b for b, _ in changes]
+    ret = []
+    for block_number in block_numbers:
+        idx = bisect.bisect_right(change_blocks, block_number) - 1
+        ret.append(changes[idx][1] if idx >= 0 else None)
+    return ret
 
 
 def setup_db(curr: psycopg2.extensions.cursor):
@@ -182,33 +242,36 @@ def setup_db(curr: psycopg2.extensions.cursor):
 def finalize(curr: psycopg2.extensions.cursor):
     curr.execute('SELECT MIN(start_block), MAX(end_block) FROM block_samples')
     start_block, end_block = curr.fetchone()
+
+    curr.execute('SELECT block_number, eth_price_usd FROM eth_prices ORDER BY block_number ASC')
+    changes = curr.fetchall()
+    assert len(changes) > 0
+    first_eth_price = changes[0][1]
+
     curr.execute(
         '''
-        CREATE TABLE eth_price_blocks AS
-        SELECT block_number, (SELECT eth_price_usd FROM eth_prices ep WHERE ep.block_number < s.block_number ORDER BY block_number DESC LIMIT 1) eth_price_usd
-        FROM generate_series(%s, %s) AS s(block_number)
-        ''',
-        (start_block, end_block),
+        CREATE TABLE eth_price_blocks (
+            block_number  INTEGER NOT NULL,
+            eth_price_usd NUMERIC
+        );
+        '''
     )
-    assert curr.rowcount > 0
 
-    curr.execute('SELECT eth_price_usd FROM eth_prices ORDER BY block_number ASC LIMIT 1')
-    (first_eth_price,) = curr.fetchone()
+    for chunk_start in range(start_block, end_block + 1, FINALIZE_CHUNK_BLOCKS):
+        block_numbers = range(chunk_start, min(chunk_start + FINALIZE_CHUNK_BLOCKS, end_block + 1))
+        # the price for a block is the one in effect at its start
+        prices = prices_after(changes, (b - 1 for b in block_numbers))
 
-    # sanity
-    curr.execute('SELECT COUNT(*) FROM eth_price_blocks WHERE block_number > %s AND eth_price_usd IS NULL', (start_block + 100,))
-    (n_broken,) = curr.fetchone()
-    assert n_broken == 0
+        # sanity
+        assert all(price is not None for b, price in zip(block_numbers, prices) if b > start_block + 100)
 
-    curr.execute(
-        '''
-        UPDATE eth_price_blocks
-        SET eth_price_usd = %s
-        WHERE eth_price_usd IS NULL
-        ''',
-        (first_eth_price,)
-    )
-    l.debug(f'fixed bottom {curr.rowcount} entries')
+        psycopg2.extras.execute_values(
+            curr,
+            'INSERT INTO eth_price_blocks (block_number, eth_price_usd) VALUES %s',
+            [(b, price if price is not None else first_eth_price) for b, price in zip(block_numbers, prices)],
+            page_size = 10_000,
+        )
+        l.debug(f'finalized up to block {block_numbers[-1]:,}')
 
     curr.execute('CREATE INDEX idx_eth_pr_blocks_block_number ON eth_price_blocks (block_number)')
 
@@ -1,6 +1,23 @@
+"""
+Labels sample arbitrages that are false-positives, and maintains copies of the
+sample tables with those removed (the *_no_fp tables).
+
+Labeling is incremental: every rule is one INSERT ... SELECT over the samples
+not yet judged, ie those neither copied to sample_arbitrages_no_fp nor labeled in
+sample_arbitrage_false_positives, so re-running after a new gather batch only
+costs time proportional to the new samples. Samples are picked by that anti-join
+rather than by id range because ids are handed out before their transaction
+commits: a low id that commits late would be missed by a MAX(id) bound.
+
+Run this after gather_samples and fill_odd_token_xfers have finished for the
+batch -- a sample is judged once, on the first run that sees it.
+Pass --rebuild to drop everything and label all samples again.
+"""
+
 import argparse
 import logging
 import time
+import typing
 import psycopg2
 import psycopg2.extensions
 
@@ -11,9 +28,28 @@ from utils import setup_logging
 
 l = logging.getLogger(__name__)
 
+# relayers that are aggregators / exchanges, not arbitrageurs
+FALSE_POSITIVE_SHOOTERS: typing.List[typing.Tuple[bytes, str]] = [
+    (bytes.fromhex('03f34be1bf910116595db1b11e9d1b2ca5d59659'), 'tokenlon'),
+    (bytes.fromhex('ad84693a21e0a1db73ae6c6e5aceb041a6c8b6b3'), 'dexible'), # https://dexible.io/
+    (bytes.fromhex('9008d19f58aabd9ed0d60971565aa8510560ab41'), 'CoW Swap'),
+    (bytes.fromhex('3328f5f2cecaf00a2443082b657cedeaf70bfaef'), 'CoW Swap'),
+    # (bytes.fromhex('def1c0ded9bec7f1a1670819833240f027b25eff'), '0x exchange proxy'),
+]
+
+NO_FP_TABLES = [
+    'sample_arbitrages_no_fp',
+    'sample_arbitrage_cycles_no_fp',
+    'sample_arbitrage_cycle_exchanges_no_fp',
+    'sample_arbitrage_cycle_exchange_items_no_fp',
+    'sample_arbitrage_exchanges_no_fp',
+]
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='store_true', dest='verbose')
+    parser.add_argument('--rebuild', action='store_true', help='drop the false-positive record and re-label every sample')
 
     args = parser.parse_args()
 
@@ -22,256 +58,291 @@ def main():
     conn = connect_db()
     curr = conn.cursor()
 
-    gen_false_positives(curr)
+    if args.rebuild:
+        answer = input('REALLY re-generate record? (yes/NO)')
+        if answer.lower().strip() != 'yes':
+            return
+
+    gen_false_positives(curr, rebuild=args.rebuild)
 
     l.info('done')
 
-def gen_false_positives(curr: psycopg2.extensions.cursor):
-    """
-    Build temp table 'sample_arbitrage_false_positives'
-    """
-    t_start = time.time()
 
+def setup_db(curr: psycopg2.extensions.cursor):
     curr.execute(
         '''
-        SELECT EXISTS (
-            SELECT FROM 
-                pg_tables
-            WHERE 
-                schemaname = 'public' AND 
-                tablename  = 'sample_arbitrage_false_positives'
-        );
-        ''',
-    )
-    (already_generated,) = curr.fetchone()
-    if already_generated:
-        print('Already generated false-positive record')
-
-        if True:
-            answer = input('REALLY re-generate record? (yes/NO)')
-            if answer.lower().strip() != 'yes':
-                return
-            
-            curr.execute(
-                '''
-                DROP TABLE sample_arbitrage_false_positives;
-                DROP TABLE sample_arbitrages_no_fp;
-                DROP TABLE sample_arbitrage_cycles_no_fp;
-                DROP TABLE sample_arbitrage_cycle_exchanges_no_fp;
-                DROP TABLE sample_arbitrage_cycle_exchange_items_no_fp;
-                DROP TABLE sample_arbitrage_exchanges_no_fp;
-                '''
-            )
-
-    print('Generating false-positive record')
-    curr.execute('BEGIN TRANSACTION')
-    curr.execute('SET max_parallel_workers_per_gather = 0;')
-
-    curr.execute(
-        '''
-        CREATE TABLE sample_arbitrage_false_positives (
+        CREATE TABLE IF NOT EXISTS sample_arbitrage_false_positives (
             sample_arbitrage_id INTEGER NOT NULL,
             reason TEXT NOT NULL
         );
 
-        CREATE INDEX idx_sample_arbitrage_false_positives_id ON sample_arbitrage_false_positives (sample_arbitrage_id);
+        CREATE TABLE IF NOT EXISTS sample_arbitrages_no_fp (LIKE sample_arbitrages);
+        CREATE TABLE IF NOT EXISTS sample_arbitrage_cycles_no_fp (LIKE sample_arbitrage_cycles);
+        CREATE TABLE IF NOT EXISTS sample_arbitrage_cycle_exchanges_no_fp (LIKE sample_arbitrage_cycle_exchanges);
+        CREATE TABLE IF NOT EXISTS sample_arbitrage_cycle_exchange_items_no_fp (LIKE sample_arbitrage_cycle_exchange_items);
+        CREATE TABLE IF NOT EXISTS sample_arbitrage_exchanges_no_fp (LIKE sample_arbitrage_exchanges);
+
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrages_no_fp_id ON sample_arbitrages_no_fp (id);
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrage_cycles_no_fp_id ON sample_arbitrage_cycles_no_fp (id);
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrage_cycle_exchanges_no_fp_id ON sample_arbitrage_cycle_exchanges_no_fp (id);
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrage_exchanges_no_fp_id ON sample_arbitrage_exchanges_no_fp (id);
+
+        -- support scoping the rules and copies to the new samples
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrage_cycles_sample_arbitrage_id ON sample_arbitrage_cycles (sample_arbitrage_id);
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrage_cycles_no_fp_sample_arbitrage_id ON sample_arbitrage_cycles_no_fp (sample_arbitrage_id);
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrage_cycle_exchanges_no_fp_cycle_id ON sample_arbitrage_cycle_exchanges_no_fp (cycle_id);
+        CREATE INDEX IF NOT EXISTS idx_sample_arbitrage_cycle_exchange_items_no_fp_cycle_exchange_id ON sample_arbitrage_cycle_exchange_items_no_fp (cycle_exchange_id);
         '''
     )
 
-    # remove anything with weird token movements
-    curr.execute(
-        '''
-        INSERT INTO sample_arbitrage_false_positives (sample_arbitrage_id, reason)
-        SELECT distinct sample_arbitrage_id, 'odd token'
-        FROM sample_arbitrages_odd_tokens
-        '''
-    )
-    assert curr.rowcount > 0
-    print(f'Labeled {curr.rowcount:,} samples as false-positive because of weird token transfers')
+    curr.execute("SELECT to_regclass('idx_sample_arbitrage_false_positives_id_reason') IS NOT NULL")
+    (has_unique_index,) = curr.fetchone()
+    if not has_unique_index:
+        # records built before the index was added can repeat a label
+        curr.execute(
+            '''
+            DELETE FROM sample_arbitrage_false_positives a
+            USING sample_arbitrage_false_positives b
+            WHERE a.sample_arbitrage_id = b.sample_arbitrage_id AND a.reason = b.reason AND a.ctid > b.ctid
+            '''
+        )
+        if curr.rowcount > 0:
+            l.info(f'Removed {curr.rowcount:,} duplicate false-positive labels')
+        curr.execute(
+            '''
+            CREATE UNIQUE INDEX idx_sample_arbitrage_false_positives_id_reason
+            ON sample_arbitrage_false_positives (sample_arbitrage_id, reason)
+            '''
+        )
+
+
+def drop_tables(curr: psycopg2.extensions.cursor):
+    curr.execute('DROP TABLE IF EXISTS sample_arbitrage_false_positives')
+    for table in NO_FP_TABLES:
+        curr.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+def gen_false_positives(curr: psycopg2.extensions.cursor, rebuild: bool = False):
+    """
+    Label all samples not yet judged, and copy the ones that are not
+    false-positives into the *_no_fp tables. Commits.
+    """
+    t_start = time.time()
+
+    curr.execute('BEGIN TRANSACTION')
+    if rebuild:
+        l.info('Dropping false-positive record')
+        drop_tables(curr)
+
+    setup_db(curr)
+
+    # conflicts with itself, so concurrent runs do not judge the same samples twice;
+    # readers are not blocked
+    curr.execute('LOCK TABLE sample_arbitrage_false_positives IN SHARE ROW EXCLUSIVE MODE')
+
+    n_new = find_unjudged(curr)
+    if n_new == 0:
+        l.info('No new samples')
+        curr.connection.commit()
+        return
 
-    # remove tokenlon
+    l.info(f'Labeling {n_new:,} new samples')
+
+    labeled = label_false_positives(curr)
+    for reason, n in labeled.items():
+        l.info(f'Labeled {n:,} samples as false-positive: {reason}')
+
+    n_new_no_fp = copy_no_fp(curr)
+    n_fp = n_new - n_new_no_fp
+    l.info(f'Have {n_fp:,} of {n_new:,} new sample arbitrages labeled as false-positive ({n_fp / max(n_new, 1) * 100:.2f}%)')
+
+    curr.connection.commit()
+    l.info(f'Took {time.time() - t_start:.1f} seconds to generate false-positive report')
+
+
+def find_unjudged(curr: psycopg2.extensions.cursor) -> int:
+    """
+    Fill temp table tmp_fp_unjudged (dropped on commit) with the ids of samples
+    that are neither labeled false-positive nor copied to sample_arbitrages_no_fp.
+
+    Returns how many there are.
+    """
     curr.execute(
         '''
-        INSERT INTO sample_arbitrage_false_positives (sample_arbitrage_id, reason)
-        SELECT id, 'tokenlon'
-        FROM sample_arbitrages
-        WHERE encode(shooter, 'hex') = '03f34be1bf910116595db1b11e9d1b2ca5d59659'
+        CREATE TEMP TABLE tmp_fp_unjudged ON COMMIT DROP AS
+        SELECT sa.id
+        FROM sample_arbitrages sa
+        WHERE NOT EXISTS(SELECT 1 FROM sample_arbitrages_no_fp x WHERE x.id = sa.id) AND
+            NOT EXISTS(SELECT 1 FROM sample_arbitrage_false_positives fp WHERE fp.sample_arbitrage_id = sa.id)
         '''
     )
-    assert curr.rowcount > 0
-    print(f'Labeled {curr.rowcount:,} samples as false-positive due to tokenlon')
+    ret = curr.rowcount
+    curr.execute('ALTER TABLE tmp_fp_unjudged ADD PRIMARY KEY (id); ANALYZE tmp_fp_unjudged')
+    return ret
 
-    # remove Dexible https://dexible.io/
+
+def label_false_positives(curr: psycopg2.extensions.cursor) -> typing.Dict[str, int]:
+    """
+    Apply every false-positive rule to the samples in tmp_fp_unjudged.
+
+    Returns the number of samples labeled, by reason.
+    """
+    ret = {}
+
+    # remove anything with weird token movements
     curr.execute(
         '''
         INSERT INTO sample_arbitrage_false_positives (sample_arbitrage_id, reason)
-        SELECT id, 'dexible'
-        FROM sample_arbitrages
-        WHERE encode(shooter, 'hex') = 'ad84693a21e0a1db73ae6c6e5aceb041a6c8b6b3'
+        SELECT distinct sat.sample_arbitrage_id, 'odd token'
+        FROM sample_arbitrages_odd_tokens sat
+        JOIN tmp_fp_unjudged new ON new.id = sat.sample_arbitrage_id
+        ON CONFLICT DO NOTHING
         '''
     )
-    assert curr.rowcount > 0
-    print(f'Labeled {curr.rowcount:,} samples as false-positive due to Dexible')
+    ret['odd token'] = curr.rowcount
 
-    # remove CoW Swap
+    # remove aggregators (tokenlon, Dexible, CoW Swap)
     curr.execute(
         '''
         INSERT INTO sample_arbitrage_false_positives (sample_arbitrage_id, reason)
-        SELECT id, 'CoW Swap'
-        FROM sample_arbitrages
-        WHERE encode(shooter, 'hex') = '9008d19f58aabd9ed0d60971565aa8510560ab41' OR encode(shooter, 'hex') = '3328f5f2cecaf00a2443082b657cedeaf70bfaef'
-        '''
+        SELECT sa.id, fps.reason
+        FROM sample_arbitrages sa
+        JOIN tmp_fp_unjudged new ON new.id = sa.id
+        JOIN unnest(%(shooters)s::bytea[], %(reasons)s::text[]) AS fps(shooter, reason) ON sa.shooter = fps.shooter
+        ON CONFLICT DO NOTHING
+        RETURNING reason
+        ''',
+        {
+            'shooters': [s for s, _ in FALSE_POSITIVE_SHOOTERS],
+            'reasons': [r for _, r in FALSE_POSITIVE_SHOOTERS],
+        },
     )
-    assert curr.rowcount > 0
-    print(f'Labeled {curr.rowcount:,} samples as false-positive due to CoW Swap')
-
-    # # remove 0x exchange proxy
-    # curr.execute(
-    #     '''
-    #     INSERT INTO sample_arbitrage_false_positives (sample_arbitrage_id, reason)
-    #     SELECT id, '0x exchange proxy'
-    #     FROM sample_arbitrages
-    #     WHERE encode(shooter, 'hex') = 'def1c0ded9bec7f1a1670819833240f027b25eff'
-    #     '''
-    # )
-    # assert curr.rowcount > 0
-    # print(f'Labeled {curr.rowcount:,} samples as false-positive due to 0x proxy')
-
+    for _, reason in FALSE_POSITIVE_SHOOTERS:
+        ret[reason] = 0
+    for (reason,) in curr:
+        ret[reason] += 1
 
     # remove null address
-
-    # find null exchange id
     curr.execute('SELECT id FROM sample_arbitrage_exchanges WHERE address = %s', (b'\x00' * 20,))
     assert curr.rowcount <= 1
     if curr.rowcount == 1:
         (zero_addr_exchange_id,) = curr.fetchone()
-        print(f'Removing null exchange (id={zero_addr_exchange_id})')
+        l.debug(f'Removing null exchange (id={zero_addr_exchange_id})')
 
         curr.execute(
             '''
             INSERT INTO sample_arbitrage_false_positives (sample_arbitrage_id, reason)
-            SELECT sa.id, 'null address'
-            FROM sample_arbitrages sa
-            WHERE EXISTS(
-                SELECT 1
-                FROM sample_arbitrage_cycles sac
-                JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
-                JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
-                WHERE sac.sample_arbitrage_id = sa.id AND sacei.exchange_id = %s
-            )
+            SELECT distinct sac.sample_arbitrage_id, 'null address'
+            FROM sample_arbitrage_cycles sac
+            JOIN tmp_fp_unjudged new ON new.id = sac.sample_arbitrage_id
+            JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
+            JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
+            WHERE sacei.exchange_id = %s
+            ON CONFLICT DO NOTHING
             ''',
-            (zero_addr_exchange_id,)
+            (zero_addr_exchange_id,),
         )
-        print(f'Labeled {curr.rowcount:,} arbitrages as false-positive due to null address')
+        ret['null address'] = curr.rowcount
     else:
-        print('did not find zero address in exchanges')
+        l.debug('did not find zero address in exchanges')
 
     # remove arbitrages with exchange address that is the relayer
     curr.execute(
         '''
         INSERT INTO sample_arbitrage_false_positives (sample_arbitrage_id, reason)
-        SELECT id, 'relayer is in exchanges list'
+        SELECT distinct sa.id, 'relayer is in exchanges list'
         FROM sample_arbitrages sa
-        WHERE EXISTS(
-            SELECT
-            FROM sample_arbitrage_cycles sac
-            join sample_arbitrage_cycle_exchanges sace on sac.id = sace.cycle_id
-            join sample_arbitrage_cycle_exchange_items sacei on sace.id = sacei.cycle_exchange_id
-            join sample_arbitrage_exchanges sax on sax.id = sacei.exchange_id
-            WHERE sa.id = sac.sample_arbitrage_id AND
-                sax.address = sa.shooter
-        )
+        JOIN tmp_fp_unjudged new ON new.id = sa.id
+        JOIN sample_arbitrage_cycles sac ON sac.sample_arbitrage_id = sa.id
+        JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
+        JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
+        JOIN sample_arbitrage_exchanges sax ON sax.id = sacei.exchange_id
+        WHERE sax.address = sa.shooter
+        ON CONFLICT DO NOTHING
         '''
     )
-    print(f'Labeled {curr.rowcount:,} arbitrages as false-positive because the relayer cannot be an exchange')
+    ret['relayer is in exchanges list'] = curr.rowcount
+
+    return ret
 
-    curr.execute('SELECT COUNT(distinct sample_arbitrage_id) FROM sample_arbitrage_false_positives')
-    (n_fp,) = curr.fetchone()
 
-    curr.execute('SELECT COUNT(*) FROM sample_arbitrages')
-    (tot_arbs,) = curr.fetchone()
+def copy_no_fp(curr: psycopg2.extensions.cursor) -> int:
+    """
+    Copy the samples in tmp_fp_unjudged that were not labeled false-positive
+    (and their cycles, exchanges, ...) into the *_no_fp tables.
 
-    print(f'Have {n_fp:,} sample arbitrages labeled as false-positive ({n_fp / tot_arbs * 100:.2f}%)')
+    Returns the number of samples copied.
+    """
+    # the newly copied samples, to scope the copies of their children
+    curr.execute(
+        '''
+        CREATE TEMP TABLE tmp_fp_kept ON COMMIT DROP AS
+        SELECT new.id
+        FROM tmp_fp_unjudged new
+        WHERE NOT EXISTS(SELECT 1 FROM sample_arbitrage_false_positives WHERE sample_arbitrage_id = new.id)
+        '''
+    )
+    curr.execute('ALTER TABLE tmp_fp_kept ADD PRIMARY KEY (id); ANALYZE tmp_fp_kept')
 
-    # generate tables with false-positives removed
     curr.execute(
         '''
-        CREATE TABLE sample_arbitrages_no_fp
-        AS SELECT *
+        INSERT INTO sample_arbitrages_no_fp
+        SELECT sa.*
         FROM sample_arbitrages sa
-        WHERE NOT EXISTS(SELECT 1 FROM sample_arbitrage_false_positives WHERE sa.id = sample_arbitrage_id);
+        JOIN tmp_fp_kept kept ON kept.id = sa.id
         '''
     )
-    assert curr.rowcount == tot_arbs - n_fp
-    curr.execute('CREATE INDEX idx_sample_arbitrages_no_fp_id ON sample_arbitrages_no_fp (id);')
+    n_copied = curr.rowcount
 
     curr.execute(
         '''
-        CREATE TABLE sample_arbitrage_cycles_no_fp
-        AS SELECT *
+        INSERT INTO sample_arbitrage_cycles_no_fp
+        SELECT sac.*
         FROM sample_arbitrage_cycles sac
-        WHERE EXISTS(SELECT 1 FROM sample_arbitrages_no_fp sa WHERE sa.id = sac.sample_arbitrage_id)
+        JOIN tmp_fp_kept kept ON kept.id = sac.sample_arbitrage_id
         '''
     )
-    assert curr.rowcount > 0
-    curr.execute('CREATE INDEX idx_sample_arbitrage_cycles_no_fp_id ON sample_arbitrage_cycles_no_fp (id);')
 
     curr.execute(
         '''
-        CREATE TABLE sample_arbitrage_cycle_exchanges_no_fp
-        AS SELECT *
+        INSERT INTO sample_arbitrage_cycle_exchanges_no_fp
+        SELECT sace.*
         FROM sample_arbitrage_cycle_exchanges sace
-        WHERE EXISTS(SELECT 1 FROM sample_arbitrage_cycles_no_fp sac WHERE sac.id = sace.cycle_id)
+        JOIN sample_arbitrage_cycles_no_fp sac ON sac.id = sace.cycle_id
+        JOIN tmp_fp_kept kept ON kept.id = sac.sample_arbitrage_id
         '''
     )
-    assert curr.rowcount > 0
-    curr.execute('CREATE INDEX idx_sample_arbitrage_cycle_exchanges_no_fp_id ON sample_arbitrage_cycle_exchanges_no_fp (id);')
 
     curr.execute(
         '''
-        CREATE TABLE sample_arbitrage_cycle_exchange_items_no_fp
-        AS SELECT *
+        INSERT INTO sample_arbitrage_cycle_exchange_items_no_fp
+        SELECT sacei.*
         FROM sample_arbitrage_cycle_exchange_items sacei
-        WHERE EXISTS(SELECT 1 FROM sample_arbitrage_cycle_exchanges_no_fp sace WHERE sace.id = sacei.cycle_exchange_id)
+        JOIN sample_arbitrage_cycle_exchanges_no_fp sace ON sace.id = sacei.cycle_exchange_id
+        JOIN sample_arbitrage_cycles_no_fp sac ON sac.id = sace.cycle_id
+        JOIN tmp_fp_kept kept ON kept.id = sac.sample_arbitrage_id
         '''
     )
-    assert curr.rowcount > 0
 
+    # exchanges first used by these samples
     curr.execute(
         '''
-        CREATE TABLE sample_arbitrage_exchanges_no_fp
-        AS SELECT *
+        INSERT INTO sample_arbitrage_exchanges_no_fp
+        SELECT sae.*
         FROM sample_arbitrage_exchanges sae
-        WHERE EXISTS(
-            SELECT 1
-            FROM sample_arbitrages_no_fp sa
-            JOIN sample_arbitrage_cycles sac ON sac.sample_arbitrage_id = sa.id
-            JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
-            JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
-            WHERE sacei.exchange_id = sae.id
-        );
+        WHERE sae.id IN (
+                SELECT sacei.exchange_id
+                FROM sample_arbitrage_cycle_exchange_items_no_fp sacei
+                JOIN sample_arbitrage_cycle_exchanges_no_fp sace ON sace.id = sacei.cycle_exchange_id
+                JOIN sample_arbitrage_cycles_no_fp sac ON sac.id = sace.cycle_id
+                JOIN tmp_fp_kept kept ON kept.id = sac.sample_arbitrage_id
+            ) AND
+            NOT EXISTS(SELECT 1 FROM sample_arbitrage_exchanges_no_fp x WHERE x.id = sae.id)
         '''
     )
-    assert curr.rowcount > 0
-    curr.execute('CREATE INDEX idx_sample_arbitrage_exchanges_no_fp_id ON sample_arbitrage_exchanges_no_fp (id);')
-
-    curr.execute('SELECT COUNT(*) FROM sample_arbitrage_exchanges')
-    (n_exchanges,) = curr.fetchone()
-
-    curr.execute('SELECT COUNT(*) FROM sample_arbitrage_exchanges_no_fp')
-    (n_exchanges_no_fp,) = curr.fetchone()
+    l.debug(f'Copied {curr.rowcount:,} newly-seen exchanges')
 
-    # sanity check for agreement
-    curr.execute('SELECT COUNT(distinct exchange_id) FROM sample_arbitrage_cycle_exchange_items_no_fp')
-    (n_distinct_exchanges,) = curr.fetchone()
-    assert n_distinct_exchanges == n_exchanges_no_fp
-
-    assert n_exchanges_no_fp < n_exchanges
-    n_fp_exchanges = n_exchanges - n_exchanges_no_fp
-    print(f'Marked {n_fp_exchanges:,} exchanges as false-positive ({n_fp_exchanges / n_exchanges * 100:.2f}%)')
-    print(f'Took {time.time() - t_start:.1f} seconds to generate false-positive report')
-    curr.connection.commit()
-    print()
+    return n_copied
 
 
 if __name__ == '__main__':
@@ -1,13 +1,8 @@
 import argparse
-import collections
 import datetime
-import itertools
 import logging
-import os
-import socket
 import time
 import typing
-from eth_utils import event_abi_to_log_topic
 import psycopg2
 import psycopg2.extensions
 import psycopg2.extras
@@ -15,11 +10,11 @@ import numpy as np
 
 
 import web3
-import web3.contract
-import web3._utils.filters
+import web3.types
+from backtest.gather_samples.receipts import get_receipts
 from backtest.utils import ERC20_TRANSFER_TOPIC, connect_db
 
-from utils import BALANCER_VAULT_ADDRESS, connect_web3, get_abi, setup_logging, erc20
+from utils import connect_web3, setup_logging
 
 ROLLING_WINDOW_SIZE_BLOCKS = 60 * 60 // 13 # about 1 hour
 
@@ -55,10 +50,7 @@ def main():
     )
     assignments = curr.fetchall()
 
-    curr2 = db.cursor()
-    last_update = time.time()
-    t_start = last_update
-    last_complete_reservation = None
+    t_start = time.time()
     for i_res, (start_block, end_block) in enumerate(assignments):
         curr.execute(
             '''
@@ -68,70 +60,152 @@ def main():
             ''',
             (start_block, end_block),
         )
-        n_to_process = curr.rowcount
+        arbs = [(id_, txn_hash.tobytes()) for id_, txn_hash in curr]
+
         n_broken = 0
-        for i, (id_, txn_hash) in enumerate(curr):
-            txn_hash: bytes = txn_hash.tobytes()
-            receipt = w3.eth.get_transaction_receipt(txn_hash)
-
-            if last_update + 10 < time.time() and i > 0:
-                last_update = time.time()
-                elapsed = last_update - t_start
-                nps = i / elapsed
-                remain = n_to_process - i
-                eta_s = remain / nps
-                eta = datetime.timedelta(seconds=eta_s)
-
-                if last_complete_reservation is not None:
-                    res_per_second = i_res / (last_complete_reservation - t_start)
-                    remain_res = len(assignments) - i_res
-                    eta_res_s = remain_res / res_per_second
-                    eta_res = datetime.timedelta(seconds=eta_res_s)
-                    print(f'Processed {i:,} of {n_to_process:,} in reservation ({i / n_to_process * 100:.2f}%) - broken percent {n_broken / i * 100:.2f}% - reservation eta {eta} -- (global {i_res / (len(assignments))*100:.2f}%) -- eta {eta_res}')
-                else:
-                    print(f'Processed {i:,} of {n_to_process:,} in reservation ({i / n_to_process * 100:.2f}%) - broken percent {n_broken / i * 100:.2f}% - reservation eta {eta} -- (global {i_res / (len(assignments))*100:.2f}%)')
-
-            parsed_txns = []
-            for log in receipt['logs']:
-                if len(log['topics']) > 0 and log['topics'][0] == ERC20_TRANSFER_TOPIC:
-                    txn = erc20.events.Transfer().processLog(log)
-                    parsed_txns.append(txn)
-
-            assert len(parsed_txns) >= 3
-            all_tokens = set(x['address'] for x in parsed_txns)
-            weird_tokens_received = set()
-            weird_tokens_sent = set()
-            for txn in parsed_txns:
-                if txn['args']['to'] in all_tokens:
-                    l.warning(f'Found weird token in transaction 0x{txn_hash.hex()}: {txn["args"]["to"]}')
-                    weird_tokens_received.add((txn['args']['to'], txn['address']))
-                if txn['args']['from'] in all_tokens:
-                    l.warning(f'Found weird token in transaction 0x{txn_hash.hex()}: {txn["args"]["from"]}')
-                    weird_tokens_sent.add((txn['args']['from'], txn['address']))
-            
-            if len(weird_tokens_received) > 0 or len(weird_tokens_sent) > 0:
-                n_broken += 1
-
-            for weird_token, outside_token in sorted(weird_tokens_received):
-                curr2.execute(
-                    '''
-                    INSERT INTO sample_arbitrages_odd_tokens (sample_arbitrage_id, odd_token, outside_token, type)
-                    VALUES (%s, %s, %s, 'received')
-                    ''',
-                    (id_, bytes.fromhex(weird_token[2:]), bytes.fromhex(outside_token[2:]))
-                )
-            for weird_token, outside_token in sorted(weird_tokens_sent):
-                curr2.execute(
-                    '''
-                    INSERT INTO sample_arbitrages_odd_tokens (sample_arbitrage_id, odd_token, outside_token, type)
-                    VALUES (%s, %s, %s, 'sent')
-                    ''',
-                    (id_, bytes.fromhex(weird_token[2:]), bytes.fromhex(outside_token[2:]))
-                )
-
-        last_complete_reservation = time.time()
+        for i in range(0, len(arbs), FILL_BATCH_SIZE):
+            batch = arbs[i : i + FILL_BATCH_SIZE]
+            receipts = get_receipts(w3, [txn_hash for _, txn_hash in batch])
+
+            transfers = TransferColumns.from_receipts([id_ for id_, _ in batch], receipts)
+            odd = find_odd_token_transfers(transfers)
+            n_broken += len(np.unique(odd.sample_arbitrage_id))
+
+            psycopg2.extras.execute_values(
+                curr,
+                '''
+                INSERT INTO sample_arbitrages_odd_tokens (sample_arbitrage_id, odd_token, outside_token, type)
+                VALUES %s
+                ''',
+                odd.rows(transfers.addresses),
+                page_size = 1_000,
+            )
+
         db.commit()
 
+        elapsed = time.time() - t_start
+        res_per_second = (i_res + 1) / elapsed
+        eta = datetime.timedelta(seconds=(len(assignments) - i_res - 1) / res_per_second)
+        broken_pct = n_broken / len(arbs) * 100 if len(arbs) > 0 else 0
+        l.info(
+            f'Processed {len(arbs):,} arbitrages in reservation - broken percent {broken_pct:.2f}% '
+            f'-- (global {(i_res + 1) / len(assignments) * 100:.2f}%) -- eta {eta}'
+        )
+
+
+# how many sample arbitrages to classify at once
+FILL_BATCH_SIZE = 2_000
+
+
+class TransferColumns:
+    """
+    ERC20 Transfer logs of many transactions, decoded into parallel arrays.
+
+    Addresses are interned to small integers (indices into `addresses`) so that
+    relations between them can be computed with integer sorts and merges.
+    """
+    sample_arbitrage_id: np.ndarray
+    token: np.ndarray
+    from_: np.ndarray
+    to: np.ndarray
+    value: typing.List[int]
+    addresses: typing.List[bytes]
+
+    def __init__(self, sample_arbitrage_id, token, from_, to, value, addresses) -> None:
+        self.sample_arbitrage_id = np.asarray(sample_arbitrage_id, dtype=np.int64)
+        self.token = np.asarray(token, dtype=np.int64)
+        self.from_ = np.asarray(from_, dtype=np.int64)
+        self.to = np.asarray(to, dtype=np.int64)
+        self.value = value
+        self.addresses = addresses
+
+    def __len__(self) -> int:
+        return len(self.token)
+
+    @staticmethod
+    def from_receipts(sample_arbitrage_ids: typing.List[int], receipts: typing.List[web3.types.TxReceipt]) -> 'TransferColumns':
+        address_ids: typing.Dict[bytes, int] = {}
+        addresses = []
+        def intern(address: bytes) -> int:
+            ret = address_ids.get(address, None)
+            if ret is None:
+                ret = len(addresses)
+                address_ids[address] = ret
+                addresses.append(address)
+            return ret
+
+        ids, token, from_, to, value = [], [], [], [], []
+        for id_, receipt in zip(sample_arbitrage_ids, receipts):
+            n_transfers = 0
+            for log in receipt['logs']:
+                topics = log['topics']
+                if len(topics) != 3 or topics[0] != ERC20_TRANSFER_TOPIC:
+                    continue
+                ids.append(id_)
+                token.append(intern(bytes.fromhex(log['address'][2:])))
+                from_.append(intern(bytes(topics[1][-20:])))
+                to.append(intern(bytes(topics[2][-20:])))
+                value.append(int(log['data'][2:] or '0', base=16))
+                n_transfers += 1
+            assert n_transfers >= 3, f'expected an arbitrage in 0x{bytes(receipt["transactionHash"]).hex()}'
+
+        return TransferColumns(ids, token, from_, to, value, addresses)
+
+
+class OddTokenTransfers(typing.NamedTuple):
+    sample_arbitrage_id: np.ndarray
+    odd_token: np.ndarray
+    outside_token: np.ndarray
+    type: np.ndarray
+
+    def rows(self, addresses: typing.List[bytes]) -> typing.List[typing.Tuple[int, bytes, bytes, str]]:
+        return [
+            (int(id_), addresses[odd], addresses[outside], type_)
+            for id_, odd, outside, type_ in zip(self.sample_arbitrage_id, self.odd_token, self.outside_token, self.type)
+        ]
+
+
+def find_odd_token_transfers(transfers: TransferColumns) -> OddTokenTransfers:
+    """
+    Find tokens that were themselves sent or received (as holders) some other token in the same transaction.
+
+    A transfer whose `to` is a token contract that also emitted a Transfer in that transaction is
+    labeled 'received' (odd_token=to, outside_token=the token moved), likewise `from` for 'sent'.
+    """
+    if len(transfers) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return OddTokenTransfers(empty, empty, empty, np.zeros(0, dtype=object))
+
+    # (transaction, address) pairs packed into one integer key
+    _, txn_idx = np.unique(transfers.sample_arbitrage_id, return_inverse=True)
+    txn_key = txn_idx.astype(np.int64) * len(transfers.addresses)
+
+    # sorted set of (transaction, token) that emitted a transfer
+    token_keys = np.unique(txn_key + transfers.token)
+
+    def is_token(addr: np.ndarray) -> np.ndarray:
+        keys = txn_key + addr
+        idxs = np.searchsorted(token_keys, keys)
+        idxs[idxs == len(token_keys)] = 0
+        return token_keys[idxs] == keys
+
+    parts = []
+    for type_, addr in [('received', transfers.to), ('sent', transfers.from_)]:
+        mask = is_token(addr)
+        found = np.unique(np.stack([
+            transfers.sample_arbitrage_id[mask],
+            addr[mask],
+            transfers.token[mask],
+        ], axis=1), axis=0)
+        parts.append((type_, found))
+
+    return OddTokenTransfers(
+        sample_arbitrage_id = np.concatenate([found[:, 0] for _, found in parts]),
+        odd_token = np.concatenate([found[:, 1] for _, found in parts]),
+        outside_token = np.concatenate([found[:, 2] for _, found in parts]),
+        type = np.concatenate([np.full(len(found), type_, dtype=object) for type_, found in parts]),
+    )
+
 
 def setup_db(curr: psycopg2.extensions.cursor):
     curr.execute(
@@ -2,20 +2,22 @@ import argparse
 import datetime
 import itertools
 import logging
-import os
 import socket
 import time
 import typing
 from eth_utils import event_abi_to_log_topic
 import psycopg2
 import psycopg2.extensions
+import psycopg2.extras
 
 import web3
 import web3.contract
+import web3.types
 import web3._utils.filters
+from backtest.gather_samples.receipts import RECEIPT_BATCH_SIZE, get_receipts
 from backtest.utils import connect_db
 
-from utils import get_abi, setup_logging
+from utils import connect_web3, get_abi, setup_logging
 
 
 l = logging.getLogger(__name__)
@@ -41,15 +43,8 @@ def main():
     db = connect_db()
     curr = db.cursor()
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
-
-    w3 = web3.Web3(web3.WebsocketProvider(
-        web3_host,
-        websocket_timeout=60 * 5,
-        websocket_kwargs={
-            'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-        },
-    ))
+    # RetryingProvider supports batched requests, used for fetching receipts
+    w3 = connect_web3()
 
     if not w3.isConnected():
         l.error(f'Could not connect to web3')
@@ -89,17 +84,41 @@ def setup_db(curr: psycopg2.extensions.cursor):
     curr.connection.commit()
 
 
+def build_event_decoders(contract: web3.contract.Contract) -> typing.Dict[bytes, web3.contract.ContractEvent]:
+    """
+    Map each event's topic0 to a (reusable) event object, so decoding a log is one dict lookup.
+    """
+    ret = {}
+    for event in contract.events._events:
+        if event.get('anonymous', False):
+            continue
+        topic = bytes(event_abi_to_log_topic(event))
+        ret[topic] = getattr(contract.events, event['name'])()
+    return ret
+
+
+def decode_log(decoders: typing.Dict[bytes, web3.contract.ContractEvent], log: web3.types.LogReceipt) -> web3.types.EventData:
+    event = decoders.get(bytes(log['topics'][0]), None)
+    if event is None:
+        raise Exception(
+            f'Could not find topic 0x{bytes(log["topics"][0]).hex()} '
+            f'(log {log["logIndex"]} of 0x{bytes(log["transactionHash"]).hex()})'
+        )
+    return event.processLog(log)
+
+
 def scrape_v4(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: int, end_block: int, id_: int, n_workers: int):
     l.info('scraping v4')
     zerox_proxy: web3.contract.Contract = w3.eth.contract(
         address = '0xDef1C0ded9bec7F1a1670819833240f027b25EfF',
         abi = get_abi('0x/IZeroEx.json')['compilerOutput']['abi'],
     )
+    decoders = build_event_decoders(zerox_proxy)
 
-    # find all transaction ids that we should query
+    # find all transactions that we should query
     curr.execute(
         '''
-        SELECT distinct sa.id
+        SELECT distinct sa.id, sa.txn_hash
         FROM (SELECT * FROM sample_arbitrages WHERE MOD(id, %(n_workers)s) = %(worker_id)s) sa
         JOIN sample_arbitrage_cycles sac ON sac.sample_arbitrage_id = sa.id
         JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
@@ -118,79 +137,70 @@ def scrape_v4(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: int,
         }
     )
     l.debug(f'have {curr.rowcount} transactions to look through for zeroex v4')
-    all_arb_ids: typing.List[int] = [x for (x,) in curr]
+    all_arbs: typing.List[typing.Tuple[int, bytes]] = [(arb_id, txn_hash.tobytes()) for arb_id, txn_hash in curr]
 
     start_time = time.time()
 
-    for i, arb_id in enumerate(all_arb_ids):
-        if i % 100 == 1:
+    for i in range(0, len(all_arbs), RECEIPT_BATCH_SIZE):
+        if i > 0:
             # status update
             elapsed = time.time() - start_time
             nps = i / elapsed
-            n_remaining = len(all_arb_ids) - i
+            n_remaining = len(all_arbs) - i
             remaining_sec = n_remaining / nps
             td_remaining = datetime.timedelta(seconds=remaining_sec)
-            l.info(f'{i}/{len(all_arb_ids)} ({i / len(all_arb_ids)*100:.1f}%) -- ETA {td_remaining}')
-            curr.connection.commit()
-
-
-        curr.execute('SELECT txn_hash FROM sample_arbitrages WHERE id = %s', (arb_id,))
-        (txn_hash,) = curr.fetchone()
-        txn_hash = txn_hash.tobytes()
-        l.debug(f'processing https://etherscan.io/tx/0x{txn_hash.hex()}')
-
-        zerox_exchanges = set()
-
-        receipt = w3.eth.get_transaction_receipt(txn_hash)
-        for log in receipt['logs']:
-            if log['address'] == zerox_proxy.address:
-                
-                # attempt to figure out what log this was
-                for event in zerox_proxy.events._events:
-                    topic = event_abi_to_log_topic(event)
-                    if log['topics'][0] == topic:
-                        event_obj = getattr(zerox_proxy.events, event['name'])()
-                        parsed = event_obj.processLog(log)
-                        break
-                else:
-                    print('Could not find topic!!!')
-                    print(log)
-                    raise Exception('Could not find topic')
-
-                if 'maker' in parsed['args']:
-                    zerox_exchanges.add(parsed['args']['maker'])
-
-        if len(zerox_exchanges) > 0:
-            l.debug(f'Found {len(zerox_exchanges)} exchanges')
-            curr.execute(
-                '''
-                SELECT sacei.id, sae.address
-                FROM (SELECT * FROM sample_arbitrages WHERE id = %s) sa
-                JOIN sample_arbitrage_cycles sac ON sac.sample_arbitrage_id = sa.id
-                JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
-                JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
-                JOIN sample_arbitrage_exchanges sae ON sacei.exchange_id = sae.id
-                ''',
-                (arb_id,)
-            )
-
-            exchanges = set()
-            for exc_item_id, baddr in list(curr):
-                baddr = baddr.tobytes()
-                address = w3.toChecksumAddress(baddr)
-                assert address not in exchanges
-                exchanges.add(address)
-                if address in zerox_exchanges:
-                    # insert this item!
-                    curr.execute(
-                        '''
-                        INSERT INTO sample_arbitrage_cycle_exchange_item_is_zerox (sample_arbitrage_cycle_exchange_item_id, is_zerox)
-                        VALUES (%s, %s)
-                        ''',
-                        (exc_item_id, True)
-                    )
-                    assert curr.rowcount == 1
-                    l.info(f'Marked {address} as zerox in 0x{txn_hash.hex()}')
+            l.info(f'{i}/{len(all_arbs)} ({i / len(all_arbs)*100:.1f}%) -- ETA {td_remaining}')
+
+        batch = all_arbs[i : i + RECEIPT_BATCH_SIZE]
+        receipts = get_receipts(w3, [txn_hash for _, txn_hash in batch])
+
+        arb_to_zerox_exchanges: typing.Dict[int, typing.Set[str]] = {}
+        for (arb_id, txn_hash), receipt in zip(batch, receipts):
+            zerox_exchanges = set()
+            for log in receipt['logs']:
+                if log['address'] == zerox_proxy.address:
+                    parsed = decode_log(decoders, log)
+                    if 'maker' in parsed['args']:
+                        zerox_exchanges.add(parsed['args']['maker'])
+
+            if len(zerox_exchanges) > 0:
+                l.debug(f'Found {len(zerox_exchanges)} exchanges in https://etherscan.io/tx/0x{txn_hash.hex()}')
+                arb_to_zerox_exchanges[arb_id] = zerox_exchanges
+
+        if len(arb_to_zerox_exchanges) == 0:
+            continue
+
+        curr.execute(
+            '''
+            SELECT sa.id, sacei.id, sae.address
+            FROM (SELECT * FROM sample_arbitrages WHERE id = ANY(%s)) sa
+            JOIN sample_arbitrage_cycles sac ON sac.sample_arbitrage_id = sa.id
+            JOIN sample_arbitrage_cycle_exchanges sace ON sace.cycle_id = sac.id
+            JOIN sample_arbitrage_cycle_exchange_items sacei ON sacei.cycle_exchange_id = sace.id
+            JOIN sample_arbitrage_exchanges sae ON sacei.exchange_id = sae.id
+            ''',
+            (list(arb_to_zerox_exchanges.keys()),)
+        )
+
+        to_insert = []
+        exchanges = set()
+        for arb_id, exc_item_id, baddr in curr.fetchall():
+            address = w3.toChecksumAddress(baddr.tobytes())
+            assert (arb_id, address) not in exchanges
+            exchanges.add((arb_id, address))
+            if address in arb_to_zerox_exchanges[arb_id]:
+                to_insert.append((exc_item_id, True))
+                l.info(f'Marked {address} as zerox in arbitrage id={arb_id}')
+
+        psycopg2.extras.execute_values(
+            curr,
+            '''
+            INSERT INTO sample_arbitrage_cycle_exchange_item_is_zerox (sample_arbitrage_cycle_exchange_item_id, is_zerox)
+            VALUES %s
+            ''',
+            to_insert,
+        )
+        curr.connection.commit()
 
     l.info('Done scrape')
     curr.connection.commit()
@@ -201,6 +211,7 @@ def scrape_v3(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: int,
         address = '0x61935CbDd02287B511119DDb11Aeb42F1593b7Ef',
         abi = get_abi('0x/exchange_proxy.abi.json'),
     )
+    fill_event = zerox.events.Fill()
 
     # get all known exchange addresses
     curr.execute('SELECT id, address FROM sample_arbitrage_exchanges')
@@ -245,16 +256,18 @@ def scrape_v3(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: int,
 
         l.debug(f'Have {len(logs):,} logs for this batch')
 
-        n_marked = 0
+        rows = []
         for log in logs:
-            fill = zerox.events.Fill().processLog(log)
+            fill = fill_event.processLog(log)
             if fill['args']['makerAddress'] not in exchanges:
                 continue
+            rows.append((exchanges[fill['args']['makerAddress']], bytes(log['transactionHash'])))
 
-            curr.execute(
-                'INSERT INTO tmp_zeroxs (exchange_id, txn_hash) VALUES (%s, %s)',
-                (exchanges[fill['args']['makerAddress']], log['transactionHash']),
-            )
+        psycopg2.extras.execute_values(
+            curr,
+            'INSERT INTO tmp_zeroxs (exchange_id, txn_hash) VALUES %s',
+            rows,
+        )
 
         curr.execute(
             '''
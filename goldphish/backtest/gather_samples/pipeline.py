@@ -0,0 +1,167 @@
+"""
+Small threaded pipeline used to overlap log fetching, arbitrage detection, and
+database inserts.
+
+Each stage runs in its own thread and is connected to the next by a bounded
+queue, so a slow stage applies back-pressure instead of buffering without limit.
+Items flow through in order; `None` is the end-of-stream marker.
+"""
+
+import logging
+import queue
+import threading
+import time
+import typing
+
+l = logging.getLogger(__name__)
+
+# how many items may wait between two stages
+DEFAULT_QUEUE_SIZE = 2
+
+
+class StageStats:
+    """
+    Throughput accounting for one pipeline stage.
+
+    busy_seconds is time spent doing work, wait_seconds is time spent blocked on
+    the neighbouring queues (starved for input or waiting for room downstream).
+    """
+    name: str
+    n_items: int
+    n_units: int
+    busy_seconds: float
+    wait_seconds: float
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.n_items = 0
+        self.n_units = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds: float, wait_seconds: float, n_units: int = 0):
+        with self._lock:
+            self.n_items += 1
+            self.n_units += n_units
+            self.busy_seconds += busy_seconds
+            self.wait_seconds += wait_seconds
+
+    @property
+    def units_per_second(self) -> float:
+        """Units processed per second of busy time, ie what the stage could sustain if never starved"""
+        if self.busy_seconds == 0:
+            return 0.0
+        return self.n_units / self.busy_seconds
+
+    @property
+    def utilization(self) -> float:
+        total = self.busy_seconds + self.wait_seconds
+        if total == 0:
+            return 0.0
+        return self.busy_seconds / total
+
+    def __str__(self) -> str:
+        return (
+            f'stage={self.name} items={self.n_items:,} units={self.n_units:,} '
+            f'busy={self.busy_seconds:.1f}s wait={self.wait_seconds:.1f}s '
+            f'utilization={self.utilization * 100:.1f}% rate={self.units_per_second:.1f}/s'
+        )
+
+
+class Stage(threading.Thread):
+    """
+    Applies `fn` to every item read from `in_queue` and forwards the result to
+    `out_queue` (if any).
+
+    `fn` returns (result, n_units) where n_units is the stage's notion of work
+    done (logs decoded, arbitrages inserted, ...), used for throughput reporting.
+    `setup`, if given, runs inside the thread before the first item; its return
+    value is passed as the first argument to `fn` (eg. a per-thread connection).
+    """
+
+    def __init__(
+            self,
+            name: str,
+            fn: typing.Callable[[typing.Any, typing.Any], typing.Tuple[typing.Any, int]],
+            in_queue: queue.Queue,
+            out_queue: typing.Optional[queue.Queue],
+            abort: threading.Event,
+            setup: typing.Optional[typing.Callable[[], typing.Any]] = None,
+        ) -> None:
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.abort = abort
+        self.setup = setup
+        self.stats = StageStats(name)
+        self.exception: typing.Optional[BaseException] = None
+
+    def run(self):
+        try:
+            ctx = self.setup() if self.setup is not None else None
+            while True:
+                t_start = time.time()
+                item = get_unless_aborted(self.in_queue, self.abort)
+                t_got = time.time()
+
+                if item is None:
+                    break
+
+                result, n_units = self.fn(ctx, item)
+                t_done = time.time()
+
+                if self.out_queue is not None:
+                    put_unless_aborted(self.out_queue, result, self.abort)
+
+                self.stats.record(
+                    busy_seconds = t_done - t_got,
+                    wait_seconds = (t_got - t_start) + (time.time() - t_done),
+                    n_units = n_units,
+                )
+        except PipelineAborted:
+            return
+        except BaseException as e:
+            l.exception(f'pipeline stage {self.name} failed')
+            self.exception = e
+            self.abort.set()
+            return
+
+        if self.out_queue is not None:
+            try:
+                put_unless_aborted(self.out_queue, None, self.abort)
+            except PipelineAborted:
+                pass
+
+
+class PipelineAborted(Exception):
+    """
+    Raised inside a stage when another stage failed and the pipeline is shutting down.
+    """
+    pass
+
+
+# how long to block on a queue before re-checking the abort flag
+_POLL_SECONDS = 0.5
+
+
+def get_unless_aborted(q: queue.Queue, abort: threading.Event) -> typing.Any:
+    while True:
+        if abort.is_set():
+            raise PipelineAborted()
+        try:
+            return q.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            pass
+
+
+def put_unless_aborted(q: queue.Queue, item: typing.Any, abort: threading.Event):
+    while True:
+        if abort.is_set():
+            raise PipelineAborted()
+        try:
+            q.put(item, timeout=_POLL_SECONDS)
+            return
+        except queue.Full:
+            pass
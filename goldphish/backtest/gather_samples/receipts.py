@@ -0,0 +1,68 @@
+"""
+Batched transaction receipt retrieval shared by the sample fill jobs.
+"""
+
+import typing
+import web3
+import web3.logs
+import web3.types
+from web3._utils.method_formatters import receipt_formatter
+from web3.datastructures import AttributeDict
+
+from utils import erc20
+
+# how many receipts to request per round-trip
+RECEIPT_BATCH_SIZE = 200
+
+
+def get_receipts(w3: web3.Web3, txn_hashes: typing.List[bytes]) -> typing.List[web3.types.TxReceipt]:
+    """
+    Fetch receipts (in the same order as txn_hashes) in as few round-trips as the provider allows.
+    """
+    if not hasattr(w3.provider, 'make_request_batch'):
+        return [w3.eth.get_transaction_receipt(h) for h in txn_hashes]
+
+    ret = []
+    for i in range(0, len(txn_hashes), RECEIPT_BATCH_SIZE):
+        batch = txn_hashes[i : i + RECEIPT_BATCH_SIZE]
+        resps = w3.provider.make_request_batch([('eth_getTransactionReceipt', ['0x' + h.hex()]) for h in batch])
+        assert len(resps) == len(batch)
+        for txn_hash, resp in zip(batch, resps):
+            if 'error' in resp:
+                raise Exception(f'could not get receipt for 0x{txn_hash.hex()}: {resp["error"]}')
+            # formatted the same way as w3.eth.get_transaction_receipt()
+            ret.append(AttributeDict.recursive(receipt_formatter(resp['result'])))
+    return ret
+
+
+class BlockReceiptCache:
+    """
+    Receipts (and their decoded ERC20 transfers) for transactions of a single block,
+    so that several samples in the block share the round-trips.
+    """
+
+    def __init__(self, w3: web3.Web3) -> None:
+        self.w3 = w3
+        self._receipts: typing.Dict[bytes, web3.types.TxReceipt] = {}
+        self._transfers: typing.Dict[bytes, typing.List[web3.types.EventData]] = {}
+
+    def get_many(self, txn_hashes: typing.List[bytes]) -> typing.List[web3.types.TxReceipt]:
+        missing = [h for h in dict.fromkeys(txn_hashes) if h not in self._receipts]
+        if len(missing) > 0:
+            for txn_hash, receipt in zip(missing, get_receipts(self.w3, missing)):
+                self._receipts[txn_hash] = receipt
+        return [self._receipts[h] for h in txn_hashes]
+
+    def get(self, txn_hash: bytes) -> web3.types.TxReceipt:
+        (ret,) = self.get_many([txn_hash])
+        return ret
+
+    def get_transfers(self, txn_hash: bytes) -> typing.List[web3.types.EventData]:
+        """
+        Decoded ERC20 Transfer events of the transaction; logs that do not parse are dropped.
+        """
+        ret = self._transfers.get(txn_hash, None)
+        if ret is None:
+            ret = erc20.events.Transfer().processReceipt(self.get(txn_hash), errors=web3.logs.DISCARD)
+            self._transfers[txn_hash] = ret
+        return ret
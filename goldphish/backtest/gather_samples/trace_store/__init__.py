@@ -0,0 +1,148 @@
+"""
+Local store of ETH value transfers, flattened out of block call traces.
+
+Blocks are traced once with `debug_traceBlockByNumber` (callTracer) and every call
+frame that moved ETH is written to `trace_value_transfers`, alongside the block's
+miner in `trace_blocks`. fill_coinbase_xfers then finds what each transaction paid
+the miner with an indexed join, instead of tracing each transaction on the node.
+"""
+
+import logging
+import typing
+import psycopg2.extensions
+import psycopg2.extras
+import web3
+
+l = logging.getLogger(__name__)
+
+# call types that cannot move ETH even though callTracer may report a value
+# (DELEGATECALL echoes the parent frame's value)
+_NO_VALUE_CALL_TYPES = {'DELEGATECALL', 'STATICCALL'}
+
+
+class ValueTransfer(typing.NamedTuple):
+    txn_hash: bytes
+    sender: bytes
+    receiver: bytes
+    value: int
+
+
+def setup_db(curr: psycopg2.extensions.cursor):
+    curr.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS trace_blocks (
+            block_number   INTEGER PRIMARY KEY NOT NULL,
+            miner          BYTEA NOT NULL,
+            n_transactions INTEGER NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS trace_value_transfers (
+            block_number INTEGER NOT NULL,
+            txn_hash     BYTEA NOT NULL,
+            sender       BYTEA NOT NULL,
+            receiver     BYTEA NOT NULL,
+            value        NUMERIC(78, 0) NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_trace_value_transfers_block_receiver ON trace_value_transfers (block_number, receiver);
+        CREATE INDEX IF NOT EXISTS idx_trace_value_transfers_txn_hash ON trace_value_transfers USING hash (txn_hash);
+        '''
+    )
+
+
+def flatten_value_transfers(txn_hash: bytes, frame: dict) -> typing.List[ValueTransfer]:
+    """
+    Walk a callTracer frame (in execution order) and return every transfer of ETH.
+
+    Frames that reverted, and everything beneath them, are skipped because their
+    value was never actually transferred.
+    """
+    ret = []
+    stack = [frame]
+    while len(stack) > 0:
+        item = stack.pop()
+        if 'error' in item:
+            continue
+
+        value = int(item.get('value', '0x0'), base=16)
+        if value > 0 and item.get('to') is not None and item.get('type') not in _NO_VALUE_CALL_TYPES:
+            ret.append(ValueTransfer(
+                txn_hash = txn_hash,
+                sender   = bytes.fromhex(item['from'][2:]),
+                receiver = bytes.fromhex(item['to'][2:]),
+                value    = value,
+            ))
+
+        stack.extend(reversed(item.get('calls', [])))
+    return ret
+
+
+def trace_block(w3: web3.Web3, block_number: int) -> typing.Tuple[bytes, typing.List[ValueTransfer], int]:
+    """
+    Trace the whole block in one request.
+
+    Returns (miner, value transfers, number of transactions).
+    """
+    block = w3.eth.get_block(block_number)
+    miner = bytes.fromhex(block['miner'][2:])
+    txn_hashes = [bytes(h) for h in block['transactions']]
+
+    resp = w3.provider.make_request(
+        'debug_traceBlockByNumber',
+        [hex(block_number), {'tracer': 'callTracer', 'timeout': '5m'}],
+    )
+    if 'error' in resp:
+        raise Exception(f'could not trace block {block_number:,}: {resp["error"]}')
+
+    traces = resp['result']
+    assert len(traces) == len(txn_hashes), f'expected {len(txn_hashes)} traces in block {block_number:,} but got {len(traces)}'
+
+    transfers = []
+    for txn_hash, trace in zip(txn_hashes, traces):
+        if 'error' in trace and 'result' not in trace:
+            raise Exception(f'could not trace transaction 0x{txn_hash.hex()}: {trace["error"]}')
+        if 'txHash' in trace:
+            assert bytes.fromhex(trace['txHash'][2:]) == txn_hash
+        transfers.extend(flatten_value_transfers(txn_hash, trace['result']))
+
+    return miner, transfers, len(txn_hashes)
+
+
+def ingest_block(w3: web3.Web3, curr: psycopg2.extensions.cursor, block_number: int) -> bool:
+    """
+    Trace the block and write it to the store. Does not commit.
+
+    Returns False if the block was already in the store.
+    """
+    if is_ingested(curr, block_number):
+        return False
+
+    miner, transfers, n_transactions = trace_block(w3, block_number)
+
+    curr.execute(
+        '''
+        INSERT INTO trace_blocks (block_number, miner, n_transactions) VALUES (%s, %s, %s)
+        ON CONFLICT DO NOTHING
+        ''',
+        (block_number, miner, n_transactions),
+    )
+    if curr.rowcount == 0:
+        # someone else ingested it meanwhile
+        return False
+
+    psycopg2.extras.execute_values(
+        curr,
+        '''
+        INSERT INTO trace_value_transfers (block_number, txn_hash, sender, receiver, value)
+        VALUES %s
+        ''',
+        [(block_number, t.txn_hash, t.sender, t.receiver, t.value) for t in transfers],
+    )
+    l.debug(f'ingested traces for block {block_number:,} ({n_transactions} transactions, {len(transfers)} value transfers)')
+    return True
+
+
+def is_ingested(curr: psycopg2.extensions.cursor, block_number: int) -> bool:
+    curr.execute('SELECT EXISTS(SELECT 1 FROM trace_blocks WHERE block_number = %s)', (block_number,))
+    (ret,) = curr.fetchone()
+    return ret
@@ -0,0 +1,73 @@
+"""
+Ingests block traces for every block that contains a sample arbitrage.
+"""
+
+import argparse
+import logging
+import socket
+import time
+
+from backtest.gather_samples.trace_store import ingest_block, setup_db
+from backtest.utils import connect_db
+from utils import setup_logging, connect_web3
+
+
+l = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--worker-name', type=str, default=None, help='worker name for log, must be POSIX path-safe')
+    parser.add_argument('--n-workers', type=int, default=1)
+    parser.add_argument('--id', type=int, default=0)
+    parser.add_argument('--setup-db', action='store_true', dest='setup_db')
+
+    args = parser.parse_args()
+
+    assert args.n_workers > args.id
+    assert args.id >= 0
+
+    if args.worker_name is None:
+        args.worker_name = socket.gethostname()
+    job_name = 'ingest_traces'
+
+    setup_logging(job_name, worker_name = args.worker_name)
+
+    db = connect_db()
+    curr = db.cursor()
+
+    if args.setup_db:
+        setup_db(curr)
+        db.commit()
+        l.info('setup db')
+        return
+
+    w3 = connect_web3()
+
+    curr.execute(
+        '''
+        SELECT distinct block_number
+        FROM sample_arbitrages sa
+        WHERE mod(block_number, %s) = %s AND
+            NOT EXISTS(SELECT 1 FROM trace_blocks tb WHERE tb.block_number = sa.block_number)
+        ''',
+        (args.n_workers, args.id),
+    )
+    blocks_to_process = sorted(x for (x,) in curr)
+    l.info(f'Have {len(blocks_to_process):,} blocks to trace')
+
+    t_start = time.time()
+    for i, block_number in enumerate(blocks_to_process):
+        ingest_block(w3, curr, block_number)
+        db.commit()
+
+        if i % 100 == 99:
+            elapsed = time.time() - t_start
+            rate = (i + 1) / elapsed
+            eta_seconds = (len(blocks_to_process) - i - 1) / rate
+            l.info(f'traced {i + 1:,} of {len(blocks_to_process):,} blocks ({rate:.2f} blocks/s, ETA {eta_seconds / 60:.1f} minutes)')
+
+    l.info('done')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Postgres LISTEN/NOTIFY plumbing so that idle workers can block until there is
+something to do, instead of sleep-polling the database.
+
+Notifications are raised by triggers (installed with `setup_triggers`), so
+producers do not need to change: inserting a candidate block, claiming or
+completing a reservation, or flagging a job for cancellation is enough to wake
+listeners. Notifications are only delivered on commit, and are a wake-up hint
+only -- listeners should always re-check the database and should keep a
+fallback timeout in case a notification is missed. Use `has_trigger` to pick that
+timeout: without the triggers, nothing is ever notified.
+
+Run `python3 -m backtest.notifications` to install the triggers.
+"""
+
+import logging
+import select
+import time
+import typing
+import psycopg2.extensions
+
+l = logging.getLogger(__name__)
+
+# new (or re-queued) blocks in candidate_arbitrage_blocks_to_verify; payload is the block number
+CANDIDATE_BLOCKS_CHANNEL = 'candidate_blocks'
+
+# a job_control row was flagged for cancellation; payload is the job_control id
+JOB_CANCEL_CHANNEL = 'job_cancel'
+
+# rows were added to a reservation table, or a reservation was claimed, released or
+# completed; payload is the table name
+RESERVATION_PROGRESS_CHANNEL = 'reservation_progress'
+
+CANDIDATE_BLOCK_TRIGGER = 'trg_notify_candidate_block'
+JOB_CANCEL_TRIGGER = 'trg_notify_job_cancel'
+RESERVATION_INSERT_TRIGGER = 'trg_notify_reservation_insert'
+RESERVATION_STATUS_TRIGGER = 'trg_notify_reservation_progress'
+
+# reservation table -> the columns that change when it is claimed, released or completed;
+# progress and heartbeat writes, which are most of them, notify no one
+RESERVATION_TABLES: typing.Dict[str, typing.Tuple[str, ...]] = {
+    'candidate_arbitrage_reservations':      ('claimed_on', 'completed_on'),
+    'candidate_arbitrage_reshoot_blocks':    ('claimed_on', 'completed_on'),
+    'top_candidate_arbitrage_reservations':  ('claimed_on', 'completed_on'),
+    'gather_sample_arbitrages_reservations': ('started_on', 'finished_on'),
+    'arb_sandwich_reservations':             ('claimed_on', 'completed_on'),
+    'work_queue_ranges':                     ('worker_name', 'finished_on'),
+}
+
+
+def setup_triggers(curr: psycopg2.extensions.cursor):
+    """
+    Install the notification triggers on every relevant table that exists. Safe to re-run.
+    """
+    curr.execute(
+        f'''
+        CREATE OR REPLACE FUNCTION notify_candidate_block() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{CANDIDATE_BLOCKS_CHANNEL}', NEW.block_number::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION notify_job_cancel() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{JOB_CANCEL_CHANNEL}', NEW.id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION notify_reservation_progress() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{RESERVATION_PROGRESS_CHANNEL}', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        '''
+    )
+
+    if _table_exists(curr, 'candidate_arbitrage_blocks_to_verify'):
+        curr.execute(
+            f'''
+            DROP TRIGGER IF EXISTS {CANDIDATE_BLOCK_TRIGGER} ON candidate_arbitrage_blocks_to_verify;
+            CREATE TRIGGER {CANDIDATE_BLOCK_TRIGGER}
+                AFTER INSERT OR UPDATE OF verify_started ON candidate_arbitrage_blocks_to_verify
+                FOR EACH ROW
+                WHEN (NEW.verify_started IS NULL)
+                EXECUTE FUNCTION notify_candidate_block();
+            '''
+        )
+        l.debug('installed candidate block trigger')
+
+    if _table_exists(curr, 'job_control'):
+        curr.execute(
+            f'''
+            DROP TRIGGER IF EXISTS {JOB_CANCEL_TRIGGER} ON job_control;
+            CREATE TRIGGER {JOB_CANCEL_TRIGGER}
+                AFTER UPDATE OF is_cancel_requested ON job_control
+                FOR EACH ROW
+                WHEN (NEW.is_cancel_requested AND NOT OLD.is_cancel_requested)
+                EXECUTE FUNCTION notify_job_cancel();
+            '''
+        )
+        l.debug('installed job cancel trigger')
+
+    for table, status_columns in RESERVATION_TABLES.items():
+        if not _table_exists(curr, table):
+            continue
+        changed = ' OR '.join(f'OLD.{c} IS DISTINCT FROM NEW.{c}' for c in status_columns)
+        # the update trigger is per-row so that it can skip rows whose status did not
+        # change; postgres folds identical notifications in a transaction into one
+        curr.execute(
+            f'''
+            DROP TRIGGER IF EXISTS {RESERVATION_INSERT_TRIGGER} ON {table};
+            CREATE TRIGGER {RESERVATION_INSERT_TRIGGER}
+                AFTER INSERT ON {table}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION notify_reservation_progress();
+
+            DROP TRIGGER IF EXISTS {RESERVATION_STATUS_TRIGGER} ON {table};
+            CREATE TRIGGER {RESERVATION_STATUS_TRIGGER}
+                AFTER UPDATE OF {', '.join(status_columns)} ON {table}
+                FOR EACH ROW
+                WHEN ({changed})
+                EXECUTE FUNCTION notify_reservation_progress();
+            '''
+        )
+        l.debug(f'installed reservation progress triggers on {table}')
+
+
+def _table_exists(curr: psycopg2.extensions.cursor, table: str) -> bool:
+    curr.execute('SELECT to_regclass(%s) IS NOT NULL', (table,))
+    (ret,) = curr.fetchone()
+    return ret
+
+
+def has_trigger(curr: psycopg2.extensions.cursor, table: str, trigger: str) -> bool:
+    """
+    Whether setup_triggers() installed the trigger on the table, ie whether a listener
+    will hear about its changes.
+    """
+    curr.execute(
+        'SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND tgname = %s)',
+        (table, trigger),
+    )
+    (ret,) = curr.fetchone()
+    return ret
+
+
+def notify(curr: psycopg2.extensions.cursor, channel: str, payload: str = ''):
+    """
+    Raise a notification explicitly; it is delivered when the transaction commits.
+    """
+    curr.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+
+
+class Listener:
+    """
+    Receives notifications on the given channels.
+
+    If no connection is supplied a dedicated autocommit connection is opened. A supplied
+    connection may be shared with other work, but notifications are only read while it
+    is idle (not inside a transaction).
+    """
+
+    def __init__(self, channels: typing.List[str], conn: typing.Optional[psycopg2.extensions.connection] = None) -> None:
+        if conn is None:
+            from backtest.utils import connect_db
+            conn = connect_db()
+            conn.autocommit = True
+        self.conn = conn
+        self.channels = list(channels)
+
+        curr = self.conn.cursor()
+        for channel in self.channels:
+            curr.execute(f'LISTEN {channel}')
+        if not self.conn.autocommit:
+            self.conn.commit()
+
+    def _idle(self) -> bool:
+        return self.conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def poll(self) -> typing.List[psycopg2.extensions.Notify]:
+        """
+        Return (and clear) notifications received so far, without blocking.
+        """
+        if self._idle():
+            self.conn.poll()
+        ret = list(self.conn.notifies)
+        self.conn.notifies.clear()
+        return ret
+
+    def wait(self, timeout: float) -> typing.List[psycopg2.extensions.Notify]:
+        """
+        Block until at least one notification arrives or `timeout` seconds pass.
+
+        Returns the notifications received (empty on timeout).
+        """
+        deadline = time.time() + timeout
+        while True:
+            ret = self.poll()
+            if len(ret) > 0:
+                return ret
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return []
+            assert self._idle(), 'cannot wait for notifications inside a transaction'
+            select.select([self.conn], [], [], remaining)
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    from backtest.utils import connect_db
+    from utils import setup_logging
+
+    setup_logging('setup_notifications', stdout_level=logging.DEBUG)
+
+    db = connect_db()
+    curr = db.cursor()
+    setup_triggers(curr)
+    db.commit()
+    l.info('installed notification triggers')
+
+
+if __name__ == '__main__':
+    main()
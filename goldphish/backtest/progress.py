@@ -0,0 +1,470 @@
+"""
+Progress and throughput telemetry for reservation jobs.
+
+Workers record what they did -- blocks processed, time spent waiting on the node,
+time spent writing to postgres -- in a `WorkerTelemetry`, which every so often
+writes one row to `job_worker_stats` and bumps the job's running count in
+`job_progress`. The eta command reads only those two small tables, so watching
+a job no longer aggregates its entire reservation table, and a slow worker
+(or a slow node behind it) stands out next to its peers.
+
+A job's total, and the work already done before telemetry was recorded, is
+seeded once from its reservation table (see `JOBS`).
+
+Run `python3 -m backtest.progress --job gather_samples` to watch a job.
+"""
+
+import argparse
+import contextlib
+import datetime
+import logging
+import statistics
+import sys
+import threading
+import time
+import typing
+import psycopg2.extensions
+import web3
+
+from backtest import notifications
+from utils import RetryingProvider
+
+l = logging.getLogger(__name__)
+
+# how often a worker writes its counters to the database
+FLUSH_PERIOD_SECONDS = 60
+
+# per-worker rows older than this are pruned by the worker itself
+STATS_RETENTION = '1 day'
+
+# a worker is reported as slow when its throughput is below this fraction of the median worker's
+SLOW_WORKER_FRACTION = 0.5
+
+
+class ReservationJob(typing.NamedTuple):
+    """
+    How to count a job's work (in blocks) from its reservation table, used only to seed `job_progress`.
+
+    `total_blocks` and `done_blocks` are SQL expressions aggregated over the rows of `table` matching `where`.
+    """
+    table: str
+    total_blocks: str
+    done_blocks: str
+    where: str = 'TRUE'
+
+
+JOBS: typing.Dict[str, ReservationJob] = {
+    'gather_samples': ReservationJob(
+        table = 'gather_sample_arbitrages_reservations',
+        total_blocks = 'SUM(to_block_exclusive - from_block)',
+        done_blocks = 'SUM(CASE WHEN finished_on IS NOT NULL THEN to_block_exclusive - from_block ELSE 0 END)',
+    ),
+    'seek_candidates': ReservationJob(
+        table = 'candidate_arbitrage_reservations',
+        total_blocks = 'SUM(block_number_end - block_number_start + 1)',
+        done_blocks = 'SUM(CASE WHEN progress IS NOT NULL THEN progress - block_number_start + 1 ELSE 0 END)',
+    ),
+    'fill_sandwich': ReservationJob(
+        table = 'arb_sandwich_reservations',
+        total_blocks = 'SUM(end_block - start_block + 1)',
+        done_blocks = 'SUM(CASE WHEN progress IS NOT NULL THEN progress - start_block + 1 ELSE 0 END)',
+    ),
+    'fill_backrunners': ReservationJob(
+        table = 'work_queue_ranges',
+        total_blocks = 'SUM(end_block_exclusive - start_block)',
+        done_blocks = 'SUM(progress - start_block)',
+        where = "job_name = 'fill_backrunners'",
+    ),
+    'relay': ReservationJob(
+        table = 'candidate_arbitrage_reshoot_blocks',
+        total_blocks = 'COUNT(*)',
+        done_blocks = 'SUM(CASE WHEN completed_on IS NOT NULL THEN 1 ELSE 0 END)',
+    ),
+}
+
+
+def setup_db(curr: psycopg2.extensions.cursor):
+    curr.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS job_progress (
+            job_name     TEXT PRIMARY KEY NOT NULL,
+            total_blocks BIGINT NOT NULL,
+            done_blocks  BIGINT NOT NULL,
+            seeded_on    TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()::timestamp,
+            updated_on   TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()::timestamp
+        );
+
+        CREATE TABLE IF NOT EXISTS job_worker_stats (
+            id             BIGSERIAL PRIMARY KEY NOT NULL,
+            job_name       TEXT NOT NULL,
+            worker_name    TEXT NOT NULL,
+            recorded_on    TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()::timestamp,
+            period_seconds DOUBLE PRECISION NOT NULL,
+            n_blocks       INTEGER NOT NULL,
+            n_rpc          INTEGER NOT NULL,
+            rpc_seconds    DOUBLE PRECISION NOT NULL,
+            n_db_writes    INTEGER NOT NULL,
+            db_seconds     DOUBLE PRECISION NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_job_worker_stats_job_recorded_on ON job_worker_stats (job_name, recorded_on);
+        '''
+    )
+
+
+class TelemetrySample(typing.NamedTuple):
+    period_seconds: float
+    n_blocks: int
+    n_rpc: int
+    rpc_seconds: float
+    n_db_writes: int
+    db_seconds: float
+
+
+class WorkerTelemetry:
+    """
+    Accumulates one worker's throughput counters and periodically writes them out.
+
+    Thread-safe, so pipeline stages may share one instance. Writes go over a dedicated
+    connection (opened lazily when none is supplied) and are committed immediately,
+    so reporting never interferes with the worker's own transactions.
+    """
+
+    def __init__(
+            self,
+            job_name: str,
+            worker_name: str,
+            conn: typing.Optional[psycopg2.extensions.connection] = None,
+            flush_period_seconds: float = FLUSH_PERIOD_SECONDS,
+        ) -> None:
+        self.job_name = job_name
+        self.worker_name = worker_name
+        self.flush_period_seconds = flush_period_seconds
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._reset(time.time())
+
+    def _reset(self, now: float):
+        self._period_start = now
+        self._n_blocks = 0
+        self._n_rpc = 0
+        self._rpc_seconds = 0.0
+        self._n_db_writes = 0
+        self._db_seconds = 0.0
+
+    def observe_blocks(self, n_blocks: int = 1):
+        with self._lock:
+            self._n_blocks += n_blocks
+
+    def observe_rpc(self, seconds: float, n_requests: int = 1):
+        with self._lock:
+            self._n_rpc += n_requests
+            self._rpc_seconds += seconds
+
+    def observe_db_write(self, seconds: float):
+        with self._lock:
+            self._n_db_writes += 1
+            self._db_seconds += seconds
+
+    @contextlib.contextmanager
+    def rpc(self, n_requests: int = 1):
+        t_start = time.time()
+        try:
+            yield
+        finally:
+            self.observe_rpc(time.time() - t_start, n_requests)
+
+    @contextlib.contextmanager
+    def db_write(self):
+        t_start = time.time()
+        try:
+            yield
+        finally:
+            self.observe_db_write(time.time() - t_start)
+
+    def instrument(self, w3: web3.Web3) -> web3.Web3:
+        """
+        Time every request made through this web3 instance. A RetryingProvider reports
+        each round-trip, batches included; any other provider is timed by a middleware,
+        which sees single requests only.
+        """
+        provider = w3.provider
+        if isinstance(provider, RetryingProvider):
+            provider.request_observers.append(self._observe_round_trip)
+        else:
+            w3.middleware_onion.add(self._rpc_middleware)
+        return w3
+
+    def _observe_round_trip(self, n_requests: int, seconds: float):
+        self.observe_rpc(seconds, n_requests)
+
+    def _rpc_middleware(self, make_request, w3: web3.Web3):
+        def middleware(method, params):
+            with self.rpc():
+                return make_request(method, params)
+        return middleware
+
+    def take_sample(self) -> TelemetrySample:
+        """
+        Return the counters accumulated since the last sample, and start a new period.
+        """
+        with self._lock:
+            now = time.time()
+            ret = TelemetrySample(
+                period_seconds = now - self._period_start,
+                n_blocks = self._n_blocks,
+                n_rpc = self._n_rpc,
+                rpc_seconds = self._rpc_seconds,
+                n_db_writes = self._n_db_writes,
+                db_seconds = self._db_seconds,
+            )
+            self._reset(now)
+            return ret
+
+    def maybe_flush(self) -> bool:
+        """
+        Flush if a full period has passed since the last flush.
+
+        Returns True if flushed.
+        """
+        if time.time() < self._period_start + self.flush_period_seconds:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        """
+        Write out the counters accumulated since the last flush. Call this once more when
+        the worker stops, so that the last, partial period is not lost.
+
+        Never raises on database errors, so it is safe in a `finally`.
+        """
+        sample = self.take_sample()
+        try:
+            if self.conn is None:
+                from backtest.utils import connect_db
+                self.conn = connect_db()
+                setup_db(self.conn.cursor())
+                self.conn.commit()
+
+            curr = self.conn.cursor()
+            curr.execute(
+                '''
+                INSERT INTO job_worker_stats (job_name, worker_name, period_seconds, n_blocks, n_rpc, rpc_seconds, n_db_writes, db_seconds)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ''',
+                (self.job_name, self.worker_name, *sample),
+            )
+            if sample.n_blocks > 0:
+                curr.execute(
+                    '''
+                    UPDATE job_progress SET done_blocks = done_blocks + %s, updated_on = now()::timestamp
+                    WHERE job_name = %s
+                    ''',
+                    (sample.n_blocks, self.job_name),
+                )
+            notifications.notify(curr, notifications.RESERVATION_PROGRESS_CHANNEL, 'job_worker_stats')
+            curr.execute(
+                f'''
+                DELETE FROM job_worker_stats
+                WHERE job_name = %s AND worker_name = %s AND recorded_on < now()::timestamp - interval '{STATS_RETENTION}'
+                ''',
+                (self.job_name, self.worker_name),
+            )
+            self.conn.commit()
+        except psycopg2.Error:
+            # telemetry must never take the job down; the counts of this period are lost
+            if self.conn is not None:
+                self.conn.rollback()
+            l.exception('could not flush telemetry')
+            return
+
+        if sample.period_seconds > 0:
+            l.debug(
+                f'telemetry job={self.job_name} blocks={sample.n_blocks:,} '
+                f'rate={sample.n_blocks / sample.period_seconds:.2f} blocks/s '
+                f'rpc={sample.n_rpc:,} ({sample.rpc_seconds:.1f}s) db_writes={sample.n_db_writes:,} ({sample.db_seconds:.1f}s)'
+            )
+
+
+def seed_job_progress(curr: psycopg2.extensions.cursor, job_name: str, reseed: bool = False) -> bool:
+    """
+    Count the job's total and completed work from its reservation table, once.
+
+    Work that workers committed but had not yet flushed when seeding ran is counted twice,
+    which is at most one flush period per worker.
+
+    Returns True if seeded, False if the job was already seeded.
+    """
+    job = JOBS[job_name]
+
+    if not reseed:
+        curr.execute('SELECT EXISTS(SELECT 1 FROM job_progress WHERE job_name = %s)', (job_name,))
+        (exists,) = curr.fetchone()
+        if exists:
+            return False
+
+    l.info(f'seeding progress of {job_name} from {job.table}, this may take a while')
+    curr.execute(
+        f'''
+        INSERT INTO job_progress (job_name, total_blocks, done_blocks)
+        SELECT %s, COALESCE({job.total_blocks}, 0), COALESCE({job.done_blocks}, 0)
+        FROM {job.table}
+        WHERE {job.where}
+        ON CONFLICT (job_name) DO UPDATE SET
+            total_blocks = EXCLUDED.total_blocks,
+            done_blocks = EXCLUDED.done_blocks,
+            seeded_on = now()::timestamp,
+            updated_on = now()::timestamp
+        ''',
+        (job_name,),
+    )
+    return True
+
+
+class WorkerThroughput(typing.NamedTuple):
+    worker_name: str
+    last_seen: datetime.datetime
+    n_blocks: int
+    blocks_per_second: float
+    mean_rpc_latency: typing.Optional[float]
+    mean_db_write_seconds: typing.Optional[float]
+    rpc_fraction: float
+    db_fraction: float
+
+
+def summarize_workers(rows: typing.Iterable[typing.Tuple[str, datetime.datetime, float, int, int, float, int, float]]) -> typing.List[WorkerThroughput]:
+    """
+    Combine raw `job_worker_stats` rows (worker_name, recorded_on, period_seconds, n_blocks, n_rpc,
+    rpc_seconds, n_db_writes, db_seconds) into one throughput figure per worker, fastest first.
+    """
+    totals: typing.Dict[str, list] = {}
+    for worker_name, recorded_on, period_seconds, n_blocks, n_rpc, rpc_seconds, n_db_writes, db_seconds in rows:
+        t = totals.setdefault(worker_name, [recorded_on, 0.0, 0, 0, 0.0, 0, 0.0])
+        t[0] = max(t[0], recorded_on)
+        t[1] += period_seconds
+        t[2] += n_blocks
+        t[3] += n_rpc
+        t[4] += rpc_seconds
+        t[5] += n_db_writes
+        t[6] += db_seconds
+
+    ret = []
+    for worker_name, (last_seen, period_seconds, n_blocks, n_rpc, rpc_seconds, n_db_writes, db_seconds) in totals.items():
+        ret.append(WorkerThroughput(
+            worker_name = worker_name,
+            last_seen = last_seen,
+            n_blocks = n_blocks,
+            blocks_per_second = n_blocks / period_seconds if period_seconds > 0 else 0.0,
+            mean_rpc_latency = rpc_seconds / n_rpc if n_rpc > 0 else None,
+            mean_db_write_seconds = db_seconds / n_db_writes if n_db_writes > 0 else None,
+            rpc_fraction = rpc_seconds / period_seconds if period_seconds > 0 else 0.0,
+            db_fraction = db_seconds / period_seconds if period_seconds > 0 else 0.0,
+        ))
+    ret.sort(key=lambda x: x.blocks_per_second, reverse=True)
+    return ret
+
+
+def find_slow_workers(workers: typing.List[WorkerThroughput], fraction: float = SLOW_WORKER_FRACTION) -> typing.List[WorkerThroughput]:
+    """
+    Workers whose throughput is below `fraction` of the median worker's.
+    """
+    if len(workers) < 2:
+        return []
+    median = statistics.median(w.blocks_per_second for w in workers)
+    return [w for w in workers if w.blocks_per_second < median * fraction]
+
+
+def estimate_eta(remaining_blocks: int, blocks_per_second: float) -> typing.Optional[datetime.timedelta]:
+    if blocks_per_second <= 0:
+        return None
+    return datetime.timedelta(seconds=round(max(remaining_blocks, 0) / blocks_per_second))
+
+
+def get_worker_throughput(curr: psycopg2.extensions.cursor, job_name: str, window_seconds: float) -> typing.List[WorkerThroughput]:
+    curr.execute(
+        '''
+        SELECT worker_name, recorded_on, period_seconds, n_blocks, n_rpc, rpc_seconds, n_db_writes, db_seconds
+        FROM job_worker_stats
+        WHERE job_name = %s AND recorded_on >= now()::timestamp - %s * interval '1 second'
+        ''',
+        (job_name, window_seconds),
+    )
+    return summarize_workers(curr.fetchall())
+
+
+def print_report(curr: psycopg2.extensions.cursor, job_name: str, window_seconds: float, show_workers: bool):
+    curr.execute('SELECT total_blocks, done_blocks FROM job_progress WHERE job_name = %s', (job_name,))
+    total_blocks, done_blocks = curr.fetchone()
+
+    workers = get_worker_throughput(curr, job_name, window_seconds)
+    rate = sum(w.blocks_per_second for w in workers)
+    eta = estimate_eta(total_blocks - done_blocks, rate)
+
+    pct_done = done_blocks / total_blocks * 100 if total_blocks > 0 else 100
+    print(
+        f'{job_name}: {done_blocks:,} of {total_blocks:,} blocks done ({pct_done:.2f}%) '
+        f'{len(workers)} workers at {rate:.2f} blocks/s ETA {eta if eta is not None else "unknown"}'
+    )
+
+    if show_workers:
+        for w in workers:
+            rpc_latency = f'{w.mean_rpc_latency * 1000:.0f}ms' if w.mean_rpc_latency is not None else '-'
+            db_write = f'{w.mean_db_write_seconds * 1000:.0f}ms' if w.mean_db_write_seconds is not None else '-'
+            print(
+                f'    {w.worker_name:<30} {w.blocks_per_second:8.2f} blocks/s  rpc {rpc_latency:>7} ({w.rpc_fraction * 100:4.1f}%)  '
+                f'db write {db_write:>7} ({w.db_fraction * 100:4.1f}%)  last seen {w.last_seen:%H:%M:%S}'
+            )
+
+    for w in find_slow_workers(workers):
+        print(f'    SLOW: {w.worker_name} at {w.blocks_per_second:.2f} blocks/s')
+
+
+def main():
+    from backtest.utils import connect_db
+
+    parser = argparse.ArgumentParser(description='Estimate time remaining for reservation jobs')
+    parser.add_argument('--job', type=str, action='append', choices=sorted(JOBS.keys()), help='job to report on (may repeat), default all seeded jobs')
+    parser.add_argument('--window-minutes', type=float, default=15, help='throughput averaging window')
+    parser.add_argument('--workers', action='store_true', help='show per-worker throughput')
+    parser.add_argument('--reseed', action='store_true', help='re-count progress from the reservation tables')
+    parser.add_argument('--once', action='store_true', help='print one report and exit')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    db = connect_db()
+    curr = db.cursor()
+    setup_db(curr)
+
+    if args.job is not None:
+        job_names = args.job
+    else:
+        curr.execute('SELECT job_name FROM job_progress ORDER BY job_name')
+        job_names = [x for (x,) in curr]
+        if len(job_names) == 0:
+            print('No jobs have been seeded yet, pass --job', file=sys.stderr)
+            exit(1)
+
+    for job_name in job_names:
+        seed_job_progress(curr, job_name, reseed=args.reseed)
+    db.commit()
+
+    listener = notifications.Listener([notifications.RESERVATION_PROGRESS_CHANNEL])
+
+    while True:
+        for job_name in job_names:
+            print_report(curr, job_name, args.window_minutes * 60, args.workers)
+        db.commit()
+
+        if args.once:
+            break
+
+        time.sleep(FLUSH_PERIOD_SECONDS / 2)
+        # only re-query once something actually changed
+        listener.wait(timeout=FLUSH_PERIOD_SECONDS)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,7 @@ from backtest.gather_samples.tokens import get_token
 from backtest.top_of_block.relay import AutoAdaptShootSuccess, InferredTokenTransferFeeCalculator, auto_adapt_attempt_shoot_candidate, load_pricer_for, open_ganache
 from backtest.utils import connect_db
 from backtest.top_of_block.common import load_pool
+from backtest.top_of_block.gas_oracle import GasOracle, load_gas_oracle
 from backtest.top_of_block.seek_candidates import get_relevant_logs
 import argparse
 import psycopg2.extensions
@@ -96,7 +97,8 @@ def do_fill_duration(w3: web3.Web3, args: argparse.Namespace):
     curr.execute(f'SELECT MIN(start_block), MAX(end_block) FROM block_samples')
     min_block, max_block = curr.fetchone()
 
-    gas_oracle_pts = get_gas_oracle(curr, min_block, max_block)
+    # the whole oracle, not just [min_block, max_block]: all workers share its on-disk cache
+    gas_oracle = load_gas_oracle(curr)
     origin_blocks = get_exchange_origin_blocks(curr)
 
     curr.execute(
@@ -124,7 +126,7 @@ def do_fill_duration(w3: web3.Web3, args: argparse.Namespace):
     )
 
     for start_block, end_block, priority in list(curr):
-        process_sample(w3, curr, min_block, max_block, start_block, end_block, priority, gas_oracle_pts, origin_blocks, args.id)
+        process_sample(w3, curr, min_block, max_block, start_block, end_block, priority, gas_oracle, origin_blocks, args.id)
 
 def get_exchange_origin_blocks(curr: psycopg2.extensions.cursor) -> typing.Dict[bytes, int]:
     l.debug(f'getting exchange origin blocks')
@@ -143,45 +145,6 @@ def get_exchange_origin_blocks(curr: psycopg2.extensions.cursor) -> typing.Dict[
     return ret
 
 
-def get_gas_oracle(curr: psycopg2.extensions.cursor, min_block: int, max_block: int) -> typing.Dict[
-        str,
-        typing.Tuple[typing.List[int], typing.Tuple[typing.List[int], typing.List[int], typing.List[int], typing.List[int], typing.List[int]]]]:
-    l.debug(f'interpolating from {min_block:,} to {max_block:,}')
-
-    curr.execute('SELECT DISTINCT niche FROM naive_gas_price_estimate')
-    all_niches = set(x for (x,) in curr)
-    l.debug(f'Have {len(all_niches):,} niches')
-
-    ret = {}
-
-    for i, niche in enumerate(sorted(all_niches)):
-        l.info(f'Processing niche {i + 1} of {len(all_niches)}')
-
-        curr.execute(
-            '''
-            SELECT block_number, gas_price_min, gas_price_25th, gas_price_median, gas_price_75th, gas_price_max
-            FROM naive_gas_price_estimate
-            WHERE niche = %s
-            ORDER BY block_number ASC
-            ''',
-            (niche,)
-        )
-
-        block_numbers = []
-        pts = ([], [], [], [], [])
-
-        for row in curr:
-            block_numbers.append(row[0])
-            for i, pt in enumerate(row[1:]):
-                pts[i].append(int(pt))
-        
-        for i in range(len(pts)):
-            assert len(block_numbers) == len(pts[i])
-
-        ret[niche] = (block_numbers, pts)
-
-    return ret
-
 def process_sample(
         w3: web3.Web3,
         curr2: psycopg2.extensions.cursor,
@@ -190,10 +153,7 @@ def process_sample(
         start_block: int,
         end_block: int,
         priority: int,
-        gas_oracle_pts: typing.Dict[
-            str,
-            typing.Tuple[typing.List[int], typing.Tuple[typing.List[int], typing.List[int], typing.List[int], typing.List[int], typing.List[int]]]
-        ],
+        gas_oracle: GasOracle,
         origin_blocks: typing.Dict[bytes, int],
         worker_id: int
     ):
@@ -432,14 +392,11 @@ def process_sample(
             # special case -- we cannot find these in our scrape so we have no oracle
 
             # just use uniswap v3 instead
-            replacement_niche_sz = niche_sz.replace('|balv2|', '|uv3|')
-            blocks = gas_oracle_pts[replacement_niche_sz][0]
-            pts = gas_oracle_pts[replacement_niche_sz][1][gas_price_group]
+            oracle_niche = niche_sz.replace('|balv2|', '|uv3|')
         else:
-            blocks = gas_oracle_pts[niche_sz][0]
-            pts = gas_oracle_pts[niche_sz][1][gas_price_group]
+            oracle_niche = niche_sz
 
-        most_generous_gas_price = int(np.interp(start_block - 1, blocks, pts))
+        most_generous_gas_price = gas_oracle.gas_price(oracle_niche, start_block - 1, gas_price_group)
         generous_gas_usage = 100_000
         if arb.profit < most_generous_gas_price * generous_gas_usage:
             l.debug(f'Does not meet generous params')
@@ -467,9 +424,7 @@ def process_sample(
             return False
 
         # this was pre-existing, compare the exact prior predicted gas price
-        blocks = gas_oracle_pts[niche][0]
-        pts = gas_oracle_pts[niche][1][gas_price_group]
-        prior_gas_price = int(np.interp(start_block - 1, blocks, pts))
+        prior_gas_price = gas_oracle.gas_price(niche, start_block - 1, gas_price_group)
         prior_profit = result.profit_no_fee - result.gas * prior_gas_price
         if prior_profit < 0:
             does_not_need_lookback.add(k)
@@ -589,15 +544,14 @@ def process_sample(
                             # special case -- we cannot find these in our scrape so we have no oracle
 
                             # just use uniswap v3 instead
-                            replacement_niche_sz = niche_sz.replace('|balv2|', '|uv3|')
-                            blocks = gas_oracle_pts[replacement_niche_sz][0]
-                            pts = gas_oracle_pts[replacement_niche_sz][1][gas_price_group]
+                            oracle_niche = niche_sz.replace('|balv2|', '|uv3|')
                         else:
-                            blocks = gas_oracle_pts[niche_sz][0]
-                            pts = gas_oracle_pts[niche_sz][1][gas_price_group]
-                        assert len(blocks) == len(pts)
-                        gas_price = int(np.interp(block_number, blocks, pts))
-                        gas_price_cache[(niche_sz, gas_price_group)] = gas_price
+                            oracle_niche = niche_sz
+                        # fill all percentile groups for this niche at once
+                        (niche_gas_prices,) = gas_oracle.gas_prices([oracle_niche], [block_number])
+                        for i, niche_gas_price in enumerate(niche_gas_prices):
+                            gas_price_cache[(niche_sz, i)] = int(niche_gas_price)
+                        gas_price = gas_price_cache[(niche_sz, gas_price_group)]
 
                     real_profit_after_fee = real_profit_before_fee - gas_price * gas_used
 
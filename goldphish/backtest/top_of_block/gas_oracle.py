@@ -0,0 +1,211 @@
+"""
+gas_oracle.py
+
+Interpolated gas-price oracle backed by `naive_gas_price_estimate`.
+
+Each niche is stored as a sorted array of block numbers alongside an (n, 5) matrix
+of gas-price percentiles (min, 25th, median, 75th, max). Lookups use `np.searchsorted`
+and follow the same linear interpolation (and end-point clamping) as `np.interp`.
+"""
+import os
+import tempfile
+import typing
+import logging
+import numpy as np
+import psycopg2.extensions
+
+l = logging.getLogger(__name__)
+
+N_GAS_PRICE_GROUPS = 5
+
+DEFAULT_CACHE_FNAME = os.path.join(os.getenv('STORAGE_DIR', '/mnt/goldphish'), 'tmp', 'gas_oracle.npz')
+
+
+class GasOracle:
+    """
+    Gas-price percentiles, by niche, interpolated over block number.
+    """
+    _block_numbers: typing.Dict[str, np.ndarray]
+    _percentiles: typing.Dict[str, np.ndarray]
+
+    def __init__(self, block_numbers: typing.Dict[str, np.ndarray], percentiles: typing.Dict[str, np.ndarray]) -> None:
+        assert set(block_numbers.keys()) == set(percentiles.keys())
+        for niche in block_numbers:
+            assert block_numbers[niche].ndim == 1
+            assert percentiles[niche].shape == (len(block_numbers[niche]), N_GAS_PRICE_GROUPS)
+            assert len(block_numbers[niche]) > 0
+        self._block_numbers = block_numbers
+        self._percentiles = percentiles
+
+    @property
+    def niches(self) -> typing.Set[str]:
+        return set(self._block_numbers.keys())
+
+    def __contains__(self, niche: str) -> bool:
+        return niche in self._block_numbers
+
+    def points(self, niche: str) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the raw (block_numbers, percentiles) observations for the given niche.
+        """
+        return self._block_numbers[niche], self._percentiles[niche]
+
+    def gas_price(self, niche: str, block_number: int, gas_price_group: int) -> int:
+        """
+        Get the interpolated gas price for a single niche, block, and percentile group
+        (0 = min, 1 = 25th, 2 = median, 3 = 75th, 4 = max).
+        """
+        return int(self._interpolate(niche, np.array([block_number]))[0, gas_price_group])
+
+    def gas_prices(self, niches: typing.Sequence[str], block_numbers: typing.Sequence[int]) -> np.ndarray:
+        """
+        Get interpolated gas prices for many (niche, block_number) pairs at once.
+
+        Returns an array of shape (len(niches), 5), one row of percentiles per pair.
+        """
+        assert len(niches) == len(block_numbers)
+        block_numbers = np.asarray(block_numbers, dtype=np.float64)
+        niches_arr = np.asarray(niches, dtype=object)
+
+        ret = np.empty((len(niches_arr), N_GAS_PRICE_GROUPS), dtype=np.float64)
+        for niche in set(niches):
+            mask = niches_arr == niche
+            ret[mask] = self._interpolate(niche, block_numbers[mask])
+        return ret
+
+    def _interpolate(self, niche: str, xs: np.ndarray) -> np.ndarray:
+        xp = self._block_numbers[niche]
+        fp = self._percentiles[niche]
+
+        xs = np.asarray(xs, dtype=np.float64)
+        if len(xp) == 1:
+            return np.repeat(fp, len(xs), axis=0)
+
+        # index of the right-hand point of the bracketing segment
+        idx = np.clip(np.searchsorted(xp, xs, side='right'), 1, len(xp) - 1)
+        x0 = xp[idx - 1]
+        x1 = xp[idx]
+        f0 = fp[idx - 1]
+        f1 = fp[idx]
+
+        slope = (f1 - f0) / (x1 - x0)[:, np.newaxis]
+        ret = slope * (xs - x0)[:, np.newaxis] + f0
+
+        # clamp outside the observed range, and pin exact hits on the last point (as np.interp does)
+        ret[xs <= xp[0]] = fp[0]
+        ret[xs >= xp[-1]] = fp[-1]
+        return ret
+
+    def save(self, fname: str, fingerprint: typing.Tuple[int, int]):
+        """
+        Atomically write the oracle to `fname`, tagged with the table fingerprint it was loaded from.
+        """
+        niches = sorted(self._block_numbers.keys())
+        lengths = np.array([len(self._block_numbers[n]) for n in niches], dtype=np.int64)
+
+        dirname = os.path.dirname(os.path.abspath(fname))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=dirname, suffix='.npz')
+        with os.fdopen(fd, mode='wb') as fout:
+            np.savez(
+                fout,
+                fingerprint=np.array(fingerprint, dtype=np.int64),
+                niches=np.array(niches, dtype=str),
+                lengths=lengths,
+                block_numbers=np.concatenate([self._block_numbers[n] for n in niches]) if niches else np.empty(0),
+                percentiles=np.concatenate([self._percentiles[n] for n in niches]) if niches else np.empty((0, N_GAS_PRICE_GROUPS)),
+            )
+        os.replace(tmp_fname, fname)
+
+    @staticmethod
+    def load(fname: str, fingerprint: typing.Optional[typing.Tuple[int, int]] = None) -> typing.Optional['GasOracle']:
+        """
+        Load an oracle written by `save()`. Returns None when the file is missing or was
+        written against a different table fingerprint.
+        """
+        if not os.path.isfile(fname):
+            return None
+
+        with np.load(fname) as f:
+            if fingerprint is not None and tuple(int(x) for x in f['fingerprint']) != tuple(fingerprint):
+                l.debug(f'gas oracle cache at {fname} is stale')
+                return None
+
+            block_numbers = {}
+            percentiles = {}
+            offset = 0
+            for niche, length in zip(f['niches'], f['lengths']):
+                niche = str(niche)
+                block_numbers[niche] = f['block_numbers'][offset : offset + length]
+                percentiles[niche] = f['percentiles'][offset : offset + length]
+                offset += length
+
+        return GasOracle(block_numbers, percentiles)
+
+
+def get_fingerprint(curr: psycopg2.extensions.cursor) -> typing.Tuple[int, int]:
+    """
+    Cheap summary of `naive_gas_price_estimate` used to detect a stale on-disk cache.
+    """
+    curr.execute('SELECT COUNT(*), COALESCE(MAX(block_number), 0) FROM naive_gas_price_estimate')
+    n_rows, max_block = curr.fetchone()
+    return (int(n_rows), int(max_block))
+
+
+def load_gas_oracle(curr: psycopg2.extensions.cursor, cache_fname: typing.Optional[str] = DEFAULT_CACHE_FNAME) -> GasOracle:
+    """
+    Load the gas oracle, using the on-disk cache at `cache_fname` if it is still fresh.
+    Pass `cache_fname=None` to always query the database.
+    """
+    fingerprint = get_fingerprint(curr)
+
+    if cache_fname is not None:
+        maybe_ret = GasOracle.load(cache_fname, fingerprint)
+        if maybe_ret is not None:
+            l.debug(f'Loaded gas oracle from cache {cache_fname} ({len(maybe_ret.niches):,} niches)')
+            return maybe_ret
+
+    # stream every row through one server-side cursor, ordered so each niche is contiguous
+    curr2 = curr.connection.cursor(name='gas_oracle_load')
+    curr2.itersize = 100_000
+    curr2.execute(
+        '''
+        SELECT niche, block_number, gas_price_min, gas_price_25th, gas_price_median, gas_price_75th, gas_price_max
+        FROM naive_gas_price_estimate
+        ORDER BY niche ASC, block_number ASC
+        '''
+    )
+
+    block_numbers = {}
+    percentiles = {}
+
+    def flush(niche, bns, pts):
+        block_numbers[niche] = np.array(bns, dtype=np.float64)
+        percentiles[niche] = np.array(pts, dtype=np.float64).reshape((len(bns), N_GAS_PRICE_GROUPS))
+
+    last_niche = None
+    bns = []
+    pts = []
+    for niche, block_number, *row in curr2:
+        if niche != last_niche:
+            if last_niche is not None:
+                flush(last_niche, bns, pts)
+            last_niche = niche
+            bns = []
+            pts = []
+        bns.append(block_number)
+        pts.extend(int(x) for x in row)
+
+    if last_niche is not None:
+        flush(last_niche, bns, pts)
+
+    curr2.close()
+
+    l.debug(f'Have {len(block_numbers):,} niches')
+    ret = GasOracle(block_numbers, percentiles)
+
+    if cache_fname is not None:
+        ret.save(cache_fname, fingerprint)
+        l.debug(f'Wrote gas oracle cache to {cache_fname}')
+
+    return ret
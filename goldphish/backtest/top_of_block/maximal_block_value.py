@@ -1,10 +1,14 @@
 """
-Measures the approximate maximal extractable value in each block
+Measures the maximal extractable value in each block
 
-Since this is generally an NP-complete problem, we just use a simple
-naive (Greedy) algorithm.
+This is a maximum-weight independent set problem over the graph of arbitrages
+that conflict (share an exchange). Although NP-complete in general, the conflict
+graph splits into many small connected components, which we solve exactly with
+branch-and-bound. Components too large to solve exactly fall back to a greedy
+selection.
 """
 
+import bisect
 import collections
 import itertools
 import logging
@@ -13,7 +17,6 @@ import psycopg2.extras
 import argparse
 import typing
 import web3
-import networkx as nx
 import web3.types
 
 from backtest.utils import connect_db
@@ -76,35 +79,35 @@ def setup_db(curr: psycopg2.extensions.cursor):
     )
 
 
-ARBITRAGE_NODE = 0x1
-EXCHANGE_NODE = 0x2
+# components with more nodes than this are solved greedily
+EXACT_MAX_COMPONENT_SIZE = 64
+
+# maximum branch-and-bound nodes explored per component before accepting the best found so far
+EXACT_MAX_SEARCH_NODES = 200_000
+
+
 def analyze_blocks(curr: psycopg2.extensions.cursor, start_block: int, end_block: int):
-    # get all arbitrage campaigns and arbitrages
+    # get all arbitrage campaigns and their member arbitrages in one go
     curr.execute(
         '''
-        SELECT id, block_number_start, block_number_end
-        FROM candidate_arbitrage_campaigns
-        WHERE gas_pricer = 'median' AND niche LIKE 'nfb|%%' AND %s <= block_number_start AND block_number_end <= %s
+        SELECT cac.id, cac.block_number_start, cac.block_number_end, ca.block_number, ca.exchanges, cacm.profit_after_fee_wei, ca.id
+        FROM candidate_arbitrage_campaigns cac
+        JOIN candidate_arbitrage_campaign_member cacm ON cacm.candidate_arbitrage_campaign = cac.id
+        JOIN candidate_arbitrages ca ON ca.id = cacm.candidate_arbitrage_id
+        WHERE cac.gas_pricer = 'median' AND cac.niche LIKE 'nfb|%%' AND %s <= cac.block_number_start AND cac.block_number_end <= %s
+        ORDER BY cac.id, ca.block_number
         ''',
         (start_block, end_block)
     )
-    l.debug(f'Have {curr.rowcount:,} campaigns in this priority')
-    
-    candidates = list(curr)
+
     candidates_with_arbitrage = []
-    for id_, block_number_start, block_number_end in candidates:
-        curr.execute(
-            '''
-            SELECT ca.block_number, ca.exchanges, profit_after_fee_wei, ca.id
-            FROM candidate_arbitrage_campaign_member
-            JOIN candidate_arbitrages ca ON ca.id = candidate_arbitrage_campaign_member.candidate_arbitrage_id
-            WHERE candidate_arbitrage_campaign = %s
-            ORDER BY ca.block_number
-            ''',
-            (id_,)
-        )
-        assert curr.rowcount > 0, f'campaign {id_} had no candidates'
-        candidates_with_arbitrage.append((id_, block_number_start, block_number_end, list(curr)))
+    for id_, rows in itertools.groupby(curr, key=lambda x: x[0]):
+        rows = list(rows)
+        _, block_number_start, block_number_end, _, _, _, _ = rows[0]
+        members = [(block_number, exchanges, profit, ca_id) for _, _, _, block_number, exchanges, profit, ca_id in rows]
+        candidates_with_arbitrage.append((id_, block_number_start, block_number_end, members))
+
+    l.debug(f'Have {len(candidates_with_arbitrage):,} campaigns in this priority')
 
     candidates_by_start_block = collections.defaultdict(lambda: [])
     candidates_by_end_block = collections.defaultdict(lambda: [])
@@ -115,6 +118,7 @@ def analyze_blocks(curr: psycopg2.extensions.cursor, start_block: int, end_block
         candidates_by_end_block[block_number_end].append(c)
 
     running_campaigns = {}
+    campaign_member_blocks = {c[0]: [x[0] for x in c[3]] for c in candidates_with_arbitrage}
 
     for block_number in range(start_block, end_block + 1):
         for c in candidates_by_start_block[block_number]:
@@ -128,70 +132,209 @@ def analyze_blocks(curr: psycopg2.extensions.cursor, start_block: int, end_block
         l.debug(f'Have {len(running_campaigns):,} campaigns running in block {block_number:,}')
 
         available_candidates = []
-        for c in running_campaigns.values():
+        for id_, c in running_campaigns.items():
             these_candidates = c[3]
-            candidate = these_candidates[0]
-            for maybe_candidate in these_candidates[1:]:
-                if maybe_candidate[0] <= block_number:
-                    candidate = maybe_candidate
-                else:
-                    break
-            
-            available_candidates.append(candidate)
+            # most recent member at or before this block (or the first, if none yet)
+            idx = bisect.bisect_right(campaign_member_blocks[id_], block_number) - 1
+            available_candidates.append(these_candidates[max(idx, 0)])
     
         analyze_block(curr, available_candidates, block_number)
         curr.connection.commit()
 
-def analyze_block(curr: psycopg2.extensions.cursor, candidates: typing.List[typing.Tuple[int, typing.List[bytes], int, int]], block_number: int):
-    l.debug(f'Have {len(candidates):,} arbitrages in block {block_number}')
 
-    g = nx.Graph()
+def build_conflict_graph(
+        candidates: typing.List[typing.Tuple[int, typing.List[bytes], int, int]]
+    ) -> typing.Tuple[typing.List[int], typing.List[int], typing.List[int]]:
+    """
+    Build the graph of candidates that conflict by sharing an exchange.
+
+    Returns (ids, weights, adjacency) where adjacency[i] is a bitset of the
+    indices of candidates which conflict with candidate i.
+    """
+    ids = []
+    weights = []
+    candidate_exchanges = []
+    seen_ids = set()
+
+    # map exchange -> bitset of candidates that use it
+    exchange_members: typing.Dict[bytes, int] = collections.defaultdict(int)
 
     for _, exchanges, profit, id_ in candidates:
-        exchanges = [e.tobytes() for e in exchanges]
-        profit = int(profit)
+        if id_ in seen_ids:
+            continue
+        seen_ids.add(id_)
 
+        exchanges = [e.tobytes() if isinstance(e, memoryview) else bytes(e) for e in exchanges]
         assert 2 <= len(exchanges) <= 3
 
-        g.add_node(id_, weight=profit, type=ARBITRAGE_NODE)
+        bit = 1 << len(ids)
         for exc in exchanges:
-            node = exc
-            if not g.has_node(node):
-                g.add_node(node, type=EXCHANGE_NODE)
-            g.add_edge(id_, node)
-
-    # collapse exchange nodes
-    for node, data in list(g.nodes(data=True)):
-        if data['type'] == ARBITRAGE_NODE:
-            continue
+            exchange_members[exc] |= bit
 
-        for n1, n2 in itertools.combinations(g.neighbors(node), 2):
-            assert g.nodes[n1]['type'] == ARBITRAGE_NODE
-            assert g.nodes[n2]['type'] == ARBITRAGE_NODE
-            assert n1 != n2
+        ids.append(id_)
+        weights.append(int(profit))
+        candidate_exchanges.append(exchanges)
 
-            g.add_edge(n1, n2)
-        
-        g.remove_node(node)
+    adjacency = []
+    for i, exchanges in enumerate(candidate_exchanges):
+        neighbors = 0
+        for exc in exchanges:
+            neighbors |= exchange_members[exc]
+        adjacency.append(neighbors & ~(1 << i))
+
+    return ids, weights, adjacency
+
+
+def _iter_bits(bitset: int) -> typing.Iterator[int]:
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+
+def connected_components(adjacency: typing.List[int]) -> typing.List[int]:
+    """
+    Split the conflict graph into connected components, each returned as a bitset.
+    """
+    ret = []
+    unvisited = (1 << len(adjacency)) - 1
+    while unvisited:
+        frontier = unvisited & -unvisited
+        component = 0
+        while frontier:
+            component |= frontier
+            reachable = 0
+            for i in _iter_bits(frontier):
+                reachable |= adjacency[i]
+            frontier = reachable & ~component
+        ret.append(component)
+        unvisited &= ~component
+    return ret
+
+
+def _greedy_independent_set(component: int, weights: typing.List[int], adjacency: typing.List[int]) -> int:
+    """
+    Repeatedly take the heaviest remaining candidate and discard its neighbors,
+    never taking candidates that cannot add value.
+    """
+    selected = 0
+    remaining = 0
+    for i in _iter_bits(component):
+        if weights[i] > 0:
+            remaining |= 1 << i
+    for i in sorted(_iter_bits(remaining), key=lambda x: weights[x], reverse=True):
+        if remaining >> i & 1:
+            selected |= 1 << i
+            remaining &= ~(adjacency[i] | (1 << i))
+    return selected
+
+
+def max_weight_independent_set(
+        component: int,
+        weights: typing.List[int],
+        adjacency: typing.List[int],
+        max_search_nodes: int = EXACT_MAX_SEARCH_NODES,
+    ) -> typing.Tuple[int, bool]:
+    """
+    Find the maximum-weight independent set within the given component (as a bitset)
+    using branch-and-bound, seeded with the greedy solution.
+
+    Returns (selected bitset, is_optimal); is_optimal is False when the search budget
+    ran out and the best set found so far was returned.
+    """
+    # candidates that cannot add value are never worth selecting
+    positive = 0
+    for i in _iter_bits(component):
+        if weights[i] > 0:
+            positive |= 1 << i
+
+    def weight_of(bitset: int) -> int:
+        return sum(weights[i] for i in _iter_bits(bitset))
+
+    best_set = _greedy_independent_set(positive, weights, adjacency)
+    best_weight = weight_of(best_set)
+    n_search_nodes = 0
+
+    # order branching by weight so good solutions are found early
+    order = sorted(_iter_bits(positive), key=lambda x: weights[x], reverse=True)
+
+    def search(remaining: int, selected: int, selected_weight: int):
+        nonlocal best_set, best_weight, n_search_nodes
+
+        n_search_nodes += 1
+        if n_search_nodes > max_search_nodes:
+            return
+
+        # take, for free, everything that no longer conflicts with anything remaining
+        isolated = 0
+        for i in _iter_bits(remaining):
+            if adjacency[i] & remaining == 0:
+                isolated |= 1 << i
+        if isolated:
+            remaining &= ~isolated
+            selected |= isolated
+            selected_weight += weight_of(isolated)
+
+        if selected_weight + weight_of(remaining) <= best_weight:
+            # cannot beat the incumbent, even taking everything left
+            return
+
+        if remaining == 0:
+            best_set = selected
+            best_weight = selected_weight
+            return
+
+        v = next(i for i in order if remaining >> i & 1)
+
+        # branch 1: take v, discarding its neighbors
+        search(remaining & ~(adjacency[v] | (1 << v)), selected | (1 << v), selected_weight + weights[v])
+        # branch 2: leave v out
+        search(remaining & ~(1 << v), selected, selected_weight)
+
+    search(positive, 0, 0)
+
+    return best_set, n_search_nodes <= max_search_nodes
+
+
+def select_arbitrages(
+        candidates: typing.List[typing.Tuple[int, typing.List[bytes], int, int]]
+    ) -> typing.Tuple[typing.List[int], int]:
+    """
+    Select the set of non-conflicting candidates with maximal total profit.
+
+    Returns (selected candidate ids, total profit).
+    """
+    ids, weights, adjacency = build_conflict_graph(candidates)
+    components = connected_components(adjacency)
+    l.debug(f'Have {len(components):,} connected components in graph')
+
+    selected = 0
+    for component in components:
+        size = bin(component).count('1')
+        if size == 1:
+            if weights[component.bit_length() - 1] > 0:
+                selected |= component
+            continue
 
-    l.debug(f'Have {len(list(nx.connected_components(g))):,} connected components in graph')
+        if size > EXACT_MAX_COMPONENT_SIZE:
+            l.debug(f'Component of size {size} is too large for exact solution, using greedy')
+            selected |= _greedy_independent_set(component, weights, adjacency)
+            continue
 
-    selected_arbitrages = []
-    selected_arbitrage_weights = []
+        component_selected, is_optimal = max_weight_independent_set(component, weights, adjacency)
+        if not is_optimal:
+            l.debug(f'Search budget exhausted on component of size {size}, using best found')
+        selected |= component_selected
 
-    while len(g.nodes) > 0:
-        largest_node_by_weight = max(g.nodes, key = lambda x: g.nodes[x]['weight'])
+    selected_ids = [ids[i] for i in _iter_bits(selected)]
+    total_weight = sum(weights[i] for i in _iter_bits(selected))
+    return selected_ids, total_weight
 
-        selected_arbitrages.append(largest_node_by_weight)
-        selected_arbitrage_weights.append(g.nodes[largest_node_by_weight]['weight'])
-        l.debug(f'selected arbitrage {largest_node_by_weight}')
 
-        # remove the node and all its neighbors from the component
-        for neighbor in list(g.neighbors(largest_node_by_weight)):
-            g.remove_node(neighbor)
-        g.remove_node(largest_node_by_weight)
+def analyze_block(curr: psycopg2.extensions.cursor, candidates: typing.List[typing.Tuple[int, typing.List[bytes], int, int]], block_number: int):
+    l.debug(f'Have {len(candidates):,} arbitrages in block {block_number}')
 
-    total_weight = sum(selected_arbitrage_weights)
+    selected_arbitrages, total_weight = select_arbitrages(candidates)
 
     psycopg2.extras.execute_batch(
         curr,
@@ -210,4 +353,3 @@ def analyze_block(curr: psycopg2.extensions.cursor, candidates: typing.List[typi
     )
 
     l.debug(f'Selected {len(selected_arbitrages):,} arbitrages in block {block_number} totaling {total_weight / (10 ** 18):.8f} ETH')
-
@@ -28,6 +28,7 @@ from backtest.top_of_block.constants import MIN_PROFIT_PREFILTER
 from find_circuit.find import DEFAULT_FEE_TRANSFER_CALCULATOR, BuiltinFeeTransferCalculator, FeeTransferCalculator, FoundArbitrage, PricingCircuit, detect_arbitrages_bisection
 import pricers
 
+from backtest.progress import WorkerTelemetry
 from backtest.utils import connect_db, erc20
 from eth_account import Account
 from eth_account.signers.local import LocalAccount
@@ -35,10 +36,10 @@ from pricers.balancer import BalancerPricer, TokenNotAvailable
 from pricers.balancer_v2.liquidity_bootstrapping_pool import BalancerV2LiquidityBootstrappingPoolPricer
 from pricers.balancer_v2.weighted_pool import BalancerV2WeightedPoolPricer
 from pricers.base import BaseExchangePricer, NotEnoughLiquidityException
+from pricers.fee_store import FeeStore, get_fee_store
 from pricers.uniswap_v2 import UniswapV2Pricer
 from pricers.uniswap_v3 import UniswapV3Pricer
-from shooter.composer import construct_arbitrage
-from shooter.encoder import serialize
+from shooter.composer import get_arbitrage_template
 
 from utils import BALANCER_VAULT_ADDRESS, DAI_ADDRESS, TETHER_ADDRESS, USDC_ADDRESS, WBTC_ADDRESS, WETH_ADDRESS, connect_web3, decode_trace_calls, get_abi, get_block_timestamp, parse_ganache_call_trace, pretty_print_trace
 from utils.profiling import inc_measurement, maybe_log, profile
@@ -143,13 +144,16 @@ def relay(w3: web3.Web3, args: argparse.Namespace):
 
     fee_calculator = InferredTokenTransferFeeCalculator()
 
+    telemetry = WorkerTelemetry('relay', args.worker_name)
+    telemetry.instrument(w3)
+
     def reconnect_db(_):
         nonlocal db
         nonlocal curr
         nonlocal w3
         db = connect_db()
         curr = db.cursor()
-        w3 = connect_web3()
+        w3 = telemetry.instrument(connect_web3())
 
     @backoff.on_exception(
         backoff.expo,
@@ -159,37 +163,46 @@ def relay(w3: web3.Web3, args: argparse.Namespace):
         on_backoff = reconnect_db,
     )
     def wrapped_do_process_reservation(w3, block_number, fee_calculator, tmpdir, id_):
-        process_reservation(w3, curr, block_number, fee_calculator, tmpdir, id_)
+        return process_reservation(w3, curr, block_number, fee_calculator, tmpdir, id_)
 
-    while True:
-        maybe_rez = get_reservation(curr, args.worker_name)
+    try:
+        while True:
+            maybe_rez = get_reservation(curr, args.worker_name)
 
-        if maybe_rez is None:
-            break
+            if maybe_rez is None:
+                break
         
-        reservation_id, block_number = maybe_rez
-        try:
-            with tempfile.TemporaryDirectory(dir='/mnt/goldphish/tmp') as tmpdir:
-                wrapped_do_process_reservation(w3, block_number, fee_calculator, tmpdir, args.id)
-        except:
-            l.critical(f'Reservation id={reservation_id} failed')
-            raise
+            reservation_id, block_number = maybe_rez
+            try:
+                with tempfile.TemporaryDirectory(dir='/mnt/goldphish/tmp') as tmpdir:
+                    new_fees = wrapped_do_process_reservation(w3, block_number, fee_calculator, tmpdir, args.id)
+            except:
+                l.critical(f'Reservation id={reservation_id} failed')
+                raise
 
-        curr.execute(
-            '''
-            UPDATE candidate_arbitrage_reshoot_blocks
-            SET completed_on = now()::timestamp
-            WHERE id = %s
-            ''',
-            (reservation_id,)
-        )
-        assert curr.rowcount == 1
+            curr.execute(
+                '''
+                UPDATE candidate_arbitrage_reshoot_blocks
+                SET completed_on = now()::timestamp
+                WHERE id = %s
+                ''',
+                (reservation_id,)
+            )
+            assert curr.rowcount == 1
 
-        if not DEBUG:
-            curr.connection.commit()
-        else:
-            l.info('Quitting because DEBUG = True')
-            return
+            if not DEBUG:
+                with telemetry.db_write():
+                    curr.connection.commit()
+                # only now can other workers see the rows the shared fees refer to
+                for tf in new_fees:
+                    fee_calculator.share(tf)
+                telemetry.observe_blocks(1)
+                telemetry.maybe_flush()
+            else:
+                l.info('Quitting because DEBUG = True')
+                return
+    finally:
+        telemetry.flush()
 
 
 def process_reservation(
@@ -199,17 +212,22 @@ def process_reservation(
         fee_calculator: 'InferredTokenTransferFeeCalculator',
         tmpdir: str,
         worker_id: int,
-    ):
+    ) -> typing.List['TokenFee']:
+    """
+    Relay the candidates in the block.
+
+    Returns the fees newly inferred here, for sharing once the transaction commits.
+    """
     fee_calculator.sync(curr, block_number)
 
-    timestamp_to_use = w3.eth.get_block(block_number + 1)['timestamp']
+    timestamp_to_use = get_block_timestamp(w3, block_number + 1)
 
     candidates = get_candidates_in_block(curr, block_number)
 
     l.debug(f'Have {len(candidates):,} arbitrages to test')
 
     if len(candidates) == 0:
-        return
+        return []
 
     # for keeping progress
     t_start = time.time()
@@ -434,9 +452,52 @@ def process_reservation(
         ((id_, False, reason) for id_, reason in results_failure.items()),
     )
 
-    # assign IDs to all the tokens fees we just inferred
+    new_fees = insert_inferred_fees(curr, results_success.values(), block_number)
+
+    for id_, success in results_success.items():
+        l.debug(f'inserting id_={id_}')
+        curr.execute(
+            '''
+            INSERT INTO candidate_arbitrage_relay_results
+            (candidate_arbitrage_id, shoot_success, gas_used, had_fee_on_xfer_token, real_profit_before_fee)
+            VALUES (%(id)s, true, %(gas_used)s, %(had_fee_on_transfer)s, %(profit)s)
+            ''',
+            {
+                'id': id_,
+                'gas_used': success.gas,
+                'had_fee_on_transfer': len(success.token_fees_used) > 0,
+                'profit': success.profit_no_fee,
+            }
+        )
+        assert curr.rowcount == 1
+
+        for tf in success.token_fees_used:
+            assert tf.id_ is not None
+            curr.execute(
+                '''
+                INSERT INTO candidate_arbitrage_relay_results_used_fees (candidate_arbitrage_id, fee_used)
+                VALUES (%s, %s)
+                ''',
+                (id_, tf.id_)
+            )
+            assert curr.rowcount == 1
+
+    return new_fees
+
+
+def insert_inferred_fees(
+        curr: psycopg2.extensions.cursor,
+        results_success: typing.Iterable['AutoAdaptShootSuccess'],
+        block_number: int,
+    ) -> typing.List['TokenFee']:
+    """
+    Insert the fees the successful shots newly inferred, and point the shots at their rows.
+
+    Fees that already have a row (from the database or the shared store) are left alone.
+    Returns the inserted fees.
+    """
     inferred_fee_with_ids: typing.Dict[TokenFee, TokenFee] = {}
-    for success in results_success.values():
+    for success in results_success:
         for i, tf in enumerate(list(success.token_fees_used)):
             # already known
             if tf.id_ is not None:
@@ -445,6 +506,7 @@ def process_reservation(
             # we just set the id
             if tf in inferred_fee_with_ids:
                 success.token_fees_used[i] = inferred_fee_with_ids[tf]
+                continue
 
             curr.execute(
                 '''
@@ -465,39 +527,12 @@ def process_reservation(
             )
             assert curr.rowcount == 1, f'expected rowcount = 1 but got {curr.rowcount} for address = {tf.token}'
             (id_,) = curr.fetchone()
-            with_id = tf._replace(id_ = id_)
+            with_id = tf._replace(id_ = id_, block_number = block_number)
             inferred_fee_with_ids[tf] = with_id
             success.token_fees_used[i] = with_id
 
-    for id_, success in results_success.items():
-        l.debug(f'inserting id_={id_}')
-        curr.execute(
-            '''
-            INSERT INTO candidate_arbitrage_relay_results
-            (candidate_arbitrage_id, shoot_success, gas_used, had_fee_on_xfer_token, real_profit_before_fee)
-            VALUES (%(id)s, true, %(gas_used)s, %(had_fee_on_transfer)s, %(profit)s)
-            ''',
-            {
-                'id': id_,
-                'gas_used': success.gas,
-                'had_fee_on_transfer': len(success.token_fees_used) > 0,
-                'profit': success.profit_no_fee,
-            }
-        )
-        assert curr.rowcount == 1
-
-        for tf in success.token_fees_used:
-            assert tf.id_ is not None
-            curr.execute(
-                '''
-                INSERT INTO candidate_arbitrage_relay_results_used_fees (candidate_arbitrage_id, fee_used)
-                VALUES (%s, %s)
-                ''',
-                (id_, tf.id_)
-            )
-            assert curr.rowcount == 1
+    return list(inferred_fee_with_ids.values())
 
-    return
 
 def splitup_work_top_arbs(curr: psycopg2.extensions.cursor):
     resp = input('Split remaining work into smaller chunks? Type yes to continue: ')
@@ -1161,15 +1196,10 @@ def attempt_relay_candidate(
     ) -> web3.types.TxReceipt:
     if DEBUG:
         l.debug(f'relaying candidate with timestamp={timestamp}')
-    encoded, approvals_required = construct_arbitrage(
-        fa,
-        shooter_address,
-        'latest',
-        fee_transfer_calculator,
-        timestamp = timestamp
-    )
+    template = get_arbitrage_template(fa, shooter_address)
+    arbitrage_payload = template.encode(fa, 'latest', fee_transfer_calculator, timestamp = timestamp)
 
-    for addr, token in approvals_required:
+    for addr, token in template.approvals_required:
         token_extended = bytes.fromhex(token[2:]).rjust(32, b'\x00')
         addr_extended = bytes.fromhex(addr[2:]).rjust(32, b'\x00')
         payload = DO_APPROVE_SELECTOR + token_extended + addr_extended
@@ -1194,10 +1224,8 @@ def attempt_relay_candidate(
     result = w3_ganache.provider.make_request('miner_stop', [])
     assert result['result'] == True
 
-    payload = serialize(encoded)
-
     # selector 0 for arbitrage
-    payload = b'\x00' * 4 + payload
+    payload = b'\x00' * 4 + arbitrage_payload
 
     txn = {
         'from': account.address,
@@ -1825,7 +1853,7 @@ def relay_top_arbs_in_range(
         # some setup
         l.debug(f'Processing block {block_number:,}')
         failed_relays: typing.List[typing.Tuple[int, str]] = []
-        timestamp_to_use = w3.eth.get_block(block_number + 1)['timestamp']
+        timestamp_to_use = get_block_timestamp(w3, block_number + 1)
 
         # construct the query
         # we need to decide whether to include new campaigns as we see existing ones to completion
@@ -2609,10 +2637,15 @@ class InferredTokenTransferFeeCalculator(BuiltinFeeTransferCalculator):
 
     updated: typing.List[TokenFee]
 
+    # shares inferred fees with the other workers as soon as they are found, if configured
+    store: typing.Optional[FeeStore]
+
 
-    def __init__(self) -> None:
+    def __init__(self, store: typing.Optional[FeeStore] = None) -> None:
         super().__init__()
 
+        self.store = store if store is not None else get_fee_store()
+
         self.proposed_mover_to_token_fees = {}
         self.mover_to_token_fees = {}
         self.updated = []
@@ -2778,7 +2811,9 @@ class InferredTokenTransferFeeCalculator(BuiltinFeeTransferCalculator):
 
             k = (t.token, t.from_address, t.to_address)
             existing_val = self.mover_to_token_fees.get(k, None)
-            if existing_val is not None:
+            if existing_val is None:
+                self.mover_to_token_fees[k] = t
+            else:
                 # conflict resolution
                 should_update = abs(suggested_block_number - existing_val.block_number) > abs(suggested_block_number - t.block_number)
                 if should_update:
@@ -2847,11 +2882,34 @@ class InferredTokenTransferFeeCalculator(BuiltinFeeTransferCalculator):
         if  maybe_t is not None:
             return maybe_t
 
+        if self.store is not None:
+            maybe_estimate = self.store.get(token, from_, to_)
+            if maybe_estimate is not None:
+                return TokenFee(
+                    id_          = maybe_estimate.id_,
+                    token        = token,
+                    from_address = from_,
+                    to_address   = to_,
+                    fee          = maybe_estimate.fee,
+                    round_down   = maybe_estimate.round_down,
+                    block_number = maybe_estimate.block_number,
+                    updated_on   = maybe_estimate.updated_on,
+                )
+
         return None
 
+    def share(self, t: TokenFee):
+        """
+        Publish a fee that was just inferred, and committed, to the other workers
+        """
+        assert t.id_ is not None
+        if self.store is not None:
+            self.store.record(t.id_, t.token, t.from_address, t.to_address, t.fee, t.round_down, t.block_number)
+
     def has_fee(self, token: str) -> bool:
         """
         Returns True if this token has fees, either committed or proposed
         """
-        return token in self.tokens_with_fee or token in self.proposed_tokens_with_fee
+        return token in self.tokens_with_fee or token in self.proposed_tokens_with_fee or \
+            (self.store is not None and self.store.has_fee(token))
 
@@ -1,5 +1,4 @@
 import argparse
-import collections
 import signal
 import itertools
 import logging
@@ -11,19 +10,20 @@ import backoff
 import numpy as np
 import web3
 import web3.types
-import web3._utils.filters
 import psycopg2
 import psycopg2.extensions
 import tempfile
 
 from backtest.top_of_block.common import load_pool
 from backtest.top_of_block.constants import MIN_PROFIT_PREFILTER
+from backtest.progress import WorkerTelemetry
 from backtest.utils import connect_db
 import pricers
 import find_circuit
 import find_circuit.monitor
 from pricers.pricer_pool import PricerPool
-from utils import get_block_timestamp
+from utils import get_block_timestamp, get_header_cache
+from utils.log_fetcher import LogFetcher, iter_blocks
 import utils.profiling
 
 
@@ -82,112 +82,128 @@ def seek_candidates(w3: web3.Web3, args: argparse.Namespace):
 
     signal.signal(signal.SIGHUP, set_cancel_requested)
 
-    batch_size_blocks = 100 # batch size for getting logs
-    with tempfile.TemporaryDirectory(dir=storage_dir) as tmpdir:
-        while not cancel_requested:
-            l.debug(f'getting new reservation')
-            maybe_rez = get_reservation(curr, args.worker_name)
-            if maybe_rez is None:
-                # we're at the end
-                break
-
-            reservation_id, reservation_start, reservation_end = maybe_rez
-
-            # occasionaly database will disconnect while loading the pool
-            # (dunno why) -- if that happens, just back off a bit, reconnect,
-            # and try again
-            def reconnect_db(_):
-                nonlocal db
-                nonlocal curr
-                db = connect_db()
-                curr = db.cursor()
-
-            @backoff.on_exception(
-                backoff.expo,
-                psycopg2.OperationalError,
-                max_time = 10 * 60,
-                factor = 4,
-                on_backoff = reconnect_db,
-            )
-            def get_pricer_with_retry() -> PricerPool:
-                return load_pool(w3, curr, tmpdir)
+    telemetry = WorkerTelemetry('seek_candidates', args.worker_name)
+    telemetry.instrument(w3)
+
+    # sizes log requests to the log density, learned over the whole run
+    log_fetcher: typing.Optional[LogFetcher] = None
+    try:
+        with tempfile.TemporaryDirectory(dir=storage_dir) as tmpdir:
+            while not cancel_requested:
+                l.debug(f'getting new reservation')
+                maybe_rez = get_reservation(curr, args.worker_name)
+                if maybe_rez is None:
+                    # we're at the end
+                    break
 
-            pricer = get_pricer_with_retry()
-            pricer.warm(reservation_start)
+                reservation_id, reservation_start, reservation_end = maybe_rez
+
+                # occasionaly database will disconnect while loading the pool
+                # (dunno why) -- if that happens, just back off a bit, reconnect,
+                # and try again
+                def reconnect_db(_):
+                    nonlocal db
+                    nonlocal curr
+                    db = connect_db()
+                    curr = db.cursor()
+
+                @backoff.on_exception(
+                    backoff.expo,
+                    psycopg2.OperationalError,
+                    max_time = 10 * 60,
+                    factor = 4,
+                    on_backoff = reconnect_db,
+                )
+                def get_pricer_with_retry() -> PricerPool:
+                    return load_pool(w3, curr, tmpdir)
 
-            curr_block = reservation_start
-            while curr_block <= reservation_end:
-                this_end_block = min(curr_block + batch_size_blocks - 1, reservation_end)
-                for block_number, logs in get_relevant_logs(w3, pricer, curr_block, this_end_block):
+                pricer = get_pricer_with_retry()
+                pricer.warm(reservation_start)
 
-                    if cancel_requested:
-                        l.debug('shutting down main loop')
-                        break
+                if log_fetcher is None:
+                    log_fetcher = LogFetcher(w3, pricer.relevant_log_topics())
+
+                curr_block = reservation_start
+                while curr_block <= reservation_end:
+                    # one eth_getLogs request's worth of blocks
+                    this_end_block = min(curr_block + log_fetcher.next_range() - 1, reservation_end)
+                    # process_candidates() needs the timestamp of the block after each one in the batch
+                    get_header_cache(w3).prefetch(curr_block + 1, this_end_block + 2)
+                    for block_number, logs in get_relevant_logs(w3, pricer, curr_block, this_end_block, log_fetcher):
 
-                    update = pricer.observe_block(block_number, logs)
-                    utils.profiling.maybe_log()
-                    while True:
-                        try:
-                            process_candidates(w3, pricer, block_number, update, curr)
-                            if not DEBUG:
-                                with utils.profiling.profile('db.update'):
-                                    curr.execute(
-                                        'UPDATE candidate_arbitrage_reservations SET progress = %s, updated_on = now()::timestamp where id=%s',
-                                        (block_number, reservation_id),
-                                    )
-                                with utils.profiling.profile('db.commit'):
-                                    db.commit()
+                        if cancel_requested:
+                            l.debug('shutting down main loop')
                             break
-                        except Exception as e:
-                            db.rollback()
-                            if 'execution aborted (timeout = 5s)' in str(e):
-                                l.exception('Encountered timeout, trying again in a little bit')
-                                time.sleep(30)
-                            else:
-                                raise e
-
-                if cancel_requested:
-                    break
 
-                curr_block = this_end_block + 1
+                        update = pricer.observe_block(block_number, logs)
+                        utils.profiling.maybe_log()
+                        while True:
+                            try:
+                                process_candidates(w3, pricer, block_number, update, curr)
+                                if not DEBUG:
+                                    with utils.profiling.profile('db.update'):
+                                        curr.execute(
+                                            'UPDATE candidate_arbitrage_reservations SET progress = %s, updated_on = now()::timestamp where id=%s',
+                                            (block_number, reservation_id),
+                                        )
+                                    with utils.profiling.profile('db.commit'), telemetry.db_write():
+                                        db.commit()
+                                break
+                            except Exception as e:
+                                db.rollback()
+                                if 'execution aborted (timeout = 5s)' in str(e):
+                                    l.exception('Encountered timeout, trying again in a little bit')
+                                    time.sleep(30)
+                                else:
+                                    raise e
+
+                        telemetry.observe_blocks(1)
+                        telemetry.maybe_flush()
 
-            # mark reservation as completed
-            if not DEBUG:
-                if not cancel_requested:
-                    assert this_end_block == reservation_end
-                    l.debug(f'Completed reservation id={reservation_id:,}')
-                    curr.execute(
-                        'UPDATE candidate_arbitrage_reservations SET completed_on = NOW()::timestamp WHERE id = %s',
-                        (reservation_id,)
-                    )
-                    db.commit()
-                else:
-                    # cancellation was requested
-                    curr.execute(
-                        '''
-                        UPDATE candidate_arbitrage_reservations SET block_number_end = progress, completed_on = NOW()::timestamp WHERE id = %s
-                        RETURNING progress
-                        ''',
-                        (reservation_id,),
-                    )
-                    assert curr.rowcount == 1
-                    (end_inclusive,) = curr.fetchone()
+                    if cancel_requested:
+                        break
 
-                    if end_inclusive < reservation_end:
-                        l.info('Splitting off unifinished reservation into new one')
+                    curr_block = this_end_block + 1
+
+                # mark reservation as completed
+                if not DEBUG:
+                    if not cancel_requested:
+                        assert this_end_block == reservation_end
+                        l.debug(f'Completed reservation id={reservation_id:,}')
+                        curr.execute(
+                            'UPDATE candidate_arbitrage_reservations SET completed_on = NOW()::timestamp WHERE id = %s',
+                            (reservation_id,)
+                        )
+                        db.commit()
+                    else:
+                        # cancellation was requested
                         curr.execute(
                             '''
-                            INSERT INTO candidate_arbitrage_reservations (block_number_start, block_number_end, priority)
-                            SELECT %s, %s, priority
-                            FROM candidate_arbitrage_reservations WHERE id = %s
-                            RETURNING id
+                            UPDATE candidate_arbitrage_reservations SET block_number_end = progress, completed_on = NOW()::timestamp WHERE id = %s
+                            RETURNING progress
                             ''',
-                            (end_inclusive + 1, reservation_end, reservation_id,)
+                            (reservation_id,),
                         )
                         assert curr.rowcount == 1
-                        (new_id,) = curr.fetchone()
-                        l.debug(f'Created new reservation id={new_id:,} {end_inclusive + 1:,} -> {reservation_end:,}')
-                    db.commit()
+                        (end_inclusive,) = curr.fetchone()
+
+                        if end_inclusive < reservation_end:
+                            l.info('Splitting off unifinished reservation into new one')
+                            curr.execute(
+                                '''
+                                INSERT INTO candidate_arbitrage_reservations (block_number_start, block_number_end, priority)
+                                SELECT %s, %s, priority
+                                FROM candidate_arbitrage_reservations WHERE id = %s
+                                RETURNING id
+                                ''',
+                                (end_inclusive + 1, reservation_end, reservation_id,)
+                            )
+                            assert curr.rowcount == 1
+                            (new_id,) = curr.fetchone()
+                            l.debug(f'Created new reservation id={new_id:,} {end_inclusive + 1:,} -> {reservation_end:,}')
+                        db.commit()
+    finally:
+        telemetry.flush()
 
 
 def setup_db(curr: psycopg2.extensions.cursor):
@@ -602,39 +618,28 @@ def get_relevant_logs(
         w3: web3.Web3,
         pool: PricerPool,
         batch_start_block: int,
-        batch_end_block: int
+        batch_end_block: int,
+        fetcher: typing.Optional[LogFetcher] = None,
     ) -> typing.Iterator[typing.Tuple[int, typing.List[web3.types.LogReceipt]]]:
     """
     Get logs relevant to the given pricer pool's pricers.
+
+    Pass a long-lived fetcher to keep its learned request size between calls.
     """
 
     assert batch_start_block <= batch_end_block
 
-    l.debug(f'start get logs from {batch_start_block:,} to {batch_end_block:,}')
-
-    with utils.profiling.profile('get_logs'):
+    if fetcher is None:
+        fetcher = LogFetcher(w3, pool.relevant_log_topics(), initial_range = batch_end_block - batch_start_block + 1)
 
-        # NOTE: turns out geth's log filtering is slower than
-        # just returning all logs and filtering in python; this
-        # is why we use the latter strategy
-        f: web3._utils.filters.Filter = w3.eth.filter({
-            'fromBlock': batch_start_block,
-            'toBlock': batch_end_block,
-        })
-
-        logs = f.get_all_entries()
-
-        l.debug(f'got {len(logs):,} logs this batch')
+    l.debug(f'start get logs from {batch_start_block:,} to {batch_end_block:,}')
 
-    important_addresses = pool.monitored_addresses()
-    logs = list(x for x in logs if x['address'] in important_addresses)
+    # the node filters by topic; filtering by address is faster in python
+    buckets = fetcher.fetch(batch_start_block, batch_end_block, pool.monitored_addresses())
 
-    gather = collections.defaultdict(lambda: [])
-    for log in logs:
-        gather[log['blockNumber']].append(log)
+    l.debug(f'got logs in {len(buckets):,} blocks this batch')
 
-    for i in range(batch_start_block, batch_end_block + 1):
-        yield (i, gather[i])
+    yield from iter_blocks(buckets, batch_start_block, batch_end_block)
 
 
 def process_candidates(
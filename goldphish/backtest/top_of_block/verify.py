@@ -11,6 +11,7 @@ import typing
 import web3
 from backtest.top_of_block.common import TraceMode, WrappedFoundArbitrage, load_exchanges, shoot
 
+from backtest import notifications
 from backtest.utils import CancellationToken, parse_logs_for_net_profit, connect_db
 import find_circuit
 import pricers
@@ -169,21 +170,35 @@ def get_next_block(curr: psycopg2.extensions.cursor) -> typing.Optional[int]:
     return block_number
 
 
+# when idle, re-check for work this often (without the candidate block trigger)
+NO_WORK_RECHECK_SECONDS = 30
+# ... or at least this often when new blocks are notified
+NOTIFIED_NO_WORK_RECHECK_SECONDS = 10 * 60
+
+
 def get_candidate_arbitrages(w3: web3.Web3, curr: psycopg2.extensions.cursor) -> typing.Iterator[typing.Tuple[int, typing.List[WrappedFoundArbitrage]]]:
     """
-    Continuously polls for candidate arbitrages in a sleep-loop.
+    Continuously gets candidate arbitrages, blocking on a notification when there is nothing to do.
     """
     uniswap_v2_exchanges, uniswap_v3_exchanges = load_exchanges()
 
+    # listen before looking for work, so a block queued in between is not missed
+    listener = notifications.Listener([notifications.CANDIDATE_BLOCKS_CHANNEL])
+    if notifications.has_trigger(curr, 'candidate_arbitrage_blocks_to_verify', notifications.CANDIDATE_BLOCK_TRIGGER):
+        recheck_seconds = NOTIFIED_NO_WORK_RECHECK_SECONDS
+    else:
+        l.debug('candidate block trigger is not installed, polling for work')
+        recheck_seconds = NO_WORK_RECHECK_SECONDS
+
     while True:
         start = time.time()
         l.debug(f'getting more work to do')
         block_number = get_next_block(curr)
 
         if block_number is None:
-            l.debug('Nothing to do, sleeping for a bit...')
+            l.debug('Nothing to do, waiting for new candidate blocks...')
             curr.connection.commit() # release transaction
-            time.sleep(30)
+            listener.wait(timeout=recheck_seconds)
             continue
 
         l.debug(f'took {time.time() - start:.3f} seconds to get new candidate block to analyze')
@@ -15,7 +15,8 @@ from eth_account.signers.local import LocalAccount
 
 l = logging.getLogger(__name__)
 
-from utils import erc20
+from utils import erc20, profiling
+from backtest import notifications
 
 ERC20_TRANSFER_TOPIC = event_abi_to_log_topic(erc20.events.Transfer().abi)
 ERC20_TRANSFER_TOPIC_HEX = '0x' + ERC20_TRANSFER_TOPIC.hex()
@@ -58,6 +59,16 @@ def connect_rabbit() -> pika.BlockingConnection:
 
     return cxn
 
+class _CountingCursor(psycopg2.extensions.cursor):
+    """
+    Counts statements for utils.profiling.
+    """
+
+    def execute(self, query, vars=None):
+        profiling.inc_counter(profiling.DB_STATEMENTS)
+        return super().execute(query, vars)
+
+
 def connect_db() -> psycopg2.extensions.connection:
     pg_host = os.getenv('PSQL_HOST', 'ethereum-measurement-pg')
     pg_port = int(os.getenv('PSQL_PORT', '5432'))
@@ -70,6 +81,7 @@ def connect_db() -> psycopg2.extensions.connection:
         user = pg_user,
         password = pg_pass,
         database = pg_db,
+        cursor_factory = _CountingCursor,
     )
     db.autocommit = False
     l.debug(f'connected to postgresql')
@@ -184,6 +196,9 @@ class CancellationToken:
     Utility class for reporting cancellations.
     """
     HEARTBEAT_PERIOD_SECONDS = 60
+    # when the job_cancel trigger is installed cancellations arrive by notification,
+    # so the periodic query is only a heartbeat
+    NOTIFIED_HEARTBEAT_PERIOD_SECONDS = 5 * 60
 
     def __init__(self, jobname: str, workername: str, conn: psycopg2.extensions.connection) -> None:
         self.jobname = jobname
@@ -211,6 +226,15 @@ class CancellationToken:
         l.info(f'Assigned job_control id={self._id}')
         self.conn.commit()
 
+        # get woken up immediately on cancellation, rather than at the next heartbeat
+        self.listener = notifications.Listener([notifications.JOB_CANCEL_CHANNEL], conn=self.conn)
+        if notifications.has_trigger(self.curr, 'job_control', notifications.JOB_CANCEL_TRIGGER):
+            self.heartbeat_period = CancellationToken.NOTIFIED_HEARTBEAT_PERIOD_SECONDS
+        else:
+            l.debug('job cancel trigger is not installed, polling for cancellation')
+            self.heartbeat_period = CancellationToken.HEARTBEAT_PERIOD_SECONDS
+        self.conn.commit()
+
     def heartbeat(self):
         self.curr.execute(
             '''
@@ -221,7 +245,13 @@ class CancellationToken:
         self.conn.commit()
 
     def cancel_requested(self) -> bool:
-        if self.cancel_requested_cache is None or self.last_heartbeat + CancellationToken.HEARTBEAT_PERIOD_SECONDS < time.time():
+        if not self.cancel_requested_cache:
+            for notify in self.listener.poll():
+                if notify.payload == str(self._id):
+                    l.info(f'Received requested cancellation!')
+                    self.cancel_requested_cache = True
+
+        if self.cancel_requested_cache is None or self.last_heartbeat + self.heartbeat_period < time.time():
             # query for cancellation
             self.curr.execute(
                 '''
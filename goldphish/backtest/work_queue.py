@@ -0,0 +1,455 @@
+"""
+backtest/work_queue.py
+
+A generic, shared queue of block ranges for reservation jobs, so that a job only
+supplies the function that processes a range (see `run_worker`).
+
+All jobs share one table, `work_queue_ranges`, keyed by job name. Compared to the
+hand-written per-job reservation tables:
+
+    - workers claim several ranges per transaction (FOR UPDATE SKIP LOCKED), so
+      claiming does not serialize many workers on one row at a time
+
+    - a claim is a lease, renewed by the worker's heartbeat as it reports progress
+      and, in `run_worker`, from a background thread while a chunk is processed;
+      a range whose owner stops heartbeating (crashed, partitioned) is claimed again
+      by someone else after `lease_seconds`, resuming from the reported progress
+
+    - when nothing is left to claim, an idle worker splits the range with the most
+      unreserved work remaining and takes its second half, so the tail of a run is
+      not left waiting on a few slow ranges
+
+An owner works through its range in chunks. Before each chunk it reserves the
+blocks it is about to process (`reserved_until`), and a split never takes reserved
+blocks, so no block is handed to two live workers. The owner notices that its range
+was shortened the next time it asks for a chunk.
+
+Progress is committed separately from the job's own output, so a chunk may be
+processed again after a crash; processing functions must be idempotent.
+"""
+
+import functools
+import logging
+import random
+import threading
+import time
+import typing
+import psycopg2.extensions
+
+l = logging.getLogger(__name__)
+
+DEFAULT_RANGE_BLOCKS = 1_000
+DEFAULT_CHUNK_BLOCKS = 100
+DEFAULT_CLAIM_BATCH = 4
+
+# a lease not renewed for this long may be claimed by another worker
+DEFAULT_LEASE_SECONDS = 15 * 60
+
+# run_worker renews held leases this many times per lease period
+HEARTBEATS_PER_LEASE = 3
+
+# a range is only split if each half would have at least this many unreserved blocks
+DEFAULT_MIN_SPLIT_BLOCKS = 10
+
+
+def setup_db(curr: psycopg2.extensions.cursor):
+    curr.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS work_queue_ranges (
+            id                  BIGSERIAL PRIMARY KEY NOT NULL,
+            job_name            TEXT NOT NULL,
+            start_block         INTEGER NOT NULL,
+            end_block_exclusive INTEGER NOT NULL,
+            progress            INTEGER NOT NULL, -- blocks before this are done
+            reserved_until      INTEGER NOT NULL, -- the owner may be processing blocks before this
+            worker_name         TEXT,
+            lease_generation    INTEGER NOT NULL DEFAULT 0,
+            claimed_on          TIMESTAMP WITHOUT TIME ZONE,
+            heartbeat_on        TIMESTAMP WITHOUT TIME ZONE,
+            finished_on         TIMESTAMP WITHOUT TIME ZONE,
+            CHECK (start_block <= progress AND progress <= reserved_until AND reserved_until <= end_block_exclusive)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_work_queue_ranges_unfinished ON work_queue_ranges (job_name, id) WHERE finished_on IS NULL;
+        '''
+    )
+
+
+def plan_ranges(start_block: int, end_block_exclusive: int, range_blocks: int) -> typing.List[typing.Tuple[int, int]]:
+    """
+    Break [start_block, end_block_exclusive) into ranges of at most range_blocks
+    """
+    assert range_blocks > 0
+    return [
+        (this_start, min(end_block_exclusive, this_start + range_blocks))
+        for this_start in range(start_block, end_block_exclusive, range_blocks)
+    ]
+
+
+def fill(
+        curr: psycopg2.extensions.cursor,
+        job_name: str,
+        start_block: int,
+        end_block_exclusive: int,
+        range_blocks: int = DEFAULT_RANGE_BLOCKS,
+        shuffle: bool = True,
+    ) -> int:
+    """
+    Queue [start_block, end_block_exclusive) for the job, extending the job's queue
+    back or forward in history if it already has one. Does not commit.
+
+    Returns the number of ranges inserted.
+    """
+    curr.execute('LOCK TABLE work_queue_ranges IN SHARE ROW EXCLUSIVE MODE')
+    curr.execute(
+        'SELECT MIN(start_block), MAX(end_block_exclusive) FROM work_queue_ranges WHERE job_name = %s',
+        (job_name,),
+    )
+    queued_start, queued_end_exclusive = curr.fetchone()
+
+    if queued_start is None:
+        ranges = plan_ranges(start_block, end_block_exclusive, range_blocks)
+    else:
+        ranges = plan_ranges(start_block, min(queued_start, end_block_exclusive), range_blocks) + \
+            plan_ranges(max(queued_end_exclusive, start_block), end_block_exclusive, range_blocks)
+
+    if shuffle:
+        # neighboring blocks have similar density, so mix them to even out claims
+        random.shuffle(ranges)
+
+    for this_start, this_end_exclusive in ranges:
+        curr.execute(
+            '''
+            INSERT INTO work_queue_ranges (job_name, start_block, end_block_exclusive, progress, reserved_until)
+            VALUES (%s, %s, %s, %s, %s)
+            ''',
+            (job_name, this_start, this_end_exclusive, this_start, this_start),
+        )
+    l.debug(f'queued {len(ranges):,} ranges for {job_name}')
+    return len(ranges)
+
+
+class LeaseLost(Exception):
+    """
+    The lease expired and the range was claimed by another worker
+    """
+    pass
+
+
+class Lease:
+    id: int
+    generation: int
+    progress: int
+    end_block_exclusive: int
+
+    def __init__(self, id_: int, generation: int, progress: int, end_block_exclusive: int) -> None:
+        self.id = id_
+        self.generation = generation
+        self.progress = progress
+        self.end_block_exclusive = end_block_exclusive
+
+    def __repr__(self) -> str:
+        return f'<Lease id={self.id} progress={self.progress:,} end={self.end_block_exclusive:,}>'
+
+
+def _locked(f):
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return f(self, *args, **kwargs)
+    return wrapper
+
+
+class WorkQueue:
+    """
+    One worker's view of a job's queue.
+
+    Uses a dedicated connection and commits every change to the queue immediately,
+    so it never interferes with the worker's own transactions. Safe to heartbeat()
+    from another thread.
+    """
+    job_name: str
+    worker_name: str
+    lease_seconds: float
+    claim_batch: int
+    min_split_blocks: int
+
+    # claimed but not yet started, renewed with every heartbeat
+    _pending: typing.List[Lease]
+
+    # being worked on, renewed with every heartbeat
+    _current: typing.Optional[Lease]
+
+    def __init__(
+            self,
+            conn: psycopg2.extensions.connection,
+            job_name: str,
+            worker_name: str,
+            lease_seconds: float = DEFAULT_LEASE_SECONDS,
+            claim_batch: int = DEFAULT_CLAIM_BATCH,
+            min_split_blocks: int = DEFAULT_MIN_SPLIT_BLOCKS,
+        ) -> None:
+        assert claim_batch > 0
+        self.conn = conn
+        self.curr = conn.cursor()
+        self.job_name = job_name
+        self.worker_name = worker_name
+        self.lease_seconds = lease_seconds
+        self.claim_batch = claim_batch
+        self.min_split_blocks = min_split_blocks
+        self._pending = []
+        self._current = None
+        # one transaction on the connection at a time
+        self._lock = threading.RLock()
+
+    @_locked
+    def next_lease(self) -> typing.Optional[Lease]:
+        """
+        The next range to work on, claiming a batch or splitting a straggler when none are held.
+
+        Returns None when the job has no work left to hand out.
+        """
+        if len(self._pending) == 0:
+            self._pending = self.claim(self.claim_batch)
+        if len(self._pending) > 0:
+            return self._pending.pop(0)
+        return self.steal()
+
+    @_locked
+    def claim(self, n: int) -> typing.List[Lease]:
+        """
+        Claim up to n unclaimed (or expired) ranges in one transaction
+        """
+        self.curr.execute(
+            '''
+            UPDATE work_queue_ranges wq
+            SET worker_name = %(worker_name)s,
+                lease_generation = wq.lease_generation + 1,
+                reserved_until = wq.progress,
+                claimed_on = now()::timestamp,
+                heartbeat_on = now()::timestamp
+            FROM (
+                SELECT id
+                FROM work_queue_ranges
+                WHERE job_name = %(job_name)s AND finished_on IS NULL AND
+                    (worker_name IS NULL OR heartbeat_on < now()::timestamp - %(lease_seconds)s * interval '1 second')
+                ORDER BY id
+                LIMIT %(n)s
+                FOR UPDATE SKIP LOCKED
+            ) claimable
+            WHERE wq.id = claimable.id
+            RETURNING wq.id, wq.lease_generation, wq.progress, wq.end_block_exclusive
+            ''',
+            {'worker_name': self.worker_name, 'job_name': self.job_name, 'lease_seconds': self.lease_seconds, 'n': n},
+        )
+        ret = sorted((Lease(*row) for row in self.curr), key=lambda x: x.id)
+        self.conn.commit()
+        if len(ret) > 0:
+            l.debug(f'claimed {len(ret)} ranges: {ret}')
+        return ret
+
+    @_locked
+    def steal(self) -> typing.Optional[Lease]:
+        """
+        Split the live range with the most unreserved work and claim its second half.
+
+        Returns None if no range is worth splitting.
+        """
+        self.curr.execute(
+            '''
+            SELECT id, reserved_until, end_block_exclusive
+            FROM work_queue_ranges
+            WHERE job_name = %(job_name)s AND finished_on IS NULL AND worker_name IS NOT NULL AND
+                end_block_exclusive - reserved_until >= 2 * %(min_split_blocks)s
+            ORDER BY end_block_exclusive - reserved_until DESC
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+            ''',
+            {'job_name': self.job_name, 'min_split_blocks': self.min_split_blocks},
+        )
+        if self.curr.rowcount < 1:
+            self.conn.commit()
+            return None
+
+        victim_id, reserved_until, end_block_exclusive = self.curr.fetchone()
+        mid = reserved_until + (end_block_exclusive - reserved_until) // 2
+
+        self.curr.execute(
+            'UPDATE work_queue_ranges SET end_block_exclusive = %s WHERE id = %s',
+            (mid, victim_id),
+        )
+        assert self.curr.rowcount == 1
+        self.curr.execute(
+            '''
+            INSERT INTO work_queue_ranges (
+                job_name, start_block, end_block_exclusive, progress, reserved_until,
+                worker_name, lease_generation, claimed_on, heartbeat_on
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, 1, now()::timestamp, now()::timestamp)
+            RETURNING id
+            ''',
+            (self.job_name, mid, end_block_exclusive, mid, mid, self.worker_name),
+        )
+        (new_id,) = self.curr.fetchone()
+        self.conn.commit()
+        l.debug(f'split range id={victim_id} at {mid:,}, took {mid:,} to {end_block_exclusive:,} as id={new_id}')
+        return Lease(new_id, 1, mid, end_block_exclusive)
+
+    @_locked
+    def advance(self, lease: Lease, done_until: int, max_blocks: int) -> typing.Optional[typing.Tuple[int, int]]:
+        """
+        Record that the lease's blocks before done_until are done, renew the held leases, and
+        reserve the next chunk of at most max_blocks.
+
+        Returns the chunk as (start_block, end_block_exclusive), or None if the range is finished.
+        Raises LeaseLost if the lease expired and was claimed by another worker.
+        """
+        assert max_blocks > 0
+        self.curr.execute(
+            '''
+            UPDATE work_queue_ranges
+            SET progress = %(done_until)s,
+                reserved_until = LEAST(end_block_exclusive, %(done_until)s + %(max_blocks)s),
+                heartbeat_on = now()::timestamp,
+                finished_on = CASE WHEN %(done_until)s >= end_block_exclusive THEN now()::timestamp ELSE NULL END
+            WHERE id = %(id)s AND lease_generation = %(generation)s
+            RETURNING reserved_until, end_block_exclusive
+            ''',
+            {'done_until': done_until, 'max_blocks': max_blocks, 'id': lease.id, 'generation': lease.generation},
+        )
+        if self.curr.rowcount < 1:
+            self.conn.rollback()
+            self._current = None
+            raise LeaseLost(f'lost lease on range id={lease.id}')
+        reserved_until, end_block_exclusive = self.curr.fetchone()
+
+        if len(self._pending) > 0:
+            self.curr.execute(
+                'UPDATE work_queue_ranges SET heartbeat_on = now()::timestamp WHERE id = ANY(%s) AND worker_name = %s',
+                ([x.id for x in self._pending], self.worker_name),
+            )
+        self.conn.commit()
+
+        lease.progress = done_until
+        lease.end_block_exclusive = end_block_exclusive
+        if done_until >= end_block_exclusive:
+            self._current = None
+            return None
+        self._current = lease
+        return (done_until, reserved_until)
+
+    @_locked
+    def heartbeat(self):
+        """
+        Renew every lease held, without reporting progress
+        """
+        held = list(self._pending)
+        if self._current is not None:
+            held.append(self._current)
+        if len(held) == 0:
+            return
+        for x in held:
+            self.curr.execute(
+                'UPDATE work_queue_ranges SET heartbeat_on = now()::timestamp WHERE id = %s AND lease_generation = %s AND finished_on IS NULL',
+                (x.id, x.generation),
+            )
+        self.conn.commit()
+
+    @_locked
+    def release(self, lease: typing.Optional[Lease] = None):
+        """
+        Give back the lease (if any) and every pending lease, so others may claim them right away
+        """
+        to_release = list(self._pending)
+        if lease is not None:
+            to_release.append(lease)
+        for x in to_release:
+            self.curr.execute(
+                '''
+                UPDATE work_queue_ranges
+                SET worker_name = NULL, reserved_until = progress
+                WHERE id = %s AND lease_generation = %s AND finished_on IS NULL
+                ''',
+                (x.id, x.generation),
+            )
+        self.conn.commit()
+        self._pending = []
+        self._current = None
+
+
+def run_worker(
+        queue: WorkQueue,
+        process_range: typing.Callable[[int, int], None],
+        chunk_blocks: int = DEFAULT_CHUNK_BLOCKS,
+        cancellation_token = None,
+        telemetry = None,
+    ) -> int:
+    """
+    Work through the job's queue until it is empty (or cancellation is requested),
+    calling process_range(start_block, end_block_exclusive) on each chunk. The
+    function must commit its own output before returning, and be idempotent.
+
+    Held leases are renewed from a background thread while chunks are processed,
+    so a slow chunk does not lose its lease.
+
+    Progress is reported to the telemetry (a progress.WorkerTelemetry), if given.
+
+    Returns the number of blocks processed.
+    """
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(queue.lease_seconds / HEARTBEATS_PER_LEASE):
+            try:
+                queue.heartbeat()
+            except Exception:
+                l.exception('could not renew leases')
+
+    heartbeater = threading.Thread(target=heartbeat, name='work-queue-heartbeat', daemon=True)
+    heartbeater.start()
+    try:
+        return _run_worker(queue, process_range, chunk_blocks, cancellation_token, telemetry)
+    finally:
+        stop.set()
+        heartbeater.join()
+        if telemetry is not None:
+            telemetry.flush()
+
+
+def _run_worker(
+        queue: WorkQueue,
+        process_range: typing.Callable[[int, int], None],
+        chunk_blocks: int,
+        cancellation_token,
+        telemetry,
+    ) -> int:
+    n_processed = 0
+    while True:
+        lease = queue.next_lease()
+        if lease is None:
+            l.info('work done')
+            return n_processed
+
+        l.debug(f'working on {lease}')
+        t_start = time.time()
+        try:
+            chunk = queue.advance(lease, lease.progress, chunk_blocks)
+            while chunk is not None:
+                if cancellation_token is not None and cancellation_token.cancel_requested():
+                    queue.release(lease)
+                    return n_processed
+
+                chunk_start, chunk_end_exclusive = chunk
+                process_range(chunk_start, chunk_end_exclusive)
+
+                n_processed += chunk_end_exclusive - chunk_start
+                if telemetry is not None:
+                    telemetry.observe_blocks(chunk_end_exclusive - chunk_start)
+                    telemetry.maybe_flush()
+                chunk = queue.advance(lease, chunk_end_exclusive, chunk_blocks)
+        except LeaseLost:
+            # someone else resumes it from the last progress we reported
+            l.warning(f'lost lease on range id={lease.id}, moving on')
+            continue
+
+        l.debug(f'finished range id={lease.id} in {time.time() - t_start:.1f} seconds')
@@ -0,0 +1,275 @@
+"""
+Offline detection-throughput benchmarks.
+
+Replays the bundled block fixture (receipts and transfers of block 17518743) through
+the arbitrage-detection stages, and runs detect_arbitrages_bisection over synthetic
+Uniswap v2/v3 circuits whose storage is served from memory. Nothing talks to a node
+or to postgres, so runs on the same machine are comparable.
+
+Each stage reports the time to get through the whole block, the distribution of
+per-transaction (per-circuit, for bisection) times, and how many JSON-RPC requests
+one pass made. Save a baseline with --save-baseline; later runs compare each stage's
+median block time against it and exit non-zero when one is slower by more than
+--threshold.
+
+    python3 -m benchmarks --save-baseline
+    ... change something ...
+    python3 -m benchmarks
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import typing
+
+from backtest.gather_samples.analyses import get_addr_to_movements, get_arbitrage_if_exists
+from benchmarks.fixtures import BLOCK_NUMBER, REPO_ROOT, BlockFixture, load_block_fixture, synthetic_circuits
+from find_circuit.find import PricingCircuit, detect_arbitrages_bisection
+from utils import profiling
+
+l = logging.getLogger(__name__)
+
+DEFAULT_BASELINE_PATH = os.path.join('.benchmarks', 'baseline.json')
+
+# a stage regresses when its median block time grows by more than this fraction of the baseline
+DEFAULT_THRESHOLD = 0.25
+
+
+class Stage(typing.NamedTuple):
+    name: str
+    unit: str
+    prepare: typing.Callable[[BlockFixture], typing.List[typing.Callable[[], typing.Any]]]
+    """Called, untimed, before every round; returns one callable per unit of work"""
+
+
+class StageResult(typing.NamedTuple):
+    name: str
+    unit: str
+    n_units: int
+    block_seconds: typing.List[float]
+    """Time to get through every unit, one entry per round"""
+
+    unit_seconds: typing.List[float]
+    """Time of each unit, over all rounds"""
+
+    rpc_calls: int = 0
+    """JSON-RPC requests made in one pass over the block"""
+
+    @property
+    def block_median(self) -> float:
+        return _percentile(self.block_seconds, 50)
+
+    @property
+    def unit_p50(self) -> float:
+        return _percentile(self.unit_seconds, 50)
+
+    @property
+    def unit_p99(self) -> float:
+        return _percentile(self.unit_seconds, 99)
+
+
+class Regression(typing.NamedTuple):
+    stage: str
+    baseline_seconds: float
+    seconds: float
+
+    @property
+    def ratio(self) -> float:
+        return self.seconds / self.baseline_seconds
+
+
+def _percentile(values: typing.List[float], pct: float) -> float:
+    assert len(values) > 0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _prepare_addr_to_movements(fixture: BlockFixture):
+    return [functools.partial(get_addr_to_movements, txns) for txns in fixture.transfers.values()]
+
+
+def _prepare_get_arbitrage_if_exists(fixture: BlockFixture):
+    # gather_samples only investigates transactions with at least 3 transfers
+    return [
+        functools.partial(get_arbitrage_if_exists, fixture.w3, tx_hash, txns)
+        for tx_hash, txns in fixture.transfers.items()
+        if len(txns) >= 3
+    ]
+
+
+def _prepare_src_arbitrage_analysis(fixture: BlockFixture):
+    analysis = _load_src_arbitrage_analysis()()
+    return [
+        functools.partial(analysis.analyze_transaction, receipt, fixture.raw_transfers.get(receipt['transactionHash'], []))
+        for receipt in fixture.receipts
+    ]
+
+
+def _prepare_bisection(_: BlockFixture):
+    # fresh pricers every round, so storage is read (from memory) again rather than served from the pricers' caches
+    ret = []
+    for circuit in synthetic_circuits():
+        pc = PricingCircuit([f() for f in circuit.exchanges], circuit.directions)
+        ret.append(functools.partial(detect_arbitrages_bisection, pc, BLOCK_NUMBER))
+    return ret
+
+
+@functools.lru_cache(maxsize=None)
+def _load_src_arbitrage_analysis():
+    """
+    The analyzers under src/ import their siblings by bare module name
+    """
+    src_dir = os.path.join(REPO_ROOT, 'src')
+    if src_dir not in sys.path:
+        sys.path.append(src_dir)
+
+    # it sets up INFO-level logging on import, which would drown out the report
+    root_level = logging.getLogger().level
+    from arbitrage_analysis import ArbitrageAnalysis
+    logging.getLogger().setLevel(root_level)
+    logging.getLogger('arbitrage_analysis').setLevel(logging.WARNING)
+    return ArbitrageAnalysis
+
+
+STAGES: typing.List[Stage] = [
+    Stage('get_addr_to_movements', 'txn', _prepare_addr_to_movements),
+    Stage('get_arbitrage_if_exists', 'txn', _prepare_get_arbitrage_if_exists),
+    Stage('src.ArbitrageAnalysis', 'txn', _prepare_src_arbitrage_analysis),
+    Stage('detect_arbitrages_bisection', 'circuit', _prepare_bisection),
+]
+
+
+def run_stage(stage: Stage, fixture: BlockFixture, rounds: int, warmup: int = 1) -> StageResult:
+    block_seconds = []
+    unit_seconds = []
+    n_units = 0
+    rpc_calls = 0
+    for i in range(warmup + rounds):
+        thunks = stage.prepare(fixture)
+        n_units = len(thunks)
+        rpc_calls_before = profiling.get_counter(profiling.RPC_CALLS)
+
+        round_seconds = []
+        for thunk in thunks:
+            t_start = time.perf_counter()
+            thunk()
+            round_seconds.append(time.perf_counter() - t_start)
+
+        rpc_calls = profiling.get_counter(profiling.RPC_CALLS) - rpc_calls_before
+
+        if i >= warmup:
+            block_seconds.append(sum(round_seconds))
+            unit_seconds.extend(round_seconds)
+
+    return StageResult(stage.name, stage.unit, n_units, block_seconds, unit_seconds, rpc_calls)
+
+
+def to_baseline(results: typing.List[StageResult]) -> typing.Dict:
+    return {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'stages': {
+            r.name: {
+                'n_units': r.n_units,
+                'block_median_seconds': r.block_median,
+                'unit_p50_seconds': r.unit_p50,
+                'unit_p99_seconds': r.unit_p99,
+                'rpc_calls': r.rpc_calls,
+            }
+            for r in results
+        },
+    }
+
+
+def find_regressions(results: typing.List[StageResult], baseline: typing.Dict, threshold: float) -> typing.List[Regression]:
+    ret = []
+    for r in results:
+        if r.name not in baseline['stages']:
+            continue
+        baseline_seconds = baseline['stages'][r.name]['block_median_seconds']
+        if r.block_median > baseline_seconds * (1 + threshold):
+            ret.append(Regression(r.name, baseline_seconds, r.block_median))
+    return ret
+
+
+def _fmt_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f'{seconds:.2f}s'
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.2f}ms'
+    return f'{seconds * 1e6:.1f}us'
+
+
+def print_report(results: typing.List[StageResult], baseline: typing.Optional[typing.Dict]):
+    print(f'{"stage":<30} {"units":>9} {"block p50":>11} {"unit p50":>11} {"unit p99":>11} {"rpc calls":>10} {"vs baseline":>12}')
+    for r in results:
+        vs_baseline = ''
+        if baseline is not None and r.name in baseline['stages']:
+            change = r.block_median / baseline['stages'][r.name]['block_median_seconds'] - 1
+            vs_baseline = f'{change * 100:+.1f}%'
+        print(
+            f'{r.name:<30} {f"{r.n_units} {r.unit}":>9} {_fmt_seconds(r.block_median):>11} '
+            f'{_fmt_seconds(r.unit_p50):>11} {_fmt_seconds(r.unit_p99):>11} {r.rpc_calls:>10} {vs_baseline:>12}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark arbitrage detection over the bundled block fixtures')
+    parser.add_argument('--fixtures-dir', type=str, default=REPO_ROOT, help='directory holding the block_17518743_*.json fixtures')
+    parser.add_argument('--stage', type=str, action='append', choices=[s.name for s in STAGES], help='stage to run (may repeat), default all')
+    parser.add_argument('--rounds', type=int, default=20, help='timed passes over the block per stage')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed passes before the timed ones')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE_PATH, help='baseline file to compare against / save to')
+    parser.add_argument('--save-baseline', action='store_true', help='write this run as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='allowed slowdown of median block time, as a fraction')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+        level=logging.WARNING,
+    )
+
+    fixture = load_block_fixture(args.fixtures_dir)
+
+    results = []
+    for stage in STAGES:
+        if args.stage is not None and stage.name not in args.stage:
+            continue
+        results.append(run_stage(stage, fixture, args.rounds, args.warmup))
+
+    baseline = None
+    if not args.save_baseline and os.path.isfile(args.baseline):
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, mode='w') as fout:
+            json.dump(to_baseline(results), fout, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        return
+
+    if baseline is None:
+        print(f'No baseline at {args.baseline}; run with --save-baseline to create one')
+        return
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    for r in regressions:
+        print(f'REGRESSION {r.stage}: {_fmt_seconds(r.baseline_seconds)} -> {_fmt_seconds(r.seconds)} ({r.ratio:.2f}x)', file=sys.stderr)
+    if len(regressions) > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+benchmarks/fixtures.py
+
+Loads the bundled block fixtures and builds synthetic exchanges whose
+chain state is served from memory, so the benchmarks need no node.
+"""
+import collections
+import json
+import math
+import os
+import typing
+import web3
+from eth_utils import keccak
+from web3.datastructures import AttributeDict
+
+from pricers.uniswap_v2 import UniswapV2Pricer
+from pricers.uniswap_v3 import UniswapV3Pricer
+from utils import WETH_ADDRESS
+from utils.fake_node import FakeNodeProvider
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BLOCK_NUMBER = 17518743
+RECEIPTS_FILE = f'block_{BLOCK_NUMBER}_receipts.json'
+TRANSFERS_FILE = f'block_{BLOCK_NUMBER}_transfers.json'
+
+
+class BlockFixture(typing.NamedTuple):
+    receipts: typing.List[dict]
+    """Receipts as they appear in the fixture file"""
+
+    raw_transfers: typing.Dict[str, typing.List[dict]]
+    """Fixture transfers, by transaction hash"""
+
+    transfers: typing.Dict[bytes, typing.List[dict]]
+    """Transfers shaped like erc20.events.Transfer().processLog() output, by transaction hash"""
+
+    w3: web3.Web3
+    """Serves the fixture's receipts"""
+
+
+def load_block_fixture(fixtures_dir: str = REPO_ROOT) -> BlockFixture:
+    with open(os.path.join(fixtures_dir, RECEIPTS_FILE)) as fin:
+        receipts = json.load(fin)
+    with open(os.path.join(fixtures_dir, TRANSFERS_FILE)) as fin:
+        transfers = json.load(fin)
+
+    raw_transfers = collections.defaultdict(list)
+    parsed_transfers = collections.defaultdict(list)
+    for xfer in transfers:
+        raw_transfers[xfer['transactionHash']].append(xfer)
+        parsed_transfers[bytes.fromhex(xfer['transactionHash'][2:])].append(AttributeDict.recursive({
+            'address': xfer['address'],
+            'transactionHash': bytes.fromhex(xfer['transactionHash'][2:]),
+            'args': {
+                'from': web3.Web3.toChecksumAddress(xfer['args']['from']),
+                'to': web3.Web3.toChecksumAddress(xfer['args']['to']),
+                'value': int(xfer['args']['value']),
+            },
+        }))
+
+    provider = FakeNodeProvider()
+    for receipt in receipts:
+        provider.snapshot.add_receipt(_to_rpc_receipt(receipt))
+
+    return BlockFixture(
+        receipts = receipts,
+        raw_transfers = dict(raw_transfers),
+        transfers = dict(parsed_transfers),
+        w3 = web3.Web3(provider),
+    )
+
+
+def _to_rpc_receipt(receipt: dict) -> dict:
+    """
+    The fixture stores some quantities as ints; put them back into JSON-RPC hex form
+    """
+    ret = dict(receipt)
+    for k in ['blockNumber', 'gasUsed', 'effectiveGasPrice', 'status']:
+        if isinstance(ret.get(k, None), int):
+            ret[k] = hex(ret[k])
+    logs = []
+    for log in receipt['logs']:
+        log = dict(log)
+        for k in ['blockNumber', 'logIndex']:
+            if isinstance(log.get(k, None), int):
+                log[k] = hex(log[k])
+        logs.append(log)
+    ret['logs'] = logs
+    return ret
+
+
+#
+# Synthetic exchanges
+#
+
+SYNTHETIC_TOKEN_A = web3.Web3.toChecksumAddress('0x' + 'a1' * 20)
+SYNTHETIC_TOKEN_B = web3.Web3.toChecksumAddress('0x' + 'b2' * 20)
+
+UNIV2_RESERVES_SLOT = 8
+UNIV3_SLOT0_SLOT = 0
+UNIV3_LIQUIDITY_SLOT = 4
+UNIV3_TICKS_SLOT = 5
+UNIV3_TICK_BITMAP_SLOT = 6
+
+
+def _sorted_tokens(token_a: str, token_b: str) -> typing.Tuple[str, str]:
+    if bytes.fromhex(token_a[2:]) < bytes.fromhex(token_b[2:]):
+        return token_a, token_b
+    return token_b, token_a
+
+
+def _mapping_slot(key: int, slot: int) -> bytes:
+    return keccak(key.to_bytes(32, byteorder='big', signed=True) + slot.to_bytes(32, byteorder='big'))
+
+
+class SyntheticExchanges:
+    """
+    Lays out Uniswap v2 and v3 pool storage in a FakeNodeProvider, so the real
+    pricers can be run against it. Storage that was never set reads as zero.
+    """
+    w3: web3.Web3
+    provider: FakeNodeProvider
+    _next_address: int
+
+    def __init__(self) -> None:
+        self.provider = FakeNodeProvider(strict=False)
+        self.w3 = web3.Web3(self.provider)
+        self._next_address = 0x1000
+
+    def _new_address(self) -> str:
+        self._next_address += 1
+        return web3.Web3.toChecksumAddress(self._next_address.to_bytes(20, byteorder='big'))
+
+    def add_uniswap_v2(self, token_a: str, reserve_a: int, token_b: str, reserve_b: int) -> typing.Callable[[], UniswapV2Pricer]:
+        """
+        Returns a factory for fresh (un-cached) pricers of the new pool
+        """
+        address = self._new_address()
+        token0, token1 = _sorted_tokens(token_a, token_b)
+        reserve0, reserve1 = (reserve_a, reserve_b) if token0 == token_a else (reserve_b, reserve_a)
+        assert reserve0 < (1 << 112) and reserve1 < (1 << 112)
+        self.provider.snapshot.set_storage(address, UNIV2_RESERVES_SLOT, (reserve1 << 112) | reserve0)
+        return lambda: UniswapV2Pricer(self.w3, address, token0, token1)
+
+    def add_uniswap_v3(self, token_a: str, amount_a: int, token_b: str, amount_b: int, fee: int = 3_000) -> typing.Callable[[], UniswapV3Pricer]:
+        """
+        Adds a pool with a single full-range position, priced as if it were a v2 pool
+        holding the given amounts. Returns a factory for fresh (un-cached) pricers of the new pool.
+        """
+        address = self._new_address()
+        token0, token1 = _sorted_tokens(token_a, token_b)
+        amount0, amount1 = (amount_a, amount_b) if token0 == token_a else (amount_b, amount_a)
+
+        sqrt_price_x96 = math.isqrt((amount1 << 192) // amount0)
+        tick = UniswapV3Pricer.get_tick_at_sqrt_ratio(sqrt_price_x96)
+        liquidity = math.isqrt(amount0 * amount1)
+        assert liquidity < (1 << 128)
+
+        self.provider.snapshot.set_storage(address, UNIV3_SLOT0_SLOT, ((tick & 0xffffff) << 160) | sqrt_price_x96)
+        self.provider.snapshot.set_storage(address, UNIV3_LIQUIDITY_SLOT, liquidity)
+
+        tick_spacing = {100: 1, 500: 10, 3_000: 60, 10_000: 200}[fee]
+        lower_tick = -(UniswapV3Pricer.MAX_TICK // tick_spacing) * tick_spacing
+        upper_tick = -lower_tick
+        bitmap = collections.defaultdict(int)
+        for position_tick, liquidity_net in [(lower_tick, liquidity), (upper_tick, -liquidity)]:
+            compressed = position_tick // tick_spacing
+            bitmap[compressed >> 8] |= 1 << (compressed % 256)
+
+            info_slot = _mapping_slot(position_tick, UNIV3_TICKS_SLOT)
+            self.provider.snapshot.set_storage(address, info_slot, ((liquidity_net & ((1 << 128) - 1)) << 128) | liquidity)
+            # `initialized` is the top byte of the struct's fourth word
+            initialized_slot = int.from_bytes(info_slot, byteorder='big') + 3
+            self.provider.snapshot.set_storage(address, initialized_slot, 1 << 248)
+        for word_idx, word in bitmap.items():
+            self.provider.snapshot.set_storage(address, _mapping_slot(word_idx, UNIV3_TICK_BITMAP_SLOT), word)
+
+        return lambda: UniswapV3Pricer(self.w3, address, token0, token1, fee)
+
+
+class SyntheticCircuit(typing.NamedTuple):
+    name: str
+    exchanges: typing.List[typing.Callable[[], typing.Any]]
+    directions: typing.List[typing.Tuple[str, str]]
+
+
+def synthetic_circuits() -> typing.List[SyntheticCircuit]:
+    """
+    A few WETH-pivot circuits: two with a price discrepancy to find and one without
+    """
+    exchanges = SyntheticExchanges()
+    eth = 10 ** 18
+
+    # token A trades at 2000 per WETH, except on the v3 pool where it is 2% cheaper
+    v2_a = exchanges.add_uniswap_v2(WETH_ADDRESS, 1_000 * eth, SYNTHETIC_TOKEN_A, 2_000_000 * eth)
+    v2_a_other = exchanges.add_uniswap_v2(WETH_ADDRESS, 400 * eth, SYNTHETIC_TOKEN_A, 800_000 * eth)
+    v3_a = exchanges.add_uniswap_v3(WETH_ADDRESS, 1_500 * eth, SYNTHETIC_TOKEN_A, 3_060_000 * eth)
+
+    # token B is 3 token A and fairly priced
+    v2_b = exchanges.add_uniswap_v2(WETH_ADDRESS, 800 * eth, SYNTHETIC_TOKEN_B, 533_333 * eth)
+    v3_ab = exchanges.add_uniswap_v3(SYNTHETIC_TOKEN_A, 6_000_000 * eth, SYNTHETIC_TOKEN_B, 2_000_000 * eth)
+
+    return [
+        SyntheticCircuit(
+            'v3-v2 two hop',
+            [v3_a, v2_a],
+            [(WETH_ADDRESS, SYNTHETIC_TOKEN_A), (SYNTHETIC_TOKEN_A, WETH_ADDRESS)],
+        ),
+        SyntheticCircuit(
+            'v3-v3-v2 three hop',
+            [v3_a, v3_ab, v2_b],
+            [(WETH_ADDRESS, SYNTHETIC_TOKEN_A), (SYNTHETIC_TOKEN_A, SYNTHETIC_TOKEN_B), (SYNTHETIC_TOKEN_B, WETH_ADDRESS)],
+        ),
+        SyntheticCircuit(
+            'v2-v2 no arbitrage',
+            [v2_a, v2_a_other],
+            [(WETH_ADDRESS, SYNTHETIC_TOKEN_A), (SYNTHETIC_TOKEN_A, WETH_ADDRESS)],
+        ),
+    ]
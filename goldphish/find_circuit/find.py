@@ -19,7 +19,7 @@ from pricers.uniswap_v2 import UniswapV2Pricer
 from pricers.uniswap_v3 import UniswapV3Pricer
 from utils import WETH_ADDRESS
 from utils import profiling
-from utils.profiling import profile, inc_measurement
+from utils.profiling import profile, profiled, inc_measurement
 
 l = logging.getLogger(__name__)
 
@@ -190,6 +190,7 @@ class PricingCircuit:
         self._directions = list((t2, t1) for (t1, t2) in reversed(self._directions))
 
 
+@profiled()
 def detect_arbitrages_bisection(
         pc: PricingCircuit,
         block_identifier: int,
@@ -14,6 +14,7 @@ import web3.types
 import web3.contract
 from eth_utils import event_abi_to_log_topic
 from utils import get_abi
+from utils.profiling import profiled
 import logging
 
 l = logging.getLogger(__name__)
@@ -42,8 +43,24 @@ LOG_JOIN_TOPIC = event_abi_to_log_topic(_base_balancer.events.LOG_JOIN().abi)
 LOG_EXIT_TOPIC = event_abi_to_log_topic(_base_balancer.events.LOG_EXIT().abi)
 LOG_SWAP_TOPIC = event_abi_to_log_topic(_base_balancer.events.LOG_SWAP().abi)
 
+# BPool storage layout
+PUBLIC_SWAP_SLOT  = 0x6 # packed above _controller
+SWAP_FEE_SLOT     = 0x7
+FINALIZED_SLOT    = 0x8
+TOKENS_SLOT       = 0x9
+RECORDS_SLOT      = 0xa
+TOTAL_WEIGHT_SLOT = 0xb
+
+# keccak(TOKENS_SLOT), where the _tokens array starts
 TOKEN_BASE_SLOT = int.from_bytes(bytes.fromhex('6e1540171b6c0c960b71a7020d9f60077f6af931a8bbf590da0223dacf75c7af'), byteorder='big', signed=False)
 
+# Record {bool bound; uint index; uint denorm; uint balance}
+RECORD_DENORM_OFFSET  = 0x2
+RECORD_BALANCE_OFFSET = 0x3
+
+# BConst.MAX_BOUND_TOKENS
+MAX_BOUND_TOKENS = 8
+
 class NotFinalizedException(Exception):
 
     def __init__(self, *args: object) -> None:
@@ -72,6 +89,7 @@ class BalancerPricer(BaseExchangePricer):
     tokens: typing.Optional[typing.Set[str]]
     address: str
     swap_fee: typing.Optional[int]
+    total_weight: typing.Optional[int]
     token_denorms: typing.Dict[str, int]
 
     _public_swap: typing.Optional[bool]
@@ -85,81 +103,128 @@ class BalancerPricer(BaseExchangePricer):
         self.finalized = None
         self.tokens = None
         self.swap_fee = None
+        self.total_weight = None
         self.token_denorms = {}
         self._balance_cache = {}
         self._public_swap = None
 
+    def _read_slots(self, slots: typing.List[int], block_identifier) -> typing.List[int]:
+        """
+        Read the given storage slots in one JSON-RPC batch
+        """
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+
+        reqs = [('eth_getStorageAt', [self.address, hex(slot), block_identifier]) for slot in slots]
+        resps = self.w3.provider.make_request_batch(reqs)
+        assert len(resps) == len(reqs)
+        return [int(resp['result'], base=16) for resp in resps]
+
+    def _record_slot(self, token: str, offset: int) -> int:
+        slot_base = self.w3.keccak(
+            bytes.fromhex(token[2:]).rjust(32, b'\x00') +
+            int.to_bytes(RECORDS_SLOT, length=32, byteorder='big', signed=False)
+        )
+        return int.from_bytes(slot_base, byteorder='big', signed=False) + offset
+
     def get_tokens(self, block_identifier: int) -> typing.Set[str]:
         if self.tokens is None:
-            # no cache, get the list of tokens
-            bn_tokens = self.w3.eth.get_storage_at(self.address, '0x9', block_identifier)
-            n_tokens = int.from_bytes(bn_tokens, byteorder='big', signed=False)
+            # no cache, get the list of tokens -- a pool binds at most MAX_BOUND_TOKENS, so
+            # read that many array slots alongside the length rather than waiting on it
+            words = self._read_slots(
+                [TOKENS_SLOT] + [TOKEN_BASE_SLOT + i for i in range(MAX_BOUND_TOKENS)],
+                block_identifier
+            )
+            n_tokens = words[0]
+            assert n_tokens <= MAX_BOUND_TOKENS
 
             tokens = set()
-
-            for i in range(n_tokens):
-                token_slot = int.to_bytes(TOKEN_BASE_SLOT + i, length=32, byteorder='big', signed=False)
-                hex_token_slot = '0x' + token_slot.hex()
-                btoken = self.w3.eth.get_storage_at(self.address, hex_token_slot, block_identifier).rjust(32, b'\x00')
-                assert btoken[0:12] == b'\x00'*12
-
-                token = self.w3.toChecksumAddress(btoken[12:])
+            for word in words[1:1 + n_tokens]:
+                assert word < (1 << 160)
+                token = self.w3.toChecksumAddress(int.to_bytes(word, length=20, byteorder='big', signed=False))
                 tokens.add(token)
 
             self.tokens = tokens
         return self.tokens
 
+    def load_state(self, block_identifier: int):
+        """
+        Fill every empty cache -- finalized, public swap, swap fee, total weight,
+        and each token's denorm and balance -- in a single JSON-RPC batch
+        (plus one for the token list, if that is not known yet)
+        """
+        tokens = self.get_tokens(block_identifier)
+
+        slots = []
+        setters = []
+
+        def _set_finalized(word):
+            self.finalized = word & 0xff != 0
+        def _set_public_swap(word):
+            self._public_swap = (word >> 0xa0) != 0
+        def _set_swap_fee(word):
+            self.swap_fee = word
+        def _set_total_weight(word):
+            self.total_weight = word
+
+        if self.finalized is None:
+            slots.append(FINALIZED_SLOT)
+            setters.append(_set_finalized)
+        if self._public_swap is None and self.finalized != True:
+            slots.append(PUBLIC_SWAP_SLOT)
+            setters.append(_set_public_swap)
+        if self.swap_fee is None:
+            slots.append(SWAP_FEE_SLOT)
+            setters.append(_set_swap_fee)
+        if self.total_weight is None:
+            slots.append(TOTAL_WEIGHT_SLOT)
+            setters.append(_set_total_weight)
+
+        for token in sorted(tokens):
+            if token not in self.token_denorms:
+                slots.append(self._record_slot(token, RECORD_DENORM_OFFSET))
+                setters.append(lambda word, token=token: self.token_denorms.__setitem__(token, word))
+            if token not in self._balance_cache:
+                slots.append(self._record_slot(token, RECORD_BALANCE_OFFSET))
+                setters.append(lambda word, token=token: self._balance_cache.__setitem__(token, word))
+
+        if len(slots) == 0:
+            return
+
+        for setter, word in zip(setters, self._read_slots(slots, block_identifier)):
+            setter(word)
+
+        if self.finalized == True:
+            # finalized implies _publicSwap
+            self._public_swap = True
+
     def get_finalized(self, block_identifier: int) -> bool:
         if self.finalized is None:
-            bfinalized = self.w3.eth.get_storage_at(self.address, '0x8', block_identifier)
-            self.finalized = bfinalized[-1] != 0
+            self.load_state(block_identifier)
         return self.finalized
 
     def get_balance(self, address: str, block_identifier: int) -> int:
         assert address in self.tokens
         if address not in self._balance_cache:
-            slot_base = self.w3.keccak(
-                bytes.fromhex(address[2:]).rjust(32, b'\x00') +
-                b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x0a'
-            )
-            slot = int.to_bytes(int.from_bytes(slot_base, byteorder='big', signed=False) + 0x3, length=32, byteorder='big', signed=False)
-
-            bbal = self.w3.eth.get_storage_at(self.address, slot.hex(), block_identifier)
-            balance = int.from_bytes(bbal, byteorder='big', signed=False)
-
-            self._balance_cache[address] = balance
+            self.load_state(block_identifier)
         return self._balance_cache[address]
 
     def get_public_swap(self, block_identifier: int) -> bool:
         if self._public_swap is None:
-            if self.finalized == True:
-                # finalized implies _publicSwap
-                self._public_swap = True
-            else:
-                bpublic_swap = self.w3.eth.get_storage_at(self.address, '0x6', block_identifier)
-                self._public_swap = (int.from_bytes(bpublic_swap, byteorder='big', signed=False) >> 0xa0) != 0
+            self.load_state(block_identifier)
         return self._public_swap
 
     def get_swap_fee(self, block_identifier: int) -> int:
         if self.swap_fee is None:
-            bswap_fee = self.w3.eth.get_storage_at(self.address, '0x7', block_identifier)
-            self.swap_fee = int.from_bytes(bswap_fee, byteorder='big', signed=False)
+            self.load_state(block_identifier)
         return self.swap_fee
 
     def get_denorm_weight(self, address: str, block_identifier: int) -> int:
         if address not in self.token_denorms:
-            slot_base = self.w3.keccak(
-                bytes.fromhex(address[2:]).rjust(32, b'\x00') +
-                b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x0a'
-            )
-            slot = int.to_bytes(int.from_bytes(slot_base, byteorder='big', signed=False) + 0x2, length=32, byteorder='big', signed=False)
-
-            bweight = self.w3.eth.get_storage_at(self.address, slot.hex(), block_identifier)
-            weight = int.from_bytes(bweight, byteorder='big', signed=False)
-
-            self.token_denorms[address] = weight
+            self.load_state(block_identifier)
         return self.token_denorms[address]
 
+    @profiled()
     def token_out_for_exact_in(self, token_in: str, token_out: str, token_amount_in: int, block_identifier: int, **_):
         # modeled based off swapExactAmountIn
         # neglects minAmountOut and maxPrice
@@ -255,11 +320,11 @@ class BalancerPricer(BaseExchangePricer):
         return self.get_balance(token_address, block_identifier)
 
     def get_token_weight(self, token_address: str, block_identifier: int) -> decimal.Decimal:
-        _tot_weight = 0
-        for t in self.get_tokens(block_identifier):
-            _tot_weight += self.get_denorm_weight(t, block_identifier)
+        denorm = self.get_denorm_weight(token_address, block_identifier)
+        if self.total_weight is None:
+            self.load_state(block_identifier)
 
-        return decimal.Decimal(self.get_denorm_weight(token_address, block_identifier)) / decimal.Decimal(_tot_weight)
+        return decimal.Decimal(denorm) / decimal.Decimal(self.total_weight)
 
     def observe_block(self, logs: typing.List[web3.types.LogReceipt], force_load: bool = False) -> BlockObservationResult:
         just_finalized = False
@@ -357,6 +422,7 @@ class BalancerPricer(BaseExchangePricer):
                     self._balance_cache[token_address] = balance
 
                     self.tokens = None
+                    self.total_weight = None
 
                 elif log['topics'][0] == BIND_TOPIC:
                     # a token-bind event
@@ -370,6 +436,7 @@ class BalancerPricer(BaseExchangePricer):
                     self._balance_cache[token_address] = balance
 
                     self.tokens = None
+                    self.total_weight = None
 
                 elif log['topics'] == PUBLIC_SWAP_TOPIC:
                     raise NotImplementedError('hmmm public swap....')
@@ -9,6 +9,7 @@ from pricers.balancer import BalancerPricer
 from pricers.block_observation_result import BlockObservationResult
 
 from utils import get_abi, get_block_timestamp
+from utils.profiling import profiled
 
 from pricers.base import BaseExchangePricer, NotEnoughLiquidityException
 from pricers.balancer_v2.common import ONE, POOL_BALANCE_CHANGED_TOPIC, POOL_REGISTERED_TOPIC, SWAP_TOPIC, TOKENS_DEREGISTERED_TOPIC, TOKENS_REGISTERED_TOPIC, _vault, complement, div_down, div_up, downscale_down, mul_down, mul_up, pow_up, pow_up_legacy, spot, upscale
@@ -105,6 +106,11 @@ def get_interpolated_value(start_value: int, end_value: int, start_time: int, en
 
 
 class BalancerV2LiquidityBootstrappingPoolPricer(BaseExchangePricer):
+    RELEVANT_LOGS = [
+        SWAP_FEE_CHANGED_TOPIC, GRADUAL_WEIGHT_UPDATE_SCHEDULED, SWAP_ENABLED_SET_TOPIC,
+        SWAP_TOPIC, POOL_REGISTERED_TOPIC, TOKENS_REGISTERED_TOPIC, TOKENS_DEREGISTERED_TOPIC, POOL_BALANCE_CHANGED_TOPIC,
+    ]
+
     w3: web3.Web3
     address: str
     vault: web3.contract.Contract
@@ -201,6 +207,7 @@ class BalancerV2LiquidityBootstrappingPoolPricer(BaseExchangePricer):
 
     MAX_IN_RATIO = 3 * 10 ** 17 # 0.3e18
 
+    @profiled()
     def token_out_for_exact_in(
             self,
             token_in: str,
@@ -23,10 +23,20 @@ class NotEnoughLiquidityException(Exception):
     def __str__(self) -> str:
         return f'<NotEnoughLiquidityException amount_in={self.amount_in} amount_remaining={self.remaining}>'
 
+class UnknownSpillFormat(Exception):
+    """
+    Thrown when spilled bytes were written by another pricer type or schema version.
+    """
+    pass
+
 class BaseExchangePricer:
     w3: web3.Web3
     address: str
 
+    # first two bytes of to_spill() output; bump SPILL_VERSION whenever the layout changes
+    SPILL_TAG: typing.Optional[int] = None
+    SPILL_VERSION: typing.Optional[int] = None
+
     def __init__(self, w3: web3.Web3) -> None:
         self.w3 = w3
 
@@ -63,3 +73,23 @@ class BaseExchangePricer:
         Return a copy of this pricer absent its cached values, for ensuring cache-consistency
         """
         raise NotImplementedError()
+
+    def to_spill(self) -> bytes:
+        """
+        Compact serialization, including cached state, for spilling an evicted pricer to disk.
+        Starts with SPILL_TAG and SPILL_VERSION bytes.
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def from_spill(cls, w3: web3.Web3, b: bytes) -> 'BaseExchangePricer':
+        """
+        Inverse of to_spill(); raises UnknownSpillFormat if b is not of this type and version.
+        """
+        raise NotImplementedError()
+
+    def approx_size_bytes(self) -> int:
+        """
+        Rough in-memory footprint, for sizing caches
+        """
+        raise NotImplementedError()
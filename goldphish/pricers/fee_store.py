@@ -0,0 +1,270 @@
+"""
+pricers/fee_store.py
+
+Shares inferred fee-on-transfer rates between workers through an append-only log.
+
+Each record is one observation of a fee: the relay saw `token` moved from one address
+to another arrive as `fee` times the amount sent, and committed it as the given row of
+inferred_token_fee_on_transfer. Every worker memory-maps the same
+log and folds in new records as they appear (at most every `refresh_seconds`), so a
+fee inferred by one worker is used by all of them within seconds, with no database
+round-trip and no reload.
+
+Observations are folded into one estimate per (token, from, to) by majority vote:
+agreeing observations raise the estimate's confidence, disagreeing ones lower it,
+and at zero the newest observation replaces it. Every worker replays the same log in
+the same order, so all arrive at the same estimates. Only fees a worker inferred itself
+are recorded, not those it used from the store, so confidence counts independent
+observations.
+
+Some tokens charge a fee only between certain addresses (eg exempting their own pool),
+so an estimate for one (from, to) pair does not carry over to another. Callers that do
+not know who is moving the token can only use `uniform_fee`, which is None unless every
+confident estimate for the token agrees.
+
+Set FEE_STORE_PATH to enable the process-wide store (see `get_fee_store`).
+"""
+import datetime
+import decimal
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+import typing
+import zlib
+
+l = logging.getLogger(__name__)
+
+# fees are stored as integers, scaled by this much
+FEE_SCALE = 10 ** 28
+
+# observations closer than this (in fee) agree
+AGREEMENT_TOLERANCE = decimal.Decimal('0.000001')
+
+# estimates need at least this confidence before pricing (rather than relaying) trusts them
+MIN_CONFIDENCE = 2
+
+DEFAULT_REFRESH_SECONDS = 1.0
+
+# token, from, to, fee (scaled, big-endian), round_down, block number, inferred_token_fee_on_transfer id,
+# recorded at (unix time), crc32 of the rest
+_RECORD = struct.Struct('<20s20s20s16sBQQdI')
+
+
+class FeeEstimate(typing.NamedTuple):
+    # the inferred_token_fee_on_transfer row the fee was committed as
+    id_: int
+    fee: decimal.Decimal
+    round_down: bool
+    confidence: int
+    block_number: int
+    updated_on: datetime.datetime
+
+
+class FeeStore:
+    path: str
+    refresh_seconds: float
+    n_records: int
+
+    # token -> (from, to) -> estimate, all as bytes
+    _estimates: typing.Dict[bytes, typing.Dict[typing.Tuple[bytes, bytes], FeeEstimate]]
+
+    # token -> (from, to) of its most confident estimate
+    _best: typing.Dict[bytes, typing.Tuple[bytes, bytes]]
+
+    # token -> its uniform fee (see uniform_fee), filled on demand and dropped when the token is observed
+    _uniform: typing.Dict[bytes, typing.Optional[FeeEstimate]]
+
+    def __init__(self, path: str, refresh_seconds: float = DEFAULT_REFRESH_SECONDS) -> None:
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.n_records = 0
+        self._estimates = {}
+        self._best = {}
+        self._uniform = {}
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        self._mmap = None
+        self._offset = 0
+        self._last_refresh = float('-inf')
+        self.refresh()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        os.close(self._fd)
+
+    def record(self, id_: int, token: str, from_address: str, to_address: str, fee: decimal.Decimal, round_down: bool, block_number: int):
+        """
+        Append an observation, committed as inferred_token_fee_on_transfer row `id_`, to the log,
+        for every worker to see
+        """
+        assert 0 < fee <= 1
+        body = _RECORD.pack(
+            bytes.fromhex(token[2:]),
+            bytes.fromhex(from_address[2:]),
+            bytes.fromhex(to_address[2:]),
+            int(fee * FEE_SCALE).to_bytes(16, byteorder='big'),
+            1 if round_down else 0,
+            block_number,
+            id_,
+            time.time(),
+            0,
+        )[:-4]
+        b = body + struct.pack('<I', zlib.crc32(body))
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            # skip past the torn tail left by a writer that died mid-record, if any
+            end = -(-size // _RECORD.size) * _RECORD.size
+            os.pwrite(self._fd, b, end)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.refresh()
+
+    def refresh(self) -> int:
+        """
+        Fold in the records appended since the last refresh.
+
+        Returns the number of records read.
+        """
+        self._last_refresh = time.monotonic()
+        size = os.fstat(self._fd).st_size
+        size -= size % _RECORD.size
+        if size <= self._offset:
+            return 0
+
+        if self._mmap is None or len(self._mmap) < size:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._fd, size, prot=mmap.PROT_READ)
+
+        n_read = 0
+        offset = self._offset
+        while offset < size:
+            token, from_address, to_address, fee, round_down, block_number, id_, recorded_at, crc = _RECORD.unpack_from(self._mmap, offset)
+            if zlib.crc32(self._mmap[offset:offset + _RECORD.size - 4]) != crc:
+                if offset + _RECORD.size == size:
+                    # may still be being written; look again next time
+                    break
+                # torn by a writer that died, see record()
+                offset += _RECORD.size
+                continue
+            fee = decimal.Decimal(int.from_bytes(fee, byteorder='big')) / FEE_SCALE
+            self._observe(id_, token, from_address, to_address, fee, round_down == 1, block_number, datetime.datetime.utcfromtimestamp(recorded_at))
+            n_read += 1
+            offset += _RECORD.size
+
+        self._offset = offset
+        self.n_records += n_read
+        return n_read
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._last_refresh >= self.refresh_seconds:
+            self.refresh()
+
+    def _observe(self, id_: int, token: bytes, from_address: bytes, to_address: bytes, fee: decimal.Decimal, round_down: bool, block_number: int, updated_on: datetime.datetime):
+        estimates = self._estimates.setdefault(token, {})
+        k = (from_address, to_address)
+        existing = estimates.get(k, None)
+
+        if existing is None:
+            updated = FeeEstimate(id_, fee, round_down, 1, block_number, updated_on)
+        elif _agrees(existing, fee, round_down):
+            # agrees; keep the lower fee, since overestimating what arrives makes the shot revert
+            if fee < existing.fee:
+                updated = FeeEstimate(id_, fee, round_down, existing.confidence + 1, max(existing.block_number, block_number), updated_on)
+            else:
+                updated = existing._replace(confidence = existing.confidence + 1, block_number = max(existing.block_number, block_number), updated_on = updated_on)
+        elif existing.confidence > 1:
+            updated = existing._replace(confidence = existing.confidence - 1)
+        else:
+            updated = FeeEstimate(id_, fee, round_down, 1, block_number, updated_on)
+        estimates[k] = updated
+        self._uniform.pop(token, None)
+
+        # keep the running best, only looking over this token's pairs when the best lost confidence
+        best_k = self._best.get(token, None)
+        if best_k == k:
+            if updated.confidence < existing.confidence:
+                self._best[token] = max(estimates, key=lambda x: estimates[x].confidence)
+        elif best_k is None or updated.confidence > estimates[best_k].confidence:
+            self._best[token] = k
+
+    def get(self, token: str, from_address: str, to_address: str) -> typing.Optional[FeeEstimate]:
+        self._maybe_refresh()
+        estimates = self._estimates.get(bytes.fromhex(token[2:]), None)
+        if estimates is None:
+            return None
+        return estimates.get((bytes.fromhex(from_address[2:]), bytes.fromhex(to_address[2:])), None)
+
+    def token_fee(self, token: str) -> typing.Optional[FeeEstimate]:
+        """
+        The most confident estimate for the token, between any two addresses
+        """
+        self._maybe_refresh()
+        btoken = bytes.fromhex(token[2:])
+        best_k = self._best.get(btoken, None)
+        if best_k is None:
+            return None
+        return self._estimates[btoken][best_k]
+
+    def uniform_fee(self, token: str) -> typing.Optional[FeeEstimate]:
+        """
+        The fee the token charges between any two addresses, when every estimate with at
+        least MIN_CONFIDENCE agrees on it; None if there is none, or if it depends on who
+        moves the token.
+        """
+        self._maybe_refresh()
+        btoken = bytes.fromhex(token[2:])
+        if btoken not in self._uniform:
+            self._uniform[btoken] = _uniform(self._estimates.get(btoken, {}).values())
+        return self._uniform[btoken]
+
+    def has_fee(self, token: str, min_confidence: int = 1) -> bool:
+        estimate = self.token_fee(token)
+        return estimate is not None and estimate.confidence >= min_confidence
+
+
+def _agrees(estimate: FeeEstimate, fee: decimal.Decimal, round_down: bool) -> bool:
+    return abs(estimate.fee - fee) <= AGREEMENT_TOLERANCE and estimate.round_down == round_down
+
+
+def _uniform(estimates: typing.Iterable[FeeEstimate]) -> typing.Optional[FeeEstimate]:
+    ret = None
+    for estimate in estimates:
+        if estimate.confidence < MIN_CONFIDENCE:
+            continue
+        if ret is None:
+            ret = estimate
+        elif not _agrees(ret, estimate.fee, estimate.round_down):
+            return None
+        elif estimate.fee < ret.fee:
+            ret = estimate
+    return ret
+
+
+_store: typing.Optional[FeeStore] = None
+
+def get_fee_store() -> typing.Optional[FeeStore]:
+    """
+    The process-wide store at FEE_STORE_PATH, or None if that is not set
+    """
+    global _store
+    path = os.environ.get('FEE_STORE_PATH', None)
+    if path is None:
+        return None
+    if _store is None or _store.path != path:
+        _store = FeeStore(path)
+    return _store
+
+
+def _forget_store_after_fork():
+    # the child opens its own descriptor (and lock) when it first needs the store
+    global _store
+    _store = None
+
+os.register_at_fork(after_in_child=_forget_store_after_fork)
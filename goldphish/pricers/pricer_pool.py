@@ -1,5 +1,4 @@
 import collections
-import pickle
 import typing
 import time
 import logging
@@ -14,7 +13,7 @@ from pricers.balancer_v2.liquidity_bootstrapping_pool import BalancerV2Liquidity
 from pricers.balancer_v2.weighted_pool import BalancerV2WeightedPoolPricer
 from pricers.block_observation_result import BlockObservationResult
 from utils import get_abi, BALANCER_VAULT_ADDRESS, get_block_timestamp
-from .base import BaseExchangePricer
+from .base import BaseExchangePricer, UnknownSpillFormat
 from .uniswap_v2 import UniswapV2Pricer
 from .uniswap_v3 import UniswapV3Pricer
 from .token_balance_changing_logs import CACHE_INVALIDATING_TOKEN_LOGS
@@ -25,6 +24,12 @@ import leveldb
 
 l = logging.getLogger(__name__)
 
+# pricer types that can be spilled to leveldb, by the tag that starts their spill
+_SPILLABLE_PRICERS: typing.Dict[int, typing.Type[BaseExchangePricer]] = {
+    UniswapV2Pricer.SPILL_TAG: UniswapV2Pricer,
+    UniswapV3Pricer.SPILL_TAG: UniswapV3Pricer,
+}
+
 
 class MyLRUCacher(cachetools.LRUCache):
 
@@ -46,9 +51,18 @@ class PricerPool:
     """
     STAT_LOG_PERIOD_SECONDS = 60 * 10
 
+    # approximate memory allowed for evictable pricers (see BaseExchangePricer.approx_size_bytes);
+    # about what the old cap of 1,000 entries held when those were v3 pricers with ~150 cached
+    # ticks each (32KB apiece), or 30k v2 pricers
+    DEFAULT_MAX_CACHE_BYTES = 32 * 1024 * 1024
+
+    # evicted pricers are written to leveldb once this many are pending
+    SPILL_BATCH_SIZE = 64
+
     _w3: web3.Web3
     _cache: typing.Dict[str, BaseExchangePricer]
     _evictable_cache: cachetools.LRUCache
+    _spill_buffer: typing.Dict[str, bytes]
 
     _token_to_pools: typing.Dict[str, typing.List[str]]
     _token_pairs_to_pools: typing.Dict[typing.Tuple[str, str], typing.List[str]]
@@ -67,21 +81,26 @@ class PricerPool:
     _last_stat_log_ts: float
     _balancer_v2_vault: web3.contract.Contract
 
-    def __init__(self, w3: web3.Web3, tmpdir: typing.Optional[str] = None) -> None:
+    def __init__(self, w3: web3.Web3, tmpdir: typing.Optional[str] = None, max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES) -> None:
         global _pool_id
         my_pool_id = _pool_id
         _pool_id += 1
 
+        # clamped so that one very large pricer can never be refused by the cache
+        def getsizeof(pricer: BaseExchangePricer) -> int:
+            return min(pricer.approx_size_bytes(), max_cache_bytes)
+
+        self._spill_buffer = {}
         if tmpdir is not None:
             assert os.path.isdir(tmpdir)
             my_dir = os.path.join(tmpdir, str(my_pool_id))
             os.mkdir(my_dir)
             self._db = leveldb.LevelDB(filename=my_dir)
-            self._evictable_cache = MyLRUCacher(self, 1_000)
+            self._evictable_cache = MyLRUCacher(self, max_cache_bytes, getsizeof=getsizeof)
             l.debug(f'Initialized pricing pool leveldb at {tmpdir}')
         else:
             self._db = None
-            self._evictable_cache = cachetools.LRUCache(maxsize=1_000)
+            self._evictable_cache = cachetools.LRUCache(maxsize=max_cache_bytes, getsizeof=getsizeof)
 
         self._cache = {} # infinite size cache
 
@@ -127,6 +146,15 @@ class PricerPool:
         ret.add(BALANCER_VAULT_ADDRESS)
         return ret
 
+    def relevant_log_topics(self) -> typing.Set[bytes]:
+        """
+        Gets the topic0 of every log that some pricer acts on; other logs from monitored addresses may be ignored
+        """
+        ret = set()
+        for pricer_type in [UniswapV2Pricer, UniswapV3Pricer, BalancerPricer, BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer]:
+            ret.update(bytes(x) for x in pricer_type.RELEVANT_LOGS)
+        return ret
+
     def add_uniswap_v2(self, address: str, token0: str, token1: str, origin_block: int):
         """
         Add the given uniswap v2 exchange details to the pricer pool.
@@ -414,7 +442,14 @@ class PricerPool:
         with profile('get_pricer_for'):
             self._maybe_log_stats()
 
-            maybe_cached_pricer = self._evictable_cache.get(address, None) or self._cache.get(address, None)
+            maybe_cached_pricer = self._evictable_cache.get(address, None)
+            if maybe_cached_pricer is not None:
+                self._cache_hits += 1
+                # pricers grow as they cache more state; re-insert to update the recorded size
+                self._evictable_cache[address] = maybe_cached_pricer
+                return maybe_cached_pricer
+
+            maybe_cached_pricer = self._cache.get(address, None)
             if maybe_cached_pricer is not None:
                 self._cache_hits += 1
                 return maybe_cached_pricer
@@ -535,24 +570,41 @@ class PricerPool:
         if self._db is None:
             return None
 
-        try:
-            with profile('ldb.read'):
-                bs = self._db.Get(key.encode('ascii'))
-                unpickled = pickle.loads(bs)
-            unpickled.set_web3(self._w3)
-            self._evictable_cache[key] = unpickled
-
-            self._soft_cache_hits += 1
-            return unpickled
-        except KeyError:
-            return None
+        with profile('ldb.read'):
+            bs = self._spill_buffer.pop(key, None)
+            if bs is None:
+                try:
+                    bs = self._db.Get(key.encode('ascii'))
+                except KeyError:
+                    return None
+
+            try:
+                pricer = _SPILLABLE_PRICERS[bs[0]].from_spill(self._w3, bytes(bs))
+            except (KeyError, UnknownSpillFormat):
+                # written by an older schema, treat as a miss and rebuild
+                l.debug(f'Could not load spilled pricer {key}, ignoring')
+                return None
+
+        self._evictable_cache[key] = pricer
+        self._soft_cache_hits += 1
+        return pricer
 
     def _evicted(self, k: str, v: typing.Union[UniswapV2Pricer, UniswapV3Pricer]):
+        assert self._db is not None
+        self._spill_buffer[k] = v.to_spill()
+        if len(self._spill_buffer) >= self.SPILL_BATCH_SIZE:
+            self._flush_spills()
+
+    def _flush_spills(self):
+        """
+        Write pending evicted pricers out to leveldb
+        """
         with profile('ldb.write'):
-            assert self._db is not None
-            # cache out to leveldb
-            bs = pickle.dumps(v)
-            self._db.Put(k.encode('ascii'), bs)
+            batch = leveldb.WriteBatch()
+            for k, bs in self._spill_buffer.items():
+                batch.Put(k.encode('ascii'), bs)
+            self._db.Write(batch)
+            self._spill_buffer.clear()
 
     def _maybe_log_stats(self):
         if time.time() > self._last_stat_log_ts + self.__class__.STAT_LOG_PERIOD_SECONDS:
@@ -2,7 +2,16 @@
 pricers/token_transfer.py
 
 Some tokens burn-on-transfer. Handle that logic here.
+
+Tokens not listed here are looked up in the shared fee store (see fee_store.py),
+which the relay fills as it infers new fees. Callers here do not say who is moving
+the token, so only fees the store has seen charged the same between every pair of
+addresses are applied; the relay prices the rest per (from, to).
 """
+import math
+import typing
+
+from . import fee_store
 
 SAITAMA_TOKEN = '0x8B3192f5eEBD8579568A2Ed41E6FEB402f93f73F'
 SANSHU_INU_TOKEN = '0xc73C167E7a4Ba109e4052f70D5466D0C312A344D'
@@ -17,6 +26,12 @@ RYOSHIS_VISION_TOKEN = '0x777E2ae845272a2F540ebf6a3D03734A5a8f618e'
 TENSET_TOKEN = '0x7FF4169a6B5122b664c51c95727d87750eC07c84'
 
 def is_known_fee(address: str) -> bool:
+    if _is_listed_fee(address):
+        return True
+    store = fee_store.get_fee_store()
+    return store is not None and store.has_fee(address, fee_store.MIN_CONFIDENCE)
+
+def _is_listed_fee(address: str) -> bool:
     return address in [
         SAITAMA_TOKEN,
         SANSHU_INU_TOKEN,
@@ -51,8 +66,20 @@ def out_from_transfer(address: str, amount: int) -> int:
         return amount * 9998 // 10_000
     elif address in [DEGO_FINANCE_TOKEN]:
         return amount * 998 // 1_000
+
+    maybe_fee = _inferred_fee(address)
+    if maybe_fee is not None:
+        if maybe_fee.round_down:
+            return int(amount * maybe_fee.fee)
+        return math.ceil(amount * maybe_fee.fee)
     return amount
 
+def _inferred_fee(address: str) -> typing.Optional[fee_store.FeeEstimate]:
+    store = fee_store.get_fee_store()
+    if store is None:
+        return None
+    return store.uniform_fee(address)
+
 def in_from_transfer(address: str, amount: int, debug = False) -> int:
     """
     Get the amount needed to be sent to the recipient if `amount` is desired to be actually received.
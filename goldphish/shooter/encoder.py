@@ -136,3 +136,68 @@ def serialize(l: typing.List[typing.Union[UniswapV2Swap, UniswapV3Swap, Balancer
     builder.extend(serialized)
     return b''.join(builder)
 
+
+
+class CalldataTemplate:
+    """
+    The serialized form of a swap list, with its amounts as holes at fixed offsets.
+
+    Everything else in the calldata (exchanges, recipients, directions, action types, offsets)
+    depends only on the shape of the swap list, so a template compiled once can encode
+    any number of amount variants with a copy and a few 32-byte writes.
+    """
+    # (offset, signed, must_be_positive) of each amount, in serialization order
+    fields: typing.List[typing.Tuple[int, bool, bool]]
+
+    # the amounts the template was compiled with, in the same order
+    compiled_amounts: typing.List[int]
+
+    _base: bytes
+
+    def __init__(self, swaps: typing.List[typing.Union[UniswapV2Swap, UniswapV3Swap, BalancerV1Swap, BalancerV2Swap]]) -> None:
+        self._base = serialize(swaps)
+        self.fields = []
+        self.compiled_amounts = []
+        self._compile(swaps, 0)
+        assert len(set(offset for offset, _, _ in self.fields)) == len(self.fields)
+
+    def _compile(self, swaps: typing.List, offset: int):
+        # skip the count and the (type, offset) table, see serialize()
+        offset += 1 + 3 * 3
+        for swap in swaps:
+            if isinstance(swap, UniswapV2Swap):
+                # only the first swap of a circuit sends input, the others are paid by the previous exchange
+                if swap.amount_in:
+                    self._add_field(offset, False, False, swap.amount_in)
+                self._add_field(offset + 32, False, False, swap.amount_out)
+            elif isinstance(swap, UniswapV3Swap):
+                self._add_field(offset, True, True, swap.amount_in)
+                if len(swap.leading_exchanges) > 0:
+                    # amount, exchange, to, zero_for_one, extradata length, must_send_input
+                    self._compile(swap.leading_exchanges, offset + 32 + 20 + 20 + 1 + 2 + 1)
+            elif isinstance(swap, BalancerV1Swap):
+                self._add_field(offset, False, True, swap.amount_in)
+            elif isinstance(swap, BalancerV2Swap):
+                self._add_field(offset + 32, False, True, swap.amount_in)
+                self._add_field(offset + 64, False, True, swap.amount_out)
+            else:
+                raise ValueError(f'cannot compile {type(swap)}')
+            offset += len(swap.serialize())
+
+    def _add_field(self, offset: int, signed: bool, must_be_positive: bool, amount: int):
+        self.fields.append((offset, signed, must_be_positive))
+        self.compiled_amounts.append(amount)
+
+    def encode(self, amounts: typing.Sequence[int]) -> bytes:
+        """
+        Encode with the given amounts, in the order of `fields`
+        """
+        assert len(amounts) == len(self.fields)
+        buf = bytearray(self._base)
+        for (offset, signed, must_be_positive), amount in zip(self.fields, amounts):
+            assert amount > 0 or not must_be_positive
+            buf[offset:offset + 32] = amount.to_bytes(32, byteorder='big', signed=signed)
+        return bytes(buf)
+
+    def encode_many(self, amounts_list: typing.Iterable[typing.Sequence[int]]) -> typing.List[bytes]:
+        return [self.encode(amounts) for amounts in amounts_list]
@@ -0,0 +1,64 @@
+import decimal
+import web3
+
+from pricers.balancer import (
+    FINALIZED_SLOT, RECORD_BALANCE_OFFSET, RECORD_DENORM_OFFSET, RECORDS_SLOT, SWAP_FEE_SLOT,
+    TOKEN_BASE_SLOT, TOKENS_SLOT, TOTAL_WEIGHT_SLOT, BalancerPricer,
+)
+from utils.fake_node import FakeNodeProvider, Snapshot
+
+POOL = web3.Web3.toChecksumAddress('0x' + '0b' * 20)
+TOKENS = [web3.Web3.toChecksumAddress('0x' + f'{i:02x}' * 20) for i in (0xa1, 0xa2, 0xa3)]
+BONE = 10 ** 18
+
+
+def _record_slot(token: str, offset: int) -> int:
+    base = web3.Web3.keccak(bytes.fromhex(token[2:]).rjust(32, b'\x00') + RECORDS_SLOT.to_bytes(32, 'big'))
+    return int.from_bytes(base, 'big') + offset
+
+
+def _pool_snapshot(balances, denorms, swap_fee) -> Snapshot:
+    snapshot = Snapshot()
+    snapshot.set_storage(POOL, TOKENS_SLOT, len(TOKENS))
+    for i, token in enumerate(TOKENS):
+        snapshot.set_storage(POOL, TOKEN_BASE_SLOT + i, int(token, 16))
+        snapshot.set_storage(POOL, _record_slot(token, RECORD_DENORM_OFFSET), denorms[i])
+        snapshot.set_storage(POOL, _record_slot(token, RECORD_BALANCE_OFFSET), balances[i])
+    snapshot.set_storage(POOL, FINALIZED_SLOT, 1)
+    snapshot.set_storage(POOL, SWAP_FEE_SLOT, swap_fee)
+    snapshot.set_storage(POOL, TOTAL_WEIGHT_SLOT, sum(denorms))
+    return snapshot
+
+
+def test_state_loads_in_batches():
+    # unused storage (the tail of the token array) reads as zero
+    provider = FakeNodeProvider(_pool_snapshot([100 * BONE, 200 * BONE, 300 * BONE], [10 * BONE, 20 * BONE, 20 * BONE], BONE // 1000), strict=False)
+    pricer = BalancerPricer(web3.Web3(provider), POOL)
+
+    assert pricer.get_tokens(1) == set(TOKENS)
+    assert provider.round_trips == 1
+    assert pricer.get_balance(TOKENS[1], 1) == 200 * BONE
+    assert provider.round_trips == 2
+
+    assert pricer.get_public_swap(1) == True
+    assert pricer.get_swap_fee(1) == BONE // 1000
+    assert [pricer.get_balance(t, 1) for t in TOKENS] == [100 * BONE, 200 * BONE, 300 * BONE]
+    assert [pricer.get_denorm_weight(t, 1) for t in TOKENS] == [10 * BONE, 20 * BONE, 20 * BONE]
+    assert pricer.get_token_weight(TOKENS[0], 1) == decimal.Decimal('0.2')
+    assert provider.round_trips == 2
+
+    # losing one balance re-reads just that one, in a single round-trip
+    del pricer._balance_cache[TOKENS[2]]
+    assert pricer.get_balance(TOKENS[2], 1) == 300 * BONE
+    assert provider.round_trips == 3
+    assert provider.request_counts['eth_getStorageAt'] == (1 + 8) + (4 + 2 * 3) + 1
+
+
+def test_swap_against_loaded_state():
+    provider = FakeNodeProvider(_pool_snapshot([100 * BONE, 100 * BONE, 100 * BONE], [BONE, BONE, BONE], 0), strict=False)
+    pricer = BalancerPricer(web3.Web3(provider), POOL)
+
+    amount_out, _ = pricer.token_out_for_exact_in(TOKENS[0], TOKENS[1], BONE, 1)
+    # equal weights and no fee: out = 100 * (1 - 100 / 101)
+    assert abs(amount_out - 100 * BONE // 101) < BONE // 10 ** 6
+    assert provider.round_trips == 2
@@ -0,0 +1,39 @@
+from benchmarks.__main__ import STAGES, StageResult, find_regressions, run_stage, to_baseline
+from benchmarks.fixtures import load_block_fixture, synthetic_circuits
+from find_circuit.find import PricingCircuit, detect_arbitrages_bisection
+
+
+def test_stages_run_over_fixture():
+    fixture = load_block_fixture()
+    for stage in STAGES:
+        result = run_stage(stage, fixture, rounds=1, warmup=0)
+        assert result.n_units > 0
+        assert len(result.block_seconds) == 1
+        assert len(result.unit_seconds) == result.n_units
+
+
+def test_synthetic_circuits():
+    found = {}
+    for circuit in synthetic_circuits():
+        pc = PricingCircuit([f() for f in circuit.exchanges], circuit.directions)
+        found[circuit.name] = detect_arbitrages_bisection(pc, 'latest')
+
+    assert len(found['v3-v2 two hop']) > 0
+    assert len(found['v3-v3-v2 three hop']) > 0
+    assert found['v2-v2 no arbitrage'] == []
+    assert all(arb.profit > 0 for arb in found['v3-v2 two hop'])
+
+
+def test_find_regressions():
+    baseline = to_baseline([
+        StageResult('a', 'txn', 1, [1.0], [1.0]),
+        StageResult('b', 'txn', 1, [1.0], [1.0]),
+    ])
+    results = [
+        StageResult('a', 'txn', 1, [1.1, 1.2, 1.2], [1.0]),
+        StageResult('b', 'txn', 1, [1.5], [1.0]),
+        StageResult('new', 'txn', 1, [9.0], [1.0]),
+    ]
+    regressions = find_regressions(results, baseline, threshold=0.25)
+    assert [r.stage for r in regressions] == ['b']
+    assert regressions[0].ratio == 1.5
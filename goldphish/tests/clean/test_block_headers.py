@@ -0,0 +1,125 @@
+import gc
+import typing
+import weakref
+
+import pytest
+import web3
+
+from utils import get_block_timestamp
+from utils.block_headers import HeaderCache, get_header_cache
+from utils.fake_node import FakeNodeProvider, Snapshot
+
+LONDON_BLOCK = 12_965_000
+
+
+def _chain(start_block: int, end_block_exclusive: int, tip: typing.Optional[int] = None) -> Snapshot:
+    snapshot = Snapshot()
+    # by default, long final
+    snapshot.record('eth_blockNumber', [], hex(tip if tip is not None else end_block_exclusive + 1_000))
+    for block_number in range(start_block, end_block_exclusive):
+        block = {
+            'number': hex(block_number),
+            'timestamp': hex(1_600_000_000 + 12 * block_number),
+            'miner': '0x' + (block_number % 256).to_bytes(1, 'big').hex() * 20,
+        }
+        if block_number >= LONDON_BLOCK:
+            block['baseFeePerGas'] = hex(10 ** 9 + block_number)
+        snapshot.record('eth_getBlockByNumber', [hex(block_number), False], block)
+    # past the tip
+    for block_number in range(end_block_exclusive, end_block_exclusive + 64):
+        snapshot.record('eth_getBlockByNumber', [hex(block_number), False], None)
+    return snapshot
+
+
+def test_readahead_and_bound():
+    start = LONDON_BLOCK - 5
+    provider = FakeNodeProvider(_chain(start, start + 100))
+    cache = HeaderCache(web3.Web3(provider), max_entries=50, readahead=9)
+
+    header = cache.get(start)
+    assert header.timestamp == 1_600_000_000 + 12 * start
+    assert header.miner == web3.Web3.toChecksumAddress('0x' + (start % 256).to_bytes(1, 'big').hex() * 20)
+    assert header.base_fee_per_gas is None
+    assert provider.round_trips == 1
+
+    # the next block continues a scan, so the blocks after it come in the same batch
+    cache.get(start + 1)
+    assert cache.base_fee(LONDON_BLOCK) == 10 ** 9 + LONDON_BLOCK
+    assert provider.round_trips == 2
+    assert len(cache._cache) == 11
+
+    # one round-trip for the whole range, even though it does not all stay in memory
+    cache.prefetch(start, start + 100)
+    assert provider.round_trips == 3
+    assert len(cache._cache) == 50
+
+    # past the tip
+    with pytest.raises(ValueError):
+        cache.get(start + 100)
+
+
+def test_no_readahead_on_random_access():
+    provider = FakeNodeProvider(_chain(100, 300))
+    cache = HeaderCache(web3.Web3(provider), readahead=32)
+
+    for block_number in [250, 120, 290, 121, 122]:
+        cache.get(block_number)
+    assert provider.request_counts['eth_getBlockByNumber'] == 5 + 32
+
+    # a scan reads ahead again from the end of each batch
+    for block_number in range(122, 122 + 33 + 1):
+        cache.get(block_number)
+    assert provider.request_counts['eth_getBlockByNumber'] == 5 + 32 + 1 + 32
+
+
+def test_persists_to_disk(tmp_path):
+    path = str(tmp_path / 'headers.bin')
+    start = LONDON_BLOCK - 2
+    cache = HeaderCache(web3.Web3(FakeNodeProvider(_chain(start, start + 4))), path=path)
+    cache.prefetch(start, start + 4)
+    expected = [cache.get(b) for b in range(start, start + 4)]
+    cache.close()
+
+    provider = FakeNodeProvider()
+    cache = HeaderCache(web3.Web3(provider), path=path)
+    assert [cache.get(b) for b in range(start, start + 4)] == expected
+    assert provider.round_trips == 0
+
+
+def test_get_block_timestamp_is_shared():
+    provider = FakeNodeProvider(_chain(100, 200))
+    w3 = web3.Web3(provider)
+    assert get_block_timestamp(w3, 100) == 1_600_000_000 + 1_200
+    assert get_block_timestamp(w3, 101) == 1_600_000_000 + 1_212
+    assert get_header_cache(w3).miner(102) == web3.Web3.toChecksumAddress('0x' + '66' * 20)
+    assert provider.round_trips == 2
+
+
+def test_only_final_blocks_persist(tmp_path):
+    path = str(tmp_path / 'headers.bin')
+    start = LONDON_BLOCK
+    cache = HeaderCache(web3.Web3(FakeNodeProvider(_chain(start, start + 10, tip = start + 9))), path=path, finality_depth=5)
+    cache.prefetch(start, start + 10)
+    cache.close()
+
+    cache = HeaderCache(web3.Web3(FakeNodeProvider()), path=path)
+    assert cache.get(start + 4).number == start + 4
+    # not on file, so it goes to the (empty) node
+    with pytest.raises(Exception, match='could not fetch'):
+        cache.get(start + 5)
+
+
+def test_shared_cache_goes_with_connection(tmp_path, monkeypatch):
+    monkeypatch.setenv('BLOCK_HEADER_CACHE', str(tmp_path / 'headers.bin'))
+    w3 = web3.Web3(FakeNodeProvider(_chain(100, 200)))
+    # not the archive node, so not backed by the file
+    assert get_header_cache(w3).path is None
+
+    caches = []
+    for _ in range(5):
+        w3 = web3.Web3(FakeNodeProvider(_chain(100, 200)))
+        get_header_cache(w3).get(100)
+        caches.append(weakref.ref(get_header_cache(w3)))
+    del w3
+    gc.collect()
+    assert all(cache() is None for cache in caches)
@@ -0,0 +1,95 @@
+import collections
+import datetime
+import decimal
+import os
+import sys
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pytest.importorskip('duckdb')
+pytest.importorskip('pandas')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'analysis_scripts'))
+
+from common import block_range_filter, connect_parquet
+from export_parquet import _schema, write_table
+
+Column = collections.namedtuple('Column', ['name', 'type_code'])
+
+# as a psycopg2 cursor describes them
+DESCRIPTION = [
+    Column('id', 23),
+    Column('block_number', 20),
+    Column('txn_hash', 17),
+    Column('profit', 1700),
+    Column('exchanges', 1001),
+    Column('found_on', 1114),
+    Column('note', 3802), # jsonb, not mapped
+]
+
+ROWS = [
+    (1, 13_999_999, memoryview(b'\x01' * 32), decimal.Decimal(10 ** 20), [memoryview(b'\xaa' * 20)], datetime.datetime(2022, 1, 1), {'a': 1}),
+    (2, 14_000_000, memoryview(b'\x02' * 32), decimal.Decimal('0.5'), [], datetime.datetime(2022, 1, 2), None),
+    (3, 14_000_001, memoryview(b'\x03' * 32), None, None, None, None),
+]
+
+
+def test_schema():
+    schema, _ = _schema(DESCRIPTION)
+    assert schema.types == [
+        pa.int32(),
+        pa.int64(),
+        pa.binary(),
+        pa.float64(),
+        pa.list_(pa.binary()),
+        pa.timestamp('us'),
+        pa.string(),
+    ]
+
+
+def test_round_trip_partitioned(tmp_path):
+    n_rows = write_table(str(tmp_path), 'sample_arbitrages', DESCRIPTION, [ROWS[:2], ROWS[2:]], 'block_number')
+    assert n_rows == 3
+    assert sorted(os.listdir(tmp_path)) == ['sample_arbitrages']
+    assert sorted(os.listdir(tmp_path / 'sample_arbitrages')) == ['block_bucket=13000000', 'block_bucket=14000000']
+
+    conn = connect_parquet(str(tmp_path))
+    got = conn.execute('SELECT id, block_number, txn_hash, profit, exchanges, found_on, note, block_bucket FROM sample_arbitrages ORDER BY id').fetchall()
+    assert got == [
+        (1, 13_999_999, b'\x01' * 32, 1e20, [b'\xaa' * 20], datetime.datetime(2022, 1, 1), "{'a': 1}", 13_000_000),
+        (2, 14_000_000, b'\x02' * 32, 0.5, [], datetime.datetime(2022, 1, 2), None, 14_000_000),
+        (3, 14_000_001, b'\x03' * 32, None, None, None, None, 14_000_000),
+    ]
+
+    # the filter only opens the partitions it needs, so breaking another does not matter
+    # (the first file gives the schema, so break the last)
+    with open(tmp_path / 'sample_arbitrages' / 'block_bucket=14000000' / 'part-0.parquet', mode='wb') as fout:
+        fout.write(b'not parquet')
+    got = conn.execute(f'SELECT id FROM sample_arbitrages WHERE {block_range_filter(13_500_000, 13_999_999)}').fetchall()
+    assert got == [(1,)]
+    with pytest.raises(Exception, match='parquet'):
+        conn.execute('SELECT id FROM sample_arbitrages WHERE block_number < 14_000_000').fetchall()
+
+
+def test_round_trip_unpartitioned(tmp_path):
+    assert write_table(str(tmp_path), 'tokens', DESCRIPTION, [ROWS], None) == 3
+    assert write_table(str(tmp_path), 'empty', DESCRIPTION, [], 'block_number') == 0
+    assert sorted(os.listdir(tmp_path / 'tokens')) == ['part-0.parquet']
+
+    conn = connect_parquet(str(tmp_path))
+    assert conn.execute('SELECT id FROM tokens ORDER BY id').fetchall() == [(1,), (2,), (3,)]
+    assert conn.execute('SELECT COUNT(*) FROM empty').fetchall() == [(0,)]
+
+
+def test_null_and_empty_partitions(tmp_path):
+    no_block = (4, None, memoryview(b'\x04' * 32), None, None, None, None)
+    assert write_table(str(tmp_path), 'sample_arbitrages', DESCRIPTION, [[ROWS[0], no_block]], 'block_number') == 2
+    assert write_table(str(tmp_path), 'empty', DESCRIPTION, [], 'block_number') == 0
+    assert sorted(os.listdir(tmp_path / 'sample_arbitrages')) == ['block_bucket=13000000', 'block_bucket=null']
+    assert sorted(os.listdir(tmp_path / 'empty')) == ['block_bucket=null']
+
+    conn = connect_parquet(str(tmp_path))
+    assert conn.execute('SELECT id, block_bucket FROM sample_arbitrages ORDER BY id').fetchall() == [(1, 13_000_000), (4, None)]
+    assert conn.execute(f'SELECT id FROM sample_arbitrages WHERE {block_range_filter(13_000_000, 13_999_999)}').fetchall() == [(1,)]
+    assert conn.execute(f'SELECT COUNT(*) FROM empty WHERE {block_range_filter(13_000_000, 13_999_999)}').fetchall() == [(0,)]
@@ -0,0 +1,115 @@
+import time
+import pytest
+import web3
+import web3.providers
+from eth_abi import encode_abi
+
+from pricers.uniswap_v2 import UniswapV2Pricer
+from utils import get_abi
+from utils.fake_node import FakeNodeProvider, Snapshot
+
+PAIR = '0x0d4a11d5EEaaC28EC3F61d100daF4d40471f1852'
+TOKEN0 = '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2'
+TOKEN1 = '0xdAC17F958D2ee523a2206206994597C13D831ec7'
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
+class _UpstreamProvider(web3.providers.BaseProvider):
+    """Stands in for a real node when recording"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.n_requests = 0
+
+    def make_request(self, method, params):
+        self.n_requests += 1
+        if method == 'eth_getStorageAt':
+            return {'jsonrpc': '2.0', 'id': 1, 'result': '0x' + ((7 << 112) | 5).to_bytes(32, 'big').hex()}
+        if method == 'eth_getLogs':
+            return {'jsonrpc': '2.0', 'id': 1, 'result': [_log(100), _log(150), _log(200)]}
+        return {'jsonrpc': '2.0', 'id': 1, 'result': '0x1'}
+
+    def isConnected(self):
+        return True
+
+
+def _log(block_number: int) -> dict:
+    return {
+        'address': TOKEN0,
+        'topics': [TRANSFER_TOPIC, '0x' + '00' * 32, '0x' + '00' * 32],
+        'data': '0x' + '00' * 32,
+        'blockNumber': hex(block_number),
+        'blockHash': '0x' + block_number.to_bytes(32, 'big').hex(),
+        'transactionHash': '0x' + block_number.to_bytes(32, 'big').hex(),
+        'transactionIndex': '0x0',
+        'logIndex': '0x0',
+        'removed': False,
+    }
+
+
+def test_replay_storage_and_calls():
+    snapshot = Snapshot()
+    snapshot.set_storage(PAIR, 8, (2_000 << 112) | 1_000, block_identifier=15_000_000)
+    provider = FakeNodeProvider(snapshot)
+    w3 = web3.Web3(provider)
+
+    pricer = UniswapV2Pricer(w3, PAIR, TOKEN0, TOKEN1)
+    assert pricer.get_balances(15_000_000) == (1_000, 2_000)
+
+    # not recorded at that block
+    with pytest.raises(ValueError):
+        UniswapV2Pricer(w3, PAIR, TOKEN0, TOKEN1).get_balances(15_000_001)
+
+    erc20 = w3.eth.contract(address=TOKEN1, abi=get_abi('erc20.abi.json'))
+    snapshot.set_call(TOKEN1, erc20.encodeABI(fn_name='decimals'), encode_abi(['uint8'], [6]))
+    assert erc20.functions.decimals().call(block_identifier=15_000_000) == 6
+
+    assert provider.request_counts['eth_getStorageAt'] == 2
+    assert provider.request_counts['eth_call'] == 1
+
+
+def test_non_strict_storage_reads_zero():
+    w3 = web3.Web3(FakeNodeProvider(strict=False))
+    assert w3.eth.get_storage_at(PAIR, 3) == b'\x00' * 32
+
+
+def test_record_then_replay(tmp_path):
+    upstream = _UpstreamProvider()
+    recorder = FakeNodeProvider(upstream=upstream)
+    w3 = web3.Web3(recorder)
+
+    assert UniswapV2Pricer(w3, PAIR, TOKEN0, TOKEN1).get_balances(100) == (5, 7)
+    logs = w3.eth.get_logs({'fromBlock': 100, 'toBlock': 200, 'topics': [TRANSFER_TOPIC]})
+    assert len(logs) == 3
+    assert w3.eth.block_number == 1
+    assert upstream.n_requests == 3
+
+    path = str(tmp_path / 'snapshot.json.gz')
+    recorder.snapshot.save(path)
+
+    w3 = web3.Web3(FakeNodeProvider(Snapshot.load(path)))
+    assert UniswapV2Pricer(w3, PAIR, TOKEN0, TOKEN1).get_balances(100) == (5, 7)
+    assert w3.eth.block_number == 1
+
+    # a sub-range of a recorded range is served by filtering
+    logs = w3.eth.get_logs({'fromBlock': 120, 'toBlock': 160, 'topics': [TRANSFER_TOPIC, None]})
+    assert [x['blockNumber'] for x in logs] == [150]
+
+    # but not a different filter, nor a range outside the recording
+    with pytest.raises(ValueError):
+        w3.eth.get_logs({'fromBlock': 120, 'toBlock': 160, 'address': TOKEN0, 'topics': [TRANSFER_TOPIC]})
+    with pytest.raises(ValueError):
+        w3.eth.get_logs({'fromBlock': 120, 'toBlock': 260, 'topics': [TRANSFER_TOPIC]})
+
+
+def test_latency_per_round_trip():
+    snapshot = Snapshot()
+    snapshot.set_storage(PAIR, 8, 1)
+    provider = FakeNodeProvider(snapshot, latency_seconds=0.05)
+
+    t_start = time.time()
+    resps = provider.make_request_batch([('eth_getStorageAt', [PAIR, hex(8), 'latest'])] * 10)
+    elapsed = time.time() - t_start
+
+    assert [r['result'][-1] for r in resps] == ['1'] * 10
+    assert 0.05 <= elapsed < 0.5
@@ -0,0 +1,174 @@
+import decimal
+import os
+import types
+
+import pricers.fee_store
+import pricers.token_transfer
+from backtest.top_of_block.relay import InferredTokenTransferFeeCalculator, insert_inferred_fees
+from pricers.fee_store import FeeStore, get_fee_store
+
+TOKEN = '0x' + 'ab' * 20
+OTHER_TOKEN = '0x' + 'cd' * 20
+POOL_1 = '0x' + '01' * 20
+POOL_2 = '0x' + '02' * 20
+SHOOTER = '0x' + '05' * 20
+
+
+def test_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'fees.log')
+    # two instances on one file stand in for two worker processes
+    a = FeeStore(path)
+    b = FeeStore(path, refresh_seconds = 3600)
+
+    a.record(1, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.98'), True, 15_000_000)
+    assert a.get(TOKEN, POOL_1, SHOOTER).fee == decimal.Decimal('0.98')
+
+    # b only looks when its refresh period is up
+    assert b.get(TOKEN, POOL_1, SHOOTER) is None
+    assert b.refresh() == 1
+    estimate = b.get(TOKEN, POOL_1, SHOOTER)
+    assert (estimate.id_, estimate.fee, estimate.round_down, estimate.confidence, estimate.block_number) == (1, decimal.Decimal('0.98'), True, 1, 15_000_000)
+    assert b.has_fee(TOKEN) and not b.has_fee(OTHER_TOKEN)
+
+    # a fresh worker replays the whole log
+    fee = decimal.Decimal('0.9712345678901234567890123456')
+    a.record(2, TOKEN, SHOOTER, POOL_2, fee, False, 15_000_001)
+    assert FeeStore(path).get(TOKEN, SHOOTER, POOL_2).fee == fee
+
+
+def test_majority_vote(tmp_path):
+    store = FeeStore(str(tmp_path / 'fees.log'))
+
+    def observe(id_: int, fee: str):
+        store.record(id_, TOKEN, POOL_1, SHOOTER, decimal.Decimal(fee), True, 1)
+        return store.get(TOKEN, POOL_1, SHOOTER)
+
+    assert observe(1, '0.98').confidence == 1
+    # agreeing observations build confidence, and the estimate keeps the lower fee (and its row)
+    estimate = observe(2, '0.9799999')
+    assert (estimate.id_, estimate.fee, estimate.confidence) == (2, decimal.Decimal('0.9799999'), 2)
+    assert observe(3, '0.98').id_ == 2
+    # outliers only dent it
+    estimate = observe(4, '0.5')
+    assert (estimate.fee, estimate.confidence) == (decimal.Decimal('0.9799999'), 2)
+    estimate = observe(5, '0.5')
+    assert (estimate.fee, estimate.confidence) == (decimal.Decimal('0.9799999'), 1)
+    # a third takes over
+    estimate = observe(6, '0.5')
+    assert (estimate.id_, estimate.fee, estimate.confidence) == (6, decimal.Decimal('0.5'), 1)
+
+    # the per-token estimate is the most confident of any mover pair
+    store.record(4, TOKEN, POOL_2, SHOOTER, decimal.Decimal('0.9'), True, 1)
+    store.record(5, TOKEN, POOL_2, SHOOTER, decimal.Decimal('0.9'), True, 1)
+    assert store.token_fee(TOKEN).fee == decimal.Decimal('0.9')
+
+    # and falls back to the next most confident when it loses confidence
+    store.record(6, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.5'), True, 1)
+    store.record(7, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.5'), True, 1)
+    assert store.token_fee(TOKEN).fee == decimal.Decimal('0.5')
+    store.record(8, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.6'), True, 1)
+    store.record(9, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.6'), True, 1)
+    assert store.token_fee(TOKEN).fee == decimal.Decimal('0.9')
+
+
+def test_uniform_fee(tmp_path):
+    store = FeeStore(str(tmp_path / 'fees.log'))
+
+    def observe(from_address: str, to_address: str, fee: str, n: int = 2):
+        for _ in range(n):
+            store.record(10, TOKEN, from_address, to_address, decimal.Decimal(fee), True, 1)
+
+    observe(POOL_1, SHOOTER, '0.98')
+    assert store.uniform_fee(TOKEN).fee == decimal.Decimal('0.98')
+    # an unconfirmed disagreement does not count
+    observe(SHOOTER, POOL_2, '1', n=1)
+    assert store.uniform_fee(TOKEN).fee == decimal.Decimal('0.98')
+    # a confirmed one does: the fee depends on who moves the token
+    observe(SHOOTER, POOL_2, '1')
+    assert store.uniform_fee(TOKEN) is None
+    assert store.has_fee(TOKEN)
+
+
+def test_skips_torn_records(tmp_path):
+    path = str(tmp_path / 'fees.log')
+    store = FeeStore(path)
+    store.record(11, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.98'), True, 1)
+
+    # a writer died part-way through a record
+    with open(path, 'ab') as fout:
+        fout.write(b'\xff' * 30)
+    store.record(12, OTHER_TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.99'), True, 1)
+
+    reader = FeeStore(path)
+    assert reader.n_records == 2
+    assert reader.get(OTHER_TOKEN, POOL_1, SHOOTER).fee == decimal.Decimal('0.99')
+    assert os.path.getsize(path) % pricers.fee_store._RECORD.size == 0
+
+
+def test_token_transfer_uses_confident_fees(tmp_path, monkeypatch):
+    monkeypatch.setenv('FEE_STORE_PATH', str(tmp_path / 'fees.log'))
+    monkeypatch.setattr(pricers.fee_store, '_store', None)
+
+    store = get_fee_store()
+    assert get_fee_store() is store
+    store.record(13, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.97'), True, 1)
+    assert pricers.token_transfer.out_from_transfer(TOKEN, 1_000) == 1_000
+    assert not pricers.token_transfer.is_known_fee(TOKEN)
+
+    store.record(14, TOKEN, POOL_2, POOL_1, decimal.Decimal('0.97'), True, 1)
+    store.record(15, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.97'), True, 1)
+    assert pricers.token_transfer.out_from_transfer(TOKEN, 1_000) == 970
+    assert pricers.token_transfer.is_known_fee(TOKEN)
+
+    # once it is seen to depend on the movers, it is not applied without them
+    store.record(16, TOKEN, SHOOTER, POOL_2, decimal.Decimal('0.99'), True, 1)
+    store.record(17, TOKEN, SHOOTER, POOL_2, decimal.Decimal('0.99'), True, 1)
+    assert pricers.token_transfer.out_from_transfer(TOKEN, 1_000) == 1_000
+    assert pricers.token_transfer.is_known_fee(TOKEN)
+
+    # listed tokens are unaffected
+    assert pricers.token_transfer.out_from_transfer(pricers.token_transfer.CULT_DAO_TOKEN, 1_000) == 996
+    assert pricers.token_transfer.out_from_transfer(OTHER_TOKEN, 1_000) == 1_000
+
+
+class _InsertCursor:
+    """Answers insert_inferred_fees' INSERT ... RETURNING id with new ids"""
+
+    def __init__(self) -> None:
+        self.inserted = []
+        self.rowcount = 0
+
+    def execute(self, query, params):
+        assert 'INSERT INTO inferred_token_fee_on_transfer' in query
+        self.inserted.append(params)
+        self.rowcount = 1
+
+    def fetchone(self):
+        return (1_000 + len(self.inserted),)
+
+
+def test_relay_inserts_and_shares_only_new_fees(tmp_path):
+    store = FeeStore(str(tmp_path / 'fees.log'))
+    store.record(41, TOKEN, POOL_1, SHOOTER, decimal.Decimal('0.98'), True, 1)
+
+    calculator = InferredTokenTransferFeeCalculator(store)
+    from_store = calculator._fee_for(TOKEN, POOL_1, SHOOTER)
+    assert from_store.id_ == 41
+    calculator.propose(TOKEN, SHOOTER, POOL_2, decimal.Decimal('0.97'), True)
+    proposed = calculator._fee_for(TOKEN, SHOOTER, POOL_2)
+    assert proposed.id_ is None
+
+    # two shots, each using the shared fee and the new one
+    successes = [types.SimpleNamespace(token_fees_used = [from_store, proposed]) for _ in range(2)]
+    curr = _InsertCursor()
+    new_fees = insert_inferred_fees(curr, successes, 100)
+
+    assert len(curr.inserted) == 1
+    assert new_fees == [proposed._replace(id_ = 1_001, block_number = 100)]
+    for success in successes:
+        assert success.token_fees_used == [from_store, new_fees[0]]
+
+    for tf in new_fees:
+        calculator.share(tf)
+    assert store.get(TOKEN, POOL_1, SHOOTER).confidence == 1
+    assert store.get(TOKEN, SHOOTER, POOL_2).id_ == 1_001
@@ -0,0 +1,153 @@
+import random
+
+import web3
+import web3.providers
+from eth_utils import event_abi_to_log_topic
+
+from backtest.gather_samples.fill_arb_sandwich.__main__ import BlockIndex, SampleInfo, load_sample_info
+from backtest.gather_samples.receipts import BlockReceiptCache
+from utils import erc20
+
+TRANSFER_TOPIC = '0x' + event_abi_to_log_topic(erc20.events.Transfer().abi).hex()
+TOKEN = web3.Web3.toChecksumAddress('0x' + 'aa' * 20)
+WETH = web3.Web3.toChecksumAddress('0x' + 'ee' * 20)
+EXCHANGE_1 = web3.Web3.toChecksumAddress('0x' + 'e1' * 20)
+EXCHANGE_2 = web3.Web3.toChecksumAddress('0x' + 'e2' * 20)
+
+
+def test_same_relayer_before_matches_scan():
+    rng = random.Random(0)
+    relayers = [f'0x{i:040x}' for i in range(5)] + [None]
+    transactions = [
+        {'hash': i.to_bytes(32, 'big'), 'transactionIndex': i, 'to': rng.choice(relayers)}
+        for i in range(300)
+    ]
+    index = BlockIndex({'transactions': transactions})
+
+    for txn in transactions:
+        idx = txn['transactionIndex']
+        assert index.txn_to_index[txn['hash']] == idx
+        expected = [x for x in transactions[:max(idx - 1, 0)] if x['to'] == txn['to']]
+        assert index.same_relayer_before(txn['to'], idx) == expected
+
+
+class _ReceiptProvider(web3.providers.BaseProvider):
+    """Serves a receipt with one ERC20 transfer per transaction index, and counts what was asked"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.requested = []
+
+    def make_request(self, method, params):
+        return self.make_request_batch([(method, params)])[0]
+
+    def make_request_batch(self, requests):
+        ret = []
+        for i, (method, params) in enumerate(requests):
+            assert method == 'eth_getTransactionReceipt'
+            self.requested.append(params[0])
+            ret.append({'jsonrpc': '2.0', 'id': i, 'result': self._receipt(params[0])})
+        return ret
+
+    def _receipt(self, txn_hash: str):
+        idx = int(txn_hash, base=16)
+        return {
+            'transactionHash': txn_hash,
+            'transactionIndex': hex(idx),
+            'blockHash': '0x' + '22' * 32,
+            'blockNumber': hex(100),
+            'from': '0x' + '01' * 20,
+            'to': '0x' + '02' * 20,
+            'gasUsed': hex(21_000),
+            'cumulativeGasUsed': hex(21_000 * (idx + 1)),
+            'contractAddress': None,
+            'status': '0x1',
+            'logs': [{
+                'address': TOKEN,
+                'topics': [TRANSFER_TOPIC, '0x' + '00' * 12 + '03' * 20, '0x' + '00' * 12 + '04' * 20],
+                'data': '0x' + idx.to_bytes(32, 'big').hex(),
+                'logIndex': hex(idx),
+                'transactionIndex': hex(idx),
+                'transactionHash': txn_hash,
+                'blockHash': '0x' + '22' * 32,
+                'blockNumber': hex(100),
+                'removed': False,
+            }],
+        }
+
+    def isConnected(self):
+        return True
+
+
+def _hash(i: int) -> bytes:
+    return i.to_bytes(32, 'big')
+
+
+def test_block_receipt_cache_hits_and_misses():
+    provider = _ReceiptProvider()
+    cache = BlockReceiptCache(web3.Web3(provider))
+
+    # duplicates are fetched once, and come back in the order asked
+    got = cache.get_many([_hash(1), _hash(2), _hash(1)])
+    assert [r['transactionIndex'] for r in got] == [1, 2, 1]
+    assert len(provider.requested) == 2
+
+    # only the miss goes to the node
+    got = cache.get_many([_hash(2), _hash(3)])
+    assert [r['transactionIndex'] for r in got] == [2, 3]
+    assert provider.requested == ['0x' + _hash(i).hex() for i in (1, 2, 3)]
+
+    assert cache.get(_hash(1)) is cache.get_many([_hash(1)])[0]
+    assert len(provider.requested) == 3
+
+    # transfers are decoded from the cached receipt, once
+    transfers = cache.get_transfers(_hash(3))
+    assert [(t['address'], t['args']['value']) for t in transfers] == [(TOKEN, 3)]
+    assert cache.get_transfers(_hash(3)) is transfers
+    assert len(cache.get_transfers(_hash(4))) == 1
+    assert len(provider.requested) == 4
+
+
+class _FakeCursor:
+    """Answers load_sample_info's two queries, with bytea columns as psycopg2 returns them"""
+
+    SAMPLES = {
+        # id: (profit token, profit, coinbase transfer, exchanges)
+        1: (WETH, 10 ** 18, None, [EXCHANGE_1, EXCHANGE_2]),
+        2: (TOKEN, 5, 7, [EXCHANGE_2]),
+    }
+
+    def __init__(self) -> None:
+        self._rows = []
+
+    def execute(self, query, params):
+        (sample_ids,) = params
+        if 'profit_amount' in query:
+            self._rows = [
+                (id_, memoryview(bytes.fromhex(token[2:])), profit, coinbase_xfer)
+                for id_, (token, profit, coinbase_xfer, _) in self.SAMPLES.items() if id_ in sample_ids
+            ]
+        else:
+            self._rows = [
+                (id_, memoryview(bytes.fromhex(exchange[2:])))
+                for id_, (_, _, _, exchanges) in self.SAMPLES.items() if id_ in sample_ids
+                for exchange in exchanges
+            ]
+
+    @property
+    def rowcount(self):
+        return len(self._rows)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+def test_load_sample_info():
+    got = load_sample_info(web3.Web3(), _FakeCursor(), [1, 2])
+    assert got == {
+        1: SampleInfo(profit_token=WETH, profit_amount=10 ** 18, coinbase_xfer=None, exchanges={EXCHANGE_1, EXCHANGE_2}),
+        2: SampleInfo(profit_token=TOKEN, profit_amount=5, coinbase_xfer=7, exchanges={EXCHANGE_2}),
+    }
@@ -0,0 +1,117 @@
+import decimal
+
+import web3
+
+from backtest.gather_samples.fill_eth_price.__main__ import (
+    AGGREGATOR_SELECTOR,
+    ANSWER_UPDATED_TOPIC,
+    CHAINLINK_ETH_USD_PROXY,
+    LATEST_ROUND_DATA_SELECTOR,
+    MAKER_MEDIANIZER,
+    READ_SELECTOR,
+    find_aggregators,
+    get_price_changes,
+    prices_after,
+)
+from utils.fake_node import FakeNodeProvider, Snapshot
+
+AGGREGATOR_A = web3.Web3.toChecksumAddress('0x' + 'aa' * 20)
+AGGREGATOR_B = web3.Web3.toChecksumAddress('0x' + 'bb' * 20)
+
+PROXY_DEPLOYED = 1_000
+# block -> aggregator the proxy uses from then on
+PHASES = {1_000: AGGREGATOR_A, 5_000: AGGREGATOR_B}
+# aggregator -> [(block, answer)], in order; the first is its answer when the phase starts
+UPDATES = {
+    AGGREGATOR_A: [(1_000, 1_500_00000000), (1_500, 1_510_00000000), (1_500, 1_520_00000000), (3_000, 1_490_00000000), (5_200, 1)],
+    AGGREGATOR_B: [(4_000, 1_480_00000000), (6_000, 1_600_00000000), (9_999, 1_610_00000000)],
+}
+
+
+def _aggregator_at(block_number: int):
+    ret = None
+    for start, aggregator in PHASES.items():
+        if start <= block_number:
+            ret = aggregator
+    return ret
+
+
+def _answer_at(aggregator: str, block_number: int) -> int:
+    return [answer for b, answer in UPDATES[aggregator] if b <= block_number][-1]
+
+
+def _maker_at(block_number: int) -> int:
+    return (1_000 + block_number) * 10 ** 18
+
+
+def _expected_price(block_number: int) -> decimal.Decimal:
+    aggregator = _aggregator_at(block_number)
+    if aggregator is None:
+        return decimal.Decimal(_maker_at(block_number)) / 10 ** 18
+    return decimal.Decimal(_answer_at(aggregator, block_number)) / 10 ** 8
+
+
+LAST_BLOCK = 10_000
+
+
+def _log(aggregator: str, i: int, block_number: int, answer: int) -> dict:
+    return {
+        'address': aggregator,
+        'topics': [web3.Web3.toHex(ANSWER_UPDATED_TOPIC), '0x' + answer.to_bytes(32, 'big', signed=True).hex(), '0x' + i.to_bytes(32, 'big').hex()],
+        'data': '0x' + '00' * 32,
+        'blockNumber': hex(block_number),
+        'blockHash': '0x' + block_number.to_bytes(32, 'big').hex(),
+        'transactionHash': '0x' + (block_number * 1_000 + i).to_bytes(32, 'big').hex(),
+        'transactionIndex': hex(i),
+        'logIndex': hex(i),
+        'removed': False,
+    }
+
+
+def _chain() -> Snapshot:
+    """The proxy, aggregators and medianizer above, up to LAST_BLOCK"""
+    snapshot = Snapshot()
+    for block_number in range(LAST_BLOCK + 1):
+        snapshot.set_call(MAKER_MEDIANIZER, READ_SELECTOR, _maker_at(block_number).to_bytes(32, 'big'), block_number)
+        aggregator = _aggregator_at(block_number)
+        if aggregator is None:
+            # no code yet
+            snapshot.set_call(CHAINLINK_ETH_USD_PROXY, AGGREGATOR_SELECTOR, b'', block_number)
+            snapshot.set_call(CHAINLINK_ETH_USD_PROXY, LATEST_ROUND_DATA_SELECTOR, b'', block_number)
+            continue
+        answer = _answer_at(aggregator, block_number).to_bytes(32, 'big', signed=True)
+        snapshot.set_call(CHAINLINK_ETH_USD_PROXY, AGGREGATOR_SELECTOR, bytes.fromhex(aggregator[2:]).rjust(32, b'\x00'), block_number)
+        snapshot.set_call(CHAINLINK_ETH_USD_PROXY, LATEST_ROUND_DATA_SELECTOR, b'\x00' * 32 + answer + b'\x00' * 96, block_number)
+
+    for aggregator, updates in UPDATES.items():
+        # the first answer was set before the phase started, so it has no log in range
+        snapshot.add_logs(
+            {'address': [aggregator], 'topics': [[web3.Web3.toHex(ANSWER_UPDATED_TOPIC)]], 'fromBlock': 0, 'toBlock': LAST_BLOCK},
+            [_log(aggregator, i, block_number, answer) for i, (block_number, answer) in enumerate(updates) if i > 0],
+        )
+    return snapshot
+
+
+def test_find_aggregators():
+    w3 = web3.Web3(FakeNodeProvider(_chain()))
+    assert find_aggregators(w3, 500, 9_000) == [(500, 999, None), (1_000, 4_999, AGGREGATOR_A), (5_000, 9_000, AGGREGATOR_B)]
+    assert find_aggregators(w3, 2_000, 3_000) == [(2_000, 3_000, AGGREGATOR_A)]
+
+
+def test_price_changes_match_per_block_calls():
+    provider = FakeNodeProvider(_chain())
+    changes = get_price_changes(web3.Web3(provider), 475, 9_999)
+
+    # prices only change where they did
+    assert all(a[1] != b[1] for a, b in zip(changes, changes[1:]))
+    assert [b for b, _ in changes if b >= PROXY_DEPLOYED] == [1_000, 1_500, 3_000, 5_000, 6_000, 9_999]
+
+    # exact from chainlink on, sampled every 50 blocks from maker before
+    block_numbers = list(range(475, 10_000))
+    for block_number, price in zip(block_numbers, prices_after(changes, block_numbers)):
+        sampled = block_number if block_number >= PROXY_DEPLOYED else max(475, block_number - block_number % 50)
+        assert price == _expected_price(sampled), block_number
+
+    assert prices_after(changes, [474]) == [None]
+    # rather than one call every 50 blocks
+    assert provider.round_trips < 20
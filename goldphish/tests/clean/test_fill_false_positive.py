@@ -0,0 +1,154 @@
+"""
+These tests need a Postgres to talk to (configured the same way as connect_db(), ie PSQL_HOST etc)
+and are skipped when none is reachable. They work in a scratch schema which is dropped afterward.
+"""
+
+import psycopg2
+import pytest
+
+from backtest.gather_samples.database import setup_db as setup_samples_db
+from backtest.gather_samples.fill_false_positive.__main__ import gen_false_positives
+from backtest.utils import connect_db
+
+SCHEMA = 'test_fill_false_positive'
+
+ARBITRAGEUR = b'\x01' * 20
+COWSWAP = bytes.fromhex('9008d19f58aabd9ed0d60971565aa8510560ab41')
+EXCHANGE_1 = b'\xe1' * 20
+EXCHANGE_2 = b'\xe2' * 20
+
+
+@pytest.fixture()
+def curr():
+    try:
+        conn = connect_db()
+    except psycopg2.OperationalError:
+        pytest.skip('no postgres available')
+
+    curr = conn.cursor()
+    curr.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA}')
+    setup_samples_db(curr)
+    curr.execute(
+        '''
+        CREATE TABLE sample_arbitrages_odd_tokens (
+            sample_arbitrage_id INTEGER NOT NULL,
+            odd_token BYTEA NOT NULL,
+            outside_token BYTEA NOT NULL,
+            type TEXT NOT NULL
+        );
+        INSERT INTO tokens (id, address) VALUES (1, %s);
+        INSERT INTO sample_arbitrage_exchanges (id, address) VALUES (1, %s), (2, %s);
+        ''',
+        (b'\xaa' * 20, EXCHANGE_1, EXCHANGE_2),
+    )
+    conn.commit()
+
+    yield curr
+
+    conn.rollback()
+    curr.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+    conn.commit()
+    conn.close()
+
+
+def _insert_sample(curr, id_: int, shooter: bytes, exchange_id: int):
+    curr.execute(
+        '''
+        INSERT INTO sample_arbitrages (id, txn_hash, block_number, n_cycles, gas_used, gas_price, shooter)
+        VALUES (%(id)s, %(txn_hash)s, %(id)s, 1, 0, 0, %(shooter)s);
+
+        INSERT INTO sample_arbitrage_cycles (id, sample_arbitrage_id, profit_token, profit_amount)
+        VALUES (%(id)s, %(id)s, 1, 10);
+
+        INSERT INTO sample_arbitrage_cycle_exchanges (id, exchange_idx, cycle_id, token_in, token_out)
+        VALUES (%(id)s, 0, %(id)s, 1, 1);
+
+        INSERT INTO sample_arbitrage_cycle_exchange_items (id, cycle_exchange_id, exchange_id, amount_in, amount_out)
+        VALUES (%(id)s, %(id)s, %(exchange_id)s, 1, 1);
+        ''',
+        {'id': id_, 'txn_hash': id_.to_bytes(32, 'big'), 'shooter': shooter, 'exchange_id': exchange_id},
+    )
+
+
+def _ids(curr, table: str, column: str = 'id'):
+    curr.execute(f'SELECT {column} FROM {table} ORDER BY {column}')
+    return [x for (x,) in curr]
+
+
+def test_gen_false_positives_incremental(curr):
+    _insert_sample(curr, 1, ARBITRAGEUR, 1)
+    _insert_sample(curr, 2, COWSWAP, 1)
+    _insert_sample(curr, 3, ARBITRAGEUR, 1)
+    curr.execute("INSERT INTO sample_arbitrages_odd_tokens VALUES (3, %s, %s, 'x'), (3, %s, %s, 'y')", (b'', b'', b'', b''))
+    curr.connection.commit()
+
+    gen_false_positives(curr)
+
+    curr.execute('SELECT sample_arbitrage_id, reason FROM sample_arbitrage_false_positives ORDER BY 1')
+    assert curr.fetchall() == [(2, 'CoW Swap'), (3, 'odd token')]
+    assert _ids(curr, 'sample_arbitrages_no_fp') == [1]
+    assert _ids(curr, 'sample_arbitrage_cycle_exchange_items_no_fp') == [1]
+    assert _ids(curr, 'sample_arbitrage_exchanges_no_fp') == [1]
+
+    # a new batch: one uses the relayer as an exchange, the other a new exchange
+    _insert_sample(curr, 4, EXCHANGE_1, 1)
+    _insert_sample(curr, 5, ARBITRAGEUR, 2)
+    # labels of already-judged samples are left alone
+    curr.execute("INSERT INTO sample_arbitrages_odd_tokens VALUES (1, %s, %s, 'x')", (b'', b''))
+    curr.connection.commit()
+
+    gen_false_positives(curr)
+
+    curr.execute('SELECT sample_arbitrage_id, reason FROM sample_arbitrage_false_positives ORDER BY 1')
+    assert curr.fetchall() == [(2, 'CoW Swap'), (3, 'odd token'), (4, 'relayer is in exchanges list')]
+    assert _ids(curr, 'sample_arbitrages_no_fp') == [1, 5]
+    assert _ids(curr, 'sample_arbitrage_cycles_no_fp') == [1, 5]
+    assert _ids(curr, 'sample_arbitrage_cycle_exchanges_no_fp') == [1, 5]
+    assert _ids(curr, 'sample_arbitrage_exchanges_no_fp') == [1, 2]
+
+    # nothing new
+    gen_false_positives(curr)
+    assert _ids(curr, 'sample_arbitrages_no_fp') == [1, 5]
+
+    gen_false_positives(curr, rebuild=True)
+    curr.execute('SELECT sample_arbitrage_id, reason FROM sample_arbitrage_false_positives ORDER BY 1')
+    assert curr.fetchall() == [(1, 'odd token'), (2, 'CoW Swap'), (3, 'odd token'), (4, 'relayer is in exchanges list')]
+    assert _ids(curr, 'sample_arbitrages_no_fp') == [5]
+    assert _ids(curr, 'sample_arbitrage_exchanges_no_fp') == [2]
+
+
+def test_gen_false_positives_late_commit(curr):
+    _insert_sample(curr, 7, ARBITRAGEUR, 1)
+    curr.connection.commit()
+    gen_false_positives(curr)
+    assert _ids(curr, 'sample_arbitrages_no_fp') == [7]
+
+    # a lower id that committed after the last run is still judged
+    _insert_sample(curr, 6, COWSWAP, 1)
+    _insert_sample(curr, 5, ARBITRAGEUR, 2)
+    curr.connection.commit()
+    gen_false_positives(curr)
+
+    curr.execute('SELECT sample_arbitrage_id, reason FROM sample_arbitrage_false_positives ORDER BY 1')
+    assert curr.fetchall() == [(6, 'CoW Swap')]
+    assert _ids(curr, 'sample_arbitrages_no_fp') == [5, 7]
+    assert _ids(curr, 'sample_arbitrage_cycle_exchange_items_no_fp') == [5, 7]
+
+
+def test_gen_false_positives_legacy_duplicates(curr):
+    _insert_sample(curr, 1, COWSWAP, 1)
+    _insert_sample(curr, 2, ARBITRAGEUR, 1)
+    # as left by the non-incremental version, which had no unique index
+    curr.execute(
+        '''
+        CREATE TABLE sample_arbitrage_false_positives (sample_arbitrage_id INTEGER NOT NULL, reason TEXT NOT NULL);
+        INSERT INTO sample_arbitrage_false_positives VALUES (1, 'CoW Swap'), (1, 'CoW Swap');
+        '''
+    )
+    curr.connection.commit()
+
+    gen_false_positives(curr)
+
+    curr.execute('SELECT sample_arbitrage_id, reason FROM sample_arbitrage_false_positives ORDER BY 1')
+    assert curr.fetchall() == [(1, 'CoW Swap')]
+    assert _ids(curr, 'sample_arbitrages_no_fp') == [2]
@@ -0,0 +1,78 @@
+import random
+
+import web3
+from hexbytes import HexBytes
+
+from backtest.gather_samples.fill_odd_token_xfers.__main__ import TransferColumns, find_odd_token_transfers
+from backtest.utils import ERC20_TRANSFER_TOPIC
+
+
+def _transfer_log(token: bytes, from_: bytes, to: bytes, value: int):
+    return {
+        'address': web3.Web3.toChecksumAddress(token),
+        'topics': [
+            HexBytes(ERC20_TRANSFER_TOPIC),
+            HexBytes(b'\x00' * 12 + from_),
+            HexBytes(b'\x00' * 12 + to),
+        ],
+        'data': '0x' + value.to_bytes(32, 'big').hex(),
+    }
+
+
+def _expected(ids, receipts):
+    # the original per-transaction set-based classification
+    ret = set()
+    for id_, receipt in zip(ids, receipts):
+        xfers = [
+            (bytes.fromhex(log['address'][2:]), bytes(log['topics'][1][-20:]), bytes(log['topics'][2][-20:]))
+            for log in receipt['logs']
+        ]
+        all_tokens = set(token for token, _, _ in xfers)
+        for token, from_, to in xfers:
+            if to in all_tokens:
+                ret.add((id_, to, token, 'received'))
+            if from_ in all_tokens:
+                ret.add((id_, from_, token, 'sent'))
+    return ret
+
+
+def test_matches_per_transaction_classification():
+    rng = random.Random(0)
+    addresses = [bytes([i]) * 20 for i in range(1, 12)]
+
+    ids = []
+    receipts = []
+    for id_ in range(200):
+        logs = []
+        for _ in range(rng.randint(3, 8)):
+            token, from_, to = (rng.choice(addresses) for _ in range(3))
+            logs.append(_transfer_log(token, from_, to, rng.randint(0, 2 ** 200)))
+        ids.append(1_000_000 + id_ * 7)
+        receipts.append({'transactionHash': HexBytes(id_.to_bytes(32, 'big')), 'logs': logs})
+
+    transfers = TransferColumns.from_receipts(ids, receipts)
+    assert len(transfers) == sum(len(r['logs']) for r in receipts)
+
+    odd = find_odd_token_transfers(transfers)
+    got = odd.rows(transfers.addresses)
+    assert len(got) == len(set(got))
+    assert set(got) == _expected(ids, receipts)
+
+
+def test_ignores_non_transfer_logs():
+    a, b, c = (bytes([i]) * 20 for i in range(1, 4))
+    logs = [
+        _transfer_log(a, b, c, 1),
+        _transfer_log(b, c, a, 2),
+        _transfer_log(c, a, b, 3),
+        {'address': web3.Web3.toChecksumAddress(a), 'topics': [HexBytes(b'\x01' * 32)], 'data': '0x'},
+    ]
+    transfers = TransferColumns.from_receipts([5], [{'transactionHash': HexBytes(b'\x00' * 32), 'logs': logs}])
+    assert len(transfers) == 3
+    assert transfers.value == [1, 2, 3]
+
+    got = set(find_odd_token_transfers(transfers).rows(transfers.addresses))
+    assert got == {
+        (5, c, a, 'received'), (5, a, b, 'received'), (5, b, c, 'received'),
+        (5, b, a, 'sent'), (5, c, b, 'sent'), (5, a, c, 'sent'),
+    }
@@ -0,0 +1,60 @@
+import eth_abi
+import pytest
+import web3
+from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+from backtest.gather_samples.fill_zerox.__main__ import build_event_decoders, decode_log
+from utils import get_abi
+
+ZEROX_PROXY = '0xDef1C0ded9bec7F1a1670819833240f027b25EfF'
+MAKER = web3.Web3.toChecksumAddress('0x' + 'ab' * 20)
+TAKER = web3.Web3.toChecksumAddress('0x' + 'cd' * 20)
+
+
+@pytest.fixture(scope='module')
+def zerox_proxy():
+    return web3.Web3().eth.contract(
+        address = ZEROX_PROXY,
+        abi = get_abi('0x/IZeroEx.json')['compilerOutput']['abi'],
+    )
+
+
+def _log(topics, data):
+    return AttributeDict({
+        'address': ZEROX_PROXY,
+        'topics': [HexBytes(t) for t in topics],
+        'data': '0x' + data.hex(),
+        'logIndex': 0,
+        'transactionIndex': 0,
+        'transactionHash': HexBytes(b'\x01' * 32),
+        'blockHash': HexBytes(b'\x02' * 32),
+        'blockNumber': 1,
+    })
+
+
+def test_decoders_cover_all_events(zerox_proxy):
+    decoders = build_event_decoders(zerox_proxy)
+    events = [e for e in zerox_proxy.events._events if not e.get('anonymous', False)]
+    assert len(decoders) == len(events)
+    for event in events:
+        assert decoders[bytes(event_abi_to_log_topic(event))].event_name == event['name']
+
+
+def test_decode_log(zerox_proxy):
+    decoders = build_event_decoders(zerox_proxy)
+    event = zerox_proxy.events.RfqOrderFilled
+    data = eth_abi.encode_abi(
+        ['bytes32', 'address', 'address', 'address', 'address', 'uint128', 'uint128', 'bytes32'],
+        [b'\x03' * 32, MAKER, TAKER, MAKER, TAKER, 10, 20, b'\x04' * 32],
+    )
+    log = _log([event_abi_to_log_topic(event._get_event_abi())], data)
+
+    parsed = decode_log(decoders, log)
+    assert parsed['event'] == 'RfqOrderFilled'
+    assert parsed['args']['maker'] == MAKER
+    assert parsed == event().processLog(log)
+
+    with pytest.raises(Exception, match='Could not find topic 0x' + 'ff' * 32):
+        decode_log(decoders, _log([b'\xff' * 32], b''))
@@ -0,0 +1,58 @@
+import numpy as np
+
+from backtest.top_of_block.gas_oracle import GasOracle
+
+
+def _random_oracle(rng: np.random.Generator) -> GasOracle:
+    block_numbers = {}
+    percentiles = {}
+    for niche in ['fb|2|uv2|', 'nfb|3|uv3|', 'nfb|2|uv2|uv3|']:
+        n = int(rng.integers(1, 50))
+        bns = np.sort(rng.choice(np.arange(15_000_000, 15_010_000), size=n, replace=False)).astype(np.float64)
+        pts = np.sort(rng.integers(10 ** 9, 500 * 10 ** 9, size=(n, 5)), axis=1).astype(np.float64)
+        block_numbers[niche] = bns
+        percentiles[niche] = pts
+    return GasOracle(block_numbers, percentiles)
+
+
+def test_matches_np_interp():
+    rng = np.random.default_rng(0)
+    oracle = _random_oracle(rng)
+
+    for niche in oracle.niches:
+        bns, pts = oracle.points(niche)
+        query = list(range(14_999_990, 15_010_010, 7)) + [int(x) for x in bns]
+        for block_number in query:
+            for group in range(5):
+                expected = int(np.interp(block_number, bns, pts[:, group]))
+                assert oracle.gas_price(niche, block_number, group) == expected
+
+
+def test_batch_matches_scalar():
+    rng = np.random.default_rng(1)
+    oracle = _random_oracle(rng)
+
+    niches = sorted(oracle.niches)
+    pairs = [(niches[i % len(niches)], int(b)) for i, b in enumerate(rng.integers(14_999_000, 15_011_000, size=2_000))]
+    got = oracle.gas_prices([n for n, _ in pairs], [b for _, b in pairs])
+
+    assert got.shape == (len(pairs), 5)
+    for (niche, block_number), row in zip(pairs, got):
+        for group in range(5):
+            assert int(row[group]) == oracle.gas_price(niche, block_number, group)
+
+
+def test_save_load_roundtrip(tmp_path):
+    rng = np.random.default_rng(2)
+    oracle = _random_oracle(rng)
+    fname = str(tmp_path / 'oracle.npz')
+
+    oracle.save(fname, (123, 15_010_000))
+
+    assert GasOracle.load(fname, (124, 15_010_000)) is None
+    loaded = GasOracle.load(fname, (123, 15_010_000))
+    assert loaded is not None
+    assert loaded.niches == oracle.niches
+    for niche in oracle.niches:
+        assert np.array_equal(loaded.points(niche)[0], oracle.points(niche)[0])
+        assert np.array_equal(loaded.points(niche)[1], oracle.points(niche)[1])
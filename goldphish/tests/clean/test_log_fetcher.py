@@ -0,0 +1,113 @@
+import typing
+import pytest
+import web3
+
+from pricers.uniswap_v2 import UNIV2_SYNC_EVENT_TOPIC
+from pricers.uniswap_v3 import UNIV3_SWAP_EVENT_TOPIC
+from utils.fake_node import FakeNodeProvider, Snapshot
+from utils.log_fetcher import LogFetcher, iter_blocks
+
+PAIR = '0x0d4a11d5EEaaC28EC3F61d100daF4d40471f1852'
+OTHER = '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2'
+TRANSFER_TOPIC = bytes.fromhex('ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef')
+
+
+def _log(block_number: int, txn_index: int, log_index: int, address: str, topic: bytes) -> dict:
+    return {
+        'address': address,
+        'topics': ['0x' + topic.hex()],
+        'data': '0x' + '00' * 64,
+        'blockNumber': hex(block_number),
+        'blockHash': '0x' + block_number.to_bytes(32, 'big').hex(),
+        'transactionHash': '0x' + (block_number * 1_000 + txn_index).to_bytes(32, 'big').hex(),
+        'transactionIndex': hex(txn_index),
+        'logIndex': hex(log_index),
+        'removed': False,
+    }
+
+
+def _chain():
+    logs = []
+    for block_number in range(1_000, 2_000):
+        # a busy stretch in the middle
+        n_txns = 40 if 1_400 <= block_number < 1_500 else 1
+        log_index = 0
+        for txn_index in range(n_txns):
+            for address, topic in [(PAIR, UNIV2_SYNC_EVENT_TOPIC), (OTHER, TRANSFER_TOPIC), (OTHER, UNIV3_SWAP_EVENT_TOPIC)]:
+                logs.append(_log(block_number, txn_index, log_index, address, topic))
+                log_index += 1
+    return logs
+
+
+def _node(logs: typing.List[dict], topic_sets: typing.List[typing.List[bytes]], max_logs: int) -> FakeNodeProvider:
+    """Serves logs to LogFetchers filtering on each of topic_sets"""
+    snapshot = Snapshot()
+    from_block = min(int(x['blockNumber'], base=16) for x in logs)
+    to_block = max(int(x['blockNumber'], base=16) for x in logs)
+    for topics in topic_sets:
+        hex_topics = ['0x' + t.hex() for t in topics]
+        snapshot.add_logs(
+            {'topics': [hex_topics], 'fromBlock': from_block, 'toBlock': to_block},
+            [x for x in logs if x['topics'][0] in hex_topics],
+        )
+    return FakeNodeProvider(snapshot, max_logs=max_logs)
+
+
+def test_fetch_splits_and_adapts():
+    provider = _node(_chain(), [[UNIV2_SYNC_EVENT_TOPIC, UNIV3_SWAP_EVENT_TOPIC]], max_logs = 1_000)
+    fetcher = LogFetcher(web3.Web3(provider), [UNIV2_SYNC_EVENT_TOPIC, UNIV3_SWAP_EVENT_TOPIC], target_logs = 200, initial_range = 50)
+
+    buckets = fetcher.fetch(1_000, 1_999, addresses = {PAIR})
+
+    # every block, bucketed by transaction, topic- and address-filtered
+    assert sorted(buckets.keys()) == list(range(1_000, 2_000))
+    assert len(buckets[1_450]) == 40
+    assert all(
+        len(logs) == 1 and logs[0]['address'] == PAIR and logs[0]['topics'][0] == UNIV2_SYNC_EVENT_TOPIC
+        for by_txn in buckets.values() for logs in by_txn.values()
+    )
+
+    # the served requests cover the range exactly once
+    assert provider.log_ranges[0][0] == 1_000 and provider.log_ranges[-1][1] == 1_999
+    assert all(a[1] + 1 == b[0] for a, b in zip(provider.log_ranges, provider.log_ranges[1:]))
+    assert fetcher.n_splits == provider.n_refused_logs > 0
+    assert fetcher.n_requests == len(provider.log_ranges) + provider.n_refused_logs
+
+    # ranges grew over the sparse start and shrank in the busy stretch
+    sizes = {from_block: to_block - from_block + 1 for from_block, to_block in provider.log_ranges}
+    assert max(size for b, size in sizes.items() if b < 1_400) > 50
+    assert max(size for b, size in sizes.items() if 1_400 <= b < 1_500) < 50
+
+
+def test_iter_blocks():
+    provider = _node(_chain(), [[UNIV2_SYNC_EVENT_TOPIC, UNIV3_SWAP_EVENT_TOPIC]], max_logs = 10_000)
+    fetcher = LogFetcher(web3.Web3(provider), [UNIV2_SYNC_EVENT_TOPIC, UNIV3_SWAP_EVENT_TOPIC])
+
+    blocks = list(iter_blocks(fetcher.fetch(1_398, 1_401), 1_397, 1_401))
+    assert [b for b, _ in blocks] == [1_397, 1_398, 1_399, 1_400, 1_401]
+    assert blocks[0][1] == []
+    assert len(blocks[1][1]) == 2
+    assert len(blocks[3][1]) == 80
+    assert [x['logIndex'] for x in blocks[3][1]] == sorted(x['logIndex'] for x in blocks[3][1])
+
+
+def test_single_block_too_large():
+    provider = _node(_chain(), [[UNIV2_SYNC_EVENT_TOPIC]], max_logs = 10)
+    fetcher = LogFetcher(web3.Web3(provider), [UNIV2_SYNC_EVENT_TOPIC])
+    with pytest.raises(Exception, match='too many logs'):
+        fetcher.fetch(1_450, 1_450)
+
+
+def test_range_does_not_wind_up_past_max():
+    # a long quiet stretch, then a busy one
+    logs = [_log(b, 0, 0, PAIR, UNIV2_SYNC_EVENT_TOPIC) for b in range(1_000, 100_000, 1_000)]
+    logs += [_log(b, i, i, PAIR, UNIV2_SYNC_EVENT_TOPIC) for b in range(100_000, 100_050) for i in range(100)]
+    provider = _node(logs, [[UNIV2_SYNC_EVENT_TOPIC]], max_logs = 100_000)
+    fetcher = LogFetcher(web3.Web3(provider), [UNIV2_SYNC_EVENT_TOPIC], target_logs = 200, initial_range = 100, max_range = 1_000)
+
+    fetcher.fetch(1_000, 99_999)
+    assert fetcher.throttle.val() == 1_000
+
+    # so one over-target response brings the range back under the max
+    fetcher.fetch(100_000, 100_049)
+    assert fetcher.next_range() < 1_000
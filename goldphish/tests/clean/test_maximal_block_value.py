@@ -0,0 +1,100 @@
+import itertools
+import random
+
+from backtest.top_of_block.maximal_block_value import (
+    EXACT_MAX_COMPONENT_SIZE,
+    build_conflict_graph,
+    connected_components,
+    max_weight_independent_set,
+    select_arbitrages,
+)
+
+
+def _random_candidates(rng: random.Random, n_candidates: int, n_exchanges: int):
+    exchanges = [bytes([i]) * 20 for i in range(n_exchanges)]
+    ret = []
+    for id_ in range(n_candidates):
+        these_exchanges = rng.sample(exchanges, rng.choice([2, 3]))
+        ret.append((0, these_exchanges, rng.randint(1, 10 ** 18), id_))
+    return ret
+
+
+def _brute_force(candidates) -> int:
+    best = 0
+    for r in range(len(candidates) + 1):
+        for subset in itertools.combinations(candidates, r):
+            used = set()
+            ok = True
+            for _, exchanges, _, _ in subset:
+                if used.intersection(exchanges):
+                    ok = False
+                    break
+                used.update(exchanges)
+            if ok:
+                best = max(best, sum(p for _, _, p, _ in subset))
+    return best
+
+
+def test_conflict_graph():
+    a, b, c, d = (bytes([i]) * 20 for i in range(4))
+    candidates = [
+        (0, [a, b], 5, 100),
+        (0, [b, c], 4, 101),
+        (0, [c, d], 3, 102),
+        (0, [d, bytes([9]) * 20], 1, 103),
+        (0, [bytes([7]) * 20, bytes([8]) * 20], 1, 104),
+    ]
+    ids, weights, adjacency = build_conflict_graph(candidates)
+
+    assert ids == [100, 101, 102, 103, 104]
+    assert weights == [5, 4, 3, 1, 1]
+    assert adjacency == [0b00010, 0b00101, 0b01010, 0b00100, 0b00000]
+    assert sorted(connected_components(adjacency)) == [0b01111, 0b10000]
+
+
+def test_beats_greedy():
+    # greedy takes the heavy middle arbitrage, but the two outer ones are worth more
+    a, b, c = (bytes([i]) * 20 for i in range(3))
+    candidates = [
+        (0, [a, bytes([10]) * 20], 6, 1),
+        (0, [a, c], 10, 2),
+        (0, [c, bytes([11]) * 20], 6, 3),
+        (0, [b, bytes([12]) * 20], 1, 4),
+    ]
+    selected, total = select_arbitrages(candidates)
+    assert sorted(selected) == [1, 3, 4]
+    assert total == 13
+
+
+def test_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(50):
+        candidates = _random_candidates(rng, rng.randint(1, 12), rng.randint(3, 10))
+        _, total = select_arbitrages(candidates)
+        assert total == _brute_force(candidates)
+
+
+def test_budget_exhaustion_returns_valid_set():
+    rng = random.Random(1)
+    candidates = _random_candidates(rng, 40, 12)
+    ids, weights, adjacency = build_conflict_graph(candidates)
+    component = (1 << len(ids)) - 1
+
+    selected, _ = max_weight_independent_set(component, weights, adjacency, max_search_nodes=10)
+    for i in range(len(ids)):
+        if selected >> i & 1:
+            assert adjacency[i] & selected == 0
+
+
+def test_large_component_skips_unprofitable():
+    # a chain too long for the exact search, where each candidate shares an exchange with
+    # the next; greedy takes the 5s, which isolates the unprofitable candidates between them
+    exchanges = [bytes([i]) * 20 for i in range(EXACT_MAX_COMPONENT_SIZE + 10)]
+    profits = [5, 4, -1, 4, 5, 4, 0, 4] * ((len(exchanges) - 1) // 8)
+    candidates = [(0, [exchanges[i], exchanges[i + 1]], profit, i) for i, profit in enumerate(profits)]
+    assert len(candidates) > EXACT_MAX_COMPONENT_SIZE
+    assert len(connected_components(build_conflict_graph(candidates)[2])) == 1
+
+    selected, total = select_arbitrages(candidates)
+    assert all(profits[i] > 0 for i in selected)
+    assert total == sum(profits[i] for i in selected)
@@ -0,0 +1,116 @@
+"""
+These tests need a Postgres to talk to (configured the same way as connect_db(), ie PSQL_HOST etc)
+and are skipped when none is reachable.
+"""
+
+import time
+
+import psycopg2
+import pytest
+
+from backtest import notifications
+from backtest.utils import CancellationToken, connect_db
+
+
+@pytest.fixture()
+def db():
+    try:
+        conn = connect_db()
+    except psycopg2.OperationalError:
+        pytest.skip('no postgres available')
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def test_listener_wakes_on_notify(db):
+    listener = notifications.Listener(['test_channel'])
+    try:
+        assert listener.wait(timeout=0.1) == []
+
+        curr = db.cursor()
+        notifications.notify(curr, 'test_channel', 'hello')
+        # not delivered until commit
+        assert listener.wait(timeout=0.2) == []
+        db.commit()
+
+        start = time.time()
+        got = listener.wait(timeout=10)
+        assert time.time() - start < 5
+        assert [(n.channel, n.payload) for n in got] == [('test_channel', 'hello')]
+    finally:
+        listener.close()
+
+
+def test_cancellation_token_notified(db):
+    token = CancellationToken('test_job', 'test_worker', connect_db())
+    try:
+        curr = db.cursor()
+        notifications.setup_triggers(curr)
+        db.commit()
+
+        assert token.cancel_requested() == False
+
+        curr.execute('UPDATE job_control SET is_cancel_requested = true WHERE id = %s', (token._id,))
+        db.commit()
+
+        # arrives well before the next heartbeat query
+        deadline = time.time() + 5
+        while not token.cancel_requested():
+            assert time.time() < deadline
+            time.sleep(0.05)
+    finally:
+        curr = db.cursor()
+        curr.execute('DELETE FROM job_control WHERE id = %s', (token._id,))
+        db.commit()
+        token.conn.close()
+
+
+def test_reservation_notifies_only_on_status_change(db):
+    curr = db.cursor()
+    # shadows any real table for this session
+    curr.execute(
+        '''
+        CREATE TEMP TABLE arb_sandwich_reservations (
+            id           SERIAL PRIMARY KEY NOT NULL,
+            progress     INTEGER,
+            claimed_on   TIMESTAMP WITHOUT TIME ZONE,
+            heartbeat    TIMESTAMP WITHOUT TIME ZONE,
+            completed_on TIMESTAMP WITHOUT TIME ZONE
+        )
+        '''
+    )
+    notifications.setup_triggers(curr)
+    curr.execute('INSERT INTO arb_sandwich_reservations (progress) SELECT 0 FROM generate_series(1, 10)')
+    db.commit()
+
+    listener = notifications.Listener([notifications.RESERVATION_PROGRESS_CHANNEL])
+    try:
+        curr.execute('UPDATE arb_sandwich_reservations SET progress = progress + 1, heartbeat = now()::timestamp')
+        db.commit()
+        assert listener.wait(timeout=0.5) == []
+
+        curr.execute('UPDATE arb_sandwich_reservations SET claimed_on = now()::timestamp')
+        db.commit()
+        got = listener.wait(timeout=10)
+        # one per transaction, not per row
+        assert [n.payload for n in got] == ['arb_sandwich_reservations']
+    finally:
+        listener.close()
+
+
+def test_cancellation_token_polls_without_trigger(db):
+    curr = db.cursor()
+    curr.execute('SELECT to_regclass(%s) IS NOT NULL', ('job_control',))
+    (exists,) = curr.fetchone()
+    if exists:
+        curr.execute(f'DROP TRIGGER IF EXISTS {notifications.JOB_CANCEL_TRIGGER} ON job_control')
+        db.commit()
+
+    token = CancellationToken('test_job', 'test_worker', connect_db())
+    try:
+        assert token.heartbeat_period == CancellationToken.HEARTBEAT_PERIOD_SECONDS
+    finally:
+        curr.execute('DELETE FROM job_control WHERE id = %s', (token._id,))
+        db.commit()
+        token.conn.close()
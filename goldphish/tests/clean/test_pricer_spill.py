@@ -0,0 +1,103 @@
+import sys
+
+import pytest
+import web3
+
+from benchmarks.fixtures import SYNTHETIC_TOKEN_A, SyntheticExchanges
+from pricers.base import UnknownSpillFormat
+from pricers.pricer_pool import PricerPool
+from pricers.uniswap_v2 import UniswapV2Pricer
+from pricers.uniswap_v3 import Tick, UniswapV3Pricer
+from utils import WETH_ADDRESS
+from utils.fake_node import FakeNodeProvider
+
+
+def _warm_v3() -> UniswapV3Pricer:
+    exchanges = SyntheticExchanges()
+    pricer = exchanges.add_uniswap_v3(WETH_ADDRESS, 1_500 * 10 ** 18, SYNTHETIC_TOKEN_A, 3_060_000 * 10 ** 18)()
+    pricer.token_out_for_exact_in(pricer.token0, pricer.token1, 10 ** 20, 'latest')
+    # extreme values, to exercise the field widths
+    pricer.tick_cache[-887220] = Tick(-887220, (1 << 128) - 1, -(1 << 127), False)
+    pricer.tick_bitmap_cache[-3466] = (1 << 256) - 1
+    pricer.known_token0_balance = (1 << 256) - 1
+    return pricer
+
+
+def test_round_trip():
+    v2 = UniswapV2Pricer(None, '0x' + '1' * 40, WETH_ADDRESS, SYNTHETIC_TOKEN_A)
+    assert UniswapV2Pricer.from_spill(None, v2.to_spill()).__getstate__() == v2.__getstate__()
+    v2.known_token0_bal, v2.known_token1_bal = (1 << 112) - 1, 12
+    assert UniswapV2Pricer.from_spill(None, v2.to_spill()).__getstate__() == v2.__getstate__()
+
+    v3 = _warm_v3()
+    assert v3.slot0_cache is not None and len(v3.tick_bitmap_cache) > 1
+    loaded = UniswapV3Pricer.from_spill(v3.w3, v3.to_spill())
+    assert loaded.__getstate__() == v3.__getstate__()
+    assert loaded.w3 is v3.w3
+
+
+def test_rejects_other_formats():
+    v3 = _warm_v3()
+    with pytest.raises(UnknownSpillFormat):
+        UniswapV2Pricer.from_spill(None, v3.to_spill())
+
+    bs = bytearray(v3.to_spill())
+    bs[1] = UniswapV3Pricer.SPILL_VERSION + 1
+    with pytest.raises(UnknownSpillFormat):
+        UniswapV3Pricer.from_spill(None, bytes(bs))
+
+
+def test_pool_spills_and_hydrates(tmp_path):
+    w3 = web3.Web3(FakeNodeProvider())
+    pool = PricerPool(w3, str(tmp_path), max_cache_bytes=10_000)
+
+    addresses = [web3.Web3.toChecksumAddress(i.to_bytes(20, byteorder='big')) for i in range(1, 201)]
+    for address in addresses:
+        pool.add_uniswap_v2(address, SYNTHETIC_TOKEN_A, WETH_ADDRESS, origin_block=1)
+        pricer = pool.get_pricer_for(address)
+        pricer.known_token0_bal, pricer.known_token1_bal = int(address, base=16), 2
+
+    # only ~10 fit in memory, the rest were spilled (some still pending in the buffer)
+    assert len(pool._evictable_cache) <= 10
+    assert len(pool._spill_buffer) < PricerPool.SPILL_BATCH_SIZE
+
+    for address in addresses:
+        pricer = pool.get_pricer_for(address)
+        assert pricer.get_balances('latest') == (int(address, base=16), 2)
+        assert pricer.w3 is w3
+
+    # a spill from an unknown schema is a miss, not an error
+    pool._db.Put(b'0x' + b'f' * 40, b'\xff\x01')
+    assert pool._hydrate_pricer('0x' + 'f' * 40) is None
+
+
+def _deep_size(o, seen: set) -> int:
+    if id(o) in seen or o is None or isinstance(o, bool):
+        return 0
+    seen.add(id(o))
+    ret = sys.getsizeof(o)
+    if isinstance(o, dict):
+        ret += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in o.items())
+    elif isinstance(o, (list, tuple)):
+        ret += sum(_deep_size(x, seen) for x in o)
+    elif hasattr(o, '__dict__'):
+        ret += _deep_size(o.__dict__, seen)
+    return ret
+
+
+def test_approx_size_bytes():
+    def measured(pricer) -> int:
+        # web3 is shared by every pricer in the pool
+        return _deep_size(pricer, {id(pricer.w3)})
+
+    v2 = UniswapV2Pricer(None, '0x' + '1' * 40, WETH_ADDRESS, SYNTHETIC_TOKEN_A)
+    v2.known_token0_bal, v2.known_token1_bal = 10 ** 24, 10 ** 21
+    assert v2.approx_size_bytes() == pytest.approx(measured(v2), rel=0.2)
+
+    v3 = _warm_v3()
+    assert v3.approx_size_bytes() == pytest.approx(measured(v3), rel=0.2)
+    for i in range(1, 500):
+        v3.tick_cache[i * 60] = Tick(i * 60, 10 ** 24 + i, -10 ** 23 - i, True)
+    for i in range(1, 50):
+        v3.tick_bitmap_cache[i] = (1 << 255) + i
+    assert v3.approx_size_bytes() == pytest.approx(measured(v3), rel=0.2)
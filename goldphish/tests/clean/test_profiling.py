@@ -0,0 +1,130 @@
+import json
+import time
+
+import pytest
+
+from utils import profiling
+
+
+@pytest.fixture(autouse=True)
+def clean_profile():
+    profiling.reset()
+    enabled = profiling.ENABLED
+    profiling.ENABLED = True
+    yield
+    profiling.ENABLED = enabled
+    profiling.reset()
+
+
+def test_histogram_buckets_are_contiguous():
+    h = profiling.LatencyHistogram
+    prev_upper = None
+    for idx in range(0, 40 * h._HALF):
+        upper = h.bucket_upper_bound(idx)
+        if prev_upper is not None:
+            assert upper > prev_upper
+        prev_upper = upper
+
+    for micros in [0, 1, 17, 63, 64, 65, 1_000, 123_456, 10_000_000]:
+        seconds = micros / 1_000_000
+        idx = h.bucket_index(seconds)
+        assert seconds < h.bucket_upper_bound(idx)
+        assert idx == 0 or h.bucket_upper_bound(idx - 1) <= seconds + 1e-12
+
+
+def test_histogram_percentiles():
+    hist = profiling.LatencyHistogram()
+    for _ in range(99):
+        hist.record(0.001)
+    hist.record(2.0)
+
+    assert hist.count == 100
+    assert hist.max == 2.0
+    assert 0.001 <= hist.percentile(50) <= 0.001 * 1.04
+    assert 0.001 <= hist.percentile(99) <= 0.001 * 1.04
+    assert hist.percentile(100) == 2.0
+    assert hist.count_at_or_below(0.01) == 99
+    assert hist.count_at_or_below(10) == 100
+
+    earlier = hist.copy()
+    hist.record(0.5)
+    window = hist.since(earlier)
+    assert window.count == 1
+    assert window.total == pytest.approx(0.5)
+
+
+def test_nested_sections_do_not_double_count():
+    with profiling.profile('outer'):
+        time.sleep(0.01)
+        with profiling.profile('inner'):
+            time.sleep(0.02)
+        profiling.inc_measurement('manual', 0.5)
+
+    outer = profiling.get_section('outer')
+    inner = profiling.get_section('outer/inner')
+    manual = profiling.get_section('outer/manual')
+    assert profiling.get_section('inner') is None
+
+    assert outer.count == inner.count == manual.count == 1
+    assert inner.self_seconds == inner.total_seconds >= 0.02
+    assert manual.total_seconds == 0.5
+    # outer's own time excludes its children
+    assert outer.self_seconds == pytest.approx(outer.total_seconds - inner.total_seconds - 0.5)
+    assert outer.self_seconds + inner.self_seconds + manual.self_seconds == pytest.approx(outer.total_seconds)
+
+    # flat totals are unchanged
+    assert profiling.get_measurement('inner') == inner.total_seconds
+
+
+def test_profiled_decorator():
+    class Pricer:
+        @profiling.profiled()
+        def token_out_for_exact_in(self, amount_in):
+            return amount_in * 2
+
+    @profiling.profiled('bisect')
+    def bisect():
+        return Pricer().token_out_for_exact_in(3)
+
+    assert bisect() == 6
+    assert profiling.get_section('bisect').count == 1
+    assert profiling.get_section('bisect/Pricer.token_out_for_exact_in').count == 1
+
+
+def test_disabled_is_noop():
+    profiling.ENABLED = False
+
+    @profiling.profiled()
+    def f():
+        return 1
+
+    with profiling.profile('x'):
+        f()
+    profiling.inc_counter(profiling.RPC_CALLS)
+    profiling.inc_measurement('y', 1.0)
+
+    assert profiling.snapshot()['sections'] == {}
+    assert profiling.get_counter(profiling.RPC_CALLS) == 0
+
+
+def test_export(tmp_path):
+    with profiling.profile('a'):
+        with profiling.profile('b'):
+            pass
+    profiling.inc_counter(profiling.DB_STATEMENTS, 3)
+
+    json_path = tmp_path / 'profile.json'
+    profiling.dump_json(str(json_path))
+    got = json.loads(json_path.read_text())
+    assert set(got['sections'].keys()) == {'a', 'a/b'}
+    assert got['sections']['a']['count'] == 1
+    assert got['counters'] == {'db.statements': 3}
+
+    prom_path = tmp_path / 'profile.prom'
+    profiling.dump_prometheus(str(prom_path))
+    text = prom_path.read_text()
+    assert 'goldphish_section_seconds_count{section="a/b"} 1' in text
+    assert 'goldphish_section_seconds_bucket{section="a",le="+Inf"} 1' in text
+    assert 'goldphish_events_total{name="db.statements"} 3' in text
+    # no temporary files left behind
+    assert sorted(tmp_path.iterdir()) == sorted([json_path, prom_path])
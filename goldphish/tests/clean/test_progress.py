@@ -0,0 +1,159 @@
+import datetime
+import json
+import web3
+import web3.providers
+
+from backtest.progress import WorkerTelemetry, estimate_eta, find_slow_workers, summarize_workers
+from utils import RetryingProvider
+
+T0 = datetime.datetime(2022, 10, 1, 12, 0, 0)
+
+
+class _StaticProvider(web3.providers.BaseProvider):
+
+    def make_request(self, method, params):
+        return {'jsonrpc': '2.0', 'id': 1, 'result': '0x10'}
+
+    def isConnected(self):
+        return True
+
+
+def test_take_sample_resets_counters():
+    telemetry = WorkerTelemetry('test_job', 'worker-0')
+    telemetry.observe_blocks(10)
+    telemetry.observe_blocks(5)
+    telemetry.observe_rpc(0.5)
+    telemetry.observe_rpc(1.5, n_requests=3)
+    with telemetry.db_write():
+        pass
+
+    sample = telemetry.take_sample()
+    assert sample.n_blocks == 15
+    assert sample.n_rpc == 4
+    assert sample.rpc_seconds == 2.0
+    assert sample.n_db_writes == 1
+    assert sample.period_seconds >= 0
+
+    sample = telemetry.take_sample()
+    assert (sample.n_blocks, sample.n_rpc, sample.n_db_writes) == (0, 0, 0)
+
+
+def test_maybe_flush_waits_for_period():
+    telemetry = WorkerTelemetry('test_job', 'worker-0', flush_period_seconds=3600)
+    telemetry.observe_blocks(1)
+    # would need a database connection if it flushed
+    assert telemetry.maybe_flush() == False
+
+
+class _RecordingConn:
+    """Stands in for the telemetry connection, keeping the job_progress increments"""
+
+    def __init__(self) -> None:
+        self.done_blocks = 0
+        self._pending = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params = None):
+        if 'UPDATE job_progress' in query:
+            self._pending += params[0]
+
+    def commit(self):
+        self.done_blocks += self._pending
+        self._pending = 0
+
+    def rollback(self):
+        self._pending = 0
+
+
+def test_final_flush_counts_every_block():
+    conn = _RecordingConn()
+    telemetry = WorkerTelemetry('test_job', 'worker-0', conn=conn, flush_period_seconds=3600)
+
+    # a worker loop that ends before a full period has passed
+    try:
+        for _ in range(7):
+            telemetry.observe_blocks(3)
+            telemetry.maybe_flush()
+    finally:
+        telemetry.flush()
+    assert conn.done_blocks == 21
+
+    # nothing is counted twice
+    telemetry.flush()
+    assert conn.done_blocks == 21
+
+
+def test_instrument_times_requests():
+    telemetry = WorkerTelemetry('test_job', 'worker-0')
+    w3 = web3.Web3(_StaticProvider())
+    # a request before instrumenting caches web3's middleware chain
+    assert w3.eth.block_number == 16
+
+    telemetry.instrument(w3)
+    assert w3.eth.block_number == 16
+    assert w3.eth.block_number == 16
+
+    sample = telemetry.take_sample()
+    assert sample.n_rpc == 2
+
+
+class _StubWebsocket:
+    """Answers what RetryingProvider sends, as its websocket provider would"""
+
+    async def coro_make_request(self, request_data: bytes):
+        request = json.loads(request_data)
+        if isinstance(request, list):
+            return [{'jsonrpc': '2.0', 'id': r['id'], 'result': '0x10'} for r in request]
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': '0x10'}
+
+
+def test_instrument_retrying_provider_times_batches():
+    telemetry = WorkerTelemetry('test_job', 'worker-0')
+    provider = RetryingProvider()
+    provider._internal_provider = _StubWebsocket()
+    w3 = telemetry.instrument(web3.Web3(provider))
+
+    assert w3.eth.block_number == 16
+    assert len(provider.make_request_batch([('eth_blockNumber', []), ('eth_blockNumber', [])])) == 2
+
+    sample = telemetry.take_sample()
+    assert sample.n_rpc == 3
+
+
+def test_summarize_workers():
+    rows = [
+        ('fast', T0, 60.0, 600, 10, 1.0, 2, 0.5),
+        ('fast', T0 + datetime.timedelta(minutes=1), 60.0, 600, 10, 3.0, 2, 0.5),
+        ('slow', T0, 60.0, 60, 20, 40.0, 0, 0.0),
+    ]
+    fast, slow = summarize_workers(rows)
+
+    assert fast.worker_name == 'fast'
+    assert fast.last_seen == T0 + datetime.timedelta(minutes=1)
+    assert fast.n_blocks == 1_200
+    assert fast.blocks_per_second == 10.0
+    assert fast.mean_rpc_latency == 0.2
+    assert fast.mean_db_write_seconds == 0.25
+
+    assert slow.worker_name == 'slow'
+    assert slow.blocks_per_second == 1.0
+    assert slow.mean_rpc_latency == 2.0
+    assert slow.mean_db_write_seconds is None
+    assert abs(slow.rpc_fraction - 40 / 60) < 1e-9
+
+
+def test_find_slow_workers():
+    rows = [(f'w{i}', T0, 60.0, 600, 0, 0.0, 0, 0.0) for i in range(4)]
+    rows.append(('laggard', T0, 60.0, 100, 0, 0.0, 0, 0.0))
+    workers = summarize_workers(rows)
+
+    assert [w.worker_name for w in find_slow_workers(workers)] == ['laggard']
+    assert find_slow_workers(workers[:1]) == []
+
+
+def test_estimate_eta():
+    assert estimate_eta(3_600, 1.0) == datetime.timedelta(hours=1)
+    assert estimate_eta(-5, 1.0) == datetime.timedelta(0)
+    assert estimate_eta(100, 0.0) is None
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from utils.rpc_limiter import ConcurrencyLimiter, SharedTokenBucket, is_congestion_error, method_weight, request_weight
+
+
+def test_weights():
+    assert method_weight('debug_traceTransaction') > method_weight('eth_getLogs') > method_weight('eth_getStorageAt')
+    assert request_weight([('eth_getStorageAt', []), ('eth_getStorageAt', []), ('eth_call', [])]) == 4
+    assert is_congestion_error({'error': {'code': -32000, 'message': 'execution aborted (timeout = 5s)'}})
+    assert not is_congestion_error({'error': {'code': 3, 'message': 'execution reverted'}})
+    assert not is_congestion_error({'result': '0x'})
+
+
+def test_caps_in_flight_weight():
+    limiter = ConcurrencyLimiter(initial_limit = 4)
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal in_flight, max_in_flight
+        for _ in range(5):
+            with limiter.request([('eth_call', [])]):
+                with lock:
+                    in_flight += 2
+                    max_in_flight = max(max_in_flight, in_flight)
+                time.sleep(0.002)
+                with lock:
+                    in_flight -= 2
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # the limit may have grown a little while saturated
+    assert max_in_flight <= limiter.limit + 2
+    assert limiter.in_flight == 0
+    assert limiter.limit > 4
+
+
+def test_backs_off_on_congestion():
+    limiter = ConcurrencyLimiter(initial_limit = 100)
+    with limiter.request([('eth_getStorageAt', [])]) as outcome:
+        outcome.failed()
+    assert limiter.limit == 75
+
+    # a failure right after another (within a round-trip) does not compound
+    limiter.acquire(1)
+    limiter.release(1, 'eth_getStorageAt', 1.0, ok = False)
+    assert limiter.limit == 75
+
+    # much slower than the fastest seen counts as congestion too
+    limiter._last_decrease = 0
+    for latency in [0.001, 0.010]:
+        limiter.acquire(1)
+        limiter.release(1, 'eth_call', latency, ok = True)
+    assert limiter.limit < 75
+
+    try:
+        with limiter.request([('eth_call', [])]):
+            limiter._last_decrease = 0
+            raise TimeoutError()
+    except TimeoutError:
+        pass
+    assert limiter.limit < 75 * 0.75
+    assert limiter.in_flight == 0
+
+
+def test_shared_bucket_across_instances(tmp_path):
+    path = str(tmp_path / 'rpc.limit')
+    # two instances on one file stand in for two worker processes
+    a = SharedTokenBucket(path, initial_rate = 1_000, burst_seconds = 0.1)
+    b = SharedTokenBucket(path, initial_rate = 5)
+    assert b.rate == 1_000
+
+    t_start = time.time()
+    for _ in range(20):
+        a.take(10)
+        b.take(10)
+    elapsed = time.time() - t_start
+    # 400 weight at 1000/s, less the 100 of initial burst
+    assert 0.25 < elapsed < 1.0
+
+    a.feedback(10, congested = True)
+    b.feedback(10, congested = True)
+    assert a.rate == 750
+
+    # draining the bucket grows the rate
+    b.feedback(10, congested = False)
+    assert a.rate > 750
+
+
+def test_batches_do_not_make_single_calls_look_slow(tmp_path):
+    shared = SharedTokenBucket(str(tmp_path / 'rpc.limit'), initial_rate = 2_000)
+    limiter = ConcurrencyLimiter(initial_limit = 100, shared = shared)
+
+    for _ in range(4):
+        # a healthy batch of 100 reads is fast per read, but a single read is not 100 times faster
+        limiter.acquire(100)
+        limiter.release(100, 'eth_getStorageAt', 0.010, ok = True, n_requests = 100)
+        limiter.acquire(1)
+        limiter.release(1, 'eth_getStorageAt', 0.002, ok = True)
+        limiter._last_decrease = 0
+
+    assert limiter.limit >= 100
+    assert shared.rate >= 2_000
+
+    # a slow round-trip of the same size still counts
+    limiter.acquire(1)
+    limiter.release(1, 'eth_getStorageAt', 0.020, ok = True)
+    assert limiter.limit < 100
@@ -0,0 +1,137 @@
+import pytest
+
+import find_circuit.find
+from benchmarks.fixtures import SYNTHETIC_TOKEN_A, SYNTHETIC_TOKEN_B, synthetic_circuits
+from pricers.balancer import BalancerPricer
+from pricers.balancer_v2.weighted_pool import BalancerV2WeightedPoolPricer
+from shooter.composer import ArbitrageTemplate, construct_arbitrage, get_arbitrage_template
+from shooter.encoder import BalancerV1Swap, BalancerV2Swap, CalldataTemplate, UniswapV2Swap, UniswapV3Swap, serialize
+from utils import WETH_ADDRESS
+
+SHOOTER = '0x' + '5' * 40
+AMOUNTS = [1, 10 ** 15, 123_456_789 * 10 ** 18, (1 << 255) - 1]
+
+
+def _address(i: int) -> str:
+    return '0x' + f'{i:040x}'
+
+
+def _swap_lists():
+    v2_first = UniswapV2Swap(amount_in=7, amount_out=8, exchange=_address(1), to=_address(2), zero_for_one=True)
+    v2 = UniswapV2Swap(amount_in=None, amount_out=9, exchange=_address(2), to=SHOOTER, zero_for_one=False)
+    b1 = BalancerV1Swap(amount_in=10, exchange=_address(3), token_in=_address(30), token_out=_address(31), to=SHOOTER, requires_approval=False)
+    b2 = BalancerV2Swap(pool_id=b'\x44' * 32, amount_in=11, amount_out=12, token_in=_address(31), token_out=_address(30), to=SHOOTER)
+    v3 = UniswapV3Swap(amount_in=13, exchange=_address(5), to=_address(1), zero_for_one=True, leading_exchanges=[], must_send_input=True)
+    return [
+        [v2_first, v2],
+        [b1, b2],
+        [v3],
+        # a v3 swap called back into a v2 swap and a nested v3 swap
+        [v3._replace(leading_exchanges=[v2_first, v3._replace(must_send_input=False, leading_exchanges=[b1])])],
+        [b2, v3._replace(leading_exchanges=[v2])],
+    ]
+
+
+def _with_amounts(swaps, amounts):
+    """Replace the amounts of the swap list, in serialization order"""
+    amounts = iter(amounts)
+    ret = []
+    for swap in swaps:
+        if isinstance(swap, UniswapV2Swap):
+            if swap.amount_in:
+                swap = swap._replace(amount_in=next(amounts))
+            swap = swap._replace(amount_out=next(amounts))
+        elif isinstance(swap, UniswapV3Swap):
+            swap = swap._replace(amount_in=next(amounts))
+            swap = swap._replace(leading_exchanges=_with_amounts(swap.leading_exchanges, amounts))
+        else:
+            swap = swap._replace(amount_in=next(amounts))
+            if isinstance(swap, BalancerV2Swap):
+                swap = swap._replace(amount_out=next(amounts))
+        ret.append(swap)
+    return ret
+
+
+def test_calldata_template_matches_serialize():
+    for swaps in _swap_lists():
+        template = CalldataTemplate(swaps)
+        assert template.encode(template.compiled_amounts) == serialize(swaps)
+
+        variants = [[AMOUNTS[(i + j) % len(AMOUNTS)] for i in range(len(template.fields))] for j in range(len(AMOUNTS))]
+        encoded = template.encode_many(variants)
+        for amounts, b in zip(variants, encoded):
+            assert b == serialize(_with_amounts(swaps, amounts))
+
+
+def test_calldata_template_checks_amounts():
+    template = CalldataTemplate([_swap_lists()[1][0]])
+    with pytest.raises(AssertionError):
+        template.encode([0])
+    with pytest.raises(OverflowError):
+        template.encode([1 << 256])
+
+
+class _FeeOnTransfer(find_circuit.find.FeeTransferCalculator):
+    """Takes 1% of every transfer of token B"""
+
+    def out_from_transfer(self, token: str, from_: str, to_: str, amount: int) -> int:
+        return amount * 99 // 100 if token == SYNTHETIC_TOKEN_B else amount
+
+
+class _FixedRatePricer:
+    """Prices every swap at 1:2, token1 per token0"""
+
+    def __init__(self, address: str, token0: str, token1: str) -> None:
+        self.address = address
+        self.token0 = token0
+        self.token1 = token1
+        self.pool_id = bytes.fromhex(address[2:]).rjust(32, b'\x00')
+
+    def token_out_for_exact_in(self, token_in: str, token_out: str, amount_in: int, block_identifier, **_):
+        return (amount_in * 2 if token_in == self.token0 else amount_in // 2), None
+
+
+class _BalancerV1(_FixedRatePricer, BalancerPricer):
+    pass
+
+
+class _BalancerV2(_FixedRatePricer, BalancerV2WeightedPoolPricer):
+    pass
+
+
+def _arbitrages():
+    for c in synthetic_circuits():
+        yield find_circuit.find.FoundArbitrage(10 ** 18, [f() for f in c.exchanges], c.directions, WETH_ADDRESS, 0)
+
+    (v3_v2, v3_v3_v2, _) = synthetic_circuits()
+    v3_a, v3_ab, v2_b = [f() for f in v3_v3_v2.exchanges]
+    b1 = _BalancerV1(_address(0xb1), SYNTHETIC_TOKEN_A, SYNTHETIC_TOKEN_B)
+    b2 = _BalancerV2(_address(0xb2), SYNTHETIC_TOKEN_A, SYNTHETIC_TOKEN_B)
+    for middle in [b1, b2]:
+        yield find_circuit.find.FoundArbitrage(10 ** 18, [v3_a, middle, v2_b], v3_v3_v2.directions, WETH_ADDRESS, 0)
+    # v2 first, into a balancer pool
+    v2_a = v3_v2.exchanges[1]()
+    yield find_circuit.find.FoundArbitrage(10 ** 18, [v2_a, b1, v2_b], v3_v3_v2.directions, WETH_ADDRESS, 0)
+
+
+def test_arbitrage_template_matches_construct_arbitrage():
+    fee_transfer_calculator = _FeeOnTransfer()
+    amounts_in = [10 ** 15, 10 ** 17, 3 * 10 ** 18 + 1]
+
+    for fa in _arbitrages():
+        template = ArbitrageTemplate(fa.circuit, fa.directions, SHOOTER)
+        _, approvals_required = construct_arbitrage(fa, SHOOTER, 'latest', fee_transfer_calculator)
+        assert template.approvals_required == approvals_required
+
+        encoded = template.encode_many(fa, amounts_in, 'latest', fee_transfer_calculator)
+        for amount_in, b in zip(amounts_in, encoded):
+            swaps, _ = construct_arbitrage(fa._replace(amount_in=amount_in), SHOOTER, 'latest', fee_transfer_calculator)
+            assert b == serialize(swaps)
+
+        assert template.encode(fa, 'latest', fee_transfer_calculator) == serialize(construct_arbitrage(fa, SHOOTER, 'latest', fee_transfer_calculator)[0])
+
+
+def test_template_cache():
+    fa1, fa2 = list(_arbitrages())[:2]
+    assert get_arbitrage_template(fa1, SHOOTER) is get_arbitrage_template(fa1._replace(amount_in=5), SHOOTER)
+    assert get_arbitrage_template(fa1, SHOOTER) is not get_arbitrage_template(fa2, SHOOTER)
@@ -0,0 +1,75 @@
+from backtest.gather_samples.trace_store import ValueTransfer, flatten_value_transfers, trace_block
+
+A = '0x' + 'aa' * 20
+B = '0x' + 'bb' * 20
+C = '0x' + 'cc' * 20
+MINER = '0x' + 'dd' * 20
+TXN_1 = b'\x01' * 32
+TXN_2 = b'\x02' * 32
+
+
+def _frame(type_, from_, to, value=None, calls=(), error=None):
+    ret = {'type': type_, 'from': from_, 'to': to, 'calls': list(calls)}
+    if value is not None:
+        ret['value'] = hex(value)
+    if error is not None:
+        ret['error'] = error
+    return ret
+
+
+def test_flatten_value_transfers():
+    frame = _frame('CALL', A, B, 5, calls=[
+        _frame('CALL', B, MINER, 7),
+        _frame('DELEGATECALL', B, C, 5),
+        _frame('STATICCALL', B, C),
+        _frame('CALL', B, C, 0),
+        _frame('CALL', B, MINER, 100, error='execution reverted', calls=[
+            _frame('CALL', MINER, C, 3),
+        ]),
+        _frame('CALL', B, C, 2, calls=[
+            _frame('CALL', C, MINER, 1),
+        ]),
+    ])
+
+    got = flatten_value_transfers(TXN_1, frame)
+    assert got == [
+        ValueTransfer(TXN_1, bytes.fromhex(A[2:]), bytes.fromhex(B[2:]), 5),
+        ValueTransfer(TXN_1, bytes.fromhex(B[2:]), bytes.fromhex(MINER[2:]), 7),
+        ValueTransfer(TXN_1, bytes.fromhex(B[2:]), bytes.fromhex(C[2:]), 2),
+        ValueTransfer(TXN_1, bytes.fromhex(C[2:]), bytes.fromhex(MINER[2:]), 1),
+    ]
+
+
+class _FakeProvider:
+    def __init__(self, traces):
+        self.traces = traces
+        self.requests = []
+
+    def make_request(self, method, params):
+        self.requests.append((method, params))
+        return {'result': self.traces}
+
+
+class _FakeEth:
+    def get_block(self, block_number):
+        return {'miner': MINER, 'transactions': [TXN_1, TXN_2]}
+
+
+class _FakeWeb3:
+    def __init__(self, traces):
+        self.eth = _FakeEth()
+        self.provider = _FakeProvider(traces)
+
+
+def test_trace_block():
+    w3 = _FakeWeb3([
+        {'result': _frame('CALL', A, MINER, 9)},
+        {'txHash': '0x' + TXN_2.hex(), 'result': _frame('CALL', A, B, calls=[_frame('CALL', B, MINER, 4)])},
+    ])
+
+    miner, transfers, n_transactions = trace_block(w3, 123)
+
+    assert w3.provider.requests == [('debug_traceBlockByNumber', ['0x7b', {'tracer': 'callTracer', 'timeout': '5m'}])]
+    assert miner == bytes.fromhex(MINER[2:])
+    assert n_transactions == 2
+    assert [(t.txn_hash, t.value) for t in transfers] == [(TXN_1, 9), (TXN_2, 4)]
@@ -0,0 +1,166 @@
+"""
+All but the first test need a Postgres to talk to (configured the same way as connect_db(), ie PSQL_HOST etc)
+and are skipped when none is reachable. They work in a scratch schema which is dropped afterward.
+"""
+
+import time
+
+import psycopg2
+import pytest
+
+from backtest import progress, work_queue
+from backtest.utils import connect_db
+
+SCHEMA = 'test_work_queue'
+JOB = 'test_job'
+
+
+def test_plan_ranges():
+    assert work_queue.plan_ranges(10, 35, 10) == [(10, 20), (20, 30), (30, 35)]
+    assert work_queue.plan_ranges(10, 10, 10) == []
+
+
+@pytest.fixture()
+def connect():
+    conns = []
+
+    def _connect():
+        try:
+            conn = connect_db()
+        except psycopg2.OperationalError:
+            pytest.skip('no postgres available')
+        conn.cursor().execute(f'SET search_path TO {SCHEMA}')
+        conn.commit()
+        conns.append(conn)
+        return conn
+
+    try:
+        setup_conn = connect_db()
+    except psycopg2.OperationalError:
+        pytest.skip('no postgres available')
+    curr = setup_conn.cursor()
+    curr.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA}')
+    work_queue.setup_db(curr)
+    setup_conn.commit()
+
+    yield _connect
+
+    for conn in conns:
+        conn.close()
+    curr.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+    setup_conn.commit()
+    setup_conn.close()
+
+
+def _fill(conn, start_block: int, end_block_exclusive: int, range_blocks: int) -> int:
+    ret = work_queue.fill(conn.cursor(), JOB, start_block, end_block_exclusive, range_blocks, shuffle = False)
+    conn.commit()
+    return ret
+
+
+def test_batched_claims_and_fill_extends(connect):
+    conn = connect()
+    assert _fill(conn, 100, 150, 10) == 5
+    # only the uncovered ends are queued
+    assert _fill(conn, 80, 170, 10) == 4
+
+    a = work_queue.WorkQueue(connect(), JOB, 'a', claim_batch = 3)
+    b = work_queue.WorkQueue(connect(), JOB, 'b', claim_batch = 3)
+    claimed_a = a.claim(3)
+    claimed_b = b.claim(100)
+    assert len(claimed_a) == 3 and len(claimed_b) == 6
+    assert {x.id for x in claimed_a}.isdisjoint(x.id for x in claimed_b)
+    assert sum(x.end_block_exclusive - x.progress for x in claimed_a + claimed_b) == 90
+    assert a.claim(1) == []
+
+
+def test_split_straggler(connect):
+    _fill(connect(), 0, 1_000, 1_000)
+    slow = work_queue.WorkQueue(connect(), JOB, 'slow')
+    idle = work_queue.WorkQueue(connect(), JOB, 'idle')
+
+    lease = slow.next_lease()
+    assert slow.advance(lease, 0, 100) == (0, 100)
+
+    # nothing left to claim, so the idle worker takes the back half of the unreserved blocks
+    stolen = idle.next_lease()
+    assert (stolen.progress, stolen.end_block_exclusive) == (550, 1_000)
+
+    # the owner finds out at its next chunk
+    assert slow.advance(lease, 100, 1_000) == (100, 550)
+    assert slow.advance(lease, 550, 1_000) is None
+    assert lease.end_block_exclusive == 550
+
+
+def test_expired_lease_is_reclaimed(connect):
+    conn = connect()
+    _fill(conn, 0, 100, 100)
+    crashed = work_queue.WorkQueue(connect(), JOB, 'crashed', lease_seconds = 60)
+    other = work_queue.WorkQueue(connect(), JOB, 'other', lease_seconds = 60)
+
+    lease = crashed.next_lease()
+    crashed.advance(lease, 0, 10)
+    crashed.advance(lease, 10, 10)
+    assert other.claim(1) == []
+
+    conn.cursor().execute("UPDATE work_queue_ranges SET heartbeat_on = now()::timestamp - interval '1 hour'")
+    conn.commit()
+
+    (reclaimed,) = other.claim(1)
+    assert (reclaimed.progress, reclaimed.end_block_exclusive) == (10, 100)
+    with pytest.raises(work_queue.LeaseLost):
+        crashed.advance(lease, 20, 10)
+
+
+def test_run_worker_covers_range_once(connect):
+    _fill(connect(), 0, 1_000, 300)
+    processed = []
+
+    a = work_queue.WorkQueue(connect(), JOB, 'a', claim_batch = 2)
+    b = work_queue.WorkQueue(connect(), JOB, 'b', claim_batch = 2)
+
+    def process_b(start_block, end_block_exclusive):
+        processed.append((start_block, end_block_exclusive))
+
+    def process_a(start_block, end_block_exclusive):
+        processed.append((start_block, end_block_exclusive))
+        if len(processed) == 1:
+            # another worker joins in the middle of our first chunk
+            work_queue.run_worker(b, process_b, chunk_blocks = 50)
+
+    assert work_queue.run_worker(a, process_a, chunk_blocks = 50) > 0
+
+    blocks = [x for start, end in processed for x in range(start, end)]
+    assert sorted(blocks) == list(range(1_000))
+
+
+def test_heartbeat_renews_lease_during_slow_chunk(connect):
+    _fill(connect(), 0, 10, 10)
+    slow = work_queue.WorkQueue(connect(), JOB, 'slow', lease_seconds = 1.5)
+    other = work_queue.WorkQueue(connect(), JOB, 'other', lease_seconds = 1.5)
+    claimed_meanwhile = []
+
+    def process_range(start_block, end_block_exclusive):
+        # longer than the lease
+        time.sleep(3)
+        claimed_meanwhile.extend(other.claim(1))
+
+    assert work_queue.run_worker(slow, process_range, chunk_blocks = 10) == 10
+    assert claimed_meanwhile == []
+
+
+def test_run_worker_flushes_telemetry_on_exit(connect):
+    _fill(connect(), 0, 95, 30)
+    conn = connect()
+    curr = conn.cursor()
+    progress.setup_db(curr)
+    curr.execute('INSERT INTO job_progress (job_name, total_blocks, done_blocks) VALUES (%s, 95, 0)', (JOB,))
+    conn.commit()
+
+    # never reaches a full period while running
+    telemetry = progress.WorkerTelemetry(JOB, 'a', conn = connect(), flush_period_seconds = 3600)
+    queue = work_queue.WorkQueue(connect(), JOB, 'a')
+    assert work_queue.run_worker(queue, lambda start, end: None, chunk_blocks = 10, telemetry = telemetry) == 95
+
+    curr.execute('SELECT done_blocks FROM job_progress WHERE job_name = %s', (JOB,))
+    assert curr.fetchone() == (95,)
@@ -1,10 +1,12 @@
 import datetime
 import subprocess
 import time
+from backtest import notifications
 from backtest.utils import connect_db
 
 db = connect_db()
 curr = db.cursor()
+listener = notifications.Listener([notifications.RESERVATION_PROGRESS_CHANNEL])
 
 curr.execute(
     '''
@@ -24,6 +26,8 @@ last_ts = []
 while True:
     time.sleep(10)
     db.rollback()
+    # re-query once a reservation is claimed or completed, or at least once a minute
+    listener.wait(timeout=60)
     curr.execute('select count(*) from candidate_arbitrage_reshoot_blocks where completed_on is not null')
     (n_blocks,) = curr.fetchone()
     last_marks.append(n_blocks)
@@ -1,9 +1,11 @@
 import datetime
 import time
+from backtest import notifications
 from backtest.utils import connect_db
 
 db = connect_db()
 curr = db.cursor()
+listener = notifications.Listener([notifications.RESERVATION_PROGRESS_CHANNEL])
 
 curr.execute(
     '''
@@ -33,6 +35,8 @@ last_ts = []
 while True:
     time.sleep(5)
     db.commit()
+    # re-query once a reservation is claimed or completed, or at least once a minute
+    listener.wait(timeout=60)
     curr.execute(
         '''
         SELECT SUM(cnt)::integer
@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import datetime
 import typing
 import os
@@ -20,7 +21,10 @@ import websockets.exceptions
 from web3.providers.base import JSONBaseProvider
 
 from .throttler import BlockThrottle
+from .block_headers import get_header_cache
+from .rpc_limiter import ConcurrencyLimiter, RequestOutcome, is_congestion_error, limiter_from_env
 from .profiling import get_measurement, reset_measurement, profile
+from . import profiling
 
 l = logging.getLogger(__name__)
 
@@ -101,10 +105,18 @@ def setup_logging(job_name = None, suppress: typing.List[str] = [], worker_name:
 
 class RetryingProvider(JSONBaseProvider):
     _internal_provider: web3.WebsocketProvider
+    limiter: typing.Optional[ConcurrencyLimiter]
+    # called with (number of requests, seconds taken) after every round-trip, batches included
+    request_observers: typing.List[typing.Callable[[int, float], None]]
 
-    def __init__(self) -> None:
+    # connects to the mainnet archive node at WEB3_HOST, whose old blocks are final (see block_headers)
+    serves_archive_node = True
+
+    def __init__(self, limiter: typing.Optional[ConcurrencyLimiter] = None) -> None:
         super().__init__()
         self._internal_provider = None
+        self.limiter = limiter
+        self.request_observers = []
         self._connect()
 
     def _connect(self):
@@ -130,6 +142,9 @@ class RetryingProvider(JSONBaseProvider):
         on_backoff = lambda x: x['args'][0]._connect()
     )
     def make_request_batch(self, requests: typing.Tuple[str, typing.Any]) -> typing.List[web3.types.RPCResponse]:
+        if profiling.ENABLED:
+            profiling.inc_counter(profiling.RPC_CALLS, len(requests))
+            profiling.inc_counter(profiling.STORAGE_READS, sum(1 for method, _ in requests if method == 'eth_getStorageAt'))
         obj = []
         for method, params in requests:
             rpc_dict = {
@@ -141,11 +156,14 @@ class RetryingProvider(JSONBaseProvider):
             obj.append(rpc_dict)
         payload = json.dumps(obj).encode('ascii')
 
-        future = asyncio.run_coroutine_threadsafe(
-            self._internal_provider.coro_make_request(payload),
-            web3.WebsocketProvider._loop
-        )
-        ret = future.result()
+        with self._observe(len(requests)), self._limit(requests) as outcome:
+            future = asyncio.run_coroutine_threadsafe(
+                self._internal_provider.coro_make_request(payload),
+                web3.WebsocketProvider._loop
+            )
+            ret = future.result()
+            if any(is_congestion_error(x) for x in (ret if isinstance(ret, list) else [ret])):
+                outcome.failed()
         ret = sorted(ret, key=lambda x: x['id'])
         return ret
 
@@ -161,17 +179,41 @@ class RetryingProvider(JSONBaseProvider):
         on_backoff = lambda x: x['args'][0]._connect()
     )
     def make_request(self, method, params):
+        profiling.inc_counter(profiling.RPC_CALLS)
+        if method == 'eth_getStorageAt':
+            profiling.inc_counter(profiling.STORAGE_READS)
         request_data = self.encode_rpc_request(method, params)
-        future = asyncio.run_coroutine_threadsafe(
-            self._internal_provider.coro_make_request(request_data),
-            web3.WebsocketProvider._loop
-        )
-        ret = future.result()
+        with self._observe(1), self._limit([(method, params)]) as outcome:
+            future = asyncio.run_coroutine_threadsafe(
+                self._internal_provider.coro_make_request(request_data),
+                web3.WebsocketProvider._loop
+            )
+            ret = future.result()
+            if is_congestion_error(ret):
+                outcome.failed()
         return ret
 
+    @contextlib.contextmanager
+    def _observe(self, n_requests: int):
+        if len(self.request_observers) == 0:
+            yield
+            return
+        t_start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - t_start
+            for observer in self.request_observers:
+                observer(n_requests, elapsed)
+
+    def _limit(self, requests: typing.List[typing.Tuple[str, typing.Any]]):
+        if self.limiter is None:
+            return contextlib.nullcontext(RequestOutcome())
+        return self.limiter.request(requests)
+
 
 def connect_web3() -> web3.Web3:
-    w3 = web3.Web3(RetryingProvider())
+    w3 = web3.Web3(RetryingProvider(limiter_from_env()))
 
     if not w3.isConnected():
         l.error(f'Could not connect to web3')
@@ -501,17 +543,8 @@ def get_block_logs(w3: web3.Web3, block_identifier: int) -> typing.List[web3.typ
     return logs
 
 
-_block_timestamp_cache: typing.Dict[int, int] = {}
 def get_block_timestamp(w3: web3.Web3, block_number: int) -> int:
-    got = _block_timestamp_cache.get(block_number, None)
-    
-    if got is not None:
-        return got
-    
-    # need to load
-    ts = w3.eth.get_block(block_number)['timestamp']
-    _block_timestamp_cache[block_number] = ts
-    return ts
+    return get_header_cache(w3).timestamp(block_number)
 
 
 # taken from https://gist.github.com/thatalextaylor/7408395 on Jan 12th 2022
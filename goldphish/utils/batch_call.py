@@ -0,0 +1,45 @@
+"""
+utils/batch_call.py
+
+Many eth_calls, possibly each at a different block, sent as JSON-RPC batches: one
+round-trip per `batch_size` calls rather than one per call. A multicall contract
+cannot do this across blocks, and a batch costs the node no more than the calls would.
+"""
+import typing
+import web3
+
+from . import profiling
+
+DEFAULT_BATCH_SIZE = 500
+
+# (to, calldata, block number)
+Call = typing.Tuple[str, bytes, int]
+
+
+def batch_eth_call(w3: web3.Web3, calls: typing.Sequence[Call], batch_size: int = DEFAULT_BATCH_SIZE) -> typing.List[typing.Optional[bytes]]:
+    """
+    Returns the output of each call, in order, or None for those that reverted
+    (or called an address without code).
+    """
+    provider = w3.provider
+    ret = []
+    for i in range(0, len(calls), batch_size):
+        reqs = [
+            ('eth_call', [{'to': to, 'data': '0x' + data.hex()}, hex(block_number)])
+            for to, data, block_number in calls[i:i + batch_size]
+        ]
+        with profiling.profile('batch_eth_call'):
+            if hasattr(provider, 'make_request_batch'):
+                resps = provider.make_request_batch(reqs)
+            else:
+                resps = [provider.make_request(method, params) for method, params in reqs]
+
+        for (to, _, block_number), resp in zip(calls[i:i + batch_size], resps):
+            if 'error' in resp:
+                if 'revert' not in str(resp['error'].get('message', '')):
+                    raise Exception(f'eth_call to {to} at block {block_number:,} failed: {resp["error"]}')
+                ret.append(None)
+                continue
+            result = bytes.fromhex(resp['result'][2:])
+            ret.append(result if len(result) > 0 else None)
+    return ret
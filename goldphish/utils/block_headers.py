@@ -0,0 +1,233 @@
+"""
+utils/block_headers.py
+
+A bounded cache of the block header fields we use (timestamp, miner, base fee),
+filled with batched eth_getBlockByNumber(number, false) requests.
+
+A miss that continues a forward scan (one on the block just past the last miss's
+batch) also fetches the next `readahead` blocks in the same batch; other misses
+fetch only their block, so random access costs one request per block. A job that
+knows its range up front can call prefetch(start, end) to load it all in one batch.
+
+Optionally backed by a file of fixed-size records indexed by block number, so that
+headers survive restarts (the file is sparse: only fetched blocks take disk space).
+A header on file is never re-fetched, so only blocks at least `finality_depth` below
+the tip are written to it.
+
+The shared, per-connection cache is get_header_cache(w3); for connections to the
+archive node (see RetryingProvider) it is backed by the file at $BLOCK_HEADER_CACHE,
+if that is set. Ganache forks and other connections are cached in memory only.
+"""
+import os
+import struct
+import threading
+import typing
+import weakref
+import cachetools
+import web3
+
+from . import profiling
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_READAHEAD = 32
+DEFAULT_BATCH_SIZE = 1_000
+
+# blocks this far below the tip are taken to be final
+DEFAULT_FINALITY_DEPTH = 64
+
+# flags, timestamp, miner, base fee
+_RECORD = struct.Struct('<BQ20sQ')
+_RECORD_PRESENT = 0x1
+_RECORD_HAS_BASE_FEE = 0x2
+
+
+class BlockHeader(typing.NamedTuple):
+    number: int
+    timestamp: int
+    miner: str
+    base_fee_per_gas: typing.Optional[int]
+    """None before London"""
+
+
+class HeaderCache:
+    w3: web3.Web3
+    readahead: int
+    batch_size: int
+    path: typing.Optional[str]
+    finality_depth: int
+    _cache: cachetools.LRUCache
+    _fd: typing.Optional[int]
+
+    # highest block known to be final
+    _final_block: int
+
+    # the block just past the last batch fetched on a miss, where a forward scan misses next
+    _next_sequential_miss: typing.Optional[int]
+
+    def __init__(
+            self,
+            w3: web3.Web3,
+            max_entries: int = DEFAULT_MAX_ENTRIES,
+            readahead: int = DEFAULT_READAHEAD,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            path: typing.Optional[str] = None,
+            finality_depth: int = DEFAULT_FINALITY_DEPTH,
+        ) -> None:
+        self.w3 = w3
+        self.readahead = readahead
+        self.batch_size = batch_size
+        self.path = path
+        self.finality_depth = finality_depth
+        self._cache = cachetools.LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+        self._final_block = -1
+        self._next_sequential_miss = None
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644) if path is not None else None
+        self._close_fd = weakref.finalize(self, os.close, self._fd) if self._fd is not None else None
+
+    def close(self):
+        if self._fd is not None:
+            self._close_fd()
+            self._fd = None
+
+    def get(self, block_number: int) -> BlockHeader:
+        with self._lock:
+            ret = self._cache.get(block_number, None)
+        if ret is not None:
+            return ret
+
+        if self._fd is not None:
+            # reading from disk is cheap enough that there is no need to read ahead
+            found = self._read_records([block_number])
+            if block_number in found:
+                with self._lock:
+                    self._cache[block_number] = found[block_number]
+                return found[block_number]
+
+        with self._lock:
+            readahead = self.readahead if block_number == self._next_sequential_miss else 0
+            self._next_sequential_miss = block_number + 1 + readahead
+        self.prefetch(block_number, block_number + 1 + readahead)
+        with self._lock:
+            ret = self._cache.get(block_number, None)
+        if ret is None:
+            raise ValueError(f'block {block_number:,} not found')
+        return ret
+
+    def timestamp(self, block_number: int) -> int:
+        return self.get(block_number).timestamp
+
+    def miner(self, block_number: int) -> str:
+        return self.get(block_number).miner
+
+    def base_fee(self, block_number: int) -> typing.Optional[int]:
+        return self.get(block_number).base_fee_per_gas
+
+    def prefetch(self, start_block: int, end_block_exclusive: int):
+        """
+        Load headers for the given range, reading from disk or fetching from
+        the node (in batches of batch_size) as needed. Blocks past the chain
+        tip are skipped.
+        """
+        with self._lock:
+            needed = [b for b in range(start_block, end_block_exclusive) if b not in self._cache]
+        if len(needed) == 0:
+            return
+
+        if self._fd is not None:
+            found = self._read_records(needed)
+            needed = [b for b in needed if b not in found]
+            with self._lock:
+                for header in found.values():
+                    self._cache[header.number] = header
+
+        for i in range(0, len(needed), self.batch_size):
+            fetched = self._fetch(needed[i:i + self.batch_size])
+            if self._fd is not None:
+                self._write_records(fetched)
+            with self._lock:
+                for header in fetched:
+                    self._cache[header.number] = header
+
+    def _fetch(self, block_numbers: typing.List[int]) -> typing.List[BlockHeader]:
+        reqs = [('eth_getBlockByNumber', [hex(b), False]) for b in block_numbers]
+        with profiling.profile('block_headers.fetch'):
+            provider = self.w3.provider
+            if hasattr(provider, 'make_request_batch'):
+                resps = provider.make_request_batch(reqs)
+            else:
+                resps = [provider.make_request(method, params) for method, params in reqs]
+
+        ret = []
+        for block_number, resp in zip(block_numbers, resps):
+            if 'error' in resp:
+                raise Exception(f'could not fetch block {block_number:,}: {resp["error"]}')
+            block = resp['result']
+            if block is None:
+                # past the tip
+                continue
+            base_fee = block.get('baseFeePerGas', None)
+            ret.append(BlockHeader(
+                number = block_number,
+                timestamp = int(block['timestamp'], base=16),
+                miner = web3.Web3.toChecksumAddress(block['miner']),
+                base_fee_per_gas = int(base_fee, base=16) if base_fee is not None else None,
+            ))
+        return ret
+
+    def _read_records(self, block_numbers: typing.List[int]) -> typing.Dict[int, BlockHeader]:
+        ret = {}
+        for block_number in block_numbers:
+            b = os.pread(self._fd, _RECORD.size, block_number * _RECORD.size)
+            if len(b) < _RECORD.size:
+                continue
+            flags, timestamp, miner, base_fee = _RECORD.unpack(b)
+            if not flags & _RECORD_PRESENT:
+                continue
+            ret[block_number] = BlockHeader(
+                number = block_number,
+                timestamp = timestamp,
+                miner = web3.Web3.toChecksumAddress(miner),
+                base_fee_per_gas = base_fee if flags & _RECORD_HAS_BASE_FEE else None,
+            )
+        return ret
+
+    def _write_records(self, headers: typing.List[BlockHeader]):
+        if len(headers) == 0:
+            return
+        if max(header.number for header in headers) > self._final_block:
+            self._final_block = self.w3.eth.block_number - self.finality_depth
+
+        for header in headers:
+            if header.number > self._final_block:
+                continue
+            flags = _RECORD_PRESENT
+            if header.base_fee_per_gas is not None:
+                flags |= _RECORD_HAS_BASE_FEE
+            b = _RECORD.pack(
+                flags,
+                header.timestamp,
+                bytes.fromhex(header.miner[2:]),
+                header.base_fee_per_gas or 0,
+            )
+            os.pwrite(self._fd, b, header.number * _RECORD.size)
+
+
+_shared_caches_lock = threading.Lock()
+
+
+def get_header_cache(w3: web3.Web3) -> HeaderCache:
+    """
+    The header cache shared by everything using this web3 connection
+    """
+    with _shared_caches_lock:
+        # kept on the connection itself, so that both go once the connection is dropped
+        # (a registry keyed on the connection would keep it alive through the cache)
+        ret = getattr(w3, '_header_cache', None)
+        if ret is None:
+            path = None
+            if getattr(w3.provider, 'serves_archive_node', False):
+                path = os.getenv('BLOCK_HEADER_CACHE', None)
+            ret = HeaderCache(w3, path=path)
+            w3._header_cache = ret
+        return ret
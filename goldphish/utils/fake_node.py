@@ -0,0 +1,344 @@
+"""
+utils/fake_node.py
+
+A web3 provider that answers JSON-RPC requests from a recorded snapshot instead of
+an archive node, for testing and benchmarking pricers offline.
+
+Served from the snapshot:
+    eth_getStorageAt            by (address, slot, block); block-agnostic entries match any block
+    eth_call                    by (to, calldata, block); likewise
+    eth_getLogs                 from any recorded request with the same address/topics
+                                filter whose block range covers the requested one
+    eth_getTransactionReceipt   by hash
+    anything else               by exact (method, params)
+
+To record, wrap a real provider; misses are forwarded to it and kept:
+
+    provider = FakeNodeProvider(upstream=connect_web3().provider)
+    w3 = web3.Web3(provider)
+    ... run the code under test ...
+    provider.snapshot.save('snapshot.json.gz')
+
+and to replay:
+
+    w3 = web3.Web3(FakeNodeProvider(Snapshot.load('snapshot.json.gz'), latency_seconds=0.002))
+"""
+import collections
+import gzip
+import json
+import threading
+import time
+import typing
+import web3
+import web3.providers
+import web3.types
+
+from . import profiling
+
+SNAPSHOT_VERSION = 1
+
+ZERO_WORD = '0x' + '00' * 32
+
+MAINNET_CHAIN_ID = 1
+
+BlockKey = typing.Optional[int]
+
+
+def _block_key(block_identifier) -> BlockKey:
+    """
+    Numbered blocks as ints; tags ('latest' etc) as None, which matches any block
+    """
+    if isinstance(block_identifier, int):
+        return block_identifier
+    if isinstance(block_identifier, str) and block_identifier.startswith('0x'):
+        return int(block_identifier, base=16)
+    return None
+
+
+def _slot_key(slot) -> int:
+    if isinstance(slot, int):
+        return slot
+    if isinstance(slot, (bytes, bytearray)):
+        return int.from_bytes(slot, byteorder='big', signed=False)
+    return int(slot, base=16)
+
+
+def _hex(b: typing.Union[bytes, str]) -> str:
+    if isinstance(b, (bytes, bytearray)):
+        return '0x' + b.hex()
+    return b.lower()
+
+
+def _logs_filter_key(log_filter: dict) -> str:
+    address = log_filter.get('address', None)
+    if isinstance(address, str):
+        address = [address]
+    if address is not None:
+        address = sorted(a.lower() for a in address)
+
+    topics = []
+    for topic in log_filter.get('topics', None) or []:
+        if isinstance(topic, list):
+            topic = sorted(t.lower() for t in topic)
+        elif topic is not None:
+            topic = topic.lower()
+        topics.append(topic)
+    # trailing wildcards do not narrow the filter
+    while len(topics) > 0 and topics[-1] is None:
+        topics.pop()
+
+    return json.dumps({'address': address, 'topics': topics}, sort_keys=True)
+
+
+class Snapshot:
+    """
+    Recorded JSON-RPC results. Values are kept in their raw (hex string) JSON-RPC form.
+    """
+    storage: typing.Dict[typing.Tuple[str, int, BlockKey], str]
+    calls: typing.Dict[typing.Tuple[str, str, BlockKey], str]
+    receipts: typing.Dict[str, dict]
+    logs: typing.List[typing.Tuple[str, int, int, typing.List[dict]]]
+    other: typing.Dict[str, typing.Any]
+
+    def __init__(self) -> None:
+        self.storage = {}
+        self.calls = {}
+        self.receipts = {}
+        self.logs = []
+        self.other = {}
+        self._lock = threading.Lock()
+
+    def set_storage(self, address: str, slot: typing.Union[int, bytes, str], value: int, block_identifier = None):
+        """
+        Set a storage word; when block_identifier is None the value is served at every block
+        """
+        key = (address.lower(), _slot_key(slot), _block_key(block_identifier))
+        self.storage[key] = '0x' + value.to_bytes(32, byteorder='big', signed=False).hex()
+
+    def set_call(self, address: str, calldata: typing.Union[bytes, str], result: typing.Union[bytes, str], block_identifier = None):
+        """
+        Set the return data of an eth_call; when block_identifier is None it is served at every block
+        """
+        self.calls[(address.lower(), _hex(calldata), _block_key(block_identifier))] = _hex(result)
+
+    def add_receipt(self, receipt: dict):
+        self.receipts[receipt['transactionHash'].lower()] = receipt
+
+    def add_logs(self, log_filter: dict, logs: typing.List[dict]):
+        """
+        Record the response to an eth_getLogs request over a numbered block range
+        """
+        from_block = _block_key(log_filter['fromBlock'])
+        to_block = _block_key(log_filter['toBlock'])
+        assert from_block is not None and to_block is not None
+        with self._lock:
+            self.logs.append((_logs_filter_key(log_filter), from_block, to_block, list(logs)))
+
+    def lookup(self, method: str, params: typing.List) -> typing.Tuple[bool, typing.Any]:
+        """
+        Returns (found, result)
+        """
+        if method == 'eth_getStorageAt':
+            address, slot, block_identifier = params
+            address = address.lower()
+            slot = _slot_key(slot)
+            for block_key in (_block_key(block_identifier), None):
+                if (address, slot, block_key) in self.storage:
+                    return True, self.storage[(address, slot, block_key)]
+            return False, None
+
+        if method == 'eth_call':
+            txn, block_identifier = params
+            to = txn['to'].lower()
+            data = _hex(txn.get('data', '0x'))
+            for block_key in (_block_key(block_identifier), None):
+                if (to, data, block_key) in self.calls:
+                    return True, self.calls[(to, data, block_key)]
+            return False, None
+
+        if method == 'eth_getTransactionReceipt':
+            (tx_hash,) = params
+            tx_hash = _hex(tx_hash)
+            if tx_hash in self.receipts:
+                return True, self.receipts[tx_hash]
+            return False, None
+
+        if method == 'eth_getLogs':
+            (log_filter,) = params
+            from_block = _block_key(log_filter.get('fromBlock', None))
+            to_block = _block_key(log_filter.get('toBlock', None))
+            if from_block is not None and to_block is not None:
+                filter_key = _logs_filter_key(log_filter)
+                for recorded_key, recorded_from, recorded_to, logs in self.logs:
+                    if recorded_key == filter_key and recorded_from <= from_block and to_block <= recorded_to:
+                        return True, [x for x in logs if from_block <= int(x['blockNumber'], base=16) <= to_block]
+
+        key = json.dumps([method, params], sort_keys=True)
+        if key in self.other:
+            return True, self.other[key]
+        if method == 'eth_chainId':
+            # web3 asks for this when building calls; snapshots are of mainnet
+            return True, hex(MAINNET_CHAIN_ID)
+        return False, None
+
+    def record(self, method: str, params: typing.List, result: typing.Any):
+        if method == 'eth_getStorageAt':
+            address, slot, block_identifier = params
+            with self._lock:
+                self.storage[(address.lower(), _slot_key(slot), _block_key(block_identifier))] = result
+        elif method == 'eth_call':
+            txn, block_identifier = params
+            with self._lock:
+                self.calls[(txn['to'].lower(), _hex(txn.get('data', '0x')), _block_key(block_identifier))] = result
+        elif method == 'eth_getTransactionReceipt' and result is not None:
+            with self._lock:
+                self.receipts[_hex(params[0])] = result
+        elif method == 'eth_getLogs' and _block_key(params[0].get('fromBlock', None)) is not None and _block_key(params[0].get('toBlock', None)) is not None:
+            self.add_logs(params[0], result)
+        else:
+            with self._lock:
+                self.other[json.dumps([method, params], sort_keys=True)] = result
+
+    def to_json(self) -> dict:
+        return {
+            'version': SNAPSHOT_VERSION,
+            'storage': [[address, hex(slot), block, value] for (address, slot, block), value in self.storage.items()],
+            'calls': [[to, data, block, result] for (to, data, block), result in self.calls.items()],
+            'receipts': list(self.receipts.values()),
+            'logs': [{'filter': json.loads(k), 'fromBlock': f, 'toBlock': t, 'logs': logs} for k, f, t, logs in self.logs],
+            'other': [[json.loads(k), v] for k, v in self.other.items()],
+        }
+
+    @staticmethod
+    def from_json(obj: dict) -> 'Snapshot':
+        assert obj['version'] == SNAPSHOT_VERSION, f'unknown snapshot version {obj["version"]}'
+        ret = Snapshot()
+        for address, slot, block, value in obj['storage']:
+            ret.storage[(address, int(slot, base=16), block)] = value
+        for to, data, block, result in obj['calls']:
+            ret.calls[(to, data, block)] = result
+        for receipt in obj['receipts']:
+            ret.add_receipt(receipt)
+        for entry in obj['logs']:
+            ret.logs.append((json.dumps(entry['filter'], sort_keys=True), entry['fromBlock'], entry['toBlock'], entry['logs']))
+        for (method, params), result in obj['other']:
+            ret.other[json.dumps([method, params], sort_keys=True)] = result
+        return ret
+
+    def save(self, path: str):
+        """
+        Write as JSON, gzipped if the path ends with .gz
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, mode='wt') as fout:
+            json.dump(self.to_json(), fout)
+
+    @staticmethod
+    def load(path: str) -> 'Snapshot':
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, mode='rt') as fin:
+            return Snapshot.from_json(json.load(fin))
+
+
+class FakeNodeProvider(web3.providers.BaseProvider):
+    """
+    Serves requests from a Snapshot. With an upstream provider, misses are forwarded
+    and recorded; without one they get a JSON-RPC error (web3 raises ValueError),
+    except that storage reads as zero when strict is False.
+
+    Every round-trip (one request, or one batch) sleeps latency_seconds first.
+    Requests are tallied by method in request_counts, and round-trips in round_trips.
+
+    With max_logs set, eth_getLogs responses with more logs than that are refused as
+    geth refuses them; the block ranges of those served are kept in log_ranges.
+    """
+    snapshot: Snapshot
+    upstream: typing.Optional[web3.providers.BaseProvider]
+    latency_seconds: float
+    strict: bool
+    max_logs: typing.Optional[int]
+    request_counts: typing.Counter[str]
+    round_trips: int
+    n_refused_logs: int
+    log_ranges: typing.List[typing.Tuple[int, int]]
+
+    def __init__(
+            self,
+            snapshot: typing.Optional[Snapshot] = None,
+            upstream: typing.Optional[web3.providers.BaseProvider] = None,
+            latency_seconds: float = 0.0,
+            strict: bool = True,
+            max_logs: typing.Optional[int] = None,
+        ) -> None:
+        super().__init__()
+        self.snapshot = snapshot if snapshot is not None else Snapshot()
+        self.upstream = upstream
+        self.latency_seconds = latency_seconds
+        self.strict = strict
+        self.max_logs = max_logs
+        self.request_counts = collections.Counter()
+        self.round_trips = 0
+        self.n_refused_logs = 0
+        self.log_ranges = []
+        self._counts_lock = threading.Lock()
+
+    def make_request(self, method, params) -> web3.types.RPCResponse:
+        return self.make_request_batch([(method, params)])[0]
+
+    def make_request_batch(self, requests: typing.List[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+        if profiling.ENABLED:
+            profiling.inc_counter(profiling.RPC_CALLS, len(requests))
+            profiling.inc_counter(profiling.STORAGE_READS, sum(1 for method, _ in requests if method == 'eth_getStorageAt'))
+
+        with self._counts_lock:
+            self.request_counts.update(method for method, _ in requests)
+            self.round_trips += 1
+
+        ret: typing.List[typing.Optional[web3.types.RPCResponse]] = []
+        misses = []
+        for i, (method, params) in enumerate(requests):
+            params = list(params or [])
+            found, result = self.snapshot.lookup(method, params)
+            if found and method == 'eth_getLogs':
+                ret.append(self._logs_response(i, params[0], result))
+            elif found:
+                ret.append({'jsonrpc': '2.0', 'id': i, 'result': result})
+            else:
+                ret.append(None)
+                misses.append((i, method, params))
+
+        if len(misses) > 0 and self.upstream is not None:
+            if hasattr(self.upstream, 'make_request_batch'):
+                upstream_resps = self.upstream.make_request_batch([(method, params) for _, method, params in misses])
+            else:
+                upstream_resps = [self.upstream.make_request(method, params) for _, method, params in misses]
+            for (i, method, params), resp in zip(misses, upstream_resps):
+                if 'result' in resp:
+                    self.snapshot.record(method, params, resp['result'])
+                ret[i] = dict(resp, id=i)
+        else:
+            for i, method, params in misses:
+                if method == 'eth_getStorageAt' and not self.strict:
+                    ret[i] = {'jsonrpc': '2.0', 'id': i, 'result': ZERO_WORD}
+                else:
+                    ret[i] = {
+                        'jsonrpc': '2.0',
+                        'id': i,
+                        'error': {'code': -32000, 'message': f'fake node has no recorded response for {method} {params}'},
+                    }
+
+        return ret
+
+    def _logs_response(self, i: int, log_filter: dict, logs: typing.List[dict]) -> web3.types.RPCResponse:
+        with self._counts_lock:
+            if self.max_logs is not None and len(logs) > self.max_logs:
+                self.n_refused_logs += 1
+                return {'jsonrpc': '2.0', 'id': i, 'error': {'code': -32005, 'message': f'query returned more than {self.max_logs} results'}}
+            self.log_ranges.append((_block_key(log_filter['fromBlock']), _block_key(log_filter['toBlock'])))
+        return {'jsonrpc': '2.0', 'id': i, 'result': logs}
+
+    def isConnected(self) -> bool:
+        return True
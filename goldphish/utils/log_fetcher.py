@@ -0,0 +1,144 @@
+"""
+utils/log_fetcher.py
+
+Fetches logs over long block ranges with eth_getLogs, letting the node filter by
+topic0 (cheap: it uses the per-block bloom filters) and sizing each request's block
+range to the log density with an AIMD controller (see throttler.BlockThrottle):
+the range grows additively while responses stay under the target number of logs
+and shrinks multiplicatively when they do not. A request the node refuses as too
+large is split in half and retried.
+
+Address filtering is usually left to the caller's side, since geth is slow to match
+against the thousands of addresses we monitor; when there are only a few, pass them
+as `node_addresses` to have the node filter by them too.
+"""
+import logging
+import typing
+import web3
+import web3.types
+
+from .throttler import BlockThrottle
+from . import profiling
+
+l = logging.getLogger(__name__)
+
+# block -> transaction index -> logs, in log-index order
+LogBuckets = typing.Dict[int, typing.Dict[int, typing.List[web3.types.LogReceipt]]]
+
+DEFAULT_TARGET_LOGS = 2_000
+DEFAULT_INITIAL_RANGE = 100
+DEFAULT_MAX_RANGE = 5_000
+
+# substrings of the errors nodes (geth, erigon, hosted providers) give for oversize queries
+TOO_MANY_RESULTS_ERRORS = [
+    'query returned more than',
+    'response size exceeded',
+    'response size should not',
+    'query timeout exceeded',
+    'too many results',
+    'block range is too wide',
+    'exceed maximum block range',
+]
+
+
+def is_too_many_results_error(e: Exception) -> bool:
+    msg = str(e.args[0].get('message', '')) if len(e.args) > 0 and isinstance(e.args[0], dict) else str(e)
+    return any(s in msg for s in TOO_MANY_RESULTS_ERRORS)
+
+
+class LogFetcher:
+    w3: web3.Web3
+    topics: typing.List[str]
+    node_addresses: typing.Optional[typing.List[str]]
+    throttle: BlockThrottle
+    max_range: int
+    n_requests: int
+    n_splits: int
+
+    def __init__(
+            self,
+            w3: web3.Web3,
+            topics: typing.Iterable[bytes],
+            target_logs: int = DEFAULT_TARGET_LOGS,
+            initial_range: int = DEFAULT_INITIAL_RANGE,
+            max_range: int = DEFAULT_MAX_RANGE,
+            node_addresses: typing.Optional[typing.Iterable[str]] = None,
+        ) -> None:
+        self.w3 = w3
+        self.topics = sorted('0x' + bytes(t).hex() for t in topics)
+        assert len(self.topics) > 0
+        self.node_addresses = sorted(node_addresses) if node_addresses is not None else None
+        self.throttle = BlockThrottle(target_logs, initial_range, additive_increase = max(1, initial_range // 5), max_val = max_range)
+        self.max_range = max_range
+        self.n_requests = 0
+        self.n_splits = 0
+
+    def next_range(self) -> int:
+        """
+        Number of blocks to request next
+        """
+        return self.throttle.val_int_clamp(1, self.max_range)
+
+    def fetch(
+            self,
+            start_block: int,
+            end_block: int,
+            addresses: typing.Optional[typing.Collection[str]] = None,
+        ) -> LogBuckets:
+        """
+        Get the logs with a relevant topic0 from start_block to end_block (inclusive),
+        optionally only those emitted by the given addresses.
+        """
+        assert start_block <= end_block
+
+        ret: LogBuckets = {}
+        curr_block = start_block
+        while curr_block <= end_block:
+            this_end_block = min(curr_block + self.next_range() - 1, end_block)
+            for log in self._get_logs(curr_block, this_end_block):
+                if addresses is not None and log['address'] not in addresses:
+                    continue
+                ret.setdefault(log['blockNumber'], {}).setdefault(log['transactionIndex'], []).append(log)
+            curr_block = this_end_block + 1
+        return ret
+
+    def _get_logs(self, start_block: int, end_block: int) -> typing.List[web3.types.LogReceipt]:
+        try:
+            with profiling.profile('get_logs'):
+                self.n_requests += 1
+                log_filter = {
+                    'fromBlock': start_block,
+                    'toBlock': end_block,
+                    'topics': [self.topics],
+                }
+                if self.node_addresses is not None:
+                    log_filter['address'] = self.node_addresses
+                logs = self.w3.eth.get_logs(log_filter)
+        except ValueError as e:
+            if not is_too_many_results_error(e):
+                raise
+            if start_block == end_block:
+                raise Exception(f'too many logs to fetch in block {start_block:,}') from e
+
+            l.debug(f'too many logs in {start_block:,} to {end_block:,}, splitting')
+            self.n_splits += 1
+            self.throttle.observe(float('inf'))
+            mid = (start_block + end_block) // 2
+            return self._get_logs(start_block, mid) + self._get_logs(mid + 1, end_block)
+
+        # normalize to logs per full-size request, so that short tail ranges do not look sparse
+        n_blocks = end_block - start_block + 1
+        self.throttle.observe(len(logs) * self.next_range() / n_blocks)
+        return logs
+
+
+def iter_blocks(buckets: LogBuckets, start_block: int, end_block: int) -> typing.Iterator[typing.Tuple[int, typing.List[web3.types.LogReceipt]]]:
+    """
+    Yield (block number, logs in log-index order) for every block in the range, including those without logs
+    """
+    for block_number in range(start_block, end_block + 1):
+        by_txn = buckets.get(block_number, None)
+        if by_txn is None:
+            yield block_number, []
+        else:
+            yield block_number, [log for txn_index in sorted(by_txn) for log in by_txn[txn_index]]
@@ -1,7 +1,23 @@
 """
 Basic utils for performance profiling, mostly in units of time
+
+Sections opened with `profile(name)` (or the `profiled` decorator) nest: a section
+opened while another is running on the same thread is recorded as its child, under
+the path 'parent/child', and its time is subtracted from the parent's self-time so
+that nothing is counted twice. Every section keeps a latency histogram, and named
+event counters (RPC calls, storage reads, DB statements) sit alongside.
+
+Reports are logged periodically by `maybe_log`, and can be exported as JSON or in
+the Prometheus text format (see `dump_json` / `dump_prometheus`); set
+PROFILE_EXPORT_PATH to have `maybe_log` write one whenever it logs.
+
+Everything is a no-op while ENABLED is False.
 """
 
+import functools
+import json
+import os
+import threading
 import time
 import typing
 import logging
@@ -9,16 +25,184 @@ import logging
 ENABLED = True
 PRINT_INTERVAL_SECONDS = 2 * 60
 
+# if set, maybe_log() also exports here, as Prometheus text if the name ends in .prom, else JSON
+EXPORT_PATH = os.getenv('PROFILE_EXPORT_PATH', None)
+
+# well-known counters
+RPC_CALLS = 'rpc.calls'
+STORAGE_READS = 'storage.reads'
+DB_STATEMENTS = 'db.statements'
+
+# bucket bounds (seconds) used for the Prometheus export
+PROMETHEUS_BUCKETS = (0.000_01, 0.000_1, 0.001, 0.01, 0.1, 1.0, 10.0, 60.0)
+
+# flat totals by section name (inclusive of children), kept for get_measurement()
 _global_profile: typing.Dict[str, float] = {}
 _last_log: float = 0
 
 l = logging.getLogger(__name__)
 
 
+class LatencyHistogram:
+    """
+    Log-linear histogram of durations, in the style of HdrHistogram.
+
+    Values are bucketed in microseconds: below 2**SUB_BUCKET_BITS each microsecond has its own
+    bucket, above that every power-of-two range is split into 2**(SUB_BUCKET_BITS-1) linear
+    buckets. Any value is therefore reported to within ~3% with a small, sparse set of buckets
+    whatever the range (1us to hours).
+    """
+    SUB_BUCKET_BITS = 6
+    _HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.counts: typing.Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_index(cls, seconds: float) -> int:
+        v = int(seconds * 1_000_000)
+        if v < 2 * cls._HALF:
+            return max(v, 0)
+        shift = v.bit_length() - cls.SUB_BUCKET_BITS
+        return shift * cls._HALF + (v >> shift)
+
+    @classmethod
+    def bucket_upper_bound(cls, index: int) -> float:
+        """
+        The (exclusive) upper bound of the bucket, in seconds.
+        """
+        if index < 2 * cls._HALF:
+            return (index + 1) / 1_000_000
+        shift = index // cls._HALF - 1
+        top = index % cls._HALF + cls._HALF
+        return ((top + 1) << shift) / 1_000_000
+
+    def record(self, seconds: float):
+        idx = self.bucket_index(seconds)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th percentile (0 <= q <= 100), in seconds.
+        """
+        if self.count == 0:
+            return 0.0
+        target = max(1, round(q / 100 * self.count))
+        seen = 0
+        for idx in sorted(self.counts.keys()):
+            seen += self.counts[idx]
+            if seen >= target:
+                return min(self.bucket_upper_bound(idx), self.max)
+        return self.max
+
+    def count_at_or_below(self, seconds: float) -> int:
+        """
+        Number of recorded values in buckets entirely at or below `seconds`.
+        """
+        return sum(n for idx, n in self.counts.items() if self.bucket_upper_bound(idx) <= seconds)
+
+    def copy(self) -> 'LatencyHistogram':
+        ret = LatencyHistogram()
+        ret.counts = dict(self.counts)
+        ret.count = self.count
+        ret.total = self.total
+        ret.max = self.max
+        return ret
+
+    def since(self, earlier: 'LatencyHistogram') -> 'LatencyHistogram':
+        """
+        The values recorded after `earlier` was copied from this histogram (max is not windowed).
+        """
+        ret = LatencyHistogram()
+        for idx, n in self.counts.items():
+            diff = n - earlier.counts.get(idx, 0)
+            if diff > 0:
+                ret.counts[idx] = diff
+        ret.count = self.count - earlier.count
+        ret.total = self.total - earlier.total
+        ret.max = self.max
+        return ret
+
+
+class SectionStats:
+    """
+    Accumulated timings of one section path.
+    """
+    __slots__ = ('path', 'self_seconds', 'histogram')
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.self_seconds = 0.0
+        self.histogram = LatencyHistogram()
+
+    @property
+    def count(self) -> int:
+        return self.histogram.count
+
+    @property
+    def total_seconds(self) -> float:
+        return self.histogram.total
+
+    def copy(self) -> 'SectionStats':
+        ret = SectionStats(self.path)
+        ret.self_seconds = self.self_seconds
+        ret.histogram = self.histogram.copy()
+        return ret
+
+
+# by path ('outer/inner')
+_sections: typing.Dict[str, SectionStats] = {}
+_counters: typing.Dict[str, int] = {}
+
+# snapshot taken at the last log(), to report per-interval figures
+_last_logged_sections: typing.Dict[str, SectionStats] = {}
+_last_logged_counters: typing.Dict[str, int] = {}
+
+# per-thread stack of open sections, each entry is [path, seconds spent in children]
+_local = threading.local()
+
+
+def _stack() -> typing.List[list]:
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def _child_path(name: str) -> str:
+    stack = _stack()
+    if len(stack) == 0:
+        return name
+    return stack[-1][0] + '/' + name
+
+
+def _record(stack: typing.List[list], path: str, name: str, elapsed: float, child_seconds: float):
+    section = _sections.get(path, None)
+    if section is None:
+        section = _sections.setdefault(path, SectionStats(path))
+    section.histogram.record(elapsed)
+    section.self_seconds += elapsed - child_seconds
+    _global_profile[name] = _global_profile.get(name, 0) + elapsed
+
+    # charge our time to the enclosing section's children
+    if len(stack) > 0:
+        stack[-1][1] += elapsed
+
+
 def maybe_log():
     """
-    If enough time has passed since last log, emits a new log report and clears
-    all profiling info.
+    If enough time has passed since last log, emits a new log report covering
+    the time since the previous one.
     """
     if not ENABLED:
         return
@@ -33,17 +217,47 @@ def maybe_log():
 
 def log():
     global _last_log
+    global _last_logged_sections
+    global _last_logged_counters
+
     now = time.time()
-    for k in sorted(_global_profile.keys()):
-        if _last_log > 0:
+    elapsed = now - _last_log if _last_log > 0 else None
+
+    for path in sorted(_sections.keys()):
+        section = _sections[path]
+        earlier = _last_logged_sections.get(path, None)
+        hist = section.histogram.since(earlier.histogram) if earlier is not None else section.histogram
+        if hist.count == 0:
+            continue
+        self_seconds = section.self_seconds - (earlier.self_seconds if earlier is not None else 0)
+
+        msg = (
+            f'profile name="{path}" count={hist.count} seconds={hist.total:.3f} self_seconds={self_seconds:.3f} '
+            f'p50={hist.percentile(50) * 1000:.3f}ms p99={hist.percentile(99) * 1000:.3f}ms max={hist.max * 1000:.3f}ms'
+        )
+        if elapsed is not None:
             # we can compute percentage of time elapsed
-            elapsed = now - _last_log
-            percentage = _global_profile[k] / elapsed * 100
-            l.debug(f'profile name="{k}" seconds={_global_profile[k]} percent={percentage:.2f}%')
-        else:
-            l.debug(f'profile name="{k}" seconds={_global_profile[k]}')
-        _global_profile[k] = 0
+            msg += f' percent={self_seconds / elapsed * 100:.2f}%'
+        l.debug(msg)
+
+    for name in sorted(_counters.keys()):
+        n = _counters[name] - _last_logged_counters.get(name, 0)
+        if n > 0:
+            l.debug(f'profile counter="{name}" count={n}')
+
+    if EXPORT_PATH is not None:
+        try:
+            if EXPORT_PATH.endswith('.prom'):
+                dump_prometheus(EXPORT_PATH)
+            else:
+                dump_json(EXPORT_PATH)
+        except OSError:
+            l.exception(f'could not export profile to {EXPORT_PATH}')
 
+    for k in _global_profile:
+        _global_profile[k] = 0
+    _last_logged_sections = {k: v.copy() for k, v in _sections.items()}
+    _last_logged_counters = dict(_counters)
     _last_log = now
 
 def get_measurement(name: str) -> typing.Optional[float]:
@@ -62,15 +276,38 @@ def reset_measurement(name: str):
     _global_profile[name] = 0
 
 def reset():
+    global _last_logged_sections
+    global _last_logged_counters
     _global_profile.clear()
+    _sections.clear()
+    _counters.clear()
+    _last_logged_sections = {}
+    _last_logged_counters = {}
 
 def inc_measurement(name: str, elapsed: float):
     """
-    increase measurement by the given amount
+    increase measurement by the given amount (recorded as a section that ran for `elapsed` seconds)
     """
     if not ENABLED:
         return
-    _global_profile[name] = _global_profile.get(name, 0) + elapsed
+    _record(_stack(), _child_path(name), name, elapsed, 0.0)
+
+
+def inc_counter(name: str, n: int = 1):
+    """
+    count `n` events of the given kind (see RPC_CALLS etc)
+    """
+    if not ENABLED:
+        return
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def get_counter(name: str) -> int:
+    return _counters.get(name, 0)
+
+
+def get_section(path: str) -> typing.Optional[SectionStats]:
+    return _sections.get(path, None)
 
 
 class ProfilerContextManager:
@@ -84,13 +321,18 @@ class ProfilerContextManager:
     def __enter__(self) -> None:
         if not ENABLED:
             return
-        self._start = time.time()
+        _stack().append([_child_path(self._name), 0.0])
+        self._start = time.perf_counter()
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        if not ENABLED:
+        if self._start is None:
+            # profiling was disabled on entry
             return
-        elapsed = time.time() - self._start
-        _global_profile[self._name] = _global_profile.get(self._name, 0) + elapsed
+        elapsed = time.perf_counter() - self._start
+        stack = _stack()
+        path, child_seconds = stack.pop()
+        _record(stack, path, self._name, elapsed, child_seconds)
+        self._start = None
 
 
 def profile(name: str) -> ProfilerContextManager:
@@ -99,3 +341,97 @@ def profile(name: str) -> ProfilerContextManager:
     """
     return ProfilerContextManager(name)
 
+
+def profiled(name: typing.Optional[str] = None):
+    """
+    Decorator that profiles every call of the function as a section named `name`
+    (default: the function's qualified name, eg 'UniswapV2Pricer.token_out_for_exact_in').
+    """
+    def decorator(fn):
+        section_name = name if name is not None else fn.__qualname__.split('<locals>.')[-1]
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            # same as `with profile(section_name)`, inlined because this wraps hot functions
+            stack = _stack()
+            frame = [stack[-1][0] + '/' + section_name if len(stack) > 0 else section_name, 0.0]
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                _record(stack, frame[0], section_name, elapsed, frame[1])
+        return wrapper
+    return decorator
+
+
+def snapshot() -> dict:
+    """
+    Cumulative profile as a JSON-serializable dict.
+    """
+    return {
+        'timestamp': time.time(),
+        'sections': {
+            path: {
+                'count': s.count,
+                'total_seconds': s.total_seconds,
+                'self_seconds': s.self_seconds,
+                'max_seconds': s.histogram.max,
+                'p50_seconds': s.histogram.percentile(50),
+                'p90_seconds': s.histogram.percentile(90),
+                'p99_seconds': s.histogram.percentile(99),
+                'histogram': {str(LatencyHistogram.bucket_upper_bound(idx)): n for idx, n in sorted(s.histogram.counts.items())},
+            }
+            for path, s in sorted(_sections.items())
+        },
+        'counters': dict(sorted(_counters.items())),
+    }
+
+
+def dump_json(path: str):
+    _atomic_write(path, json.dumps(snapshot(), indent=2))
+
+
+def dump_prometheus(path: str):
+    """
+    Write the cumulative profile in the Prometheus text exposition format (eg for
+    node_exporter's textfile collector).
+    """
+    lines = [
+        '# HELP goldphish_section_seconds Time spent in profiled sections, including children.',
+        '# TYPE goldphish_section_seconds histogram',
+    ]
+    for path_, s in sorted(_sections.items()):
+        label = _prometheus_label(path_)
+        for le in PROMETHEUS_BUCKETS:
+            lines.append(f'goldphish_section_seconds_bucket{{section="{label}",le="{le}"}} {s.histogram.count_at_or_below(le)}')
+        lines.append(f'goldphish_section_seconds_bucket{{section="{label}",le="+Inf"}} {s.count}')
+        lines.append(f'goldphish_section_seconds_sum{{section="{label}"}} {s.total_seconds}')
+        lines.append(f'goldphish_section_seconds_count{{section="{label}"}} {s.count}')
+
+    lines.append('# HELP goldphish_section_self_seconds_total Time spent in profiled sections, excluding children.')
+    lines.append('# TYPE goldphish_section_self_seconds_total counter')
+    for path_, s in sorted(_sections.items()):
+        lines.append(f'goldphish_section_self_seconds_total{{section="{_prometheus_label(path_)}"}} {s.self_seconds}')
+
+    lines.append('# HELP goldphish_events_total Counted events (RPC calls, storage reads, DB statements, ...).')
+    lines.append('# TYPE goldphish_events_total counter')
+    for name, n in sorted(_counters.items()):
+        lines.append(f'goldphish_events_total{{name="{_prometheus_label(name)}"}} {n}')
+
+    _atomic_write(path, '\n'.join(lines) + '\n')
+
+
+def _prometheus_label(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _atomic_write(path: str, contents: str):
+    tmp_path = f'{path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'w') as fout:
+        fout.write(contents)
+    os.replace(tmp_path, path)
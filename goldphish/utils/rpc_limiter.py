@@ -0,0 +1,273 @@
+"""
+utils/rpc_limiter.py
+
+Client-side limits on JSON-RPC load, so that many workers can push the node
+as hard as it will go without tipping it into timeouts.
+
+Requests are weighed by method (a debug_traceTransaction costs the node far
+more than an eth_getStorageAt; see METHOD_WEIGHTS). Two limits apply:
+
+    ConcurrencyLimiter   caps the weight in flight from this process. The cap is
+                         AIMD-controlled: it grows while requests come back quickly
+                         and shrinks when one errors or takes much longer than the
+                         fastest round-trip seen for its method and batch size.
+
+    SharedTokenBucket    optionally caps the weight per second sent by all processes
+                         on the host. The bucket lives in a small file locked with
+                         flock, and its rate is AIMD-controlled the same way, so all
+                         workers share one estimate of node capacity. Nothing in it
+                         is held across a request, so a crashed worker leaks nothing.
+
+connect_web3() sets these up from the environment:
+
+    RPC_MAX_CONCURRENCY    initial in-flight weight cap per process (default 64)
+    RPC_SHARED_LIMIT_FILE  path of the shared bucket; unset means no shared limit
+    RPC_SHARED_RATE        initial shared rate, in weight per second (default 2000)
+"""
+import contextlib
+import fcntl
+import logging
+import os
+import struct
+import threading
+import time
+import typing
+
+l = logging.getLogger(__name__)
+
+# by method name prefix; the first match wins
+METHOD_WEIGHTS: typing.List[typing.Tuple[str, int]] = [
+    ('debug_trace', 50),
+    ('trace_', 50),
+    ('eth_getLogs', 10),
+    ('eth_getBlockByNumber', 2),
+    ('eth_call', 2),
+    ('eth_estimateGas', 2),
+    ('eth_getStorageAt', 1),
+]
+DEFAULT_WEIGHT = 1
+
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_SHARED_RATE = 2_000
+
+MULT_DECREASE = 0.75
+
+# shared rate growth, in weight per second, per second of traffic
+SHARED_ADDITIVE_INCREASE = 10
+
+# latency beyond this multiple of the fastest seen (for the method and batch size) counts as congestion
+LATENCY_TOLERANCE = 3.0
+
+# substrings of JSON-RPC errors that mean the node is overloaded (rather than, say, a reverted call)
+CONGESTION_ERRORS = ['timeout', 'timed out', 'too many', 'rate limit', 'busy', 'capacity']
+
+
+def is_congestion_error(resp: typing.Dict) -> bool:
+    if 'error' not in resp:
+        return False
+    msg = str(resp['error'].get('message', '') if isinstance(resp['error'], dict) else resp['error']).lower()
+    return any(s in msg for s in CONGESTION_ERRORS)
+
+
+def method_weight(method: str) -> int:
+    for prefix, weight in METHOD_WEIGHTS:
+        if method.startswith(prefix):
+            return weight
+    return DEFAULT_WEIGHT
+
+
+def request_weight(requests: typing.Iterable[typing.Tuple[str, typing.Any]]) -> int:
+    return sum(method_weight(method) for method, _ in requests)
+
+
+class ConcurrencyLimiter:
+    limit: float
+    min_limit: float
+    max_limit: float
+    in_flight: int
+    shared: typing.Optional['SharedTokenBucket']
+
+    # fastest round-trip seen per (method, batch size bucket), which creeps up slowly so it can follow the node;
+    # bucketed since a batch of 100 takes longer than one request, though not 100 times longer
+    _baseline_latency: typing.Dict[typing.Tuple[str, int], float]
+    _last_decrease: float
+
+    def __init__(
+            self,
+            initial_limit: float = DEFAULT_MAX_CONCURRENCY,
+            min_limit: float = 1,
+            max_limit: float = 4_096,
+            shared: typing.Optional['SharedTokenBucket'] = None,
+        ) -> None:
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.in_flight = 0
+        self.shared = shared
+        self._baseline_latency = {}
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def request(self, requests: typing.List[typing.Tuple[str, typing.Any]]):
+        """
+        Hold capacity for the given (method, params) requests, sent as one round-trip.
+        The caller should call `failed()` on the yielded RequestOutcome if the node seemed overloaded.
+        """
+        weight = request_weight(requests)
+        self.acquire(weight)
+        outcome = RequestOutcome()
+        t_start = time.monotonic()
+        try:
+            yield outcome
+        except:
+            outcome.failed()
+            raise
+        finally:
+            method = requests[0][0] if len(requests) > 0 else ''
+            self.release(weight, method, time.monotonic() - t_start, outcome.ok, n_requests = len(requests))
+
+    def acquire(self, weight: int):
+        if self.shared is not None:
+            self.shared.take(weight)
+        with self._cond:
+            # a request heavier than the whole limit still goes out, alone
+            while self.in_flight > 0 and self.in_flight + weight > self.limit:
+                self._cond.wait()
+            self.in_flight += weight
+
+    def release(self, weight: int, method: str, latency: float, ok: bool, n_requests: int = 1):
+        # batches within a factor of two of each other in size are compared to each other
+        k = (method, max(1, n_requests).bit_length())
+        with self._cond:
+            # only grow the limit while we are close to it, otherwise it would grow without bound
+            near_limit = self.in_flight >= self.limit / 2
+            self.in_flight -= weight
+
+            baseline = self._baseline_latency.get(k, None)
+            if baseline is None or latency < baseline:
+                self._baseline_latency[k] = latency
+                baseline = latency
+            else:
+                self._baseline_latency[k] = baseline * 1.001
+
+            congested = not ok or latency > LATENCY_TOLERANCE * baseline
+            now = time.monotonic()
+            if congested:
+                # at most one decrease per round-trip, or one bad batch would collapse the limit
+                if now - self._last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * MULT_DECREASE)
+                    self._last_decrease = now
+            elif near_limit:
+                # about +1 per limit's-worth of completed weight
+                self.limit = min(self.max_limit, self.limit + weight / self.limit)
+
+            self._cond.notify_all()
+
+        if self.shared is not None:
+            self.shared.feedback(weight, congested)
+
+
+class RequestOutcome:
+    ok: bool
+
+    def __init__(self) -> None:
+        self.ok = True
+
+    def failed(self):
+        self.ok = False
+
+
+class SharedTokenBucket:
+    """
+    A token bucket (in request weight) shared by the processes on one host through
+    a file. The refill rate is adjusted AIMD-style by every process's feedback.
+    """
+    path: str
+    min_rate: float
+    max_rate: float
+    burst_seconds: float
+
+    # tokens, last refill time, rate, last decrease time
+    _STATE = struct.Struct('<dddd')
+
+    def __init__(
+            self,
+            path: str,
+            initial_rate: float = DEFAULT_SHARED_RATE,
+            min_rate: float = 10,
+            max_rate: float = 1_000_000,
+            burst_seconds: float = 0.5,
+        ) -> None:
+        self.path = path
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst_seconds = burst_seconds
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        with self._locked() as state:
+            if state is None:
+                self._write(initial_rate * burst_seconds, time.time(), initial_rate, 0.0)
+
+    def close(self):
+        os.close(self._fd)
+
+    @contextlib.contextmanager
+    def _locked(self) -> typing.Iterator[typing.Optional[typing.Tuple[float, float, float, float]]]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            b = os.pread(self._fd, self._STATE.size, 0)
+            yield self._STATE.unpack(b) if len(b) == self._STATE.size else None
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write(self, tokens: float, ts: float, rate: float, last_decrease: float):
+        os.pwrite(self._fd, self._STATE.pack(tokens, ts, rate, last_decrease), 0)
+
+    @property
+    def rate(self) -> float:
+        with self._locked() as (_, _, rate, _):
+            return rate
+
+    def take(self, weight: int):
+        """
+        Block until `weight` tokens are available, then take them
+        """
+        while True:
+            with self._locked() as (tokens, ts, rate, last_decrease):
+                now = time.time()
+                burst = rate * self.burst_seconds
+                tokens = min(burst, tokens + (now - ts) * rate)
+                # a request heavier than the burst waits for a full bucket
+                needed = min(weight, burst)
+                if tokens >= needed:
+                    self._write(tokens - needed, now, rate, last_decrease)
+                    return
+                self._write(tokens, now, rate, last_decrease)
+                wait = (needed - tokens) / rate
+            time.sleep(min(wait, 0.1))
+
+    def feedback(self, weight: int, congested: bool):
+        with self._locked() as (tokens, ts, rate, last_decrease):
+            now = time.time()
+            if congested:
+                # at most one decrease per second host-wide, however many workers see the same congestion
+                if now - last_decrease < 1:
+                    return
+                rate = max(self.min_rate, rate * MULT_DECREASE)
+                l.debug(f'RPC congestion, shared rate now {rate:.0f}/s')
+                last_decrease = now
+            elif min(rate * self.burst_seconds, tokens + (now - ts) * rate) < rate * self.burst_seconds / 2:
+                # the bucket is being drained, so the rate is what limits us: grow it
+                rate = min(self.max_rate, rate + SHARED_ADDITIVE_INCREASE * weight / rate)
+            self._write(tokens, ts, rate, last_decrease)
+
+
+def limiter_from_env() -> ConcurrencyLimiter:
+    shared = None
+    shared_path = os.getenv('RPC_SHARED_LIMIT_FILE', None)
+    if shared_path is not None:
+        shared = SharedTokenBucket(shared_path, initial_rate = float(os.getenv('RPC_SHARED_RATE', DEFAULT_SHARED_RATE)))
+    return ConcurrencyLimiter(
+        initial_limit = float(os.getenv('RPC_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)),
+        shared = shared,
+    )
@@ -1,16 +1,21 @@
 # Simple AIMD control system
+import typing
 
 class BlockThrottle:
     setpoint: float
     additive_increase: float
     mult_decrease: float
 
+    # next_val never grows past this, so a long quiet stretch does not wind it up
+    max_val: typing.Optional[float]
+
     next_val: float
     
 
-    def __init__(self, setpoint: float, initial: float, additive_increase: float = 100) -> None:
+    def __init__(self, setpoint: float, initial: float, additive_increase: float = 100, max_val: typing.Optional[float] = None) -> None:
         self.setpoint = float(setpoint)
-        self.next_val = float(initial)
+        self.max_val = None if max_val is None else float(max_val)
+        self.next_val = float(initial) if max_val is None else min(float(initial), self.max_val)
 
         # tuning constants
         self.additive_increase = additive_increase
@@ -25,6 +30,8 @@ class BlockThrottle:
             self.next_val = self.next_val * self.mult_decrease
         else:
             self.next_val = self.next_val + self.additive_increase
+            if self.max_val is not None:
+                self.next_val = min(self.next_val, self.max_val)
     
     def val(self) -> float:
         """
@@ -0,0 +1,337 @@
+"""
+区块区间套利分析模块
+按 --from-block / --to-block 将区块分配到进程池：每个进程批量获取区块收据、解码 ERC-20 转账并识别套利，
+结果按区块顺序合并写入同一个 JSONL 文件，并定期写入检查点以便中断后续跑；
+某个区块多次重试仍失败时，在它之前写入检查点并停止，续跑时从该区块重新开始
+
+用法:
+    python analyze_block_range.py --from-block 17518000 --to-block 17525000 --workers 16 --output arbitrages.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from dotenv import load_dotenv
+from web3 import Web3
+from web3.datastructures import AttributeDict
+from hexbytes import HexBytes
+
+# 获取项目根目录的绝对路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 将 goldphish 目录添加到 Python 路径
+sys.path.append(os.path.join(project_root, 'goldphish'))
+
+from backtest.gather_samples.analyses import get_arbitrage_from_receipt_if_exists
+from analyze_specific_block import arbitrage_to_dict
+from stream_loader import is_transfer_log
+
+# 加载环境变量
+load_dotenv()
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 单个区块的最大重试次数
+MAX_BLOCK_ATTEMPTS = 4
+
+# JSON-RPC 请求超时（秒）
+RPC_TIMEOUT_SECONDS = 60
+
+# JSON-RPC 错误码：方法不存在
+METHOD_NOT_FOUND = -32601
+
+# 每个工作进程独立的 HTTP 会话（在进程池初始化时创建）
+_rpc_url: Optional[str] = None
+_session: Optional[requests.Session] = None
+_supports_block_receipts = True
+
+
+class RPCError(Exception):
+    """JSON-RPC 请求失败；code 为节点返回的错误码（若有）"""
+
+    def __init__(self, message, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+
+def _error_code(error) -> Optional[int]:
+    return error.get('code') if isinstance(error, dict) else None
+
+
+def _init_worker(rpc_url: str):
+    global _rpc_url, _session
+    _rpc_url = rpc_url
+    _session = requests.Session()
+
+
+def _rpc_batch(calls: List[tuple]) -> List:
+    """发送一个 JSON-RPC 批量请求，按请求顺序返回结果"""
+    payload = [
+        {'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+        for i, (method, params) in enumerate(calls)
+    ]
+    resp = _session.post(_rpc_url, json=payload, timeout=RPC_TIMEOUT_SECONDS)
+    resp.raise_for_status()
+    body = resp.json()
+    if isinstance(body, dict):
+        # 部分节点对整个批量请求返回单个错误
+        error = body.get('error', body)
+        raise RPCError(error, code=_error_code(error))
+
+    ret = [None] * len(calls)
+    for item in body:
+        if 'error' in item:
+            raise RPCError(f"{calls[item['id']][0]}: {item['error']}", code=_error_code(item['error']))
+        ret[item['id']] = item['result']
+    return ret
+
+
+def fetch_block_receipts(block_number: int) -> List[Dict]:
+    """
+    获取区块内全部交易收据
+
+    优先使用 eth_getBlockReceipts（一次请求）；节点不支持时退化为
+    eth_getBlockByNumber 加一次 eth_getTransactionReceipt 批量请求
+
+    节点落后时可能对区块或收据返回 null，此时抛出 RPCError 以便重试
+    """
+    global _supports_block_receipts
+
+    if _supports_block_receipts:
+        try:
+            (receipts,) = _rpc_batch([('eth_getBlockReceipts', [hex(block_number)])])
+        except RPCError as e:
+            if e.code != METHOD_NOT_FOUND:
+                raise
+            logger.info(f"节点不支持 eth_getBlockReceipts，改用批量请求: {e}")
+            _supports_block_receipts = False
+        else:
+            if receipts is None:
+                raise RPCError(f"区块 {block_number} 的收据为空（节点可能尚未同步到该区块）")
+            return receipts
+
+    (block,) = _rpc_batch([('eth_getBlockByNumber', [hex(block_number), False])])
+    if block is None:
+        raise RPCError(f"区块 {block_number} 为空（节点可能尚未同步到该区块）")
+    if not block['transactions']:
+        return []
+    receipts = _rpc_batch([('eth_getTransactionReceipt', [txn_hash]) for txn_hash in block['transactions']])
+    if any(receipt is None for receipt in receipts):
+        raise RPCError(f"区块 {block_number} 的部分收据为空（节点可能尚未同步到该区块）")
+    return receipts
+
+
+def _to_int(value) -> int:
+    """JSON-RPC 返回十六进制字符串，已导出的数据中为整数"""
+    return int(value, 16) if isinstance(value, str) else value
+
+
+def normalize_receipt(raw: Dict) -> Dict:
+    """将 JSON-RPC 原始收据转换为与 get_block_receipts.py 相同的格式"""
+    return {
+        'transactionHash': raw['transactionHash'],
+        'from': Web3.toChecksumAddress(raw['from']),
+        'to': Web3.toChecksumAddress(raw['to']) if raw.get('to') else None,
+        'blockNumber': _to_int(raw['blockNumber']),
+        'gasUsed': _to_int(raw['gasUsed']),
+        'effectiveGasPrice': _to_int(raw['effectiveGasPrice']),
+        'status': _to_int(raw['status']),
+        'logs': raw['logs'],
+    }
+
+
+def decode_transfers(receipt: Dict) -> List[AttributeDict]:
+    """
+    解码收据中的 ERC-20 转账，格式与 goldphish 中 processLog 的结果一致
+    （校验和地址、HexBytes 哈希、可哈希的 AttributeDict）
+    """
+    ret = []
+    for log in receipt['logs']:
+        if not is_transfer_log(log):
+            continue
+        data = log['data']
+        ret.append(AttributeDict({
+            'address': Web3.toChecksumAddress(log['address']),
+            'transactionHash': HexBytes(receipt['transactionHash']),
+            'logIndex': _to_int(log['logIndex']),
+            'args': AttributeDict({
+                'from': Web3.toChecksumAddress('0x' + log['topics'][1][-40:]),
+                'to': Web3.toChecksumAddress('0x' + log['topics'][2][-40:]),
+                'value': int(data, 16) if data not in ('0x', '') else 0,
+            }),
+        }))
+    return ret
+
+
+def analyze_block(block_number: int) -> Dict:
+    """分析单个区块，返回可写入 JSONL 的结果；多次重试仍失败时返回 error 字段，由 analyze_range 停止并保留检查点"""
+    for attempt in range(MAX_BLOCK_ATTEMPTS):
+        try:
+            raw_receipts = fetch_block_receipts(block_number)
+            break
+        except (requests.RequestException, RPCError) as e:
+            if attempt + 1 == MAX_BLOCK_ATTEMPTS:
+                logger.error(f"获取区块 {block_number} 收据失败: {e}")
+                return {'block_number': block_number, 'error': str(e)}
+            time.sleep(2 ** attempt)
+
+    arbitrages = []
+    for raw in raw_receipts:
+        receipt = normalize_receipt(raw)
+        if receipt['status'] != 1:
+            continue
+
+        transfers = decode_transfers(receipt)
+        if len(transfers) < 2:
+            continue
+
+        full_txn = AttributeDict({**receipt, 'transactionHash': HexBytes(receipt['transactionHash'])})
+        try:
+            arbitrage = get_arbitrage_from_receipt_if_exists(full_txn, transfers)
+        except Exception as e:
+            logger.warning(f"分析交易 {receipt['transactionHash']} 失败: {e}")
+            continue
+
+        if arbitrage:
+            arbitrages.append(arbitrage_to_dict(arbitrage))
+
+    return {
+        'block_number': block_number,
+        'n_transactions': len(raw_receipts),
+        'arbitrages': arbitrages,
+    }
+
+
+def load_checkpoint(checkpoint_file: str) -> Optional[Dict]:
+    if not os.path.isfile(checkpoint_file):
+        return None
+    with open(checkpoint_file) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_file: str, checkpoint: Dict):
+    """原子地写入检查点"""
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, checkpoint_file)
+
+
+def analyze_range(
+        rpc_url: str,
+        from_block: int,
+        to_block: int,
+        output_file: str,
+        checkpoint_file: str,
+        n_workers: int,
+        checkpoint_every: int = 20,
+    ):
+    """分析区间 [from_block, to_block]，结果按区块顺序写入 output_file"""
+    assert from_block <= to_block
+
+    start_block = from_block
+    output_offset = 0
+    checkpoint = load_checkpoint(checkpoint_file)
+    if checkpoint is not None and not os.path.isfile(output_file):
+        logger.warning(f"输出文件 {output_file} 不存在，忽略检查点 {checkpoint_file}，从头开始分析")
+        checkpoint = None
+    if checkpoint is not None:
+        if checkpoint['from_block'] != from_block or checkpoint['to_block'] != to_block:
+            raise ValueError(f"检查点 {checkpoint_file} 对应的区间与参数不一致")
+        start_block = checkpoint['next_block']
+        output_offset = checkpoint['output_offset']
+        logger.info(f"从检查点恢复，继续分析区块 {start_block}")
+
+    if start_block > to_block:
+        logger.info("区间已全部分析完成")
+        return
+
+    # 截断检查点之后写入的不完整结果
+    mode = 'r+' if checkpoint is not None else 'w'
+    n_blocks = to_block - start_block + 1
+    n_arbitrages = 0
+    t_start = time.time()
+
+    with open(output_file, mode) as fout, multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(rpc_url,)) as pool:
+        fout.seek(output_offset)
+        fout.truncate()
+
+        def checkpoint_before(next_block: int):
+            fout.flush()
+            os.fsync(fout.fileno())
+            save_checkpoint(checkpoint_file, {
+                'from_block': from_block,
+                'to_block': to_block,
+                'next_block': next_block,
+                'output_offset': fout.tell(),
+            })
+
+        # imap 按提交顺序返回结果，实现有序合并；chunksize 较小以保持负载均衡
+        results: Iterator[Dict] = pool.imap(analyze_block, range(start_block, to_block + 1), chunksize=4)
+        for i, result in enumerate(results, start=1):
+            if 'error' in result:
+                # 不写入失败的区块，续跑时从它重新开始
+                checkpoint_before(result['block_number'])
+                raise RPCError(
+                    f"区块 {result['block_number']} 重试 {MAX_BLOCK_ATTEMPTS} 次后仍失败，"
+                    f"已保存检查点，可稍后续跑: {result['error']}"
+                )
+
+            fout.write(json.dumps(result) + '\n')
+            n_arbitrages += len(result['arbitrages'])
+
+            if i % checkpoint_every == 0 or i == n_blocks:
+                checkpoint_before(result['block_number'] + 1)
+
+                elapsed = time.time() - t_start
+                logger.info(
+                    f"已分析 {i}/{n_blocks} 个区块（{i / elapsed:.2f} 区块/秒），"
+                    f"发现 {n_arbitrages} 笔套利"
+                )
+
+    logger.info(f"分析完成，结果已保存到 {output_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='区块区间套利分析')
+    parser.add_argument('--from-block', type=int, required=True, help='起始区块（包含）')
+    parser.add_argument('--to-block', type=int, required=True, help='结束区块（包含）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='工作进程数量')
+    parser.add_argument('--output', default=None, help='JSONL 输出文件，默认为 blocks_<from>_<to>_arbitrages.jsonl')
+    parser.add_argument('--checkpoint', default=None, help='检查点文件，默认为 <output>.checkpoint')
+    parser.add_argument('--checkpoint-every', type=int, default=20, help='每处理多少个区块写一次检查点')
+    parser.add_argument('--rpc-url', default=os.getenv('ALCHEMY_API_URL'), help='JSON-RPC 节点地址，默认读取 ALCHEMY_API_URL')
+    args = parser.parse_args()
+
+    if not args.rpc_url:
+        raise ValueError("未找到 ALCHEMY_API_URL 环境变量")
+
+    output_file = args.output or f'blocks_{args.from_block}_{args.to_block}_arbitrages.jsonl'
+    checkpoint_file = args.checkpoint or output_file + '.checkpoint'
+
+    analyze_range(
+        args.rpc_url,
+        args.from_block,
+        args.to_block,
+        output_file,
+        checkpoint_file,
+        args.workers,
+        args.checkpoint_every,
+    )
+
+
+if __name__ == "__main__":
+    main()
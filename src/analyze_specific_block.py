@@ -78,45 +78,47 @@ def analyze_arbitrage(block_number: int, erc20_transactions: List[Dict]) -> List
         logger.error(f"套利分析失败: {str(e)}")
         raise
 
-def save_arbitrages_to_file(arbitrages: List[Arbitrage], filename: str):
-    """保存套利结果到文件"""
-    try:
-        # 将Arbitrage对象转换为可序列化的字典
-        arbitrage_dicts = []
-        for arb in arbitrages:
-            arb_dict = {
-                'txn_hash': arb.txn_hash.hex(),
-                'block_number': arb.block_number,
-                'gas_used': arb.gas_used,
-                'gas_price': arb.gas_price,
-                'shooter': arb.shooter,
-                'n_cycles': arb.n_cycles,
-            }
-            
-            if arb.only_cycle:
-                cycle_dict = {
-                    'profit_token': arb.only_cycle.profit_token,
-                    'profit_amount': arb.only_cycle.profit_amount,
-                    'profit_taker': arb.only_cycle.profit_taker,
-                    'exchanges': [
+def arbitrage_to_dict(arb: Arbitrage) -> Dict:
+    """将Arbitrage对象转换为可序列化的字典"""
+    arb_dict = {
+        'txn_hash': arb.txn_hash.hex(),
+        'block_number': arb.block_number,
+        'gas_used': arb.gas_used,
+        'gas_price': arb.gas_price,
+        'shooter': arb.shooter,
+        'n_cycles': arb.n_cycles,
+    }
+    
+    if arb.only_cycle:
+        cycle_dict = {
+            'profit_token': arb.only_cycle.profit_token,
+            'profit_amount': arb.only_cycle.profit_amount,
+            'profit_taker': arb.only_cycle.profit_taker,
+            'exchanges': [
+                {
+                    'token_in': exc.token_in,
+                    'token_out': exc.token_out,
+                    'items': [
                         {
-                            'token_in': exc.token_in,
-                            'token_out': exc.token_out,
-                            'items': [
-                                {
-                                    'address': item.address,
-                                    'amount_in': item.amount_in,
-                                    'amount_out': item.amount_out
-                                }
-                                for item in exc.items
-                            ]
+                            'address': item.address,
+                            'amount_in': item.amount_in,
+                            'amount_out': item.amount_out
                         }
-                        for exc in arb.only_cycle.cycle
+                        for item in exc.items
                     ]
                 }
-                arb_dict['only_cycle'] = cycle_dict
-            
-            arbitrage_dicts.append(arb_dict)
+                for exc in arb.only_cycle.cycle
+            ]
+        }
+        arb_dict['only_cycle'] = cycle_dict
+
+    return arb_dict
+
+def save_arbitrages_to_file(arbitrages: List[Arbitrage], filename: str):
+    """保存套利结果到文件"""
+    try:
+        # 将Arbitrage对象转换为可序列化的字典
+        arbitrage_dicts = [arbitrage_to_dict(arb) for arb in arbitrages]
             
         with open(filename, 'w') as f:
             json.dump(arbitrage_dicts, f, indent=2)
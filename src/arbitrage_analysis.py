@@ -1,6 +1,7 @@
 import os
 import sys
 import json
+import argparse
 import logging
 import networkx as nx
 import matplotlib.pyplot as plt
@@ -8,6 +9,8 @@ from collections import defaultdict
 from typing import List, Dict, Set, Tuple, Optional
 from web3 import Web3
 
+from stream_loader import PathLengthStats, TokenGraphBuilder, group_transfers_by_hash, iter_json_records, iter_receipts_with_transfers
+
 # 获取项目根目录的绝对路径
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # 将 goldphish 目录添加到 Python 路径
@@ -193,9 +196,9 @@ def get_arbitrage_from_receipt_if_exists(full_txn: Dict, txns: List[Dict]) -> Op
 
 class ArbitrageAnalysis:
     def __init__(self):
-        self.token_graph = nx.DiGraph()  # 代币流向图
+        self.token_graph_builder = TokenGraphBuilder()  # 代币流向图（分析结束时统一构建）
         self.dex_usage = defaultdict(int)  # DEX 使用频率
-        self.path_lengths = []  # 套利路径长度
+        self.path_length_stats = PathLengthStats()  # 套利路径长度统计
         self.token_profits = defaultdict(float)  # 各代币套利收益
         self.miner_revenue = 0  # 矿工收益
         self.arbitrage_count = 0  # 套利交易数量
@@ -233,13 +236,13 @@ class ArbitrageAnalysis:
             
         # 更新统计信息
         if 'token_graph' in arb_info:
-            self.token_graph = nx.compose(self.token_graph, arb_info['token_graph'])
+            self.token_graph_builder.add_graph(arb_info['token_graph'])
             
         for dex, count in arb_info.get('dex_usage', {}).items():
             self.dex_usage[dex] += count
             
         for path in arb_info.get('arbitrage_paths', []):
-            self.path_lengths.append(path['length'])
+            self.path_length_stats.add(path['length'])
             
         for token, profit in arb_info.get('profits', {}).items():
             self.token_profits[token] += profit
@@ -248,6 +251,11 @@ class ArbitrageAnalysis:
         self.arbitrage_count += 1
         
         return arb_info
+
+    @property
+    def token_graph(self) -> nx.DiGraph:
+        """全局代币流向图"""
+        return self.token_graph_builder.build()
         
     def generate_visualizations(self):
         """生成可视化结果"""
@@ -271,7 +279,8 @@ class ArbitrageAnalysis:
         
         # 3. 套利路径长度分布
         plt.figure(figsize=(10, 6))
-        plt.hist(self.path_lengths, bins=20)
+        histogram = self.path_length_stats.histogram
+        plt.hist(list(histogram.keys()), weights=list(histogram.values()), bins=20)
         plt.title('Arbitrage Path Length Distribution')
         plt.xlabel('Path Length')
         plt.ylabel('Frequency')
@@ -291,46 +300,58 @@ class ArbitrageAnalysis:
         
     def save_analysis_results(self, output_file: str):
         """保存分析结果到 JSON 文件"""
-        if not self.path_lengths:  # 防止除零错误
+        if not self.path_length_stats:  # 防止除零错误
             return
             
         results = {
             'arbitrage_count': self.arbitrage_count,
             'miner_revenue': self.miner_revenue,
             'dex_usage': dict(self.dex_usage),
-            'path_length_stats': {
-                'mean': sum(self.path_lengths) / len(self.path_lengths),
-                'max': max(self.path_lengths),
-                'min': min(self.path_lengths)
-            },
+            'path_length_stats': self.path_length_stats.summary(),
             'token_profits': dict(self.token_profits)
         }
         
         with open(output_file, 'w') as f:
             json.dump(results, f, indent=2)
             
+def parse_args():
+    parser = argparse.ArgumentParser(description='区块套利分析')
+    parser.add_argument('--transfers', default='block_17518743_transfers.json', help='ERC-20 转账文件（JSON 数组或 NDJSON）')
+    parser.add_argument('--receipts', default='block_17518743_receipts.json', help='交易收据文件（JSON 数组或 NDJSON）')
+    parser.add_argument('--output', default='arbitrage_analysis_results.json', help='分析结果输出文件')
+    parser.add_argument('--stream', action='store_true', help='流式模式：增量读取输入，内存占用有界')
+    parser.add_argument('--transfers-from-receipts', action='store_true', help='流式模式下直接从收据日志解码转账，不读取转账文件')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+
     try:
-        # 读取交易数据
-        with open('block_17518743_transfers.json', 'r') as f:
-            transfers = json.load(f)
-        
-        # 读取交易收据数据
-        with open('block_17518743_receipts.json', 'r') as f:
-            receipts = json.load(f)
-        
-        logger.info(f"成功加载 {len(transfers)} 笔转账和 {len(receipts)} 笔交易收据")
+        if args.stream:
+            # 流式读取，单遍按交易哈希配对
+            transfers_path = None if args.transfers_from_receipts else args.transfers
+            txns = iter_receipts_with_transfers(args.receipts, transfers_path)
+            logger.info("流式模式：增量读取交易收据和转账")
+        else:
+            # 读取交易数据
+            transfers = list(iter_json_records(args.transfers))
+            
+            # 读取交易收据数据
+            receipts = list(iter_json_records(args.receipts))
+            
+            logger.info(f"成功加载 {len(transfers)} 笔转账和 {len(receipts)} 笔交易收据")
+
+            # 按交易哈希分组（单遍）
+            transfers_by_hash = group_transfers_by_hash(transfers)
+            txns = ((r, transfers_by_hash.get(r['transactionHash'], [])) for r in receipts)
         
         # 创建分析器
         analyzer = ArbitrageAnalysis()
         
         # 处理每笔交易
-        for receipt in receipts:
+        for receipt, tx_transfers in txns:
             try:
                 # 获取该交易对应的转账记录
-                tx_transfers = [t for t in transfers 
-                              if t['transactionHash'] == receipt['transactionHash']]
-                
                 if not tx_transfers:
                     continue
                     
@@ -353,7 +374,7 @@ def main():
         analyzer.generate_visualizations()
         
         # 保存分析结果
-        analyzer.save_analysis_results('arbitrage_analysis_results.json')
+        analyzer.save_analysis_results(args.output)
         
     except Exception as e:
         logger.error(f"分析过程中发生错误: {str(e)}")
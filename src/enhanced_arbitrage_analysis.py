@@ -1,12 +1,15 @@
 import os
 import sys
 import json
+import argparse
 import logging
 import networkx as nx
 import matplotlib.pyplot as plt
 from typing import List, Dict, Optional, Set
 from collections import defaultdict
 
+from stream_loader import PathLengthStats, TokenGraphBuilder, group_transfers_by_hash, iter_json_records, iter_receipts_with_transfers
+
 # 配置日志
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
@@ -200,9 +203,9 @@ def get_arbitrage_from_receipt_if_exists(full_txn: Dict, txns: List[Dict]) -> Op
 
 class EnhancedArbitrageAnalysis:
     def __init__(self):
-        self.token_graph = nx.DiGraph()  # 代币流向图
+        self.token_graph_builder = TokenGraphBuilder()  # 代币流向图（分析结束时统一构建）
         self.dex_usage = defaultdict(int)  # DEX 使用频率
-        self.path_lengths = []  # 套利路径长度
+        self.path_length_stats = PathLengthStats()  # 套利路径长度统计
         self.token_profits = defaultdict(float)  # 各代币套利收益
         self.miner_revenue = 0  # 矿工收益
         self.arbitrage_count = 0  # 套利交易数量
@@ -242,13 +245,13 @@ class EnhancedArbitrageAnalysis:
             
         # 更新统计信息
         if 'token_graph' in arb_info:
-            self.token_graph = nx.compose(self.token_graph, arb_info['token_graph'])
+            self.token_graph_builder.add_graph(arb_info['token_graph'])
             
         for dex, count in arb_info.get('dex_usage', {}).items():
             self.dex_usage[dex] += count
             
         for path in arb_info.get('arbitrage_paths', []):
-            self.path_lengths.append(path['length'])
+            self.path_length_stats.add(path['length'])
             
         for token, profit in arb_info.get('profits', {}).items():
             self.token_profits[token] += profit
@@ -277,6 +280,11 @@ class EnhancedArbitrageAnalysis:
             })
         
         return arb_info
+
+    @property
+    def token_graph(self) -> nx.DiGraph:
+        """全局代币流向图"""
+        return self.token_graph_builder.build()
         
     def generate_visualizations(self):
         """生成可视化结果"""
@@ -300,7 +308,8 @@ class EnhancedArbitrageAnalysis:
         
         # 3. 套利路径长度分布
         plt.figure(figsize=(10, 6))
-        plt.hist(self.path_lengths, bins=20)
+        histogram = self.path_length_stats.histogram
+        plt.hist(list(histogram.keys()), weights=list(histogram.values()), bins=20)
         plt.title('Arbitrage Path Length Distribution')
         plt.xlabel('Path Length')
         plt.ylabel('Frequency')
@@ -329,18 +338,14 @@ class EnhancedArbitrageAnalysis:
         
     def save_analysis_results(self, output_file: str):
         """保存分析结果到 JSON 文件"""
-        if not self.path_lengths:  # 防止除零错误
+        if not self.path_length_stats:  # 防止除零错误
             return
             
         results = {
             'arbitrage_count': self.arbitrage_count,
             'miner_revenue': self.miner_revenue,
             'dex_usage': dict(self.dex_usage),
-            'path_length_stats': {
-                'mean': sum(self.path_lengths) / len(self.path_lengths),
-                'max': max(self.path_lengths),
-                'min': min(self.path_lengths)
-            },
+            'path_length_stats': self.path_length_stats.summary(),
             'token_profits': dict(self.token_profits),
             'profit_takers': dict(self.profit_takers),
             'detailed_arbitrage_paths': self.arbitrage_details
@@ -349,23 +354,41 @@ class EnhancedArbitrageAnalysis:
         with open(output_file, 'w') as f:
             json.dump(results, f, indent=2)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='增强版区块套利分析')
+    parser.add_argument('--transfers', default='block_17518743_transfers.json', help='ERC-20 转账文件（JSON 数组或 NDJSON）')
+    parser.add_argument('--receipts', default='block_17518743_receipts.json', help='交易收据文件（JSON 数组或 NDJSON）')
+    parser.add_argument('--output', default='enhanced_arbitrage_analysis_results.json', help='分析结果输出文件')
+    parser.add_argument('--stream', action='store_true', help='流式模式：增量读取输入，内存占用有界')
+    parser.add_argument('--transfers-from-receipts', action='store_true', help='流式模式下直接从收据日志解码转账，不读取转账文件')
+    return parser.parse_args()
+
 def main():
-    # 读取交易数据
-    with open('block_17518743_transfers.json', 'r') as f:
-        transfers = json.load(f)
-    with open('block_17518743_receipts.json', 'r') as f:
-        receipts = json.load(f)
-        
-    print(f"已加载 {len(transfers)} 条 ERC-20 代币转账和 {len(receipts)} 条交易收据（transaction receipts）")
+    args = parse_args()
+
+    if args.stream:
+        # 流式读取，单遍按交易哈希配对
+        transfers_path = None if args.transfers_from_receipts else args.transfers
+        txns = iter_receipts_with_transfers(args.receipts, transfers_path)
+        print("流式模式：增量读取交易收据和 ERC-20 转账")
+    else:
+        # 读取交易数据
+        transfers = list(iter_json_records(args.transfers))
+        receipts = list(iter_json_records(args.receipts))
+        print(f"已加载 {len(transfers)} 条 ERC-20 代币转账和 {len(receipts)} 条交易收据（transaction receipts）")
+
+        # 按交易哈希分组（单遍）
+        transfers_by_hash = group_transfers_by_hash(transfers)
+        txns = ((r, transfers_by_hash.get(r['transactionHash'], [])) for r in receipts)
     
     # 创建分析器实例
     analyzer = EnhancedArbitrageAnalysis()
     
     # 分析每笔交易
-    for receipt in receipts:
-        # 获取该交易的所有转账记录
-        txn_transfers = [t for t in transfers if t['transactionHash'] == receipt['transactionHash']]
-        
+    n_receipts = 0
+    for receipt, txn_transfers in txns:
+        n_receipts += 1
+
         # 分析交易
         arb_info = analyzer.analyze_transaction(receipt, txn_transfers)
         if arb_info:
@@ -377,9 +400,9 @@ def main():
     analyzer.generate_visualizations()
     
     # 保存分析结果
-    analyzer.save_analysis_results('enhanced_arbitrage_analysis_results.json')
-    print(f"分析完成。发现 {analyzer.arbitrage_count} 笔代币流转环路（token flow cycle）。")
-    print("结果已保存到 enhanced_arbitrage_analysis_results.json")
+    analyzer.save_analysis_results(args.output)
+    print(f"分析完成。共处理 {n_receipts} 条交易收据，发现 {analyzer.arbitrage_count} 笔代币流转环路（token flow cycle）。")
+    print(f"结果已保存到 {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+"""
+测试区块区间分析模块
+使用仓库自带的区块 #17518743 数据
+"""
+
+import os
+import json
+
+import pytest
+
+import analyze_block_range
+from analyze_block_range import METHOD_NOT_FOUND, RPCError, analyze_block, analyze_range, decode_transfers, fetch_block_receipts, normalize_receipt, save_checkpoint, load_checkpoint
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECEIPTS_FILE = os.path.join(project_root, 'block_17518743_receipts.json')
+TRANSFERS_FILE = os.path.join(project_root, 'block_17518743_transfers.json')
+
+
+def test_decode_transfers_matches_transfers_file():
+    with open(RECEIPTS_FILE) as f:
+        receipts = json.load(f)
+    with open(TRANSFERS_FILE) as f:
+        expected = json.load(f)
+
+    decoded = []
+    for receipt in receipts:
+        decoded.extend(decode_transfers(normalize_receipt(receipt)))
+
+    assert len(decoded) == len(expected)
+    for got, want in zip(decoded, expected):
+        assert got.transactionHash.hex() == want['transactionHash']
+        assert got.address.lower() == want['address'].lower()
+        assert got.args['from'].lower() == want['args']['from'].lower()
+        assert got.args['to'].lower() == want['args']['to'].lower()
+        assert got.args['value'] == want['args']['value']
+    # get_arbitrage_from_receipt_if_exists 会把转账放入集合
+    assert len(set(decoded)) == len(decoded)
+
+
+def test_analyze_block(monkeypatch):
+    with open(RECEIPTS_FILE) as f:
+        receipts = json.load(f)
+    monkeypatch.setattr(analyze_block_range, 'fetch_block_receipts', lambda block_number: receipts)
+
+    result = analyze_block(17518743)
+    assert result['block_number'] == 17518743
+    assert result['n_transactions'] == len(receipts)
+    assert len(result['arbitrages']) == 1
+    json.dumps(result)
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    fname = str(tmp_path / 'out.jsonl.checkpoint')
+    assert load_checkpoint(fname) is None
+    save_checkpoint(fname, {'next_block': 10, 'output_offset': 123})
+    assert load_checkpoint(fname) == {'next_block': 10, 'output_offset': 123}
+
+
+def _fake_rpc(monkeypatch, responses):
+    """按顺序返回 responses 中的结果（异常则抛出），并记录调用的方法"""
+    calls = []
+    responses = list(responses)
+
+    def rpc_batch(batch):
+        calls.append(batch[0][0])
+        ret = responses.pop(0)
+        if isinstance(ret, Exception):
+            raise ret
+        return ret
+
+    monkeypatch.setattr(analyze_block_range, '_rpc_batch', rpc_batch)
+    monkeypatch.setattr(analyze_block_range, '_supports_block_receipts', True)
+    monkeypatch.setattr(analyze_block_range.time, 'sleep', lambda _: None)
+    return calls
+
+
+def test_block_receipts_only_disabled_when_unsupported(monkeypatch):
+    # 临时错误不会永久停用 eth_getBlockReceipts
+    calls = _fake_rpc(monkeypatch, [RPCError('timeout', code=-32000), [[{'status': '0x1'}]]])
+    with pytest.raises(RPCError):
+        fetch_block_receipts(1)
+    assert fetch_block_receipts(1) == [{'status': '0x1'}]
+    assert calls == ['eth_getBlockReceipts', 'eth_getBlockReceipts']
+
+    # 方法不存在时改用批量请求
+    calls = _fake_rpc(monkeypatch, [RPCError('method not found', code=METHOD_NOT_FOUND), [{'transactions': []}], [{'transactions': []}]])
+    assert fetch_block_receipts(1) == []
+    assert fetch_block_receipts(2) == []
+    assert calls == ['eth_getBlockReceipts', 'eth_getBlockByNumber', 'eth_getBlockByNumber']
+
+
+def test_null_results_are_retried(monkeypatch):
+    # 节点落后时返回 null，重试后成功
+    calls = _fake_rpc(monkeypatch, [[None], [[]]])
+    assert analyze_block(5) == {'block_number': 5, 'n_transactions': 0, 'arbitrages': []}
+    assert calls == ['eth_getBlockReceipts', 'eth_getBlockReceipts']
+
+    _fake_rpc(monkeypatch, [RPCError('method not found', code=METHOD_NOT_FOUND)] + [[None]] * analyze_block_range.MAX_BLOCK_ATTEMPTS)
+    assert 'error' in analyze_block(5)
+
+
+def _read_blocks(fname):
+    with open(fname) as f:
+        return [json.loads(line)['block_number'] for line in f]
+
+
+def test_failed_block_is_retried_on_resume(monkeypatch, tmp_path):
+    output = str(tmp_path / 'out.jsonl')
+    checkpoint = output + '.checkpoint'
+    monkeypatch.setattr(analyze_block_range.time, 'sleep', lambda _: None)
+
+    # 工作进程由 fork 创建，继承这里替换的函数
+    def flaky(block_number):
+        if block_number == 3:
+            raise RPCError('node behind')
+        return []
+
+    monkeypatch.setattr(analyze_block_range, 'fetch_block_receipts', flaky)
+    with pytest.raises(RPCError, match='区块 3'):
+        analyze_range('http://unused', 1, 6, output, checkpoint, n_workers=2, checkpoint_every=1)
+    assert load_checkpoint(checkpoint)['next_block'] == 3
+    assert _read_blocks(output) == [1, 2]
+
+    monkeypatch.setattr(analyze_block_range, 'fetch_block_receipts', lambda block_number: [])
+    analyze_range('http://unused', 1, 6, output, checkpoint, n_workers=2, checkpoint_every=1)
+    assert _read_blocks(output) == [1, 2, 3, 4, 5, 6]
+
+    # 输出文件丢失时忽略检查点，从头开始
+    os.remove(output)
+    analyze_range('http://unused', 1, 6, output, checkpoint, n_workers=2, checkpoint_every=4)
+    assert _read_blocks(output) == [1, 2, 3, 4, 5, 6]
@@ -0,0 +1,105 @@
+"""
+测试流式读取模块
+使用仓库自带的区块 #17518743 数据
+"""
+
+import os
+import json
+import random
+
+import networkx as nx
+
+import stream_loader
+from stream_loader import (
+    PathLengthStats,
+    TokenGraphBuilder,
+    group_transfers_by_hash,
+    iter_json_records,
+    iter_receipts_with_transfers,
+    transfers_from_receipt,
+)
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECEIPTS_FILE = os.path.join(project_root, 'block_17518743_receipts.json')
+TRANSFERS_FILE = os.path.join(project_root, 'block_17518743_transfers.json')
+
+
+def test_iter_json_array_matches_json_load(monkeypatch):
+    """小缓冲区下增量解析结果与 json.load 一致"""
+    monkeypatch.setattr(stream_loader, 'READ_CHUNK_SIZE', 7)
+    with open(RECEIPTS_FILE) as f:
+        expected = json.load(f)
+    assert list(iter_json_records(RECEIPTS_FILE)) == expected
+
+
+def test_iter_ndjson(tmp_path):
+    with open(TRANSFERS_FILE) as f:
+        transfers = json.load(f)
+    fname = str(tmp_path / 'transfers.ndjson')
+    with open(fname, 'w') as f:
+        for t in transfers:
+            f.write(json.dumps(t) + '\n')
+    assert list(iter_json_records(fname)) == transfers
+
+
+def test_transfers_from_receipts_match_transfers_file():
+    decoded = []
+    for receipt in iter_json_records(RECEIPTS_FILE):
+        decoded.extend(transfers_from_receipt(receipt))
+    assert decoded == list(iter_json_records(TRANSFERS_FILE))
+
+
+def test_merge_matches_grouping(tmp_path):
+    receipts = list(iter_json_records(RECEIPTS_FILE))
+    by_hash = group_transfers_by_hash(iter_json_records(TRANSFERS_FILE))
+    expected = [(r['transactionHash'], by_hash.get(r['transactionHash'], [])) for r in receipts]
+
+    got = [(r['transactionHash'], t) for r, t in iter_receipts_with_transfers(RECEIPTS_FILE, TRANSFERS_FILE)]
+    assert got == expected
+
+    # 转账顺序被打乱时，依靠收据日志判断完整性
+    shuffled = list(iter_json_records(TRANSFERS_FILE))
+    random.Random(0).shuffle(shuffled)
+    shuffled_file = str(tmp_path / 'shuffled.json')
+    with open(shuffled_file, 'w') as f:
+        json.dump(shuffled, f)
+
+    got = {r['transactionHash']: t for r, t in iter_receipts_with_transfers(RECEIPTS_FILE, shuffled_file)}
+    for txn_hash, transfers in expected:
+        assert sorted(got[txn_hash], key=json.dumps) == sorted(transfers, key=json.dumps)
+
+    # 收据不含日志、交易顺序与转账文件不同（同一交易的转账仍连续）
+    no_logs_file = str(tmp_path / 'receipts.jsonl')
+    with open(no_logs_file, 'w') as f:
+        for r in reversed(receipts):
+            f.write(json.dumps({k: v for k, v in r.items() if k != 'logs'}) + '\n')
+
+    got = {r['transactionHash']: t for r, t in iter_receipts_with_transfers(no_logs_file, TRANSFERS_FILE)}
+    for txn_hash, transfers in expected:
+        assert got[txn_hash] == transfers
+
+
+def test_token_graph_builder_matches_compose():
+    g1 = nx.DiGraph()
+    g1.add_edge('a', 'b', weight=1)
+    g1.add_edge('b', 'c', weight=2)
+    g2 = nx.DiGraph()
+    g2.add_edge('b', 'c', weight=3)
+    g2.add_edge('c', 'a', weight=4)
+
+    builder = TokenGraphBuilder()
+    builder.add_graph(g1)
+    builder.add_graph(g2)
+    expected = nx.compose(g1, g2)
+
+    got = builder.build()
+    assert sorted(got.edges(data=True)) == sorted(expected.edges(data=True))
+
+
+def test_path_length_stats():
+    stats = PathLengthStats()
+    assert not stats
+    for length in [2, 3, 3, 2, 4]:
+        stats.add(length)
+    assert stats.summary() == {'mean': 2.8, 'max': 4, 'min': 2}
+    assert stats.histogram == {2: 2, 3: 2, 4: 1}